@@ -0,0 +1,63 @@
+# 脚本产物：run 结束后 AP_ARTIFACTS_DIR 里的文件（截图等）的列表和下载。
+from __future__ import annotations
+
+from pathlib import PurePosixPath
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from app.schemas.script import ArtifactInfo, RunArtifacts
+from app.storage.artifacts import ArtifactStore
+from app.storage.state_store import StateStore
+
+
+def build_router(*, store: StateStore, artifacts: ArtifactStore) -> APIRouter:
+    router = APIRouter(tags=["artifacts"])
+
+    @router.get("/runs/{run_id}/artifacts", response_model=RunArtifacts)
+    def list_artifacts(run_id: str):
+        m = artifacts.manifest(run_id)
+        if m is None:
+            if not store.get_run(run_id):
+                raise HTTPException(status_code=404, detail="run_id not found")
+            return RunArtifacts(run_id=run_id, pending=artifacts.pending(run_id))
+        return RunArtifacts(
+            run_id=run_id,
+            files=[
+                ArtifactInfo(
+                    name=a.name,
+                    size=a.size,
+                    sha256=a.sha256,
+                    content_type=a.content_type,
+                    url=f"/runs/{run_id}/artifacts/{quote(a.name)}",
+                )
+                for a in m.files
+            ],
+            total_bytes=m.total_bytes,
+            skipped=m.skipped,
+        )
+
+    @router.get("/runs/{run_id}/artifacts/{name:path}")
+    def get_artifact(run_id: str, name: str):
+        # 对象文件内容不会变：ETag 就是 sha256，Range / 206 由 FileResponse 处理（大文件可以断点续传 / 拖进度条）
+        found = artifacts.open(run_id, name)
+        if found is None:
+            if artifacts.pending(run_id):
+                raise HTTPException(status_code=404, detail="artifacts are still being ingested, retry shortly")
+            raise HTTPException(status_code=404, detail="artifact not found")
+        path, art = found
+        return FileResponse(
+            path,
+            media_type=art.content_type,
+            filename=PurePosixPath(art.name).name,
+            content_disposition_type="inline",  # 截图直接在浏览器里打开
+            headers={"ETag": f'"{art.sha256}"', "Cache-Control": "private, max-age=86400, immutable"},
+        )
+
+    @router.get("/artifacts/stats")
+    # 占了多少盘、去重省了多少、清理删了多少个 run
+    def artifact_stats():
+        return artifacts.stats()
+
+    return router
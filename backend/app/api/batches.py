@@ -0,0 +1,108 @@
+# 批量 run：POST /runs/batch 一次提交一组参数（或参数网格），返回一个 batch；进度 / 取消都按 batch 来。
+from __future__ import annotations
+
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Query
+
+from app.schemas.script import BatchInfo, BatchRun, CreateBatchRequest
+from app.services.batches import Batch, BatchManager, expand_grid
+from app.services.params import ParamError
+from app.services.registry import ScriptRegistry
+
+
+def batch_to_info(batches: BatchManager, batch: Batch, *, with_runs: bool) -> BatchInfo:
+    summary = batches.summary(batch)
+    runs = None
+    if with_runs:
+        runs = [BatchRun(index=c.index, params=c.params, run_id=c.run_id, status=c.status) for c in batch.children]
+    return BatchInfo(
+        batch_id=batch.batch_id,
+        script_id=batch.script_id,
+        max_parallel=batch.max_parallel,
+        created_at=batch.created_at,
+        finished_at=batch.finished_at,
+        runs=runs,
+        **summary,
+    )
+
+
+def build_router(
+    *,
+    registry: ScriptRegistry,
+    batches: BatchManager,
+    max_runs: int,
+    default_parallel: int,
+) -> APIRouter:
+    router = APIRouter(tags=["batches"])
+
+    @router.post("/runs/batch", response_model=BatchInfo)
+    def create_batch(req: CreateBatchRequest):
+        # spec 查找、脚本路径检查只做一次；所有参数先校验完，有一个不合法整个 batch 都不建
+        try:
+            spec = registry.get(req.script_id)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+        if (req.params is None) == (req.grid is None):
+            raise HTTPException(status_code=400, detail="give exactly one of `params` (a list) or `grid`")
+        if req.grid is not None:
+            if any(not isinstance(v, list) or not v for v in req.grid.values()):
+                raise HTTPException(status_code=400, detail="every grid value must be a non-empty list")
+            n = 1
+            for v in req.grid.values():
+                n *= len(v)
+            if n > max_runs:  # 先算数量再展开，避免一个巨大的网格把内存吃掉
+                raise HTTPException(status_code=400, detail=f"batch too large: {n} runs > {max_runs}")
+            raw = expand_grid(req.grid, req.base_params)
+        else:
+            raw = [{**req.base_params, **p} for p in req.params or []]
+        if not raw:
+            raise HTTPException(status_code=400, detail="batch has no runs")
+        if len(raw) > max_runs:
+            raise HTTPException(status_code=400, detail=f"batch too large: {len(raw)} runs > {max_runs}")
+
+        params_list: List[dict] = []
+        errors: List[dict] = []
+        for i, p in enumerate(raw):
+            try:
+                params_list.append(spec.validate_params(p))
+            except ParamError as e:
+                errors.extend({**err, "loc": ["body", "runs", i, err["loc"]]} for err in e.errors)
+        if errors:
+            raise HTTPException(status_code=422, detail=errors[:100])
+
+        script_path = registry.resolve_script_path(spec.entry)
+        if not script_path.exists():
+            raise HTTPException(status_code=404, detail=f"Script file not found: {script_path}")
+
+        batch = batches.create(
+            spec=spec,
+            script_path=script_path,
+            cwd=registry.resolve_cwd(spec.cwd),
+            params_list=params_list,
+            max_parallel=req.max_parallel or default_parallel,
+            priority=req.priority,
+        )
+        return batch_to_info(batches, batch, with_runs=False)
+
+    @router.get("/batches", response_model=List[BatchInfo])
+    def list_batches(limit: int = Query(default=50, ge=1, le=500)):
+        return [batch_to_info(batches, b, with_runs=False) for b in batches.list()[:limit]]
+
+    @router.get("/batches/{batch_id}", response_model=BatchInfo)
+    def get_batch(batch_id: str, runs: bool = True):
+        batch = batches.get(batch_id)
+        if batch is None:
+            raise HTTPException(status_code=404, detail="batch_id not found")
+        return batch_to_info(batches, batch, with_runs=runs)
+
+    @router.post("/batches/{batch_id}/cancel")
+    def cancel_batch(batch_id: str):
+        # 还没放进调度器的直接不跑了；排队 / 在跑的逐个 stop
+        stopped = batches.cancel(batch_id)
+        if stopped is None:
+            raise HTTPException(status_code=404, detail="batch_id not found")
+        return {"ok": True, "batch_id": batch_id, "stopped": stopped}
+
+    return router
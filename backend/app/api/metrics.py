@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core import metrics
+from app.services.daemon_rpc import DaemonClient
+from app.services.result_cache import ResultCache
+from app.services.scheduler import Scheduler
+from app.storage.state_store import StateStore
+
+# Prometheus 文本格式的 content-type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _state_gauges(store: StateStore, scheduler: Scheduler, result_cache: Optional[ResultCache]) -> Iterable[str]:
+    # 只在被抓取时算：store.stats() 要遍历内存里的 run
+    st = store.stats()
+    yield from metrics.gauge_lines(
+        "ap_runs",
+        "Runs currently held by this process's store, by status.",
+        [({"status": s}, n) for s, n in sorted((st.get("by_status") or {}).items())],
+    )
+    yield from metrics.gauge_lines(
+        "ap_store_log_bytes",
+        "In-memory log bytes held by the store.",
+        [({"state": "active"}, st.get("log_bytes_active", 0)), ({"state": "finished"}, st.get("log_bytes_finished", 0))],
+    )
+    sched = scheduler.stats()
+    yield from metrics.gauge_lines(
+        "ap_scheduler_runs",
+        "Runs the scheduler is holding, by state.",
+        [({"state": k}, v) for k, v in sched.items() if k in ("queued", "running") and isinstance(v, (int, float))],
+    )
+    if "max_concurrent_runs" in sched:
+        yield from metrics.gauge_lines(
+            "ap_scheduler_max_concurrent_runs", "Global concurrency cap.", [({}, sched["max_concurrent_runs"])]
+        )
+    if result_cache is not None:
+        cs = result_cache.stats()
+        yield from metrics.gauge_lines(
+            "ap_cache_entries",
+            "Result cache entries, by state.",
+            [({"state": "inflight"}, cs["inflight"]), ({"state": "done"}, cs["entries"] - cs["inflight"])],
+        )
+        yield from metrics.gauge_lines("ap_cache_log_bytes", "Log bytes of the cached runs.", [({}, cs["log_bytes"])])
+
+
+def build_router(
+    *,
+    store: StateStore,
+    scheduler: Scheduler,
+    result_cache: Optional[ResultCache] = None,
+    daemon: Optional[DaemonClient] = None,
+) -> APIRouter:
+    router = APIRouter(tags=["metrics"])
+    metrics.REGISTRY.add_collector("state", lambda: _state_gauges(store, scheduler, result_cache))
+
+    @router.get("/metrics", response_class=PlainTextResponse)
+    def get_metrics():
+        return PlainTextResponse(metrics.REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    if daemon is not None:
+        # AP_RUN_MODE=daemon：run / 调度 / pool 的计数都记在 run_daemon 进程里；/metrics 只有这个 worker 的 HTTP 指标
+        @router.get("/metrics/daemon", response_class=PlainTextResponse)
+        def get_daemon_metrics():
+            return PlainTextResponse(daemon.call("daemon", "metrics"), media_type=CONTENT_TYPE)
+
+    return router
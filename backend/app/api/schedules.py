@@ -0,0 +1,89 @@
+# 定时任务：spec 里的 schedule 由 ScheduleManager 触发；这里可以查看、暂停 / 恢复、立刻触发一次。
+from __future__ import annotations
+
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException
+
+from app.schemas.schedule import ScheduleInfo, TriggerResult
+from app.services.schedules import ScheduleManager
+
+
+def _dt(ts: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(ts) if ts is not None else None
+
+
+def schedule_to_info(s) -> ScheduleInfo:
+    spec = s.spec
+    return ScheduleInfo(
+        schedule_id=s.schedule_id,
+        script_id=s.script_id,
+        name=spec.name,
+        expr=spec.expr,
+        params=spec.params or {},
+        jitter_s=spec.jitter_s,
+        max_overlap=spec.max_overlap,
+        on_overlap=spec.on_overlap,
+        catch_up=spec.catch_up,
+        paused=s.paused,
+        next_run_at=_dt(s.fire_at),
+        last_run_at=_dt(s.last_fire_at),
+        last_run_id=s.last_run_id,
+        last_error=s.last_error,
+        active_runs=len(s.active),
+        fired=s.fired,
+        skipped=s.skipped,
+        missed=s.missed,
+        errors=s.errors,
+    )
+
+
+def build_router(*, schedules: ScheduleManager) -> APIRouter:
+    router = APIRouter(tags=["schedules"])
+
+    def _get(schedule_id: str):
+        s = schedules.get(schedule_id)
+        if s is None:
+            raise HTTPException(status_code=404, detail="schedule_id not found")
+        return s
+
+    @router.get("/schedules", response_model=List[ScheduleInfo])
+    def list_schedules():
+        return [schedule_to_info(s) for s in schedules.list()]
+
+    @router.get("/schedules/{schedule_id}", response_model=ScheduleInfo)
+    def get_schedule(schedule_id: str):
+        return schedule_to_info(_get(schedule_id))
+
+    @router.post("/schedules/{schedule_id}/pause", response_model=ScheduleInfo)
+    def pause_schedule(schedule_id: str):
+        if not schedules.pause(schedule_id):
+            raise HTTPException(status_code=404, detail="schedule_id not found")
+        return schedule_to_info(_get(schedule_id))
+
+    @router.post("/schedules/{schedule_id}/resume", response_model=ScheduleInfo)
+    def resume_schedule(schedule_id: str):
+        # 暂停期间错过的不补，从现在开始按计划走
+        if not schedules.resume(schedule_id):
+            raise HTTPException(status_code=404, detail="schedule_id not found")
+        return schedule_to_info(_get(schedule_id))
+
+    @router.post("/schedules/{schedule_id}/trigger", response_model=TriggerResult)
+    def trigger_schedule(schedule_id: str, force: bool = False):
+        # 立刻跑一次，不影响下一次计划时间；force=true 时不检查 max_overlap
+        try:
+            run_id, result = schedules.trigger(schedule_id, force=force)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="schedule_id not found")
+        if result == "skipped_overlap":
+            raise HTTPException(status_code=409, detail="max_overlap reached; use force=true to start anyway")
+        s = _get(schedule_id)
+        return TriggerResult(
+            schedule_id=schedule_id,
+            result=result,
+            run_id=run_id,
+            error=s.last_error if result == "error" else None,
+        )
+
+    return router
@@ -1,14 +1,37 @@
 # 这一层只做 HTTP：接收请求、调用服务、返回 schema。
 from __future__ import annotations
 
-from fastapi import APIRouter, HTTPException, Query
+import asyncio
+import json
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import List, Literal, Optional
 
-from app.schemas.script import CreateRunRequest, RunInfo, RunLogs, RunStatus
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+
+from app.schemas.script import (
+    CreateRunRequest,
+    RunInfo,
+    RunList,
+    RunLogs,
+    RunProgressDetail,
+    RunProgressInfo,
+    RunStatus,
+    ScriptStats,
+    StopRunsRequest,
+)
+from app.services.params import ParamError
 from app.services.registry import ScriptRegistry, ScriptSpec
-from app.services.runner import RunnerService
-from app.storage.state_store import InMemoryStateStore
+from app.services.result_cache import ResultCache
+from app.services.scheduler import Scheduler
+from app.storage.state_store import RunProgress, RunQuery, RunRecord, StateStore
 
-router = APIRouter(tags=["scripts"])
+# SSE 推送：没有新行时隔多久再看一次 store（读只拷贝新行，很便宜）；隔多久发一次心跳注释防止代理断开。
+_STREAM_POLL_S = 0.2
+_STREAM_KEEPALIVE_S = 15.0
+_STREAM_BATCH = 500
 
 
 def spec_to_dict(script_spec: ScriptSpec) -> dict:
@@ -20,10 +43,71 @@ def spec_to_dict(script_spec: ScriptSpec) -> dict:
         "timeout_s": script_spec.timeout_s,
         "env": script_spec.env or {},
         "args_schema": script_spec.args_schema or {},
+        "max_concurrency": script_spec.max_concurrency,
+        "execution": script_spec.execution,
+        "params_via": script_spec.params_via,
+        "max_rss_mb": script_spec.max_rss_mb,
+        "max_cpu_s": script_spec.max_cpu_s,
+        "cacheable": script_spec.cacheable,
+        "cache_ttl_s": script_spec.cache_ttl_s,
+        "schedules": [
+            {"name": sch.name, "expr": sch.expr, "max_overlap": sch.max_overlap, "catch_up": sch.catch_up}
+            for sch in script_spec.schedules
+        ],
+        "adaptive_timeout": asdict(script_spec.adaptive_timeout) if script_spec.adaptive_timeout else None,
+    }
+
+
+def _progress_fields(p: RunProgress) -> dict:
+    return {
+        "current": p.current,
+        "total": p.total,
+        "percent": p.percent,
+        "message": p.message,
+        "counters": p.counters,
+        "events": p.events,
+        "updated_at": p.updated_at,
     }
 
 
-def build_router(*, registry: ScriptRegistry, runner: RunnerService, store: InMemoryStateStore) -> APIRouter:
+def record_to_run_info(rec: RunRecord, *, queue_position: int | None = None, cache: str | None = None) -> RunInfo:
+    usage = rec.usage
+    return RunInfo(
+        run_id=rec.run_id,
+        script_id=rec.script_id,
+        status=rec.status,
+        pid=rec.pid,
+        returncode=rec.returncode,
+        created_at=rec.created_at,
+        finished_at=rec.finished_at,
+        queue_position=queue_position,
+        node=rec.node,
+        peak_rss_mb=usage.peak_rss_mb if usage else None,
+        cpu_s=usage.cpu_s if usage else None,
+        io_read_bytes=usage.io_read_bytes if usage else None,
+        io_write_bytes=usage.io_write_bytes if usage else None,
+        cache=cache,
+        failure_reason=rec.failure_reason,
+        progress=RunProgressInfo(**_progress_fields(rec.progress)) if rec.progress is not None else None,
+    )
+
+
+def _naive_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    # store 里的 created_at 是 naive UTC；带时区的参数先换算过去
+    if dt is None or dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def build_router(
+    *,
+    registry: ScriptRegistry,
+    scheduler: Scheduler,
+    store: StateStore,
+    result_cache: Optional[ResultCache] = None,
+) -> APIRouter:
+    # 每次 build 一个新 router：create_app() 调多次（benchmark / 测试）时，路由不会还绑着上一个 store
+    router = APIRouter(tags=["scripts"])
 
     @router.get("/scripts")
     # 如果有人用浏览器 / 程序访问/scripts，比如http://127.0.0.1:8000/scripts，FastAPI 会自动帮调用 list_scripts()。
@@ -31,6 +115,21 @@ def build_router(*, registry: ScriptRegistry, runner: RunnerService, store: InMe
         specs = registry.list()
         return [spec_to_dict(s) for s in specs]
 
+    @router.get("/scripts/{script_id}/stats", response_model=ScriptStats)
+    def get_script_stats(script_id: str):
+        # run 结束时增量更新的统计（次数 / 成功率 / 耗时分位数），这里只是读一份快照，不扫历史
+        try:
+            spec = registry.get(script_id)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        snap = scheduler.script_stats(spec)
+        if snap is None:
+            raise HTTPException(status_code=501, detail="Script stats are kept on the runner nodes in queue mode")
+        since = snap["since"]
+        # 和 run 的 created_at 一样用 naive UTC
+        since = _naive_utc(datetime.fromtimestamp(since, tz=timezone.utc)) if since is not None else None
+        return ScriptStats(script_id=script_id, **{**snap, "since": since})
+
     @router.post("/runs", response_model=RunInfo)
     # GET：要“看东西”
     # POST：要“干一件新事”，即启动一个新进程，也就是改变了系统状态。
@@ -41,31 +140,85 @@ def build_router(*, registry: ScriptRegistry, runner: RunnerService, store: InMe
         except KeyError as e:
             raise HTTPException(status_code=404, detail=str(e))
 
+        # 按 spec 里预编译好的 args_schema 校验、补默认值；不合法的参数在 fork 之前就拒绝
+        try:
+            params = spec.validate_params(req.params)
+        except ParamError as e:
+            raise HTTPException(status_code=422, detail=[{**err, "loc": ["body", "params", err["loc"]]} for err in e.errors])
+
         script_path = registry.resolve_script_path(spec.entry)
         if not script_path.exists():
             raise HTTPException(status_code=404, detail=f"Script file not found: {script_path}")
 
         cwd = registry.resolve_cwd(spec.cwd)
-        run_id = runner.start(
-            script_id=spec.script_id,
-            script_path=script_path,
-            params=req.params,
-            cwd=cwd,
-            env=spec.env,
-            timeout_s=spec.timeout_s,
-        )
+
+        def submit() -> str:
+            # 只进队列，不等 fork；真正启动由 scheduler 的 dispatcher 线程负责。
+            return scheduler.submit(
+                spec=spec,
+                script_path=script_path,
+                params=params,
+                cwd=cwd,
+                priority=req.priority,
+            )
+
+        outcome = None
+        if spec.cacheable and result_cache is not None:
+            # 同样的请求已经在跑 / 刚跑完：直接把那个 run 给出去，不再 fork
+            run_id, outcome = result_cache.submit(
+                script_id=spec.script_id,
+                script_path=script_path,
+                params=params,
+                ttl_s=spec.cache_ttl_s,
+                submit=submit,
+            )
+        else:
+            run_id = submit()
 
         rec = store.get_run(run_id)
         assert rec is not None
+        queue_position = scheduler.queue_position(run_id) if rec.status == RunStatus.queued else None
+        return record_to_run_info(rec, queue_position=queue_position, cache=outcome)
 
-        return RunInfo(
+    @router.get("/runs", response_model=RunList)
+    def list_runs(
+        script_id: Optional[str] = None,
+        status: Optional[RunStatus] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = Query(default=50, ge=1, le=500),
+        order: Literal["desc", "asc"] = "desc",
+    ):
+        # keyset 翻页：下一页带上返回的 next_cursor（和同样的过滤条件），翻页期间新建的 run 不会打乱顺序
+        q = RunQuery(
+            script_id=script_id,
+            status=status,
+            created_after=_naive_utc(created_after),
+            created_before=_naive_utc(created_before),
+            cursor=cursor,
+            limit=limit,
+            descending=order == "desc",
+        )
+        try:
+            page = store.query_runs(q)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return RunList(items=[record_to_run_info(rec) for rec in page.records], next_cursor=page.next_cursor)
+
+    @router.get("/runs/{run_id}/progress", response_model=RunProgressDetail)
+    def get_run_progress(run_id: str):
+        # 只读 run 记录上的一个字段：轮询进度不用拉日志、不用扫正则
+        rec = store.get_run(run_id)
+        if not rec:
+            raise HTTPException(status_code=404, detail="run_id not found")
+        p = rec.progress or RunProgress()
+        return RunProgressDetail(
             run_id=rec.run_id,
-            script_id=rec.script_id,
             status=rec.status,
-            pid=rec.pid,
-            returncode=rec.returncode,
-            created_at=rec.created_at,
-            finished_at=rec.finished_at,
+            result=p.result,
+            history=list(p.history),
+            **_progress_fields(p),
         )
 
     @router.get("/runs/{run_id}", response_model=RunInfo)
@@ -74,30 +227,172 @@ def build_router(*, registry: ScriptRegistry, runner: RunnerService, store: InMe
         if not rec:
             raise HTTPException(status_code=404, detail="run_id not found")
 
-        return RunInfo(
-            run_id=rec.run_id,
-            script_id=rec.script_id,
-            status=rec.status,
-            pid=rec.pid,
-            returncode=rec.returncode,
-            created_at=rec.created_at,
-            finished_at=rec.finished_at,
-        )
+        queue_position = scheduler.queue_position(run_id) if rec.status == RunStatus.queued else None
+        return record_to_run_info(rec, queue_position=queue_position)
 
     @router.get("/runs/{run_id}/logs", response_model=RunLogs)
-    def get_logs(run_id: str, tail: int = Query(default=200, ge=1, le=5000)):
+    def get_logs(
+        run_id: str,
+        tail: int = Query(default=200, ge=1, le=5000),
+        since: Optional[int] = Query(default=None, ge=0),
+    ):
+        # 不带 since：最后 tail 行；带 since：从这个序号开始最多 tail 行（增量轮询）。
         rec = store.get_run(run_id)
         if not rec:
             raise HTTPException(status_code=404, detail="run_id not found")
 
-        lines, truncated = store.get_logs(run_id, tail=tail)
-        return RunLogs(run_id=run_id, lines=lines, truncated=truncated)
+        sl = store.read_logs(run_id, since=since, limit=tail)
+        return RunLogs(
+            run_id=run_id,
+            lines=sl.lines,
+            truncated=sl.truncated,
+            first_seq=sl.first_seq,
+            next_seq=sl.next_seq,
+        )
+
+    @router.get("/runs/{run_id}/logs/range", response_model=RunLogs)
+    def get_log_range(
+        run_id: str,
+        start: int = Query(ge=0),
+        end: int = Query(ge=0),
+    ):
+        # 按行号（= seq）取任意一段，[start, end)；旧的行从磁盘 spool 读。
+        if not store.get_run(run_id):
+            raise HTTPException(status_code=404, detail="run_id not found")
+        if end <= start:
+            raise HTTPException(status_code=400, detail="end must be greater than start")
+        if end - start > 5000:
+            raise HTTPException(status_code=400, detail="at most 5000 lines per request")
+
+        sl = store.read_logs(run_id, since=start, limit=end - start)
+        return RunLogs(
+            run_id=run_id,
+            lines=sl.lines,
+            truncated=sl.truncated,
+            first_seq=sl.first_seq,
+            next_seq=sl.next_seq,
+        )
+
+    @router.get("/runs/{run_id}/logs/raw")
+    def get_log_bytes(
+        run_id: str,
+        offset: int = Query(default=0, ge=0),
+        length: int = Query(default=1 << 20, ge=1, le=16 << 20),
+    ):
+        # 按字节范围读完整日志（需要开启日志落盘）。X-Log-Size 告诉客户端总大小，方便分段下载。
+        if not store.get_run(run_id):
+            raise HTTPException(status_code=404, detail="run_id not found")
+        data = store.read_log_bytes(run_id, offset, length)
+        if data is None:
+            raise HTTPException(status_code=404, detail="log spool is disabled")
+        return Response(
+            content=data,
+            media_type="text/plain; charset=utf-8",
+            headers={"X-Log-Size": str(store.log_size(run_id) or 0)},
+        )
+
+    @router.get("/runs/{run_id}/logs/stream")
+    async def stream_logs(
+        run_id: str,
+        request: Request,
+        since: Optional[int] = Query(default=None, ge=0),
+        last_event_id: Optional[str] = Header(default=None),
+    ):
+        """
+        Server-Sent Events: one event per log line (`id` = seq), then `event: end` once the run finished.
+        Reconnecting clients resume via `Last-Event-ID` (or `since`).
+        """
+        # store 的方法都是同步的（sqlite / redis / 守护进程 RPC 都会阻塞），放到线程池里调，别卡住 event loop
+        if not await run_in_threadpool(store.get_run, run_id):
+            raise HTTPException(status_code=404, detail="run_id not found")
+
+        cursor = since or 0
+        if since is None and last_event_id and last_event_id.isdigit():
+            cursor = int(last_event_id) + 1
+
+        async def events():
+            nonlocal cursor
+            loop = asyncio.get_running_loop()
+            last_sent = loop.time()
+            while not await request.is_disconnected():
+                rec = await run_in_threadpool(store.get_run, run_id)
+                finished = rec is None or rec.finished_at is not None
+                # 先看状态再读日志：结束前写进来的行一定能在这次读到。
+
+                sl = await run_in_threadpool(store.read_logs, run_id, since=cursor, limit=_STREAM_BATCH)
+                if sl.lines:
+                    yield "".join(
+                        f"id: {sl.first_seq + i}\ndata: {line.rstrip(chr(10))}\n\n"
+                        for i, line in enumerate(sl.lines)
+                    )
+                    cursor = sl.next_seq
+                    last_sent = loop.time()
+                    continue
+
+                if finished:
+                    status = rec.status.value if rec else "unknown"
+                    yield f"event: end\ndata: {json.dumps({'status': status, 'next_seq': cursor})}\n\n"
+                    return
+
+                if loop.time() - last_sent > _STREAM_KEEPALIVE_S:
+                    yield ": keep-alive\n\n"
+                    last_sent = loop.time()
+                await asyncio.sleep(_STREAM_POLL_S)
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
     @router.post("/runs/{run_id}/stop")
     def stop_run(run_id: str):
-        ok = runner.stop(run_id)
+        # 只发 SIGTERM 就返回；宽限期后的 SIGKILL 和最终的 stopped 状态都是异步的
+        ok = scheduler.stop(run_id)
         if not ok:
             raise HTTPException(status_code=404, detail="run_id not running or not found")
         return {"ok": True, "run_id": run_id}
 
+    @router.post("/runs/stop")
+    def stop_runs(req: StopRunsRequest):
+        # 按条件批量停。先停排队的再停在跑的：不然在跑的一结束，调度器马上把排队的放出来
+        if not req.run_ids and req.script_id is None and req.status is None:
+            raise HTTPException(status_code=400, detail="give at least one of run_ids / script_id / status")
+        if req.status is not None and req.status not in (RunStatus.queued, RunStatus.running):
+            raise HTTPException(status_code=400, detail="status must be queued or running")
+        statuses = [req.status] if req.status is not None else [RunStatus.queued, RunStatus.running]
+
+        targets: List[RunRecord] = []
+        if req.run_ids:
+            for rid in dict.fromkeys(req.run_ids):
+                rec = store.get_run(rid)
+                if rec is not None and rec.status in statuses and req.script_id in (None, rec.script_id):
+                    targets.append(rec)
+            targets.sort(key=lambda r: statuses.index(r.status))
+        else:
+            for status in statuses:
+                cursor = None
+                while len(targets) < req.limit:
+                    page = store.query_runs(
+                        RunQuery(script_id=req.script_id, status=status, cursor=cursor, limit=500, descending=False)
+                    )
+                    targets.extend(page.records)
+                    cursor = page.next_cursor
+                    if cursor is None:
+                        break
+
+        stopping: List[str] = []
+        missed: List[str] = []  # 查到之后、stop 之前自己结束了的
+        for rec in targets[: req.limit]:
+            (stopping if scheduler.stop(rec.run_id) else missed).append(rec.run_id)
+        return {"ok": True, "stopping": stopping, "count": len(stopping), "already_finished": missed}
+
+    @router.get("/store/stats")
+    # 内存占用 + 淘汰计数 + 调度器队列，排查“API 进程越跑越大”的时候先看这个。
+    def store_stats():
+        out = {"store": store.stats(), "scheduler": scheduler.stats()}
+        if result_cache is not None:
+            out["result_cache"] = result_cache.stats()
+        return out
+
     return router
@@ -0,0 +1,121 @@
+# 工作流：workflow_specs/*.yaml 里的 DAG，启动后由 WorkflowEngine 推进；这里只做 HTTP。
+from __future__ import annotations
+
+import time
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Query
+
+from app.schemas.workflow import (
+    StartWorkflowRequest,
+    WorkflowInfo,
+    WorkflowRunInfo,
+    WorkflowStep,
+    WorkflowStepRun,
+)
+from app.services.workflow_engine import WorkflowEngine, WorkflowRun
+from app.services.workflows import WorkflowRegistry, WorkflowSpec
+
+
+def workflow_to_info(spec: WorkflowSpec) -> WorkflowInfo:
+    return WorkflowInfo(
+        workflow_id=spec.workflow_id,
+        description=spec.description,
+        params=spec.params or {},
+        fail_fast=spec.fail_fast,
+        steps=[
+            WorkflowStep(step_id=s.step_id, script_id=s.script_id, needs=list(s.needs), params=s.params or {})
+            for s in spec.steps
+        ],
+    )
+
+
+def workflow_run_to_info(wr: WorkflowRun) -> WorkflowRunInfo:
+    steps = []
+    step_time = 0.0
+    for spec in wr.spec.steps:
+        st = wr.steps[spec.step_id]
+        d = st.duration_s
+        if d is not None:
+            step_time += d
+        steps.append(
+            WorkflowStepRun(
+                step_id=st.step_id,
+                script_id=spec.script_id,
+                needs=list(spec.needs),
+                status=st.status,
+                run_id=st.run_id,
+                run_ids=list(st.run_ids),
+                params=st.params,
+                outputs=dict(st.outputs),
+                error=st.error,
+                duration_s=round(d, 3) if d is not None else None,
+            )
+        )
+    end = wr.finished_mono if wr.finished_mono is not None else time.monotonic()
+    return WorkflowRunInfo(
+        wf_run_id=wr.wf_run_id,
+        workflow_id=wr.spec.workflow_id,
+        status=wr.status,
+        attempt=wr.attempt,
+        params=wr.params,
+        created_at=wr.created_at,
+        finished_at=wr.finished_at,
+        elapsed_s=round(end - wr.started_mono, 3),
+        step_time_s=round(step_time, 3),
+        steps=steps,
+    )
+
+
+def build_router(*, workflows: WorkflowRegistry, engine: WorkflowEngine) -> APIRouter:
+    router = APIRouter(tags=["workflows"])
+
+    @router.get("/workflows", response_model=List[WorkflowInfo])
+    def list_workflows():
+        return [workflow_to_info(s) for s in workflows.list()]
+
+    @router.get("/workflows/{workflow_id}", response_model=WorkflowInfo)
+    def get_workflow(workflow_id: str):
+        try:
+            return workflow_to_info(workflows.get(workflow_id))
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=str(e).strip("'\""))
+
+    @router.post("/workflows/{workflow_id}/runs", response_model=WorkflowRunInfo)
+    def start_workflow(workflow_id: str, req: StartWorkflowRequest):
+        try:
+            spec = workflows.get(workflow_id)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=str(e).strip("'\""))
+        return workflow_run_to_info(engine.start(spec, req.params))
+
+    @router.get("/workflow-runs", response_model=List[WorkflowRunInfo])
+    def list_workflow_runs(limit: int = Query(default=50, ge=1, le=500)):
+        return [workflow_run_to_info(wr) for wr in engine.list()[:limit]]
+
+    @router.get("/workflow-runs/{wf_run_id}", response_model=WorkflowRunInfo)
+    def get_workflow_run(wf_run_id: str):
+        wr = engine.get(wf_run_id)
+        if wr is None:
+            raise HTTPException(status_code=404, detail="wf_run_id not found")
+        return workflow_run_to_info(wr)
+
+    @router.post("/workflow-runs/{wf_run_id}/cancel")
+    def cancel_workflow_run(wf_run_id: str):
+        stopped = engine.cancel(wf_run_id)
+        if stopped is None:
+            raise HTTPException(status_code=404, detail="wf_run_id not found")
+        return {"ok": True, "wf_run_id": wf_run_id, "stopped": stopped}
+
+    @router.post("/workflow-runs/{wf_run_id}/resume", response_model=WorkflowRunInfo)
+    def resume_workflow_run(wf_run_id: str):
+        # 成功的步骤不重跑，只从失败 / 被跳过的步骤接着跑
+        try:
+            wr = engine.resume(wf_run_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="wf_run_id not found")
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return workflow_run_to_info(wr)
+
+    return router
@@ -0,0 +1,169 @@
+# 组装各个组件（store / runner / pool / registry）。API（main.py）和 runner 节点（runner_node.py）共用，
+# 单独放一个模块是因为 import app.main 会顺带 create_app()。
+from __future__ import annotations
+
+import logging
+from typing import Optional
+
+from app.core.config import Settings
+from app.services.async_runner import AsyncRunnerService
+from app.services.registry import ScriptRegistry
+from app.services.resources import ResourceSampler
+from app.services.runner import Runner, RunnerService
+from app.services.spec_watcher import SpecWatcher
+from app.services.supervisor import ProcessSupervisor
+from app.services.worker_pool import WorkerPool
+from app.storage.artifacts import ArtifactStore
+from app.storage.log_spool import LogSpool
+from app.storage.redis_store import RedisStateStore, connect
+from app.storage.retention import DirectoryArchiver, RetentionPolicy, start_sweeper
+from app.storage.sqlite_store import SqliteStateStore
+from app.storage.state_store import InMemoryStateStore, StateStore
+
+logger = logging.getLogger("app.bootstrap")
+
+
+def build_registry(settings: Settings) -> ScriptRegistry:
+    return ScriptRegistry(
+        project_root=settings.project_root,
+        scripts_dir=settings.scripts_dir,
+        specs_dir=settings.script_specs_dir
+    )
+
+
+def start_spec_watcher(settings: Settings, registry: ScriptRegistry) -> Optional[SpecWatcher]:
+    if settings.spec_watch == "off":
+        return None
+    registry.refresh()  # 先全量加载一次，之后只处理变化
+    watcher = SpecWatcher(registry, mode=settings.spec_watch, poll_interval_s=settings.spec_poll_interval_s)
+    watcher.start()
+    return watcher
+
+
+def build_retention(settings: Settings) -> RetentionPolicy:
+    max_mb = settings.retention_max_log_mb
+    return RetentionPolicy(
+        max_finished_runs=settings.retention_max_runs,
+        finished_ttl_s=settings.retention_ttl_s,
+        max_log_bytes=int(max_mb * 1024 * 1024) if max_mb is not None else None,
+    )
+
+
+def build_store(settings: Settings) -> StateStore:
+    # "memory"：只在内存（默认）；"sqlite"：同样的内存读写 + 后台批量写进 SQLite，重启不丢历史；
+    # "redis"：多机共用一份状态（API + runner_node），见 redis_store.py。
+    retention = build_retention(settings)
+    spool = None
+    logs_max_lines = settings.logs_max_lines
+    if settings.log_spool_dir is not None:
+        # 日志落盘后，内存里只需要一小段 hot tail
+        spool = LogSpool(settings.log_spool_dir, compress_finished=settings.log_spool_compress)
+        logs_max_lines = settings.log_hot_tail_lines
+
+    archiver = None
+    if settings.retention_archive_dir is not None:
+        archiver = DirectoryArchiver(settings.retention_archive_dir, spool=spool)
+
+    if settings.state_backend == "memory":
+        store = InMemoryStateStore(logs_max_lines=logs_max_lines, spool=spool, retention=retention, on_evict=archiver)
+    elif settings.state_backend == "sqlite":
+        if settings.state_db_path is None:
+            raise ValueError("AP_STATE_BACKEND=sqlite needs AP_STATE_DB")
+        store = SqliteStateStore(
+            settings.state_db_path,
+            logs_max_lines=logs_max_lines,
+            spool=spool,
+            retention=retention,
+            on_evict=archiver,
+        )
+    elif settings.state_backend == "redis":
+        store = RedisStateStore(
+            connect(settings.redis_url),
+            prefix=settings.redis_prefix,
+            logs_max_lines=logs_max_lines,
+            stream_max_lines=settings.redis_stream_max_lines,
+            spool=spool,
+            retention=retention,
+            on_evict=archiver,
+        )
+    else:
+        raise ValueError(f"Unknown state backend: {settings.state_backend!r} (expected 'memory', 'sqlite' or 'redis')")
+    if retention.finished_ttl_s is not None:
+        # 没有新 run 进出的时候也要按时清理过期的
+        start_sweeper(store.sweep, interval_s=min(60.0, max(1.0, retention.finished_ttl_s / 4)))
+    return store
+
+
+def build_artifacts(settings: Settings, *, read_only: bool = False) -> Optional[ArtifactStore]:
+    # read_only：queue 模式的 API 不跑脚本，只从（共享的）目录读 runner 节点写的 manifest，清理归节点管
+    if settings.artifacts_dir is None:
+        return None
+    max_mb = settings.artifacts_max_mb
+    artifacts = ArtifactStore(
+        settings.artifacts_dir,
+        max_bytes=int(max_mb * 1024 * 1024) if max_mb is not None else None,
+        ttl_s=settings.artifacts_ttl_s,
+        max_files_per_run=settings.artifacts_max_files,
+        read_only=read_only,
+    )
+    if not read_only and settings.artifacts_ttl_s is not None:
+        # 超预算在每次 ingest 之后就处理了；按时间过期的要定时扫
+        interval = min(300.0, max(1.0, settings.artifacts_ttl_s / 4))
+        start_sweeper(artifacts.sweep, interval_s=interval, what="runs' artifacts")
+    return artifacts
+
+
+def build_sampler(settings: Settings, store: StateStore) -> Optional[ResourceSampler]:
+    # runner 和 pool 共用一个采样线程：每个周期一次读完所有在跑的进程
+    if settings.resource_sample_s is None:
+        return None
+    return ResourceSampler(store, interval_s=settings.resource_sample_s)
+
+
+def build_runner(
+    backend: str,
+    store: StateStore,
+    sampler: Optional[ResourceSampler] = None,
+    supervisor: Optional[ProcessSupervisor] = None,
+) -> Runner:
+    # "thread"：一个 run 一个线程（默认）；"asyncio"：所有 run 共用一个 event loop 线程。
+    if backend == "thread":
+        return RunnerService(store, sampler=sampler, supervisor=supervisor)
+    if backend == "asyncio":
+        return AsyncRunnerService(store, sampler=sampler, supervisor=supervisor)
+    raise ValueError(f"Unknown runner backend: {backend!r} (expected 'thread' or 'asyncio')")
+
+
+def _pool_config(settings: Settings, registry: ScriptRegistry) -> dict:
+    # worker 预加载 = 全局配置 + 所有 execution=pool 的 spec 里声明的模块；没有这样的 spec 就不开 worker
+    specs = [spec for spec in registry.list() if spec.execution == "pool"]
+    preload = set(settings.worker_pool_preload)
+    for spec in specs:
+        preload.update(spec.preload)
+    return {"preload": sorted(preload), "active": bool(specs)}
+
+
+def build_worker_pool(
+    settings: Settings,
+    registry: ScriptRegistry,
+    store: StateStore,
+    sampler: Optional[ResourceSampler] = None,
+    supervisor: Optional[ProcessSupervisor] = None,
+) -> Optional[WorkerPool]:
+    if settings.worker_pool_size <= 0:
+        pooled = [spec.script_id for spec in registry.list() if spec.execution == "pool"]
+        if pooled:
+            logger.warning("AP_WORKER_POOL_SIZE=0: %s use execution: pool but will run with Popen", pooled)
+        return None
+    pool = WorkerPool(
+        store,
+        size=settings.worker_pool_size,
+        max_runs_per_worker=settings.worker_max_runs,
+        max_rss_mb=settings.worker_max_rss_mb,
+        sampler=sampler,
+        supervisor=supervisor,
+        **_pool_config(settings, registry),
+    )
+    # 热加载加进来的 pool spec：补上它的 preload（换掉旧 worker），第一个 pool spec 出现时才拉起 worker
+    registry.add_listener(lambda diff: pool.reconfigure(**_pool_config(settings, registry)))
+    return pool
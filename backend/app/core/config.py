@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import os
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional, Tuple
 
 
 def find_project_root(start: Path) -> Path:
@@ -28,8 +30,83 @@ class Settings:
     project_root: Path
     scripts_dir: Path
     script_specs_dir: Path
+    workflow_specs_dir: Optional[Path] = None  # 工作流 DAG（workflow_specs/*.yaml），默认和 script_specs 放在一起
+    spec_watch: str = "auto"  # "auto" | "inotify" | "poll" | "off"：spec 改了自动生效，不用重启
+    spec_poll_interval_s: float = 2.0
     logs_max_lines: int = 2000
     default_tail_lines: int = 200
+    runner_backend: str = "thread"  # "thread" | "asyncio"
+    max_concurrent_runs: int = 16
+    worker_pool_size: int = 0  # 0 = 不启用预热进程池，execution=pool 的脚本退回 Popen；>0 时也只在有 pool spec 时才拉起 worker
+    worker_pool_preload: Tuple[str, ...] = ()
+    worker_max_runs: int = 100
+    worker_max_rss_mb: float = 512.0
+    resource_sample_s: Optional[float] = 1.0  # 多久读一次所有在跑进程的 /proc；None = 不采样（spec 里的 max_rss_mb 也就不生效）
+    state_backend: str = "memory"  # "memory" | "sqlite"
+    state_db_path: Optional[Path] = None  # sqlite 库文件，默认 var/state.db
+    redis_url: str = "redis://localhost:6379/0"
+    redis_prefix: str = "ap:"
+    redis_stream_max_lines: int = 100_000  # 每个 run 的日志 stream 最多留这么多行
+    run_mode: str = "local"  # "local"：API 自己跑脚本；"queue"：放进 Redis 队列，交给 runner 节点；"daemon"：交给本机的 run_daemon
+    daemon_socket: Optional[Path] = None  # run_daemon 监听的 Unix socket，默认 var/daemon.sock
+    node_id: Optional[str] = None  # runner 节点名，默认 <hostname>-<随机>
+    node_heartbeat_s: float = 5.0
+    node_ttl_s: float = 15.0  # 这么久没心跳就认为节点挂了，它上面的 run 标成 failed
+    log_spool_dir: Optional[Path] = None  # None = 不落盘，只有内存 deque；设置 AP_LOG_SPOOL_DIR=<目录> 打开
+    log_hot_tail_lines: int = 200  # 落盘时内存里只留最近这么多行
+    log_spool_compress: bool = False
+    # 已结束 run 的保留策略（None = 不限制）。超出的按“最老 + 最近没人看”淘汰。
+    retention_max_runs: Optional[int] = 1000
+    retention_ttl_s: Optional[float] = None
+    retention_max_log_mb: Optional[float] = 256.0  # 已结束 run 的内存日志总预算
+    retention_archive_dir: Optional[Path] = None  # 设置了就先把被淘汰的 run 存档到这里
+    # cacheable 脚本的结果缓存（见 result_cache.py）
+    cache_ttl_s: float = 300.0  # spec 里没写 ttl_s 时，成功结果复用多久
+    cache_max_entries: int = 1000
+    cache_max_log_mb: Optional[float] = 64.0  # 被缓存的 run 的日志总量上限，超了按 LRU 丢
+    # POST /runs/batch：一个 batch 最多多少个子 run；不指定 max_parallel 时同时放进调度器几个
+    batch_max_runs: int = 10_000
+    batch_max_parallel: int = 8
+    # spec 里的 schedule 由进程内定时器触发；多个 API 副本时只在一个上开（AP_SCHEDULES=off 关掉其它的）
+    schedules_enabled: bool = True
+    schedule_state_path: Optional[Path] = None  # 记下次触发时间，重启后按 catch_up 补跑；None = 不记
+    metrics_enabled: bool = True  # /metrics + store 锁计时 + API 延迟中间件
+    # 脚本产物（AP_ARTIFACTS_DIR 里的文件）：结束后按内容去重收进这里；超出总大小 / 保留时间从最老的 run 删
+    artifacts_dir: Optional[Path] = None  # None = 不给脚本产物目录；设置 AP_ARTIFACTS_DIR=<目录> 打开
+    artifacts_max_mb: Optional[float] = 2048.0
+    artifacts_ttl_s: Optional[float] = None
+    artifacts_max_files: int = 1000  # 单个 run 最多收这么多个文件
+
+
+def _env_list(name: str) -> Tuple[str, ...]:
+    # "a, b,c" -> ("a", "b", "c")
+    return tuple(x.strip() for x in os.environ.get(name, "").split(",") if x.strip())
+
+
+def _env_path(name: str, default: Optional[Path]) -> Optional[Path]:
+    # 没设置 -> default；设置成 "" / "off" -> None（关闭）
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    raw = raw.strip()
+    if not raw or raw.lower() in ("off", "none", "0"):
+        return None
+    return Path(raw)
+
+
+def _env_limit(name: str, default: Optional[float]) -> Optional[float]:
+    # 没设置 -> default；"0" / "off" / "none" / "" -> None（不限制）
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    raw = raw.strip()
+    if not raw or raw.lower() in ("off", "none", "0"):
+        return None
+    return float(raw)
+
+
+def _opt_int(v: Optional[float]) -> Optional[int]:
+    return None if v is None else int(v)
 
 
 def get_settings() -> Settings:
@@ -42,6 +119,47 @@ def get_settings() -> Settings:
         project_root=project_root,
         scripts_dir=project_root / "scripts",
         script_specs_dir=project_root / "script_specs",
+        workflow_specs_dir=project_root / "workflow_specs",
+        spec_watch=os.environ.get("AP_SPEC_WATCH", "auto").strip().lower(),
+        spec_poll_interval_s=float(os.environ.get("AP_SPEC_POLL_S", "2")),
         logs_max_lines=2000,
         default_tail_lines=200,
+        runner_backend=os.environ.get("AP_RUNNER_BACKEND", "thread").strip().lower(),
+        # 用环境变量切换 runner 实现，比如：AP_RUNNER_BACKEND=asyncio uvicorn app.main:app
+        max_concurrent_runs=int(os.environ.get("AP_MAX_CONCURRENT_RUNS", "16")),
+        worker_pool_size=int(os.environ.get("AP_WORKER_POOL_SIZE", "0")),
+        worker_pool_preload=_env_list("AP_WORKER_POOL_PRELOAD"),
+        worker_max_runs=int(os.environ.get("AP_WORKER_MAX_RUNS", "100")),
+        worker_max_rss_mb=float(os.environ.get("AP_WORKER_MAX_RSS_MB", "512")),
+        resource_sample_s=_env_limit("AP_RESOURCE_SAMPLE_S", 1.0),
+        state_backend=os.environ.get("AP_STATE_BACKEND", "memory").strip().lower(),
+        state_db_path=_env_path("AP_STATE_DB", project_root / "var" / "state.db"),
+        redis_url=os.environ.get("AP_REDIS_URL", "redis://localhost:6379/0"),
+        redis_prefix=os.environ.get("AP_REDIS_PREFIX", "ap:"),
+        redis_stream_max_lines=int(os.environ.get("AP_REDIS_STREAM_MAX_LINES", "100000")),
+        run_mode=os.environ.get("AP_RUN_MODE", "local").strip().lower(),
+        daemon_socket=Path(os.environ.get("AP_DAEMON_SOCKET") or project_root / "var" / "daemon.sock"),
+        node_id=os.environ.get("AP_NODE_ID") or None,
+        node_heartbeat_s=float(os.environ.get("AP_NODE_HEARTBEAT_S", "5")),
+        node_ttl_s=float(os.environ.get("AP_NODE_TTL_S", "15")),
+        # 日志落盘要自己打开：不设置就只有内存里的 deque（logs_max_lines 行），不写磁盘
+        log_spool_dir=_env_path("AP_LOG_SPOOL_DIR", None),
+        log_hot_tail_lines=int(os.environ.get("AP_LOG_HOT_TAIL_LINES", "200")),
+        log_spool_compress=os.environ.get("AP_LOG_SPOOL_COMPRESS", "0") == "1",
+        retention_max_runs=_opt_int(_env_limit("AP_RETENTION_MAX_RUNS", 1000)),
+        retention_ttl_s=_env_limit("AP_RETENTION_TTL_S", None),
+        retention_max_log_mb=_env_limit("AP_RETENTION_MAX_LOG_MB", 256.0),
+        retention_archive_dir=_env_path("AP_RETENTION_ARCHIVE_DIR", None),
+        cache_ttl_s=float(os.environ.get("AP_CACHE_TTL_S", "300")),
+        cache_max_entries=int(os.environ.get("AP_CACHE_MAX_ENTRIES", "1000")),
+        cache_max_log_mb=_env_limit("AP_CACHE_MAX_LOG_MB", 64.0),
+        batch_max_runs=int(os.environ.get("AP_BATCH_MAX_RUNS", "10000")),
+        batch_max_parallel=int(os.environ.get("AP_BATCH_MAX_PARALLEL", "8")),
+        schedules_enabled=os.environ.get("AP_SCHEDULES", "1").strip().lower() not in ("0", "off", "false"),
+        schedule_state_path=_env_path("AP_SCHEDULE_STATE", project_root / "var" / "schedules.json"),
+        metrics_enabled=os.environ.get("AP_METRICS", "1").strip().lower() not in ("0", "off", "false"),
+        artifacts_dir=_env_path("AP_ARTIFACTS_DIR", None),  # 同样要自己打开：不设置就不收产物、不写磁盘
+        artifacts_max_mb=_env_limit("AP_ARTIFACTS_MAX_MB", 2048.0),
+        artifacts_ttl_s=_env_limit("AP_ARTIFACTS_TTL_S", None),
+        artifacts_max_files=int(os.environ.get("AP_ARTIFACTS_MAX_FILES", "1000")),
     )
@@ -0,0 +1,323 @@
+# Prometheus 指标（文本格式 0.0.4），给 /metrics 用。
+# 没用 prometheus_client：这里只要 counter / histogram / 抓取时现算的 gauge，几十行就够了，不多一个依赖。
+#
+# 开销的原则：热路径上只做“加一个数”（一次无竞争的锁 + 一次加法，几十纳秒）；
+# 运行中 run 的数量这种要遍历的东西，放在 collector 里，只有被抓取（scrape）的时候才算。
+from __future__ import annotations
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# AP_METRICS=off 时关掉：store 用回普通 Lock，API 不挂中间件（计数器照样加，反正很便宜）
+_enabled = True
+
+# 默认桶：1ms .. 60s，覆盖 API 延迟和 spawn 延迟
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# run 时长：0.1s .. 4h
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 14400.0)
+# 锁：1us .. 100ms
+LOCK_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.1)
+
+Collector = Callable[[], Iterable[str]]
+
+
+def configure(*, enabled: bool) -> None:
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, n: float = 1.0) -> None:
+        with self._lock:
+            self.value += n
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一个是 +Inf
+        self.sum = 0.0
+
+    def observe(self, v: float) -> None:
+        i = bisect_left(self._bounds, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Child for one label combination. Hot paths should call this once and keep the child."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, n: float = 1.0) -> None:
+        self._default.inc(n)
+
+    def collect(self) -> List[str]:
+        out = self._header()
+        for key, child in list(self._children.items()):
+            out.append(f"{self.name}{_labels(self.labelnames, key)} {_num(child.value)}")
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), *, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, v: float) -> None:
+        self._default.observe(v)
+
+    def collect(self) -> List[str]:
+        out = self._header()
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            acc = 0
+            for bound, c in zip((*self.buckets, math.inf), counts):
+                acc += c
+                le = f'le="{_num(bound)}"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {acc}")
+        return out
+
+
+def gauge_lines(name: str, help: str, samples: Iterable[Tuple[Dict[str, str], float]]) -> List[str]:
+    """Render a gauge computed at scrape time: samples = [({label: value}, number), ...]."""
+    out = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for labels, v in samples:
+        out.append(f"{name}{_labels(list(labels), list(labels.values()))} {_num(v)}")
+    return out
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: Dict[str, Collector] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, key: str, fn: Collector) -> None:
+        # 按 key 覆盖：create_app 被调多次（测试 / benchmark）时只保留最新那个 store / scheduler
+        with self._lock:
+            self._collectors[key] = fn
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors.items())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.collect())
+        for key, fn in collectors:
+            try:
+                lines.extend(fn())
+            except Exception as e:  # 一个 collector 坏了不影响其它指标
+                lines.append(f"# collector {key} failed: {type(e).__name__}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))  # type: ignore[return-value]
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), *, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets=buckets))  # type: ignore[return-value]
+
+
+# ---- 各模块共用的指标 ----
+
+SPAWN_SECONDS = histogram(
+    "ap_spawn_seconds", "Time to fork/exec a run's process (or hand it to a pool worker).", ("backend",)
+)
+LOG_LINES = counter("ap_log_lines_total", "Log lines ingested from run output.")
+LOG_BYTES = counter("ap_log_bytes_total", "Raw log bytes read from run output.")
+STORE_LOCK_ACQUIRED = counter(
+    "ap_store_lock_acquired_total", "Acquisitions of the state store's global lock (counted in steps of 64)."
+)
+STORE_LOCK_WAIT = histogram(
+    "ap_store_lock_wait_seconds",
+    "Wait time for the state store's global lock, contended acquisitions only.",
+    buckets=LOCK_BUCKETS,
+)
+STORE_LOCK_HOLD = histogram(
+    "ap_store_lock_hold_seconds", "Hold time of the state store's global lock (1 in 64 acquisitions).", buckets=LOCK_BUCKETS
+)
+RUNS_FINISHED = counter("ap_runs_finished_total", "Runs that reached a final status.", ("script_id", "status"))
+RUN_DURATION = histogram(
+    "ap_run_duration_seconds", "Wall time from process start to finish, per script.", ("script_id",), buckets=DURATION_BUCKETS
+)
+HTTP_SECONDS = histogram(
+    "ap_http_request_seconds", "API handler latency until the response headers are sent.", ("method", "route", "status")
+)
+
+
+class TimedLock:
+    """
+    Drop-in for threading.Lock that feeds the store lock metrics.
+
+    Kept cheap because the store takes this lock on every create / finish / query:
+    - wait time is only measured when the non-blocking fast path fails (contention);
+    - hold time is measured on every `HOLD_SAMPLE`-th acquisition.
+    The counters are only touched while the lock is held, so they need no extra lock.
+    """
+
+    HOLD_SAMPLE = 64
+
+    __slots__ = ("_lock", "_n", "_held_since")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._n = 0
+        self._held_since = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if not self._lock.acquire(False):
+            if not blocking:
+                return False
+            t0 = time.perf_counter()
+            if not self._lock.acquire(True, timeout):
+                return False
+            _LOCK_WAIT.observe(time.perf_counter() - t0)
+        self._n += 1
+        if self._n % self.HOLD_SAMPLE == 0:
+            _LOCK_ACQUIRED.inc(self.HOLD_SAMPLE)
+            self._held_since = time.perf_counter()
+        return True
+
+    def release(self) -> None:
+        since = self._held_since
+        if since:
+            self._held_since = 0.0
+            held = time.perf_counter() - since
+            self._lock.release()
+            _LOCK_HOLD.observe(held)
+        else:
+            self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc: object) -> None:
+        self.release()
+
+
+_LOCK_ACQUIRED = STORE_LOCK_ACQUIRED._default
+_LOCK_WAIT = STORE_LOCK_WAIT._default
+_LOCK_HOLD = STORE_LOCK_HOLD._default
+
+
+def store_lock() -> "TimedLock | threading.Lock":
+    return TimedLock() if _enabled else threading.Lock()
+
+
+def observe_http(method: str, route: str, status: int, seconds: float) -> None:
+    HTTP_SECONDS.labels(method, route, str(status)).observe(seconds)
+
+
+def metrics_app_middleware(app: Callable) -> Callable:
+    """
+    Pure ASGI middleware: records ap_http_request_seconds per route template
+    (e.g. /runs/{run_id}) at http.response.start, so streaming endpoints are
+    measured to their first byte, not to the end of the stream.
+    """
+
+    async def middleware(scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                path = getattr(route, "path", None) or "<unmatched>"
+                observe_http(scope["method"], path, message["status"], time.perf_counter() - t0)
+            await send(message)
+
+        await app(scope, receive, send_wrapper)
+
+    return middleware
+
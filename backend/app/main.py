@@ -21,43 +21,216 @@
 # 入口：创建 app、初始化 registry/store/runner、挂载 router。
 from __future__ import annotations
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 
-from app.core.config import get_settings
+from app.bootstrap import (
+    build_artifacts,
+    build_registry,
+    build_runner,
+    build_sampler,
+    build_store,
+    build_worker_pool,
+    start_spec_watcher,
+)
+from app.core import metrics
+from app.core.config import Settings, get_settings
 from app.core.logging import setup_logging
 from app.api.health import router as health_router
+from app.api.artifacts import build_router as build_artifacts_router
+from app.api.batches import build_router as build_batches_router
+from app.api.metrics import build_router as build_metrics_router
+from app.api.schedules import build_router as build_schedules_router
 from app.api.scripts import build_router
-from app.services.registry import ScriptRegistry
-from app.services.runner import RunnerService
-from app.storage.state_store import InMemoryStateStore
+from app.api.workflows import build_router as build_workflows_router
+from app.services.batches import BatchManager
+from app.services.daemon_rpc import (
+    DaemonClient,
+    DaemonError,
+    RemoteBatchManager,
+    RemoteResultCache,
+    RemoteScheduleManager,
+    RemoteScheduler,
+    RemoteStateStore,
+    RemoteWorkflowEngine,
+)
+from app.services.result_cache import ResultCache
+from app.services.scheduler import RunScheduler, Scheduler
+from app.services.schedules import ScheduleManager
+from app.services.supervisor import ProcessSupervisor
+from app.services.workflow_engine import WorkflowEngine
+from app.services.workflows import WorkflowRegistry
+from app.services.work_queue import QueueScheduler, RedisWorkQueue
+from app.storage.redis_store import RedisStateStore
 
 import logging
+from typing import Optional
 
 logger = logging.getLogger("app.main")
 
 
-def create_app() -> FastAPI:
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    # settings 不传就读环境变量；benchmark 会传一份指向 fixtures 的配置进来
     setup_logging()
-    settings = get_settings()
+    settings = settings or get_settings()
 
     logger.info("project_root=%s", settings.project_root)
     logger.info("scripts_dir=%s", settings.scripts_dir)
-    logger.info("script_specs_dir=%s", settings.script_specs_dir)
-
-    store = InMemoryStateStore(logs_max_lines=settings.logs_max_lines)
-    registry = ScriptRegistry(
-        project_root=settings.project_root,
-        scripts_dir=settings.scripts_dir,
-        specs_dir=settings.script_specs_dir
+    logger.info("script_specs_dir=%s spec_watch=%s", settings.script_specs_dir, settings.spec_watch)
+    logger.info("workflow_specs_dir=%s", settings.workflow_specs_dir)
+    logger.info("runner_backend=%s", settings.runner_backend)
+    logger.info("max_concurrent_runs=%s", settings.max_concurrent_runs)
+    logger.info("state_backend=%s state_db_path=%s", settings.state_backend, settings.state_db_path)
+    logger.info("run_mode=%s", settings.run_mode)
+    logger.info("metrics_enabled=%s", settings.metrics_enabled)
+    logger.info("schedules_enabled=%s schedule_state_path=%s", settings.schedules_enabled, settings.schedule_state_path)
+    logger.info(
+        "result cache ttl_s=%s max_entries=%s max_log_mb=%s",
+        settings.cache_ttl_s,
+        settings.cache_max_entries,
+        settings.cache_max_log_mb,
+    )
+    logger.info("log_spool_dir=%s", settings.log_spool_dir)
+    logger.info(
+        "artifacts_dir=%s max_mb=%s ttl_s=%s",
+        settings.artifacts_dir,
+        settings.artifacts_max_mb,
+        settings.artifacts_ttl_s,
     )
-    runner = RunnerService(store)
+    logger.info(
+        "retention max_runs=%s ttl_s=%s max_log_mb=%s archive_dir=%s",
+        settings.retention_max_runs,
+        settings.retention_ttl_s,
+        settings.retention_max_log_mb,
+        settings.retention_archive_dir,
+    )
+
+    metrics.configure(enabled=settings.metrics_enabled)  # 要在 build_store 之前：决定 store 用哪种锁
+    daemon: Optional[DaemonClient] = None
+    if settings.run_mode == "daemon":
+        # 单机多 worker：run 的状态和执行都在 run_daemon 进程里，这个进程只拿代理对象（见 daemon_rpc.py）
+        logger.info("daemon_socket=%s", settings.daemon_socket)
+        daemon = DaemonClient(settings.daemon_socket)
+        store = RemoteStateStore(daemon)
+    else:
+        store = build_store(settings)
+    registry = build_registry(settings)
+    start_spec_watcher(settings, registry)
+    scheduler: Scheduler
+    if settings.run_mode == "queue":
+        # 多机：API 不执行脚本，只往 Redis 队列里放；runner 节点用 `python -m app.services.runner_node` 启动
+        if not isinstance(store, RedisStateStore):
+            raise ValueError("AP_RUN_MODE=queue needs AP_STATE_BACKEND=redis")
+        scheduler = QueueScheduler(
+            queue=RedisWorkQueue(store.client, prefix=settings.redis_prefix),
+            store=store,
+            reap_interval_s=settings.node_heartbeat_s,
+        )
+        artifacts = build_artifacts(settings, read_only=True)
+    elif settings.run_mode == "local":
+        sampler = build_sampler(settings, store)
+        supervisor = ProcessSupervisor()  # runner 和 pool 共用：所有超时 / stop 宽限期在一个堆里，一个线程
+        runner = build_runner(settings.runner_backend, store, sampler, supervisor)
+        pool = build_worker_pool(settings, registry, store, sampler, supervisor)
+        artifacts = build_artifacts(settings)
+        scheduler = RunScheduler(
+            runner=runner,
+            store=store,
+            max_concurrent_runs=settings.max_concurrent_runs,
+            pool=pool,
+            artifacts=artifacts,
+        )
+    elif settings.run_mode == "daemon":
+        assert daemon is not None
+        scheduler = RemoteScheduler(daemon)
+        artifacts = build_artifacts(settings, read_only=True)  # 同一台机器：直接读守护进程写的目录
+    else:
+        raise ValueError(f"Unknown run mode: {settings.run_mode!r} (expected 'local', 'queue' or 'daemon')")
 
     app = FastAPI(title="Automation Platform", version="0.2.0")
+    # 给 benchmark / 调试脚本用：拿到这个 app 背后的组件，不用再走 HTTP
+    app.state.store = store
+    app.state.scheduler = scheduler
+    app.state.registry = registry
     app.include_router(health_router)
+    if daemon is not None:
+        app.state.daemon = daemon
 
-    scripts_router = build_router(registry=registry, runner=runner, store=store)
+        @app.exception_handler(DaemonError)
+        async def daemon_unavailable(request: Request, exc: DaemonError):
+            return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+    # cacheable 脚本的 single-flight + 结果缓存；spec 改了就清掉这个脚本的条目
+    if daemon is not None:
+        result_cache = RemoteResultCache(daemon, scheduler)  # 缓存在守护进程里，所有 worker 共用
+    else:
+        result_cache = ResultCache(
+            store,
+            default_ttl_s=settings.cache_ttl_s,
+            max_entries=settings.cache_max_entries,
+            max_log_bytes=int(settings.cache_max_log_mb * 1024 * 1024) if settings.cache_max_log_mb is not None else None,
+        )
+    registry.add_listener(result_cache.on_registry_change)
+    if isinstance(scheduler, RunScheduler):
+        # 本进程里跑的 run 一结束就结算缓存条目；queue 模式下 run 在别的节点结束，查缓存时再问 store
+        scheduler.add_listener(result_cache.on_run_finished)
+    app.state.result_cache = result_cache
+
+    scripts_router = build_router(registry=registry, scheduler=scheduler, store=store, result_cache=result_cache)
     app.include_router(scripts_router)
 
+    # 脚本产物：GET /runs/{id}/artifacts 列 manifest，/runs/{id}/artifacts/{name} 下载（支持 Range）
+    if artifacts is not None:
+        app.state.artifacts = artifacts
+        app.include_router(build_artifacts_router(store=store, artifacts=artifacts))
+
+    # 参数扫描：一个 batch 的子 run 由 BatchManager 按 max_parallel 一点点放进调度器
+    if daemon is not None:
+        batches = RemoteBatchManager(daemon)
+    else:
+        batches = BatchManager(scheduler=scheduler, store=store, result_cache=result_cache)
+    app.state.batches = batches
+    app.include_router(
+        build_batches_router(
+            registry=registry,
+            batches=batches,
+            max_runs=settings.batch_max_runs,
+            default_parallel=settings.batch_max_parallel,
+        )
+    )
+
+    # 工作流：DAG 里的步骤上游一成功就交给调度器，独立分支并行
+    workflows = WorkflowRegistry(
+        specs_dir=settings.workflow_specs_dir or settings.script_specs_dir.parent / "workflow_specs"
+    )
+    if daemon is not None:
+        engine = RemoteWorkflowEngine(daemon)
+    else:
+        engine = WorkflowEngine(registry=registry, scheduler=scheduler, store=store)
+    app.state.workflows = workflows
+    app.state.workflow_engine = engine
+    app.include_router(build_workflows_router(workflows=workflows, engine=engine))
+
+    # spec 里的 schedule：进程内一个最小堆定时器触发，代替外部 cron + curl
+    if settings.schedules_enabled:
+        if daemon is not None:
+            schedules = RemoteScheduleManager(daemon)  # 只在守护进程里触发，N 个 worker 不会各触发一次
+        else:
+            schedules = ScheduleManager(
+                registry=registry,
+                scheduler=scheduler,
+                store=store,
+                state_path=settings.schedule_state_path,
+            )
+        app.state.schedules = schedules
+        app.include_router(build_schedules_router(schedules=schedules))
+
+    if settings.metrics_enabled:
+        app.include_router(
+            build_metrics_router(store=store, scheduler=scheduler, result_cache=result_cache, daemon=daemon)
+        )
+        app.add_middleware(metrics.metrics_app_middleware)
+
     return app
 
 
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+
+class ScheduleInfo(BaseModel):
+    schedule_id: str  # script_id，或者 script_id:name（一个脚本有多个定时时）
+    script_id: str
+    name: str = ""
+    expr: str  # cron 表达式，或者 "every 300s"
+    params: Dict[str, Any] = {}
+    jitter_s: float = 0.0
+    max_overlap: int = 1
+    on_overlap: str = "skip"
+    catch_up: str = "one"
+    paused: bool = False
+    next_run_at: Optional[datetime] = None  # 含 jitter；暂停时为 None
+    last_run_at: Optional[datetime] = None
+    last_run_id: Optional[str] = None
+    last_error: Optional[str] = None
+    active_runs: int = 0
+    fired: int = 0
+    skipped: int = 0  # 因为 max_overlap 跳过的次数
+    missed: int = 0  # 按 catch_up 策略没补的次数
+    errors: int = 0
+
+
+class TriggerResult(BaseModel):
+    schedule_id: str
+    result: str  # "fired" | "skipped_overlap" | "error"
+    run_id: Optional[str] = None
+    error: Optional[str] = None
@@ -16,15 +16,35 @@ class ScriptInfo(BaseModel):
 class CreateRunRequest(BaseModel):
     script_id: str
     params: Dict[str, Any] = Field(default_factory=dict)
+    priority: int = 0  # 越大越先跑；同优先级先来先跑
 
 
 class RunStatus(str, Enum):
+    queued = "queued"
     running = "running"
     done = "done"
     failed = "failed"
     stopped = "stopped"
 
 
+class RunProgressInfo(BaseModel):
+    # 脚本用 ap_sdk 上报的最新状态（RunInfo 里只放这些，result / 历史在 GET /runs/{id}/progress）
+    current: Optional[float] = None
+    total: Optional[float] = None
+    percent: Optional[float] = None
+    message: Optional[str] = None
+    counters: Dict[str, float] = Field(default_factory=dict)
+    events: int = 0
+    updated_at: Optional[datetime] = None
+
+
+class RunProgressDetail(RunProgressInfo):
+    run_id: str
+    status: RunStatus
+    result: Any = None
+    history: List[Dict[str, Any]] = Field(default_factory=list)
+
+
 class RunInfo(BaseModel):
     run_id: str
     script_id: str
@@ -33,12 +53,53 @@ class RunInfo(BaseModel):
     returncode: Optional[int] = None
     created_at: datetime
     finished_at: Optional[datetime] = None
+    queue_position: Optional[int] = None  # 只有 queued 状态才有，0 表示下一个就轮到它
+    node: Optional[str] = None  # 多机部署时在哪个 runner 节点上跑
+    # 资源占用（采样得到，跑的时候也会更新）；没开采样时都是 None
+    peak_rss_mb: Optional[float] = None
+    cpu_s: Optional[float] = None
+    io_read_bytes: Optional[int] = None
+    io_write_bytes: Optional[int] = None
+    cache: Optional[str] = None  # cacheable 脚本才有："miss" 新跑的 / "joined" 跟着正在跑的 / "hit" 之前的结果
+    failure_reason: Optional[str] = None  # 比如 "memory limit exceeded: ..."、"timeout after 30s"
+    progress: Optional[RunProgressInfo] = None  # 脚本没上报过进度时为 None
+
+
+class StopRunsRequest(BaseModel):
+    # 条件之间是“且”；至少给一个，避免一个空请求停掉所有 run
+    run_ids: Optional[List[str]] = None
+    script_id: Optional[str] = None
+    status: Optional[RunStatus] = None  # 只能是 queued / running；不写两种都停
+    limit: int = Field(default=1000, ge=1, le=10000)
+
+
+class RunList(BaseModel):
+    items: List[RunInfo]
+    next_cursor: Optional[str] = None  # 带上它请求下一页；None 表示已经是最后一页
 
 
 class RunLogs(BaseModel):
     run_id: str
     lines: List[str]
     truncated: bool = False
+    first_seq: int = 0  # lines[0] 的序号
+    next_seq: int = 0  # 下次轮询带上 since=next_seq，只拿新行
+
+
+class ArtifactInfo(BaseModel):
+    name: str  # 脚本在 AP_ARTIFACTS_DIR 下写的相对路径
+    size: int
+    sha256: str  # 内容一样的文件（重复截图）sha256 一样，只存了一份
+    content_type: str
+    url: str
+
+
+class RunArtifacts(BaseModel):
+    run_id: str
+    pending: bool = False  # run 刚结束，文件还在收进存储的路上；过一会儿再查
+    files: List[ArtifactInfo] = Field(default_factory=list)
+    total_bytes: int = 0
+    skipped: int = 0  # 没收进来的（超过文件数上限 / 符号链接）
 
 
 class ScriptDetail(BaseModel):
@@ -49,3 +110,66 @@ class ScriptDetail(BaseModel):
     timeout_s: Optional[float] = None
     env: Dict[str, str] = {}
     args_schema: Dict[str, Any] = {}
+    max_concurrency: Optional[int] = None
+    execution: str = "subprocess"
+    params_via: str = "argv"
+    max_rss_mb: Optional[float] = None
+    max_cpu_s: Optional[float] = None
+    cacheable: bool = False
+    cache_ttl_s: Optional[float] = None
+    schedules: List[Dict[str, Any]] = []
+    adaptive_timeout: Optional[Dict[str, Any]] = None
+
+
+class DurationStats(BaseModel):
+    # 只算成功（done）的 run；分位数来自对数分桶直方图，相对误差 ~1%
+    samples: int
+    mean: float
+    min: float
+    max: float
+    p50: float
+    p90: float
+    p95: float
+    p99: float
+
+
+class ScriptStats(BaseModel):
+    script_id: str
+    runs: int = 0  # 经过调度器跑起来的 run（排队时被取消的不算）
+    by_status: Dict[str, int] = Field(default_factory=dict)
+    success_rate: Optional[float] = None
+    duration_s: Optional[DurationStats] = None
+    since: Optional[datetime] = None  # 统计只在内存里：进程（守护进程）启动后第一个 run 结束的时间
+    timeout_s: Optional[float] = None  # spec 里写的静态超时
+    effective_timeout_s: Optional[float] = None  # 下一个 run 实际用的超时（adaptive_timeout 算出来的，或者 timeout_s）
+
+
+class CreateBatchRequest(BaseModel):
+    script_id: str
+    # 二选一：params 是一组参数（每个一个 run）；grid 是参数网格，按笛卡尔积展开，base_params 是每个组合共用的参数
+    params: Optional[List[Dict[str, Any]]] = None
+    grid: Optional[Dict[str, List[Any]]] = None
+    base_params: Dict[str, Any] = Field(default_factory=dict)
+    max_parallel: Optional[int] = Field(default=None, ge=1)  # 这个 batch 同时在调度器里的 run 数，不写用 AP_BATCH_MAX_PARALLEL
+    priority: int = 0
+
+
+class BatchRun(BaseModel):
+    index: int
+    params: Dict[str, Any]
+    run_id: Optional[str] = None  # 还没轮到的子 run 没有 run_id
+    status: Optional[RunStatus] = None
+
+
+class BatchInfo(BaseModel):
+    batch_id: str
+    script_id: str
+    status: str  # "running" | "cancelling" | "done" | "failed" | "cancelled"
+    total: int
+    finished: int
+    progress: float  # finished / total
+    counts: Dict[str, int]  # 按状态计数，"pending" = 还没放进调度器
+    max_parallel: int
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    runs: Optional[List[BatchRun]] = None  # 列表接口不带
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class WorkflowStep(BaseModel):
+    step_id: str
+    script_id: str
+    needs: List[str] = []
+    params: Dict[str, Any] = {}  # 原样返回，里面可能有 ${...} 引用
+
+
+class WorkflowInfo(BaseModel):
+    workflow_id: str
+    description: str = ""
+    params: Dict[str, Any] = {}  # 默认参数
+    fail_fast: bool = False
+    steps: List[WorkflowStep]
+
+
+class StartWorkflowRequest(BaseModel):
+    params: Dict[str, Any] = Field(default_factory=dict)
+
+
+class WorkflowStepRun(BaseModel):
+    step_id: str
+    script_id: str
+    needs: List[str] = []
+    status: str  # pending | running | done | failed | skipped | cancelled
+    run_id: Optional[str] = None
+    run_ids: List[str] = []  # 每次尝试的 run，resume 过才会有多个
+    params: Optional[Dict[str, Any]] = None  # 代入上游输出后实际提交的参数
+    outputs: Dict[str, Any] = {}
+    error: Optional[str] = None
+    duration_s: Optional[float] = None
+
+
+class WorkflowRunInfo(BaseModel):
+    wf_run_id: str
+    workflow_id: str
+    status: str  # running | done | failed | cancelled
+    attempt: int = 1
+    params: Dict[str, Any] = {}
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    elapsed_s: float  # 这次尝试从开始到现在 / 到结束的时间
+    step_time_s: float  # 已结束步骤的耗时之和；比 elapsed_s 大得越多，说明并行省下的时间越多
+    steps: List[WorkflowStepRun]
@@ -0,0 +1,332 @@
+# asyncio 版 Runner：所有子进程都挂在同一个后台 event loop 上。
+# RunnerService 是“一个 run 一个线程”，几千个长时间运行的脚本就是几千个阻塞在 proc.stdout 上的线程；
+# 这里改成 asyncio.create_subprocess_exec + event loop 的 pipe reader，整个服务只多一个线程。
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from app.core.metrics import SPAWN_SECONDS
+from app.schemas.script import RunStatus
+from app.services.log_ingest import CHUNK_SIZE, COALESCE_S, SMALL_READ_BYTES, LineSplitter
+from app.services.params import ParamsDelivery, prepare_params
+from app.services.resources import ResourceLimits, ResourceSampler
+from app.services.run_events import ProgressTracker, events_env, open_channel
+from app.services.runner import FinishListener
+from app.services.supervisor import ProcessSupervisor, kill_group
+from app.storage.state_store import StateStore
+
+logger = logging.getLogger("app.async_runner")
+
+# StreamReader 的缓冲上限；超过 2*limit 才会暂停读 pipe，给刷屏脚本多留点余量。
+_STREAM_LIMIT = 1 << 20
+
+_SPAWN = SPAWN_SECONDS.labels("asyncio")
+
+
+async def _feed_stdin(proc: asyncio.subprocess.Process, data: bytes) -> None:
+    # params_via=stdin：写完 JSON 就关掉，脚本读到 EOF
+    assert proc.stdin is not None
+    try:
+        proc.stdin.write(data)
+        await proc.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # 脚本没读完就退出了
+    finally:
+        proc.stdin.close()
+
+
+def _kill_leftovers(pid: int) -> None:
+    # 主进程可能已经被 asyncio 回收了；组里还有进程时这个组号不会被复用，按组号清掉脚本丢在后台的孙进程，
+    # 不然它们一直占着 stdout：asyncio 的 proc.wait() 要等 pipe 全关才返回，这个 run 就永远结束不了
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class AsyncRunnerService:
+    """
+    Same start/stop/state-store contract as RunnerService, backed by asyncio.
+
+    - start()/stop() stay synchronous so the (sync) API handlers can call them directly;
+      the actual work is submitted to a private event loop running in one daemon thread.
+    - Log streaming and timeouts are coroutines, not threads.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        *,
+        sampler: Optional[ResourceSampler] = None,
+        supervisor: Optional[ProcessSupervisor] = None,
+    ) -> None:
+        self._store = store
+        self._sampler = sampler
+        # 超时 / stop 宽限期用 event loop 自己的定时器；supervisor 只用来拿 pidfd 的退出通知
+        self._sup = supervisor or ProcessSupervisor()
+        self._procs: Dict[str, asyncio.subprocess.Process] = {}
+        self._stopping: Set[str] = set()
+        self._events: Dict[str, asyncio.Future] = {}  # run_id -> 事件 pipe 读到 EOF 时完成
+        self._tasks: Set[asyncio.Task] = set()
+        # create_task 返回的 task 只被 event loop 弱引用，自己留一份，防止被 GC 掉。
+        self._listeners: List[FinishListener] = []
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="async-runner", daemon=True)
+        self._thread.start()
+
+    def add_listener(self, fn: FinishListener) -> None:
+        self._listeners.append(fn)
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def start(
+        self,
+        *,
+        script_id: str,
+        script_path: Path,
+        params: dict,
+        cwd: Optional[Path] = None,
+        env: Optional[dict[str, str]] = None,
+        timeout_s: Optional[float] = None,
+        run_id: Optional[str] = None,
+        params_via: str = "argv",
+        limits: Optional[ResourceLimits] = None,
+    ) -> str:
+        fut = asyncio.run_coroutine_threadsafe(
+            self._spawn(
+                script_id=script_id,
+                script_path=script_path,
+                params=params,
+                cwd=cwd,
+                env=env,
+                timeout_s=timeout_s,
+                run_id=run_id,
+                params_via=params_via,
+                limits=limits,
+            ),
+            self._loop,
+        )
+        # 只等到进程 fork 出来、store 里有记录为止，不等脚本跑完。
+        return fut.result()
+
+    async def _spawn(
+        self,
+        *,
+        script_id: str,
+        script_path: Path,
+        params: dict,
+        cwd: Optional[Path],
+        env: Optional[dict[str, str]],
+        timeout_s: Optional[float],
+        run_id: Optional[str],
+        params_via: str,
+        limits: Optional[ResourceLimits],
+    ) -> str:
+        queued = run_id is not None
+        run_id = run_id or str(uuid.uuid4())
+
+        delivery = prepare_params(params, params_via)
+        cmd = [sys.executable, "-u", str(script_path), *delivery.argv]
+        env = delivery.merge_env(env)
+        events_r, events_w = open_channel()
+        env = events_env(env, via="fd", fd=events_w)
+
+        t_spawn = time.perf_counter()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE if delivery.stdin is not None else None,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                cwd=str(cwd) if cwd else None,
+                env={**(env or {})} if env else None,  # same rule as RunnerService
+                limit=_STREAM_LIMIT,
+                preexec_fn=limits.preexec_fn() if limits is not None else None,
+                start_new_session=True,  # 和 RunnerService 一样：stop / 超时按进程组杀
+                pass_fds=(events_w,),
+            )
+        except BaseException:
+            delivery.cleanup()
+            os.close(events_r)
+            raise
+        finally:
+            os.close(events_w)
+        _SPAWN.observe(time.perf_counter() - t_spawn)
+
+        self._procs[run_id] = proc
+        self._sup.watch(proc.pid, _kill_leftovers)
+        if queued:
+            self._store.mark_running(run_id, pid=proc.pid)
+        else:
+            self._store.create_run(run_id=run_id, script_id=script_id, pid=proc.pid)
+        if self._sampler is not None:
+            self._sampler.track(run_id, proc.pid, limits=limits)
+        # 事件 pipe 直接挂在 event loop 上读，不多开线程
+        done = self._loop.create_future()
+        self._events[run_id] = done
+        tracker = ProgressTracker(self._store, run_id)
+        self._loop.add_reader(events_r, self._on_events, events_r, tracker, done)
+
+        task = self._loop.create_task(self._supervise(run_id, proc, timeout_s, delivery))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        logger.info(
+            "Started run %s (script_id=%s pid=%s cwd=%s timeout=%s)",
+            run_id, script_id, proc.pid, cwd, timeout_s
+        )
+        return run_id
+
+    async def _supervise(
+        self, run_id: str, proc: asyncio.subprocess.Process, timeout_s: Optional[float], delivery: ParamsDelivery
+    ) -> None:
+        try:
+            if delivery.stdin is not None:
+                self._loop.create_task(_feed_stdin(proc, delivery.stdin))
+            await self._stream_and_watch(run_id, proc, timeout_s)
+        finally:
+            delivery.cleanup()
+
+    async def _pump(self, run_id: str, proc: asyncio.subprocess.Process) -> None:
+        if proc.stdout is None:
+            self._store.append_log(run_id, "[runner] no stdout pipe\n")
+        else:
+            splitter = LineSplitter()
+            while True:
+                chunk = await proc.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._store.append_logs(run_id, splitter.feed(chunk))
+                if len(chunk) < SMALL_READ_BYTES:
+                    await asyncio.sleep(COALESCE_S)
+            self._store.append_logs(run_id, splitter.flush())
+        if self._sampler is not None:
+            # stdout EOF 一般就是进程要退出了：趁还没被 asyncio 回收，读最后一次
+            self._sampler.sample(run_id)
+        await proc.wait()
+
+    async def _stream_and_watch(
+        self, run_id: str, proc: asyncio.subprocess.Process, timeout_s: Optional[float]
+    ) -> None:
+        # 这里是唯一写最终状态的地方（stop / 超时都只负责发信号），同一个 run 不会被 finish 两次
+        pump = self._loop.create_task(self._pump(run_id, proc))
+        timed_out = False
+        # 超时由 event loop 的定时器负责，脚本不输出也能按时杀掉。
+        await asyncio.wait({pump}, timeout=timeout_s)
+        if not pump.done() and run_id not in self._stopping:
+            timed_out = True
+            self._store.append_log(run_id, "[runner] timeout reached, killing process\n")
+            self._store.set_failure_reason(run_id, f"timeout after {float(timeout_s):g}s")
+            self._kill_process(run_id, proc)
+        try:
+            # 不取消 pump：杀掉之后 stdout 很快 EOF，LineSplitter 里没换行的最后一段也会落进日志
+            await pump
+        except Exception as e:
+            self._store.append_log(run_id, f"[runner] stream error: {e}\n")
+
+        rc = await proc.wait()
+        stopped = run_id in self._stopping
+        rec = self._store.peek_run(run_id)
+        if rec and rec.finished_at is not None:
+            self._cleanup(run_id)
+            return
+
+        if stopped:
+            status = RunStatus.stopped
+        elif timed_out:
+            status, rc = RunStatus.failed, -9
+        else:
+            status = RunStatus.done if rc == 0 else RunStatus.failed
+        await self._events_closed(run_id)
+        self._finish(run_id, status=status, returncode=rc)
+        self._cleanup(run_id)
+        logger.info("Finished run %s (rc=%s status=%s)", run_id, rc, status)
+
+    def _on_events(self, fd: int, tracker: ProgressTracker, done: asyncio.Future) -> None:
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if data:
+            tracker.feed(data)
+            return
+        self._loop.remove_reader(fd)
+        os.close(fd)
+        tracker.close()
+        if not done.done():
+            done.set_result(None)
+
+    async def _events_closed(self, run_id: str) -> None:
+        # 写最终状态之前等最后的进度落进 store；整组都杀掉了，写端都关了，正常马上就到
+        done = self._events.get(run_id)
+        if done is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(done), timeout=2.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self, run_id: str, *, kill_after_s: float = 2.0) -> bool:
+        # 不等结果：SIGTERM、宽限期、SIGKILL 都在 event loop 里做完，API 线程马上返回
+        if run_id not in self._procs or run_id in self._stopping:
+            return run_id in self._procs
+        asyncio.run_coroutine_threadsafe(self._stop(run_id, kill_after_s), self._loop)
+        return True
+
+    async def _stop(self, run_id: str, kill_after_s: float) -> bool:
+        # 只发信号：进程退出后由 _stream_and_watch 记成 stopped
+        proc = self._procs.get(run_id)
+        if proc is None or run_id in self._stopping or proc.returncode is not None:
+            return False  # 已经退出了（pid 可能被复用，不能再发信号），按它自己的结果收尾
+        self._stopping.add(run_id)
+
+        self._store.append_log(run_id, "[runner] stop requested\n")
+        try:
+            kill_group(proc.pid, signal.SIGTERM)
+        except Exception as e:
+            self._store.append_log(run_id, f"[runner] terminate failed: {e}\n")
+            self._stopping.discard(run_id)
+            return False
+
+        try:
+            await asyncio.wait_for(asyncio.shield(proc.wait()), timeout=kill_after_s)
+        except asyncio.TimeoutError:
+            self._store.append_log(run_id, "[runner] terminate timeout -> kill\n")
+            self._kill_process(run_id, proc)
+        return True
+
+    def _finish(self, run_id: str, *, status: RunStatus, returncode: Optional[int]) -> None:
+        if self._sampler is not None:
+            # 进程已经被回收了，pid 可能被复用：不再读 /proc，用最后一次采样
+            self._sampler.finalize(run_id, returncode, sample=False)
+        self._store.finish_run(run_id, status=status, returncode=returncode)
+        for fn in self._listeners:
+            try:
+                fn(run_id, status, returncode)
+            except Exception:
+                logger.exception("finish listener failed for run %s", run_id)
+
+    def _kill_process(self, run_id: str, proc: asyncio.subprocess.Process) -> None:
+        try:
+            if proc.returncode is None:
+                kill_group(proc.pid, signal.SIGKILL)
+        except Exception as e:
+            self._store.append_log(run_id, f"[runner] kill failed: {e}\n")
+
+    def _cleanup(self, run_id: str) -> None:
+        self._procs.pop(run_id, None)
+        self._events.pop(run_id, None)
+        self._stopping.discard(run_id)
@@ -0,0 +1,295 @@
+# 批量 run（参数扫描）：一次请求 = 一个 batch + N 个子 run。
+#
+# 为什么不让客户端自己发 500 次 POST /runs：
+#   - registry 查找、脚本路径检查、参数校验每次都要做一遍，这里一个 batch 只查一次 spec / 路径，参数在建 batch 时一次性校验完；
+#   - 客户端要自己控制并发、轮询、出错时一个个去停。
+# 子 run 不是一次全塞进调度器：batch 自己有 max_parallel，同时在调度器里（排队 + 在跑）的子 run 不超过它，
+# 跑完一个再放一个进去。这样一个大扫描不会把全局队列占满，别的请求还能插进来。
+from __future__ import annotations
+
+import itertools
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.schemas.script import RunStatus
+from app.services.registry import ScriptSpec
+from app.services.result_cache import ResultCache
+from app.services.scheduler import Scheduler
+from app.storage.state_store import StateStore
+
+logger = logging.getLogger("app.batches")
+
+_FINAL = (RunStatus.done, RunStatus.failed, RunStatus.stopped)
+
+
+def expand_grid(grid: Dict[str, List[Any]], base: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """{"a": [1, 2], "b": ["x", "y"]} -> 4 param dicts (cartesian product, keys in the given order), each on top of `base`."""
+    keys = list(grid)
+    return [{**(base or {}), **dict(zip(keys, combo))} for combo in itertools.product(*(grid[k] for k in keys))]
+
+
+@dataclass
+class BatchChild:
+    index: int
+    params: Dict[str, Any]
+    run_id: Optional[str] = None  # None = 还没放进调度器
+    status: Optional[RunStatus] = None  # 最后一次看到的状态；到了终态就不再查 store
+    shared: bool = False  # 走了结果缓存（joined / hit）：run 不是这个 batch 独占的，取消 batch 时不去停它
+
+
+@dataclass
+class Batch:
+    batch_id: str
+    script_id: str
+    spec: ScriptSpec
+    script_path: Path
+    cwd: Optional[Path]
+    priority: int
+    max_parallel: int
+    children: List[BatchChild]
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    cancelled: bool = False
+    next_index: int = 0  # 下一个要放进调度器的子 run
+    # run_id -> children（已提交、还没到终态）。一般一个 run 一个 child；cacheable 脚本参数重复时几个 child 共用一个 run
+    inflight: Dict[str, List[BatchChild]] = field(default_factory=dict)
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+
+class BatchManager:
+    """
+    Owns all batches of this API process and feeds their children into the
+    scheduler, at most `max_parallel` per batch at a time.
+
+    One pump thread does the feeding. It is woken by scheduler finish events
+    when the scheduler has add_listener() (local mode) and otherwise polls the
+    store every `poll_s` (queue mode: runs finish on other nodes). Batches are
+    kept in memory; the most recent `max_batches` finished ones stay queryable.
+    """
+
+    def __init__(
+        self,
+        *,
+        scheduler: Scheduler,
+        store: StateStore,
+        result_cache: Optional[ResultCache] = None,
+        poll_s: float = 1.0,
+        max_batches: int = 200,
+    ) -> None:
+        self._scheduler = scheduler
+        self._store = store
+        self._cache = result_cache
+        self._poll_s = max(0.05, float(poll_s))
+        self._max_batches = max(1, int(max_batches))
+        self._lock = threading.Lock()
+        self._batches: "OrderedDict[str, Batch]" = OrderedDict()
+        self._owner: Dict[str, str] = {}  # 在飞的子 run_id -> batch_id，给结束回调用
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+        add_listener: Optional[Callable] = getattr(scheduler, "add_listener", None)
+        if add_listener is not None:
+            add_listener(self._on_run_finished)
+
+        self._thread = threading.Thread(target=self._loop, name="batch-pump", daemon=True)
+        self._thread.start()
+
+    # ---- public ----
+
+    def create(
+        self,
+        *,
+        spec: ScriptSpec,
+        script_path: Path,
+        cwd: Optional[Path],
+        params_list: List[Dict[str, Any]],
+        max_parallel: int,
+        priority: int = 0,
+    ) -> Batch:
+        """params_list must already be validated against the spec."""
+        batch = Batch(
+            batch_id=str(uuid.uuid4()),
+            script_id=spec.script_id,
+            spec=spec,
+            script_path=script_path,
+            cwd=cwd,
+            priority=int(priority),
+            max_parallel=max(1, int(max_parallel)),
+            children=[BatchChild(index=i, params=p) for i, p in enumerate(params_list)],
+        )
+        with self._lock:
+            self._batches[batch.batch_id] = batch
+            self._trim_locked()
+            self._fill_locked(batch)  # 第一批直接放进去，响应里就能看到 run_id
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Batch]:
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def list(self) -> List[Batch]:
+        with self._lock:
+            return list(reversed(self._batches.values()))
+
+    def cancel(self, batch_id: str) -> Optional[int]:
+        """Drop children not yet dispatched and stop the ones in flight. Returns how many runs were stopped."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            batch.cancelled = True
+            to_stop = [rid for rid, cs in batch.inflight.items() if not any(c.shared for c in cs)]
+        stopped = sum(1 for rid in to_stop if self._scheduler.stop(rid))
+        self._wake.set()
+        return stopped
+
+    def summary(self, batch: Batch) -> dict:
+        """Counts per status ("pending" = not dispatched yet), plus the aggregated batch status."""
+        self._refresh(batch)
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for c in batch.children:
+                key = "pending" if c.run_id is None else (c.status.value if c.status else RunStatus.queued.value)
+                counts[key] = counts.get(key, 0) + 1
+            total = len(batch.children)
+            done = sum(counts.get(s.value, 0) for s in _FINAL)
+            if not batch.finished:
+                status = "cancelling" if batch.cancelled else "running"
+            elif batch.cancelled:
+                status = "cancelled"
+            elif counts.get(RunStatus.done.value, 0) == total:
+                status = "done"
+            else:
+                status = "failed"
+            return {
+                "status": status,
+                "total": total,
+                "finished": done,
+                "progress": round(done / total, 4) if total else 1.0,
+                "counts": counts,
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = sum(1 for b in self._batches.values() if not b.finished)
+            return {"batches": len(self._batches), "active": active, "inflight_runs": len(self._owner)}
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+
+    # ---- internals ----
+
+    def _on_run_finished(self, run_id: str, status: RunStatus, returncode: Optional[int]) -> None:
+        # 调度器线程里调用：只记一下状态、叫醒 pump，不在这里提交新 run
+        with self._lock:
+            batch_id = self._owner.get(run_id)
+            if batch_id is None:
+                return
+            batch = self._batches.get(batch_id)
+            if batch is not None:
+                self._settle_locked(batch, run_id, status)
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self._poll_s)
+            self._wake.clear()
+            with self._lock:
+                active = [b for b in self._batches.values() if not b.finished]
+            for batch in active:
+                try:
+                    self._refresh(batch)
+                    with self._lock:
+                        self._fill_locked(batch)
+                except Exception:
+                    logger.exception("batch %s: pump failed", batch.batch_id)
+
+    def _refresh(self, batch: Batch) -> None:
+        # 在飞的子 run 去 store 看一眼（队列模式下没有结束回调，只能这样）；最多 max_parallel 个
+        with self._lock:
+            run_ids = list(batch.inflight)
+        for rid in run_ids:
+            rec = self._store.peek_run(rid)
+            status = rec.status if rec is not None else RunStatus.failed  # 记录被淘汰了：当作失败
+            with self._lock:
+                if status in _FINAL:
+                    self._settle_locked(batch, rid, status)
+                else:
+                    for c in batch.inflight.get(rid, ()):
+                        c.status = status
+
+    def _settle_locked(self, batch: Batch, run_id: str, status: RunStatus) -> None:
+        for child in batch.inflight.pop(run_id, ()):
+            child.status = status
+        if self._owner.get(run_id) == batch.batch_id:
+            self._owner.pop(run_id, None)
+        if not batch.inflight and (batch.cancelled or batch.next_index >= len(batch.children)):
+            self._finish_locked(batch)
+
+    def _finish_locked(self, batch: Batch) -> None:
+        if batch.finished_at is None:
+            batch.finished_at = datetime.utcnow()
+            logger.info("batch %s finished (%s runs, cancelled=%s)", batch.batch_id, len(batch.children), batch.cancelled)
+
+    def _fill_locked(self, batch: Batch) -> None:
+        if batch.finished:
+            return
+        if batch.cancelled:
+            if not batch.inflight:
+                self._finish_locked(batch)
+            return
+        while len(batch.inflight) < batch.max_parallel and batch.next_index < len(batch.children):
+            child = batch.children[batch.next_index]
+            batch.next_index += 1
+            run_id, shared = self._submit(batch, child.params)
+            child.run_id, child.shared = run_id, shared
+            child.status = RunStatus.queued
+            batch.inflight.setdefault(run_id, []).append(child)
+            self._owner.setdefault(run_id, batch.batch_id)
+            if shared:
+                # 缓存命中的 run 可能早就结束了，不会再有结束回调：让 pump 马上去 store 看
+                self._wake.set()
+        if not batch.inflight:
+            self._finish_locked(batch)
+
+    def _submit(self, batch: Batch, params: Dict[str, Any]) -> Tuple[str, bool]:
+        spec = batch.spec
+
+        def submit() -> str:
+            return self._scheduler.submit(
+                spec=spec,
+                script_path=batch.script_path,
+                params=params,
+                cwd=batch.cwd,
+                priority=batch.priority,
+            )
+
+        if spec.cacheable and self._cache is not None:
+            run_id, outcome = self._cache.submit(
+                script_id=spec.script_id,
+                script_path=batch.script_path,
+                params=params,
+                ttl_s=spec.cache_ttl_s,
+                submit=submit,
+            )
+            return run_id, outcome != "miss"
+        return submit(), False
+
+    def _trim_locked(self) -> None:
+        # 只淘汰已经结束的 batch（最老的先走）；在跑的一直留着
+        over = len(self._batches) - self._max_batches
+        if over <= 0:
+            return
+        for bid in [bid for bid, b in self._batches.items() if b.finished][:over]:
+            del self._batches[bid]
@@ -0,0 +1,194 @@
+# 定时触发：cron 表达式解析 + spec 里的 schedule 配置。
+#
+#   schedule:
+#     cron: "*/5 * * * *"        # 分 时 日 月 周（服务器本地时间）；也可以 @hourly / @daily / @weekly / @monthly
+#     # every_s: 300             # 或者固定间隔（二选一）
+#     jitter_s: 10               # 每次在计划时间上随机往后推 0~10 秒，避免一堆任务同一秒启动
+#     params: {seconds: 1}
+#     max_overlap: 1             # 这个定时任务最多同时有几个 run（排队 + 在跑）
+#     on_overlap: skip           # 到了上限："skip" 这次不跑；"allow" 照样提交（不检查上限）
+#     catch_up: one              # 错过的触发（进程停了 / 卡住 / 暂停恢复）："none" 全丢 / "one" 补一次 / "all" 每次都补
+#     paused: false
+# 一个脚本要多个定时，写成列表，每项带 name。
+from __future__ import annotations
+
+import calendar
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+_MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+_MONTHS = {m.lower(): i for i, m in enumerate(calendar.month_abbr) if m}
+_DAYS = {d.lower(): (i + 1) % 7 for i, d in enumerate(calendar.day_abbr)}  # cron：0 = 周日
+OVERLAP_POLICIES = ("skip", "allow")
+CATCH_UP_POLICIES = ("none", "one", "all")
+_MAX_YEARS = 5  # 找下一次触发时最多往后看几年（比如 2 月 30 号这种永远不会到的）
+
+
+def _field(text: str, lo: int, hi: int, names: Dict[str, int]) -> FrozenSet[int]:
+    out = set()
+    for part in text.split(","):
+        expr, _, step_s = part.partition("/")
+        step = int(step_s) if step_s else 1
+        if step <= 0:
+            raise ValueError(f"bad step in {part!r}")
+        if expr == "*":
+            a, b = lo, hi
+        else:
+            first, _, last = expr.partition("-")
+            a = names.get(first.lower()) if first.lower() in names else int(first)
+            b = (names.get(last.lower()) if last.lower() in names else int(last)) if last else (hi if step_s else a)
+        if not (lo <= a <= hi and lo <= b <= hi) or a > b:
+            raise ValueError(f"{part!r} out of range {lo}-{hi}")
+        # 周字段允许 0-7，7 也是周日
+        out.update(v % 7 if hi == 7 else v for v in range(a, b + 1, step))
+    return frozenset(out)
+
+
+@dataclass(frozen=True)
+class CronExpr:
+    """Standard 5-field cron (minute hour day-of-month month day-of-week), Vixie semantics for dom/dow."""
+
+    text: str
+    minutes: FrozenSet[int]
+    hours: FrozenSet[int]
+    days: FrozenSet[int]
+    months: FrozenSet[int]
+    weekdays: FrozenSet[int]  # 0 = 周日
+    dom_any: bool
+    dow_any: bool
+
+    @classmethod
+    def parse(cls, text: str) -> "CronExpr":
+        raw = _MACROS.get(text.strip().lower(), text)
+        fields = raw.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron needs 5 fields, got {len(fields)}: {text!r}")
+        expr = cls(
+            text=text.strip(),
+            minutes=_field(fields[0], 0, 59, {}),
+            hours=_field(fields[1], 0, 23, {}),
+            days=_field(fields[2], 1, 31, {}),
+            months=_field(fields[3], 1, 12, _MONTHS),
+            weekdays=_field(fields[4], 0, 7, _DAYS),
+            dom_any=fields[2] == "*",
+            dow_any=fields[4] == "*",
+        )
+        if expr.next_after(datetime(2000, 1, 1)) is None:
+            raise ValueError(f"cron never fires: {text!r}")
+        return expr
+
+    def _day_ok(self, d: datetime) -> bool:
+        dom = d.day in self.days
+        dow = (d.weekday() + 1) % 7 in self.weekdays
+        # 日和周都限定了：满足任意一个就行（和 Vixie cron 一致）；只限定了一个：看那一个
+        if not self.dom_any and not self.dow_any:
+            return dom or dow
+        return dom and dow
+
+    def next_after(self, after: datetime) -> Optional[datetime]:
+        """First matching minute strictly after `after` (naive local time), or None within 5 years."""
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end = after + timedelta(days=366 * _MAX_YEARS)
+        # 按 月 -> 日 -> 时 -> 分 逐级跳，不匹配的整段直接跳过，不是一分钟一分钟地试
+        while t <= end:
+            if t.month not in self.months:
+                y, m = (t.year + 1, 1) if t.month == 12 else (t.year, t.month + 1)
+                t = datetime(y, m, 1)
+                continue
+            if not self._day_ok(t):
+                t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+            if t.hour not in self.hours:
+                t = datetime(t.year, t.month, t.day, t.hour) + timedelta(hours=1)
+                continue
+            if t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+                continue
+            return t
+        return None
+
+
+@dataclass(frozen=True)
+class ScheduleSpec:
+    name: str  # 同一个脚本里区分多个定时；单个定时时是 ""
+    cron: Optional[CronExpr] = None
+    every_s: Optional[float] = None
+    jitter_s: float = 0.0
+    params: Dict[str, Any] | None = None
+    max_overlap: int = 1
+    on_overlap: str = "skip"
+    catch_up: str = "one"
+    paused: bool = False
+
+    @property
+    def expr(self) -> str:
+        return self.cron.text if self.cron is not None else f"every {self.every_s:g}s"
+
+    def next_after(self, ts: float) -> Optional[float]:
+        """Next planned fire time (epoch seconds, without jitter) strictly after `ts`."""
+        if self.every_s is not None:
+            return ts + self.every_s
+        assert self.cron is not None
+        nxt = self.cron.next_after(datetime.fromtimestamp(ts))
+        return nxt.timestamp() if nxt is not None else None
+
+
+def parse_schedules(raw: Any) -> Tuple[ScheduleSpec, ...]:
+    """The `schedule` value of a script spec (mapping or list of mappings) -> ScheduleSpecs; raises ValueError."""
+    if raw is None or raw is False:
+        return ()
+    items: List[Any] = raw if isinstance(raw, list) else [raw]
+    out: List[ScheduleSpec] = []
+    names = set()
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("schedule must be a mapping (or a list of mappings)")
+        name = str(item.get("name") or "").strip()
+        if len(items) > 1 and not name:
+            raise ValueError("each of several schedules needs a name")
+        if name in names:
+            raise ValueError(f"duplicate schedule name {name!r}")
+        names.add(name)
+        cron_text, every = item.get("cron"), item.get("every_s")
+        if (cron_text is None) == (every is None):
+            raise ValueError("schedule needs exactly one of cron / every_s")
+        cron = CronExpr.parse(str(cron_text)) if cron_text is not None else None
+        every_s = float(every) if every is not None else None
+        if every_s is not None and every_s <= 0:
+            raise ValueError("every_s must be > 0")
+        params = item.get("params") or None
+        if params is not None and not isinstance(params, dict):
+            raise ValueError("schedule params must be a mapping")
+        on_overlap = str(item.get("on_overlap") or "skip").strip().lower()
+        catch_up = str(item.get("catch_up") or "one").strip().lower()
+        if on_overlap not in OVERLAP_POLICIES:
+            raise ValueError(f"on_overlap must be one of {OVERLAP_POLICIES}")
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"catch_up must be one of {CATCH_UP_POLICIES}")
+        max_overlap = int(item.get("max_overlap", 1))
+        jitter_s = float(item.get("jitter_s") or 0)
+        if max_overlap < 1 or jitter_s < 0:
+            raise ValueError("max_overlap must be >= 1 and jitter_s >= 0")
+        out.append(
+            ScheduleSpec(
+                name=name,
+                cron=cron,
+                every_s=every_s,
+                jitter_s=jitter_s,
+                params=dict(params) if params else None,
+                max_overlap=max_overlap,
+                on_overlap=on_overlap,
+                catch_up=catch_up,
+                paused=bool(item.get("paused", False)),
+            )
+        )
+    return tuple(out)
@@ -0,0 +1,376 @@
+# 单机多 API 进程（uvicorn --workers N）：脚本执行和所有状态放在一个本机守护进程里（run_daemon.py），
+# 每个 API worker 通过 Unix socket 调它（AP_RUN_MODE=daemon）。这里是两边共用的帧格式，加上 API 这边的客户端和代理对象。
+#
+# 帧 = 4 字节长度 + 4 字节请求号（大端）+ pickle（protocol 5）。
+#   请求：(target, method, args, kwargs)，target 是 "store" / "scheduler" / "batches" …（见 EXPOSED）
+#   响应：(ok, value)，ok=False 时 value 是异常对象，客户端原样抛出（KeyError / ValueError 的处理和单进程时一样）
+# 一个连接上可以连续发很多请求不等响应（pipelining）：worker 里所有线程共用一个连接，响应按请求号配对。
+# pickle 只在同一个用户的进程之间用（socket 文件权限 0600），能直接传 RunRecord / Batch 这些 dataclass。
+from __future__ import annotations
+
+import copyreg
+import io
+import logging
+import os
+import pickle
+import socket
+import struct
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from app.storage.state_store import LogSlice, RunPage, RunQuery, RunRecord
+
+logger = logging.getLogger("app.daemon_rpc")
+
+HEADER = struct.Struct("!II")  # (payload 长度, 请求号)
+MAX_FRAME = 256 * 1024 * 1024
+
+# 守护进程对外开放的方法；不在表里的一律拒绝
+EXPOSED: Dict[str, FrozenSet[str]] = {
+    "store": frozenset(
+        ("get_run", "peek_run", "list_runs", "query_runs", "get_logs", "read_logs", "read_log_bytes", "log_size", "stats")
+    ),
+    "scheduler": frozenset(("submit", "queue_position", "stop", "stats", "script_stats")),
+    "cache": frozenset(("invalidate", "stats")),
+    "batches": frozenset(("create", "get", "list", "cancel", "summary", "stats")),
+    "workflows": frozenset(("start", "get", "list", "cancel", "resume", "stats")),
+    "schedules": frozenset(("list", "get", "pause", "resume", "trigger")),
+    "daemon": frozenset(("ping", "metrics")),
+}
+
+
+class DaemonError(RuntimeError):
+    """The run daemon is unreachable or broke the protocol."""
+
+
+# ---- 编码 ----
+
+
+def _record_from_wire(state: Dict[str, Any]) -> RunRecord:
+    return RunRecord(logs=deque(), **state)
+
+
+def _record_to_wire(rec: RunRecord):
+    # 锁不能 pickle；日志不跟着记录走（API 读日志用 read_logs），否则每次 get_run 都要带上整段 hot tail
+    with rec.lock:
+        state = {k: v for k, v in vars(rec).items() if k not in ("logs", "lock")}
+    return _record_from_wire, (state,)
+
+
+class _Pickler(pickle.Pickler):
+    dispatch_table = {**copyreg.dispatch_table, RunRecord: _record_to_wire}
+
+
+def encode(req_id: int, obj: Any) -> bytes:
+    buf = io.BytesIO()
+    buf.write(b"\0" * HEADER.size)
+    _Pickler(buf, protocol=5).dump(obj)
+    data = buf.getbuffer()
+    HEADER.pack_into(data, 0, len(data) - HEADER.size, req_id)
+    return bytes(data)
+
+
+def read_frame(f: BinaryIO) -> Optional[Tuple[int, bytes]]:
+    """(req_id, payload) from a buffered reader; None at a clean EOF."""
+    head = f.read(HEADER.size)
+    if not head:
+        return None
+    if len(head) < HEADER.size:
+        raise DaemonError("connection closed mid-frame")
+    n, req_id = HEADER.unpack(head)
+    if n > MAX_FRAME:
+        raise DaemonError(f"frame too large ({n} bytes)")
+    payload = f.read(n)
+    if len(payload) < n:
+        raise DaemonError("connection closed mid-frame")
+    return req_id, payload
+
+
+# ---- 客户端 ----
+
+
+class _Waiter:
+    __slots__ = ("event", "ok", "value")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.ok = False
+        self.value: Any = None
+
+
+class _Conn:
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.pid = os.getpid()
+        self.waiters: Dict[int, _Waiter] = {}  # 这个连接上还没收到响应的请求
+        self.send_lock = threading.Lock()
+
+
+class DaemonClient:
+    """
+    One pipelined connection to the run daemon, shared by every thread of this process.
+
+    call() writes its request under a send lock and waits for its own response; a
+    reader thread matches responses to requests by id, so slow calls never hold up
+    fast ones on the wire. The connection is (re)opened lazily, also after a fork.
+    """
+
+    def __init__(self, path: Path, *, timeout_s: float = 30.0) -> None:
+        self._path = str(path)
+        self._timeout_s = timeout_s
+        self._lock = threading.Lock()  # 当前连接 / 请求号 / 等待表
+        self._conn: Optional[_Conn] = None
+        self._next_id = 0
+
+    def call(self, target: str, method: str, *args: Any, **kwargs: Any) -> Any:
+        w = _Waiter()
+        with self._lock:
+            conn = self._connect_locked()
+            self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+            req_id = self._next_id
+            conn.waiters[req_id] = w
+        try:
+            frame = encode(req_id, (target, method, args, kwargs))
+            with conn.send_lock:
+                conn.sock.sendall(frame)
+        except OSError as e:
+            self._drop(conn, DaemonError(f"run daemon connection lost: {e}"))
+        except Exception:
+            with self._lock:
+                conn.waiters.pop(req_id, None)
+            raise  # 参数没法 pickle
+        if not w.event.wait(self._timeout_s):
+            with self._lock:
+                conn.waiters.pop(req_id, None)
+            raise DaemonError(f"run daemon did not answer {target}.{method} within {self._timeout_s}s")
+        if not w.ok:
+            raise w.value
+        return w.value
+
+    def close(self) -> None:
+        with self._lock:
+            conn = self._conn
+        if conn is not None:
+            self._drop(conn, DaemonError("client closed"))
+
+    def _connect_locked(self) -> _Conn:
+        # fork 出来的子进程不能和父进程共用连接
+        if self._conn is not None and self._conn.pid == os.getpid():
+            return self._conn
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._path)
+        except OSError as e:
+            sock.close()
+            raise DaemonError(f"run daemon not reachable at {self._path}: {e}") from e
+        conn = self._conn = _Conn(sock)
+        threading.Thread(target=self._read_loop, args=(conn,), name="daemon-client", daemon=True).start()
+        return conn
+
+    def _read_loop(self, conn: _Conn) -> None:
+        f = conn.sock.makefile("rb", buffering=1 << 16)
+        err: Exception = DaemonError("run daemon closed the connection")
+        try:
+            while True:
+                frame = read_frame(f)
+                if frame is None:
+                    break
+                req_id, payload = frame
+                ok, value = pickle.loads(payload)
+                with self._lock:
+                    w = conn.waiters.pop(req_id, None)
+                if w is None:
+                    continue  # 已经超时放弃了
+                w.ok, w.value = ok, value
+                w.event.set()
+        except Exception as e:  # 读线程不能悄悄死掉，不然在等的请求只能等到超时
+            err = e if isinstance(e, DaemonError) else DaemonError(f"run daemon connection lost: {e!r}")
+        self._drop(conn, err)
+
+    def _drop(self, conn: _Conn, err: Exception) -> None:
+        # 连接断了：这个连接上在等的请求全部失败，下一次 call 重新连
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            waiters, conn.waiters = conn.waiters, {}
+        try:
+            conn.sock.close()
+        except OSError:
+            pass
+        for w in waiters.values():
+            w.ok, w.value = False, err
+            w.event.set()
+
+
+# ---- 代理对象：接口和单进程时传给 router 的那些对象一样 ----
+
+
+class _Remote:
+    _target = ""
+
+    def __init__(self, client: DaemonClient) -> None:
+        self._client = client
+
+    def _call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        return self._client.call(self._target, method, *args, **kwargs)
+
+
+class RemoteStateStore(_Remote):
+    """Read side of the daemon's StateStore (API workers never write runs themselves)."""
+
+    _target = "store"
+
+    def get_run(self, run_id: str) -> Optional[RunRecord]:
+        return self._call("get_run", run_id)
+
+    def peek_run(self, run_id: str) -> Optional[RunRecord]:
+        return self._call("peek_run", run_id)
+
+    def list_runs(self) -> List[RunRecord]:
+        return self._call("list_runs")
+
+    def query_runs(self, q: RunQuery) -> RunPage:
+        return self._call("query_runs", q)
+
+    def get_logs(self, run_id: str, tail: int = 200) -> tuple[list[str], bool]:
+        return self._call("get_logs", run_id, tail)
+
+    def read_logs(self, run_id: str, *, since: Optional[int] = None, limit: int = 200) -> LogSlice:
+        return self._call("read_logs", run_id, since=since, limit=limit)
+
+    def read_log_bytes(self, run_id: str, offset: int, length: int) -> Optional[bytes]:
+        return self._call("read_log_bytes", run_id, offset, length)
+
+    def log_size(self, run_id: str) -> Optional[int]:
+        return self._call("log_size", run_id)
+
+    def stats(self) -> dict:
+        return self._call("stats")
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class RemoteScheduler(_Remote):
+    """
+    Scheduler protocol over the daemon. Cacheable specs go through the daemon's
+    ResultCache on submit (single-flight across all API workers); the outcome is
+    kept per thread for RemoteResultCache.submit.
+    """
+
+    _target = "scheduler"
+
+    def __init__(self, client: DaemonClient) -> None:
+        super().__init__(client)
+        self._local = threading.local()
+
+    def submit(self, *, spec, script_path: Path, params: dict, cwd: Optional[Path] = None, priority: int = 0) -> str:
+        run_id, outcome = self._call(
+            "submit", spec=spec, script_path=script_path, params=params, cwd=cwd, priority=priority
+        )
+        self._local.outcome = outcome
+        return run_id
+
+    def last_cache_outcome(self) -> Optional[str]:
+        return getattr(self._local, "outcome", None)
+
+    def queue_position(self, run_id: str) -> Optional[int]:
+        return self._call("queue_position", run_id)
+
+    def stop(self, run_id: str) -> bool:
+        return self._call("stop", run_id)
+
+    def stats(self) -> dict:
+        return self._call("stats")
+
+    def script_stats(self, spec) -> Optional[dict]:
+        return self._call("script_stats", spec)
+
+
+class RemoteResultCache(_Remote):
+    """The result cache lives in the daemon; submit() just reports what the daemon decided."""
+
+    _target = "cache"
+
+    def __init__(self, client: DaemonClient, scheduler: RemoteScheduler) -> None:
+        super().__init__(client)
+        self._scheduler = scheduler
+
+    def submit(self, *, script_id: str, script_path: Path, params: dict, ttl_s, submit: Callable[[], str]):
+        # submit() 是 RemoteScheduler.submit：守护进程那边对 cacheable 的 spec 已经查过缓存了
+        run_id = submit()
+        return run_id, self._scheduler.last_cache_outcome() or "miss"
+
+    def invalidate(self, script_id: str) -> int:
+        return self._call("invalidate", script_id)
+
+    def on_registry_change(self, diff) -> None:
+        pass  # 守护进程自己监听 spec 变化
+
+    def stats(self) -> dict:
+        return self._call("stats")
+
+
+class RemoteBatchManager(_Remote):
+    _target = "batches"
+
+    def create(self, **kwargs: Any):
+        return self._call("create", **kwargs)
+
+    def get(self, batch_id: str):
+        return self._call("get", batch_id)
+
+    def list(self):
+        return self._call("list")
+
+    def cancel(self, batch_id: str) -> Optional[int]:
+        return self._call("cancel", batch_id)
+
+    def summary(self, batch) -> dict:
+        return self._call("summary", batch)
+
+    def stats(self) -> dict:
+        return self._call("stats")
+
+
+class RemoteWorkflowEngine(_Remote):
+    _target = "workflows"
+
+    def start(self, spec, params: Optional[Dict[str, Any]] = None):
+        return self._call("start", spec, params)
+
+    def get(self, wf_run_id: str):
+        return self._call("get", wf_run_id)
+
+    def list(self):
+        return self._call("list")
+
+    def cancel(self, wf_run_id: str) -> Optional[int]:
+        return self._call("cancel", wf_run_id)
+
+    def resume(self, wf_run_id: str):
+        return self._call("resume", wf_run_id)
+
+    def stats(self) -> dict:
+        return self._call("stats")
+
+
+class RemoteScheduleManager(_Remote):
+    _target = "schedules"
+
+    def list(self):
+        return self._call("list")
+
+    def get(self, schedule_id: str):
+        return self._call("get", schedule_id)
+
+    def pause(self, schedule_id: str) -> bool:
+        return self._call("pause", schedule_id)
+
+    def resume(self, schedule_id: str) -> bool:
+        return self._call("resume", schedule_id)
+
+    def trigger(self, schedule_id: str, *, force: bool = False):
+        return self._call("trigger", schedule_id, force=force)
@@ -0,0 +1,71 @@
+# 日志摄取：一次读一大块原始 bytes，批量切成行，再一次性交给 store.append_logs。
+# 之前是 text 模式逐行迭代 proc.stdout，每一行都要单独 decode + 抢一次 store 的锁，
+# 刷屏的脚本（每秒几万行）会让 API 进程的 CPU 全耗在这里。
+from __future__ import annotations
+
+from typing import List
+
+from app.core.metrics import LOG_BYTES, LOG_LINES
+
+# 一次 read 最多拿这么多字节；脚本刷屏时基本每次都能读满，相当于一批几百上千行。
+CHUNK_SIZE = 64 * 1024
+
+# `python -u` 的脚本每 print 一次就 write 一次，reader 跟得太紧的话每次 read 只拿到几行，
+# 大部分 CPU 花在 syscall 上。读到的块很小时先歇 1ms 再读，让 pipe 攒一攒：
+# 对刷屏脚本 read 次数能降两个数量级，对慢脚本只是多 1ms 延迟。
+SMALL_READ_BYTES = CHUNK_SIZE // 4
+COALESCE_S = 0.001
+
+# 一直没有换行的超长输出（比如进度条、二进制垃圾）到这个长度就强制切一行，免得缓冲区无限涨。
+MAX_LINE_BYTES = 1 << 20
+
+
+class LineSplitter:
+    """
+    Incremental bytes -> lines splitter.
+
+    - feed() returns only complete lines, each ending with "\\n"; the trailing
+      partial line is kept until the next chunk (or flush()).
+    - Newlines are normalized like text-mode pipes ("\\r\\n" and lone "\\r" -> "\\n").
+    - Decoding happens once per batch. Cutting at b"\\n" never splits a UTF-8
+      character, so multi-byte text that straddles two reads decodes correctly.
+    """
+
+    def __init__(self, encoding: str = "utf-8") -> None:
+        self._encoding = encoding
+        self._buf = b""
+
+    def feed(self, chunk: bytes) -> List[str]:
+        LOG_BYTES.inc(len(chunk))  # 每块（最多 64KB）记一次，不是每行
+        data = self._buf + chunk if self._buf else chunk
+
+        if b"\r" in data:
+            # 末尾单独的 \r 先留着：下一块可能以 \n 开头，要合成一个 \r\n
+            tail = b"\r" if data.endswith(b"\r") else b""
+            body = data[:-1] if tail else data
+            data = body.replace(b"\r\n", b"\n").replace(b"\r", b"\n") + tail
+
+        cut = data.rfind(b"\n")
+        if cut < 0:
+            if len(data) >= MAX_LINE_BYTES:
+                self._buf = b""
+                LOG_LINES.inc()
+                return [data.decode(self._encoding, errors="replace") + "\n"]
+            self._buf = data
+            return []
+
+        self._buf = data[cut + 1:]
+        text = data[:cut].decode(self._encoding, errors="replace")
+        lines = [line + "\n" for line in text.split("\n")]
+        LOG_LINES.inc(len(lines))
+        return lines
+
+    def flush(self) -> List[str]:
+        """Return the trailing partial line (without a newline, like text-mode iteration)."""
+        data, self._buf = self._buf, b""
+        if not data:
+            return []
+        LOG_LINES.inc()
+        if data.endswith(b"\r"):
+            return [data[:-1].decode(self._encoding, errors="replace") + "\n"]
+        return [data.decode(self._encoding, errors="replace")]
@@ -0,0 +1,341 @@
+# 脚本参数：按 spec 的 args_schema 校验 / 补默认值 / 转类型，再决定怎么交给脚本（argv / stdin / 临时文件）。
+#
+# args_schema 写法（script_specs/*.yaml）：
+#   args_schema:
+#     seconds: {type: number, default: 5, min: 0}
+#     mode:    {type: string, enum: [fast, slow], required: true}
+#     tags:    {type: array, items: string}
+#     verbose: boolean                         # 只写类型也行
+# 类型：string / integer / number / boolean / array / object / any。
+# 有 args_schema 的脚本，不认识的参数直接拒绝；没有 args_schema 的照旧原样传。
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PARAMS_VIA = ("argv", "stdin", "file", "auto")
+
+# auto：参数都是标量、拼出来的命令行不超过这么长就走 argv，否则写临时文件
+_AUTO_ARGV_MAX_BYTES = 4096
+
+_TRUE = {"true", "1", "yes", "y", "on"}
+_FALSE = {"false", "0", "no", "n", "off"}
+
+
+class ParamError(ValueError):
+    """Params rejected by a spec's args_schema; `errors` is a list of {"loc", "msg"}."""
+
+    def __init__(self, errors: List[Dict[str, str]]) -> None:
+        self.errors = errors
+        super().__init__("; ".join(f"{e['loc']}: {e['msg']}" for e in errors))
+
+
+class _Invalid(ValueError):
+    # 单个值不合法；编译 schema 时（比如 enum / default 不合法）会作为 ValueError 抛出去
+    pass
+
+
+Coercer = Callable[[Any], Any]
+
+
+def _to_string(v: Any) -> str:
+    if isinstance(v, str):
+        return v
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return str(v)
+    raise _Invalid("expected a string")
+
+
+def _to_integer(v: Any) -> int:
+    if isinstance(v, bool):
+        raise _Invalid("expected an integer")
+    if isinstance(v, int):
+        return v
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, str):
+        try:
+            return int(v.strip())
+        except ValueError:
+            pass
+    raise _Invalid("expected an integer")
+
+
+def _to_number(v: Any) -> float | int:
+    if isinstance(v, bool):
+        raise _Invalid("expected a number")
+    if isinstance(v, (int, float)):
+        return v
+    if isinstance(v, str):
+        try:
+            x = float(v.strip())
+        except ValueError:
+            raise _Invalid("expected a number") from None
+        return int(x) if x.is_integer() and "." not in v and "e" not in v.lower() else x
+    raise _Invalid("expected a number")
+
+
+def _to_boolean(v: Any) -> bool:
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, int) and v in (0, 1):
+        return bool(v)
+    if isinstance(v, str):
+        s = v.strip().lower()
+        if s in _TRUE:
+            return True
+        if s in _FALSE:
+            return False
+    raise _Invalid("expected a boolean")
+
+
+def _json_if_str(v: Any) -> Any:
+    # 表单 / 命令行传过来的 "[1, 2]" 这种，按 JSON 解一下
+    if isinstance(v, str):
+        try:
+            return json.loads(v)
+        except ValueError:
+            raise _Invalid("expected JSON") from None
+    return v
+
+
+def _any(v: Any) -> Any:
+    return v
+
+
+_SCALARS: Dict[str, Coercer] = {
+    "string": _to_string,
+    "str": _to_string,
+    "integer": _to_integer,
+    "int": _to_integer,
+    "number": _to_number,
+    "float": _to_number,
+    "boolean": _to_boolean,
+    "bool": _to_boolean,
+    "any": _any,
+}
+
+
+def _compile_type(name: str, decl: Dict[str, Any]) -> Coercer:
+    t = str(decl.get("type") or "any").strip().lower()
+    if t in _SCALARS:
+        return _SCALARS[t]
+    if t in ("array", "list"):
+        items = decl.get("items")
+        item = _compile_type(name, items if isinstance(items, dict) else {"type": items or "any"})
+
+        def to_array(v: Any) -> list:
+            v = _json_if_str(v)
+            if not isinstance(v, list):
+                raise _Invalid("expected an array")
+            out = []
+            for i, x in enumerate(v):
+                try:
+                    out.append(item(x))
+                except _Invalid as e:
+                    raise _Invalid(f"item {i}: {e}") from None
+            return out
+
+        return to_array
+    if t in ("object", "dict"):
+
+        def to_object(v: Any) -> dict:
+            v = _json_if_str(v)
+            if not isinstance(v, dict):
+                raise _Invalid("expected an object")
+            return v
+
+        return to_object
+    raise ValueError(f"args_schema.{name}: unknown type {t!r}")
+
+
+@dataclass(frozen=True)
+class _Field:
+    name: str
+    coerce: Coercer
+    required: bool
+    has_default: bool
+    default: Any
+    checks: Tuple[Callable[[Any], Optional[str]], ...]
+
+
+def _compile_field(name: str, decl: Any) -> _Field:
+    if isinstance(decl, str) or decl is None:
+        decl = {"type": decl or "any"}
+    if not isinstance(decl, dict):
+        raise ValueError(f"args_schema.{name}: expected a mapping or a type name")
+    coerce = _compile_type(name, decl)
+
+    checks: List[Callable[[Any], Optional[str]]] = []
+    enum = decl.get("enum", decl.get("choices"))
+    if enum is not None:
+        try:
+            allowed = [coerce(x) for x in enum] if not isinstance(enum, str) else [coerce(enum)]
+        except _Invalid as e:
+            raise ValueError(f"args_schema.{name}: bad enum value ({e})") from None
+        checks.append(lambda v: None if v in allowed else f"must be one of {allowed}")
+    lo = decl.get("min", decl.get("minimum"))
+    hi = decl.get("max", decl.get("maximum"))
+    if lo is not None or hi is not None:
+        # 数字比大小；字符串 / 数组比长度
+        def check_range(v: Any, lo=lo, hi=hi) -> Optional[str]:
+            x = len(v) if isinstance(v, (str, list, dict)) else v
+            if lo is not None and x < lo:
+                return f"must be >= {lo}" if x is v else f"length must be >= {lo}"
+            if hi is not None and x > hi:
+                return f"must be <= {hi}" if x is v else f"length must be <= {hi}"
+            return None
+
+        checks.append(check_range)
+
+    has_default = "default" in decl
+    default = decl.get("default")
+    if has_default and default is not None:
+        try:
+            default = coerce(default)
+        except _Invalid as e:
+            raise ValueError(f"args_schema.{name}: bad default ({e})") from None
+    return _Field(
+        name=name,
+        coerce=coerce,
+        required=bool(decl.get("required", False)),
+        has_default=has_default,
+        default=default,
+        checks=tuple(checks),
+    )
+
+
+@dataclass(frozen=True)
+class ParamValidator:
+    """Compiled args_schema. Build once per spec with compile_args_schema()."""
+
+    fields: Tuple[_Field, ...]
+    names: frozenset = field(default=frozenset(), repr=False)
+
+    def validate(self, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Coerced params with defaults filled in; raises ParamError listing every problem."""
+        params = params or {}
+        out: Dict[str, Any] = {}
+        errors: List[Dict[str, str]] = []
+        for f in self.fields:
+            if f.name not in params or params[f.name] is None:
+                if f.required:
+                    errors.append({"loc": f.name, "msg": "required"})
+                elif f.has_default:
+                    out[f.name] = f.default
+                continue
+            try:
+                v = f.coerce(params[f.name])
+            except _Invalid as e:
+                errors.append({"loc": f.name, "msg": str(e)})
+                continue
+            for check in f.checks:
+                msg = check(v)
+                if msg is not None:
+                    errors.append({"loc": f.name, "msg": msg})
+                    break
+            else:
+                out[f.name] = v
+        for k in params:
+            if k not in self.names:
+                errors.append({"loc": str(k), "msg": "unknown parameter"})
+        if errors:
+            raise ParamError(errors)
+        return out
+
+
+def compile_args_schema(schema: Optional[Dict[str, Any]]) -> Optional[ParamValidator]:
+    """args_schema -> ParamValidator (None when the spec has no schema). Raises ValueError on a bad schema."""
+    if not schema:
+        return None
+    if not isinstance(schema, dict):
+        raise ValueError("args_schema must be a mapping")
+    fields = tuple(_compile_field(str(k), v) for k, v in schema.items())
+    return ParamValidator(fields=fields, names=frozenset(f.name for f in fields))
+
+
+# ---- 把参数交给脚本 ----
+
+
+def _cli_value(v: Any) -> str:
+    if isinstance(v, str):
+        return v
+    # bool / list / dict 用 JSON（str(True) / str([1]) 这种 Python repr 脚本那边不好解析）
+    return json.dumps(v, ensure_ascii=False)
+
+
+def params_to_cli_args(params: dict) -> list[str]:
+    """
+    {"x": 1, "name": "abc"} -> ["--x", "1", "--name", "abc"]
+    Non-string values are JSON encoded: True -> "true", [1, 2] -> "[1, 2]".
+    """
+    args: list[str] = []
+    for k, v in (params or {}).items():
+        key = str(k).strip()
+        if not key:
+            continue
+        args.append(f"--{key}")
+        args.append(_cli_value(v))
+    return args
+
+
+@dataclass
+class ParamsDelivery:
+    """
+    How one run receives its params:
+      argv  -> `--k v` after the script path (default, same as before)
+      stdin -> one JSON object on stdin, then EOF; env AP_PARAMS_VIA=stdin
+      file  -> JSON in a temp file; env AP_PARAMS_VIA=file, AP_PARAMS_FILE=<path>
+    """
+
+    via: str
+    argv: List[str]
+    stdin: Optional[bytes] = None
+    env: Dict[str, str] = field(default_factory=dict)
+    file: Optional[Path] = None
+
+    def merge_env(self, env: Optional[Dict[str, str]]) -> Optional[Dict[str, str]]:
+        # runner 的规则：spec 没写 env -> 继承父进程环境（传 None）；写了 -> 只用 spec 的。这里保持不变，只往里加 AP_PARAMS_*
+        if not self.env:
+            return env
+        base = env if env else dict(os.environ)
+        return {**base, **self.env}
+
+    def cleanup(self) -> None:
+        if self.file is not None:
+            try:
+                self.file.unlink()
+            except FileNotFoundError:
+                pass
+            self.file = None
+
+
+def prepare_params(params: Optional[dict], via: str = "argv") -> ParamsDelivery:
+    params = params or {}
+    if via == "auto":
+        argv = params_to_cli_args(params)
+        scalar = all(isinstance(v, (str, int, float, bool)) or v is None for v in params.values())
+        if scalar and sum(len(a) + 1 for a in argv) <= _AUTO_ARGV_MAX_BYTES:
+            return ParamsDelivery(via="argv", argv=argv)
+        via = "file"
+    if via == "argv":
+        return ParamsDelivery(via="argv", argv=params_to_cli_args(params))
+
+    data = json.dumps(params, ensure_ascii=False).encode("utf-8")
+    if via == "stdin":
+        return ParamsDelivery(via="stdin", argv=[], stdin=data, env={"AP_PARAMS_VIA": "stdin"})
+    if via == "file":
+        fd, name = tempfile.mkstemp(prefix="ap-params-", suffix=".json")  # 0600，只有运行用户能读
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return ParamsDelivery(
+            via="file",
+            argv=[],
+            env={"AP_PARAMS_VIA": "file", "AP_PARAMS_FILE": name},
+            file=Path(name),
+        )
+    raise ValueError(f"Unknown params_via: {via!r} (expected one of {PARAMS_VIA})")
@@ -0,0 +1,109 @@
+# 预热 worker 进程的入口（由 WorkerPool 用 `python -u pool_worker.py --preload a,b` 启动）。
+# 只依赖标准库：这个文件是按路径直接跑的，不 import app.*。
+#
+# 协议很简单：
+#   - stdin：WorkerPool 每行发一个 JSON job
+#   - stdout/stderr：脚本的输出原样写出（WorkerPool 那边会合并到同一个 pipe）
+#   - 每个 job 跑完后在 stdout 写一行 MARKER + "DONE <rc>"，准备好时写 MARKER + "READY"
+#   - 脚本用 ap_sdk 上报的事件也是控制行：MARKER + "EVENT <json>"（ap_sdk 自己写，这里不用管）
+from __future__ import annotations
+
+import argparse
+import importlib
+import io
+import json
+import os
+import runpy
+import sys
+import traceback
+
+MARKER = "\x00AP-POOL "
+
+
+def _emit(msg: str) -> None:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # 直接写 fd，避免脚本把 sys.stdout 换掉之后控制消息丢失。
+    os.write(1, f"{MARKER}{msg}\n".encode("utf-8"))
+
+
+def _exit_code(e: SystemExit) -> int:
+    code = e.code
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _run_job(job: dict) -> int:
+    script_path = job["script_path"]
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    saved_argv = sys.argv
+    saved_path = list(sys.path)
+    saved_stdin = sys.stdin
+
+    rc = 0
+    try:
+        os.environ.update(job.get("env") or {})
+        if job.get("cwd"):
+            os.chdir(job["cwd"])
+        sys.argv = [script_path, *(job.get("argv") or [])]
+        sys.path.insert(0, os.path.dirname(script_path))
+        sys.path.extend(p for p in job.get("path") or [] if p not in sys.path)  # 比如 ap_sdk 所在的 scripts/
+        # 脚本不能读到 job 通道（真正的 stdin）：给它 params_via=stdin 的参数，或者一个空输入。
+        sys.stdin = io.StringIO(job["stdin"]) if job.get("stdin") is not None else open(os.devnull, "r")
+        runpy.run_path(script_path, run_name="__main__")
+    except SystemExit as e:
+        rc = _exit_code(e)
+    except BaseException as e:
+        # 和直接 `python script.py` 一样，traceback 从脚本自己的帧开始，不带 worker/runpy 的帧
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != script_path:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        rc = 1
+    finally:
+        if sys.stdin is not saved_stdin:
+            try:
+                sys.stdin.close()
+            except Exception:
+                pass
+        sys.stdin = saved_stdin
+        os.environ.clear()
+        os.environ.update(saved_env)
+        os.chdir(saved_cwd)
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+    return rc
+
+
+def main() -> None:
+    # 按路径启动时 sys.path[0] 是 app/services，别让脚本误 import 到这里的模块。
+    here = os.path.dirname(os.path.abspath(__file__))
+    if sys.path and os.path.abspath(sys.path[0] or ".") == here:
+        sys.path.pop(0)
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--preload", default="")
+    ns = ap.parse_args()
+
+    for name in filter(None, (m.strip() for m in ns.preload.split(","))):
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"[pool-worker] preload {name} failed: {e}", file=sys.stderr)
+
+    _emit("READY")
+    for raw in sys.stdin:
+        raw = raw.strip()
+        if not raw:
+            continue
+        rc = _run_job(json.loads(raw))
+        _emit(f"DONE {rc}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
+import hashlib
 import logging
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import yaml
 
+from app.services.cron import ScheduleSpec, parse_schedules
+from app.services.params import PARAMS_VIA, ParamValidator, compile_args_schema
+from app.services.resources import ResourceLimits
+from app.services.run_stats import AdaptiveTimeout, parse_adaptive_timeout
+
 logger = logging.getLogger("app.registry")
 
 
@@ -19,64 +26,274 @@ class ScriptSpec:
     timeout_s: Optional[float] = None
     env: Dict[str, str] | None = None
     args_schema: Dict[str, Any] | None = None
+    max_concurrency: Optional[int] = None  # 同一个脚本最多同时跑几个，None 表示只受全局上限限制
+    execution: str = "subprocess"  # "subprocess"：每次 Popen；"pool"：交给预热进程池
+    preload: Tuple[str, ...] = ()  # execution=pool 时，worker 预先 import 的模块
+    params_via: str = "argv"  # 参数怎么交给脚本："argv" | "stdin" | "file" | "auto"（见 params.py）
+    max_rss_mb: Optional[float] = None  # 超过就杀掉（采样器检查，见 resources.py）
+    max_cpu_s: Optional[float] = None  # CPU 时间（user+sys）上限，RLIMIT_CPU
+    cacheable: bool = False  # 同样参数 + 同样脚本文件 -> 同样结果，可以复用（见 result_cache.py）
+    cache_ttl_s: Optional[float] = None  # 成功结果缓存多久，None = 用全局默认 AP_CACHE_TTL_S
+    schedules: Tuple[ScheduleSpec, ...] = ()  # 定时触发（cron / 固定间隔），由 schedules.py 的定时器执行
+    adaptive_timeout: Optional[AdaptiveTimeout] = None  # 按历史耗时分位数收紧超时（见 run_stats.py），timeout_s 是上限
+    # args_schema 在加载 spec 时编译好，提交 run 时直接用
+    validator: Optional[ParamValidator] = field(default=None, compare=False, repr=False)
+
+    def validate_params(self, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Params checked against args_schema (defaults filled, types coerced); raises ParamError."""
+        if self.validator is None:
+            return dict(params or {})
+        return self.validator.validate(params)
+
+    @property
+    def limits(self) -> Optional[ResourceLimits]:
+        if self.max_rss_mb is None and self.max_cpu_s is None:
+            return None
+        return ResourceLimits(max_rss_mb=self.max_rss_mb, max_cpu_s=self.max_cpu_s)
+
+
+@dataclass
+class _SpecFile:
+    # 上次看到的文件状态：stat 没变就不读；读了但 sha256 没变就不解析
+    mtime_ns: int
+    size: int
+    sha256: str
+    spec: Optional[ScriptSpec]  # None = 文件无效（缺 id/entry 等）
+
+
+@dataclass(frozen=True)
+class RegistryDiff:
+    added: Tuple[str, ...] = ()
+    changed: Tuple[str, ...] = ()
+    removed: Tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+RegistryListener = Callable[[RegistryDiff], None]
+
+
+def parse_spec(path: Path, raw: bytes) -> Optional[ScriptSpec]:
+    """One YAML file -> ScriptSpec; None (with a warning) if the spec is invalid."""
+    try:
+        data = yaml.safe_load(raw.decode("utf-8")) or {}
+    except (yaml.YAMLError, UnicodeDecodeError) as e:
+        logger.warning("Invalid spec (%s): %s", e, path)
+        return None
+    if not isinstance(data, dict):
+        logger.warning("Invalid spec (not a mapping): %s", path)
+        return None
+
+    script_id = str(data.get("id") or "").strip()
+    entry = str(data.get("entry") or "").strip()
+    desc = str(data.get("description") or "").strip()
+
+    if not script_id or not entry:
+        logger.warning("Invalid spec (missing id/entry): %s", path)
+        return None
+
+    cwd = data.get("cwd")
+    timeout_s = data.get("timeout_s")
+    env = data.get("env") or None
+    args_schema = data.get("args_schema") or None
+    max_concurrency = data.get("max_concurrency")
+    execution = str(data.get("execution") or "subprocess").strip().lower()
+    preload = data.get("preload") or []
+    params_via = str(data.get("params_via") or "argv").strip().lower()
+    limits = {k: data.get(k) for k in ("max_rss_mb", "max_cpu_s")}
+    # cacheable: true | false | {ttl_s: 600}
+    cache = data.get("cacheable") or False
+    cache_ttl_s = None
+    if isinstance(cache, dict):
+        cache_ttl_s, cache = cache.get("ttl_s"), True
+
+    if execution not in ("subprocess", "pool"):
+        logger.warning("Invalid spec (execution=%r): %s", execution, path)
+        return None
+    if params_via not in PARAMS_VIA:
+        logger.warning("Invalid spec (params_via=%r): %s", params_via, path)
+        return None
+    try:
+        limits = {k: float(v) if v is not None else None for k, v in limits.items()}
+    except (TypeError, ValueError):
+        logger.warning("Invalid spec (max_rss_mb/max_cpu_s must be numbers): %s", path)
+        return None
+    if any(v is not None and v <= 0 for v in limits.values()):
+        logger.warning("Invalid spec (max_rss_mb/max_cpu_s must be > 0): %s", path)
+        return None
+    if not isinstance(cache, bool):
+        logger.warning("Invalid spec (cacheable must be true/false or a mapping): %s", path)
+        return None
+    try:
+        cache_ttl_s = float(cache_ttl_s) if cache_ttl_s is not None else None
+    except (TypeError, ValueError):
+        logger.warning("Invalid spec (cacheable.ttl_s must be a number): %s", path)
+        return None
+    if cache_ttl_s is not None and cache_ttl_s <= 0:
+        logger.warning("Invalid spec (cacheable.ttl_s must be > 0): %s", path)
+        return None
+    try:
+        schedules = parse_schedules(data.get("schedule"))
+    except (TypeError, ValueError) as e:
+        logger.warning("Invalid spec (schedule: %s): %s", e, path)
+        return None
+    try:
+        adaptive_timeout = parse_adaptive_timeout(data.get("adaptive_timeout"))
+    except ValueError as e:
+        logger.warning("Invalid spec (%s): %s", e, path)
+        return None
+    try:
+        validator = compile_args_schema(args_schema)
+    except ValueError as e:
+        logger.warning("Invalid spec (%s): %s", e, path)
+        return None
+
+    return ScriptSpec(
+        script_id=script_id,
+        entry=entry,
+        description=desc,
+        cwd=str(cwd) if cwd else None,
+        timeout_s=float(timeout_s) if timeout_s is not None else None,
+        env={str(k): str(v) for k, v in dict(env).items()} if env else None,
+        args_schema=dict(args_schema) if args_schema else None,
+        max_concurrency=int(max_concurrency) if max_concurrency else None,
+        execution=execution,
+        preload=tuple(str(m) for m in preload),
+        params_via=params_via,
+        max_rss_mb=limits["max_rss_mb"],
+        max_cpu_s=limits["max_cpu_s"],
+        cacheable=cache,
+        cache_ttl_s=cache_ttl_s,
+        schedules=schedules,
+        adaptive_timeout=adaptive_timeout,
+        validator=validator,
+    )
 
 
 class ScriptRegistry:
     """
     Reads script_specs/*.yaml into ScriptSpec.
+
+    Reloads are incremental: each file's mtime/size/sha256 is remembered and
+    only files whose content changed are re-parsed. The new script table is
+    built on the side and swapped in with one assignment, so list()/get()
+    always see either the old or the new registry, never a half-built one.
+    SpecWatcher (spec_watcher.py) calls refresh() when the directory changes.
     """
 
     def __init__(self, *, project_root: Path, scripts_dir: Path, specs_dir: Path) -> None:
         self._project_root = project_root
         self._scripts_dir = scripts_dir
         self._specs_dir = specs_dir
-        self._cache: Dict[str, ScriptSpec] = {}
+        self._cache: Dict[str, ScriptSpec] = {}  # 只整体替换，不原地修改
+        self._loaded = False
+        self._files: Dict[Path, _SpecFile] = {}  # 以下都受 _refresh_lock 保护
+        self._refresh_lock = threading.Lock()
+        self._listeners: List[RegistryListener] = []
+        self.stats = {"refreshes": 0, "files_read": 0, "files_parsed": 0}
 
-    def reload(self) -> None:
-        self._cache.clear()
-        # .clear() 是 dict / list / set 的清空。
+    @property
+    def specs_dir(self) -> Path:
+        return self._specs_dir
 
-        logger.info("Loading specs from: %s", self._specs_dir)
-        if not self._specs_dir.exists():
-            logger.warning("script_specs dir not found: %s", self._specs_dir)
-            return
+    def add_listener(self, fn: RegistryListener) -> None:
+        """fn(diff) is called after every refresh that added, changed or removed scripts."""
+        self._listeners.append(fn)
 
-        files = sorted(self._specs_dir.glob("*.yaml"))
-        logger.info("Found %d spec files", len(files))
+    def reload(self) -> None:
+        # 以前是清空后全部重新解析；现在和 refresh() 一样只处理变过的文件
+        self.refresh()
 
-        for p in files:
-            data = yaml.safe_load(p.read_text(encoding="utf-8")) or {}
+    def refresh(self, paths: Optional[Iterable[Path]] = None) -> RegistryDiff:
+        """
+        Pick up spec changes. With `paths` (from the file watcher) only those
+        files are checked; otherwise every *.yaml in specs_dir is stat()ed.
+        """
+        with self._refresh_lock:
+            if not self._loaded:
+                logger.info("Loading specs from: %s", self._specs_dir)
+            if paths is None or not self._loaded:
+                if not self._specs_dir.exists():
+                    logger.warning("script_specs dir not found: %s", self._specs_dir)
+                candidates = set(self._specs_dir.glob("*.yaml")) | set(self._files)
+            else:
+                candidates = {Path(x) for x in paths if Path(x).suffix == ".yaml"}
 
-            script_id = str(data.get("id") or "").strip()
-            entry = str(data.get("entry") or "").strip()
-            desc = str(data.get("description") or "").strip()
+            files = dict(self._files)
+            dirty = False
+            for path in candidates:
+                dirty |= self._check_file(files, path)
 
-            if not script_id or not entry:
-                logger.warning("Invalid spec (missing id/entry): %s", p)
-                continue
+            self.stats["refreshes"] += 1
+            if not dirty and self._loaded:
+                return RegistryDiff()
 
-            cwd = data.get("cwd")
-            timeout_s = data.get("timeout_s")
-            env = data.get("env") or None
-            args_schema = data.get("args_schema") or None
+            old = self._cache
+            new = self._build(files)
+            self._files = files
+            self._cache = new  # 原子替换：读的一方要么拿到旧表，要么拿到新表
+            first_load = not self._loaded
+            self._loaded = True
 
-            spec = ScriptSpec(
-                script_id=script_id,
-                entry=entry,
-                description=desc,
-                cwd=str(cwd) if cwd else None,
-                timeout_s=float(timeout_s) if timeout_s is not None else None,
-                env={str(k): str(v) for k, v in dict(env).items()} if env else None,
-                args_schema=dict(args_schema) if args_schema else None,
-            )
-            self._cache[script_id] = spec
+        if first_load:
+            logger.info("Found %d spec files", len(files))
+            logger.info("Loaded %d scripts", len(new))
+            return RegistryDiff(added=tuple(sorted(new)))
+        diff = RegistryDiff(
+            added=tuple(sorted(new.keys() - old.keys())),
+            changed=tuple(sorted(k for k in new.keys() & old.keys() if new[k] != old[k])),
+            removed=tuple(sorted(old.keys() - new.keys())),
+        )
+        if diff:
+            logger.info("Specs reloaded: added=%s changed=%s removed=%s", list(diff.added), list(diff.changed), list(diff.removed))
+            for fn in list(self._listeners):
+                try:
+                    fn(diff)
+                except Exception:
+                    logger.exception("registry listener failed")
+        return diff
 
-        logger.info("Loaded %d scripts", len(self._cache))
+    def _check_file(self, files: Dict[Path, _SpecFile], path: Path) -> bool:
+        # 返回这个文件是否影响了脚本表
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return files.pop(path, None) is not None
+        prev = files.get(path)
+        if prev is not None and prev.mtime_ns == st.st_mtime_ns and prev.size == st.st_size:
+            return False
+        try:
+            raw = path.read_bytes()
+        except FileNotFoundError:
+            return files.pop(path, None) is not None
+        self.stats["files_read"] += 1
+        digest = hashlib.sha256(raw).hexdigest()
+        if prev is not None and prev.sha256 == digest:
+            # touch / 保存了同样的内容：只更新 stat，不重新解析
+            files[path] = _SpecFile(st.st_mtime_ns, st.st_size, digest, prev.spec)
+            return False
+        self.stats["files_parsed"] += 1
+        files[path] = _SpecFile(st.st_mtime_ns, st.st_size, digest, parse_spec(path, raw))
+        return True
+
+    @staticmethod
+    def _build(files: Dict[Path, _SpecFile]) -> Dict[str, ScriptSpec]:
+        # 按文件名排序，同一个 id 出现在多个文件里时以排前面的为准（和以前全量加载的结果一致）
+        out: Dict[str, ScriptSpec] = {}
+        for path in sorted(files):
+            spec = files[path].spec
+            if spec is None:
+                continue
+            if spec.script_id in out:
+                logger.warning("Duplicate script id %r in %s (ignored)", spec.script_id, path)
+                continue
+            out[spec.script_id] = spec
+        return out
 
     def list(self) -> List[ScriptSpec]:
-        if not self._cache:
-        # None, False, 0, "", {}, []等等所有“空容器”都是 False。
-            self.reload()
+        if not self._loaded:
+            self.refresh()
         return list(self._cache.values())
         # .keys(), .values(), .items返回的是：Python 内置的、只属于 dict 的一种特殊对象。
 
@@ -93,11 +310,12 @@ class ScriptRegistry:
         Raises:
             KeyError: If the script_id is unknown.
         """
-        if not self._cache:
-            self.reload()
-        if script_id not in self._cache:
+        if not self._loaded:
+            self.refresh()
+        cache = self._cache  # 同一个快照里查，避免判断和取值之间被替换
+        if script_id not in cache:
             raise KeyError(f"Unknown script_id: {script_id}")
-        return self._cache[script_id]
+        return cache[script_id]
 
     def resolve_script_path(self, entry: str) -> Path:
         return (self._scripts_dir / entry).resolve()
@@ -0,0 +1,242 @@
+# 每个 run 的资源占用：定时扫一遍所有在跑的进程的 /proc/<pid>/{stat,status,io}，
+# 记下峰值内存、CPU 时间、磁盘读写量，超过 spec 里的上限就杀掉并写明原因。
+#
+# 上限怎么生效：
+#   max_cpu_s  -> 子进程启动前 setrlimit(RLIMIT_CPU)，内核到点发 SIGXCPU（再过 2 秒 SIGKILL）；采样器也会兜底检查
+#   max_rss_mb -> Linux 不执行 RLIMIT_RSS，只能靠采样器发现超了就 SIGKILL（RLIMIT_AS 限的是虚拟内存，会误伤）
+from __future__ import annotations
+
+import logging
+import math
+import os
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from app.storage.state_store import RunUsage, StateStore
+
+logger = logging.getLogger("app.resources")
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_MB = (os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096) / (1024 * 1024)
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    max_rss_mb: Optional[float] = None
+    max_cpu_s: Optional[float] = None
+
+    def preexec_fn(self) -> Optional[Callable[[], None]]:
+        """For Popen(preexec_fn=...): applies RLIMIT_CPU in the child. None when there is nothing to set."""
+        if self.max_cpu_s is None:
+            return None
+        soft = max(1, math.ceil(self.max_cpu_s))
+
+        def apply() -> None:
+            import resource
+
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 2))
+
+        return apply
+
+
+@dataclass(frozen=True)
+class ProcSample:
+    rss_mb: float
+    hwm_mb: float  # 内核记录的进程峰值 RSS（VmHWM），两次采样之间的尖峰也算得到
+    cpu_s: float
+    read_bytes: int
+    write_bytes: int
+
+
+def _read(path: str) -> Optional[bytes]:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return os.read(fd, 8192)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+def read_proc(pid: int) -> Optional[ProcSample]:
+    """One sample of /proc/<pid>; None if the process is gone (or not Linux)."""
+    raw = _read(f"/proc/{pid}/stat")
+    if raw is None:
+        return None
+    # comm 在括号里，可能带空格，从最后一个 ')' 之后开始数字段（第 3 个字段起）
+    fields = raw[raw.rfind(b")") + 2:].split()
+    try:
+        cpu_s = (int(fields[11]) + int(fields[12])) / _CLK_TCK  # utime, stime
+        rss_mb = int(fields[21]) * _PAGE_MB
+    except (IndexError, ValueError):
+        return None
+
+    hwm_mb = rss_mb
+    status = _read(f"/proc/{pid}/status")
+    if status is not None:
+        i = status.find(b"VmHWM:")
+        if i >= 0:
+            try:
+                hwm_mb = int(status[i + 6:status.index(b"kB", i)]) / 1024.0
+            except ValueError:
+                pass
+
+    read_bytes = write_bytes = 0
+    io = _read(f"/proc/{pid}/io")  # 别的用户的进程读不了，这时记 0
+    if io is not None:
+        for line in io.split(b"\n"):
+            if line.startswith(b"read_bytes:"):
+                read_bytes = int(line[11:])
+            elif line.startswith(b"write_bytes:"):
+                write_bytes = int(line[12:])
+    return ProcSample(rss_mb=rss_mb, hwm_mb=hwm_mb, cpu_s=cpu_s, read_bytes=read_bytes, write_bytes=write_bytes)
+
+
+def wait_exited(pid: int) -> Optional[int]:
+    """
+    Block until `pid` (our child) exits, WITHOUT reaping it, and return a Popen-style
+    returncode. The zombie keeps /proc/<pid>/stat and io, so the final CPU / I/O
+    numbers can still be read; Popen.wait() reaps it afterwards.
+    """
+    try:
+        r = os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    except (AttributeError, OSError):  # 非 Linux，或者已经被别的线程 wait 掉了
+        return None
+    if r is None:
+        return None
+    return -r.si_status if r.si_code in (os.CLD_KILLED, os.CLD_DUMPED) else r.si_status
+
+
+@dataclass
+class _Tracked:
+    pid: int
+    limits: Optional[ResourceLimits]
+    shared: bool  # pool worker：进程跑过别的 run，CPU / IO 要减去开始时的基数，峰值只能看采样值
+    base: Optional[ProcSample]
+    usage: Optional[RunUsage] = None
+    killed: bool = False
+
+
+class ResourceSampler:
+    """
+    One background thread that samples every tracked run each `interval_s`.
+
+    Runners call track() right after the process started and finalize() when
+    it ended (before reaping it when they can, so the last /proc read still
+    sees the zombie's CPU counters). Usage goes to store.set_usage(); the
+    store persists it together with the final status.
+    """
+
+    def __init__(self, store: StateStore, *, interval_s: float = 1.0) -> None:
+        self._store = store
+        self._interval_s = max(0.05, float(interval_s))
+        self._lock = threading.Lock()
+        self._runs: Dict[str, _Tracked] = {}
+        self.stats = {"passes": 0, "samples": 0, "limit_kills": 0, "last_pass_ms": 0.0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="resource-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def track(self, run_id: str, pid: Optional[int], *, limits: Optional[ResourceLimits] = None, shared: bool = False) -> None:
+        if pid is None:
+            return
+        base = read_proc(pid) if shared else None
+        with self._lock:
+            self._runs[run_id] = _Tracked(pid=pid, limits=limits, shared=shared, base=base)
+
+    def sample(self, run_id: str) -> None:
+        """Take one sample right now (e.g. when the run's stdout hit EOF, before it is reaped)."""
+        with self._lock:
+            t = self._runs.get(run_id)
+        if t is not None:
+            self._sample(run_id, t)
+
+    def finalize(self, run_id: str, returncode: Optional[int] = None, *, sample: bool = True) -> Optional[RunUsage]:
+        """
+        Stop tracking; with sample=True take a last reading first (only while the pid
+        is still ours: alive or an unreaped zombie). Also explains a kernel RLIMIT_CPU
+        kill via failure_reason.
+        """
+        with self._lock:
+            t = self._runs.pop(run_id, None)
+        if t is None:
+            return None
+        if sample:
+            self._sample(run_id, t)
+        lim = t.limits
+        if lim is not None and lim.max_cpu_s is not None and returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+            cpu = t.usage.cpu_s if t.usage is not None else 0.0
+            if returncode == -signal.SIGXCPU or cpu >= lim.max_cpu_s:
+                self._store.set_failure_reason(run_id, f"cpu limit exceeded: {cpu:.1f}s > max_cpu_s={lim.max_cpu_s:g}")
+        return t.usage
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self._interval_s):
+            t0 = time.perf_counter()
+            with self._lock:
+                runs = list(self._runs.items())
+            for run_id, t in runs:
+                self._sample(run_id, t)
+                self._enforce(run_id, t)
+            self.stats["passes"] += 1
+            self.stats["samples"] += len(runs)
+            self.stats["last_pass_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+
+    def _sample(self, run_id: str, t: _Tracked) -> None:
+        s = read_proc(t.pid)
+        if s is None:
+            return
+        prev = t.usage
+        if t.shared and t.base is not None:
+            b = t.base
+            usage = RunUsage(
+                peak_rss_mb=round(max(s.rss_mb, prev.peak_rss_mb if prev else 0.0), 1),
+                cpu_s=round(max(0.0, s.cpu_s - b.cpu_s), 2),
+                io_read_bytes=max(0, s.read_bytes - b.read_bytes),
+                io_write_bytes=max(0, s.write_bytes - b.write_bytes),
+            )
+        else:
+            usage = RunUsage(
+                peak_rss_mb=round(max(s.hwm_mb, s.rss_mb, prev.peak_rss_mb if prev else 0.0), 1),
+                cpu_s=round(s.cpu_s, 2),
+                io_read_bytes=s.read_bytes,
+                io_write_bytes=s.write_bytes,
+            )
+        t.usage = usage
+        self._store.set_usage(run_id, usage)
+
+    def _enforce(self, run_id: str, t: _Tracked) -> None:
+        lim, u = t.limits, t.usage
+        if lim is None or u is None or t.killed:
+            return
+        reason = None
+        if lim.max_rss_mb is not None and u.peak_rss_mb > lim.max_rss_mb:
+            reason = f"memory limit exceeded: {u.peak_rss_mb:.0f} MB > max_rss_mb={lim.max_rss_mb:g}"
+        elif lim.max_cpu_s is not None and u.cpu_s > lim.max_cpu_s + 1.0:
+            # 正常情况下 RLIMIT_CPU 先到；pool worker 这种没法设 rlimit 的靠这里
+            reason = f"cpu limit exceeded: {u.cpu_s:.1f}s > max_cpu_s={lim.max_cpu_s:g}"
+        if reason is None:
+            return
+        t.killed = True
+        self.stats["limit_kills"] += 1
+        self._store.set_failure_reason(run_id, reason)
+        self._store.append_log(run_id, f"[resources] {reason}, killing process\n")
+        logger.warning("run %s: %s (pid=%s)", run_id, reason, t.pid)
+        try:
+            # 单独启动的脚本是进程组组长（start_new_session），连它拉起的子进程一起杀；pool worker 只杀自己
+            if not t.shared and os.getpgid(t.pid) == t.pid:
+                os.killpg(t.pid, signal.SIGKILL)
+            else:
+                os.kill(t.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
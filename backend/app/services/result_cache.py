@@ -0,0 +1,255 @@
+# 确定性脚本的结果缓存 + single-flight（spec 里写 `cacheable: true` 才生效）。
+#
+# key = (script_id, 校验后的参数按 key 排序的 JSON, 脚本文件的 sha256)：
+#   - 同一个 key 已经有 run 在排队 / 在跑 -> 直接返回那个 run_id（joined），不再 fork
+#   - 同一个 key 成功跑完过且没过期       -> 返回那次的 run_id（hit），状态 / 日志都是现成的
+#   - 否则正常提交（miss），登记为 in-flight
+# 只缓存 status=done 的 run；失败 / 被停掉的下一次请求会重新跑。
+# 脚本文件内容变了 sha256 就变了，旧 key 自然不会再命中；spec 改了（registry 通知）整个脚本的条目都清掉。
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from app.core import metrics
+from app.schemas.script import RunStatus
+from app.services.registry import RegistryDiff
+from app.storage.state_store import StateStore
+
+logger = logging.getLogger("app.result_cache")
+
+CACHE_REQUESTS = metrics.counter(
+    "ap_cache_requests_total", "Submissions of cacheable scripts, by outcome (hit, joined, miss).", ("result",)
+)
+CACHE_EVICTIONS = metrics.counter(
+    "ap_cache_evictions_total", "Result cache entries dropped, by reason.", ("reason",)
+)
+_HIT, _JOINED, _MISS = (CACHE_REQUESTS.labels(r) for r in ("hit", "joined", "miss"))
+
+
+@dataclass
+class _Entry:
+    run_id: str
+    script_id: str
+    file_hash: str
+    ttl_s: float
+    expires_at: Optional[float] = None  # None = 还在跑（in-flight），跑完时按 ttl_s 算出来
+    log_bytes: int = 0
+
+
+class ResultCache:
+    """
+    Single-flight + completed-result cache in front of Scheduler.submit().
+
+    Finished results live in one LRU OrderedDict bounded by `max_entries` and by
+    the total log bytes of the cached runs. Runs still queued / running are kept
+    apart (they are needed for single-flight and never count against the LRU).
+    A run leaves the in-flight map when it finishes: on_run_finished() is the
+    scheduler's finish listener; without one (queue mode, runs finish on other
+    nodes) the next lookup or a reconcile pass asks the store instead.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        *,
+        default_ttl_s: float = 300.0,
+        max_entries: int = 1000,
+        max_log_bytes: Optional[int] = None,
+    ) -> None:
+        self._store = store
+        self._default_ttl_s = float(default_ttl_s)
+        self._max_entries = max(1, int(max_entries))
+        self._max_log_bytes = max_log_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()  # 跑完的结果，LRU
+        self._inflight: Dict[str, _Entry] = {}  # 还在排队 / 在跑的，key -> 条目
+        self._by_run: Dict[str, str] = {}  # in-flight 的 run_id -> key，run 结束时用
+        self._reconcile_at = self._max_entries  # in-flight 超过这么多才去 store 里核对一遍（没有 finish 回调时）
+        self._log_bytes = 0
+        self._file_hashes: Dict[str, Tuple[int, int, str]] = {}  # path -> (mtime_ns, size, sha256)，受 self._lock 保护
+
+    # ---- public ----
+
+    def submit(
+        self,
+        *,
+        script_id: str,
+        script_path: Path,
+        params: dict,
+        ttl_s: Optional[float],
+        submit: Callable[[], str],
+    ) -> Tuple[str, str]:
+        """
+        Return (run_id, outcome) with outcome "hit" | "joined" | "miss".
+        `submit` is only called on a miss; it runs under the cache lock so two
+        identical requests can never both start a run.
+        """
+        file_hash, changed = self._file_hash(script_path)
+        key = self.key(script_id, params, file_hash)
+        with self._lock:
+            if changed:
+                # 脚本文件改过：旧内容的结果不会再命中了，顺手清掉，不用等 LRU
+                self._drop_where_locked(lambda e: e.script_id == script_id and e.file_hash != file_hash, "script_changed")
+            found = self._lookup_locked(key)
+            if found is not None:
+                run_id, outcome = found
+                (_HIT if outcome == "hit" else _JOINED).inc()
+                return run_id, outcome
+            run_id = submit()
+            self._inflight[key] = _Entry(
+                run_id=run_id,
+                script_id=script_id,
+                file_hash=file_hash,
+                ttl_s=self._default_ttl_s if ttl_s is None else float(ttl_s),
+            )
+            self._by_run[run_id] = key
+            if len(self._inflight) > self._reconcile_at:
+                self._reconcile_locked()
+        _MISS.inc()
+        return run_id, "miss"
+
+    def on_run_finished(self, run_id: str, status: RunStatus, returncode: Optional[int]) -> None:
+        # RunScheduler 的 finish 回调：成功的变成缓存结果，失败 / 被停掉的直接丢
+        with self._lock:
+            if run_id in self._by_run:
+                self._settle_locked(run_id, status)
+
+    def invalidate(self, script_id: str) -> int:
+        with self._lock:
+            return self._drop_where_locked(lambda e: e.script_id == script_id, "invalidated")
+
+    def on_registry_change(self, diff: RegistryDiff) -> None:
+        # spec 改了（env / args_schema / entry…）同样的参数也可能得到不同结果
+        for script_id in (*diff.changed, *diff.removed):
+            n = self.invalidate(script_id)
+            if n:
+                logger.info("Dropped %s cached results of %s (spec changed)", n, script_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries) + len(self._inflight),
+                "inflight": len(self._inflight),
+                "log_bytes": self._log_bytes,
+                "max_entries": self._max_entries,
+                "max_log_bytes": self._max_log_bytes,
+            }
+
+    @staticmethod
+    def key(script_id: str, params: dict, file_hash: str) -> str:
+        canon = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(f"{script_id}\0{canon}\0{file_hash}".encode("utf-8")).hexdigest()
+
+    # ---- internals ----
+
+    def _lookup_locked(self, key: str) -> Optional[Tuple[str, str]]:
+        # (run_id, "hit" / "joined")；条目不能用了就删掉并返回 None
+        e = self._inflight.get(key)
+        if e is not None:
+            rec = self._store.peek_run(e.run_id)
+            if rec is None:  # run 已经被 retention 淘汰了
+                self._forget_inflight_locked(e.run_id, "run_evicted")
+                return None
+            if rec.finished_at is None:
+                return e.run_id, "joined"
+            # 结束回调还没到（或者根本没有回调）：按 store 里的状态结算
+            self._settle_locked(e.run_id, rec.status)
+        e = self._entries.get(key)
+        if e is None:
+            return None
+        assert e.expires_at is not None
+        if time.monotonic() >= e.expires_at:
+            self._drop_locked(key, "expired")
+            return None
+        if self._store.peek_run(e.run_id) is None:
+            self._drop_locked(key, "run_evicted")
+            return None
+        self._entries.move_to_end(key)
+        return e.run_id, "hit"
+
+    def _settle_locked(self, run_id: str, status: RunStatus) -> None:
+        key = self._by_run.pop(run_id)
+        e = self._inflight.pop(key)
+        if status != RunStatus.done:
+            CACHE_EVICTIONS.labels("failed").inc()
+            return
+        # 变成缓存结果，TTL 从结束时刻算
+        e.expires_at = time.monotonic() + e.ttl_s
+        size = self._store.log_size(run_id)
+        if size is None:
+            size = sum(len(x) for x in self._store.get_logs(run_id, tail=10**9)[0])
+        e.log_bytes = size
+        old = self._entries.pop(key, None)  # 同一个 key 过期后又跑了一次
+        if old is not None:
+            self._log_bytes -= old.log_bytes
+        self._entries[key] = e
+        self._log_bytes += size
+        self._shrink_locked(keep=key)
+
+    def _reconcile_locked(self) -> None:
+        # 没有 finish 回调时 in-flight 只会在再次查到同一个 key 时结算：参数各不相同的 run 会一直堆着。
+        # 堆到上限就去 store 里核对一遍，已经结束 / 被淘汰的结算掉；还剩很多（真的都在排队）就把下一次核对的门槛翻倍，
+        # 平摊下来每次 submit 还是 O(1)。
+        for key, e in list(self._inflight.items()):
+            rec = self._store.peek_run(e.run_id)
+            if rec is None:
+                self._forget_inflight_locked(e.run_id, "run_evicted")
+            elif rec.finished_at is not None:
+                self._settle_locked(e.run_id, rec.status)
+        self._reconcile_at = max(self._max_entries, 2 * len(self._inflight))
+
+    def _shrink_locked(self, keep: Optional[str] = None) -> None:
+        # LRU：最久没被用到的先走（OrderedDict 的开头），正在结算的 `keep` 不删
+        while self._entries and (
+            len(self._entries) > self._max_entries
+            or (self._max_log_bytes is not None and self._log_bytes > self._max_log_bytes)
+        ):
+            k = next(iter(self._entries))
+            if k == keep:
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(k)
+                continue
+            self._drop_locked(k, "size")
+
+    def _drop_locked(self, key: str, reason: str) -> None:
+        e = self._entries.pop(key, None)
+        if e is not None:
+            self._log_bytes -= e.log_bytes
+            CACHE_EVICTIONS.labels(reason).inc()
+
+    def _forget_inflight_locked(self, run_id: str, reason: str) -> None:
+        key = self._by_run.pop(run_id, None)
+        if key is not None and self._inflight.pop(key, None) is not None:
+            CACHE_EVICTIONS.labels(reason).inc()
+
+    def _drop_where_locked(self, pred: Callable[[_Entry], bool], reason: str) -> int:
+        done = [k for k, e in self._entries.items() if pred(e)]
+        for k in done:
+            self._drop_locked(k, reason)
+        running = [e.run_id for e in self._inflight.values() if pred(e)]
+        for run_id in running:
+            self._forget_inflight_locked(run_id, reason)
+        return len(done) + len(running)
+
+    def _file_hash(self, path: Path) -> Tuple[str, bool]:
+        # stat 没变就用上次的 sha256；改了文件（mtime / size 变）才重新读。第二个值：内容是否和上次不同
+        st = os.stat(path)
+        p = str(path)
+        with self._lock:
+            cached = self._file_hashes.get(p)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2], False
+        h = hashlib.sha256(Path(path).read_bytes()).hexdigest()  # 读文件不占锁
+        with self._lock:
+            self._file_hashes[p] = (st.st_mtime_ns, st.st_size, h)
+        return h, cached is not None and cached[2] != h
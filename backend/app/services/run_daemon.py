@@ -0,0 +1,308 @@
+# 单机执行守护进程：所有子进程和 run 状态都在这里，API 可以开多个 worker 进程（uvicorn --workers N）。
+#
+#   python -m app.services.run_daemon                                   # 先起守护进程
+#   AP_RUN_MODE=daemon uvicorn app.main:app --workers 4                 # 再起 API，每个 worker 连同一个 socket
+#
+# 以前 create_app 在每个进程里各建一份 InMemoryStateStore + RunnerService，开多个 worker 时
+# 在 A 上启动的 run 在 B 上查不到，只能单进程跑。现在 API worker 只做 HTTP / 校验 / 序列化，
+# store / 调度器 / 结果缓存 / batch / 工作流 / 定时任务都在守护进程里，通过 daemon_rpc.py 的代理对象访问。
+from __future__ import annotations
+
+import logging
+import os
+import pickle
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.core import metrics
+from app.services.daemon_rpc import EXPOSED, DaemonError, encode, read_frame
+from app.services.registry import ScriptSpec
+from app.services.result_cache import ResultCache
+from app.services.scheduler import RunScheduler
+
+logger = logging.getLogger("app.run_daemon")
+
+# 直接在连接的读线程里回答的调用（只读内存、很快）；其它的交给线程池，慢调用不挡住同一个 worker 的其它请求
+INLINE = frozenset(
+    [("store", m) for m in ("get_run", "peek_run", "get_logs", "read_logs", "read_log_bytes", "log_size")]
+    + [("scheduler", "queue_position"), ("scheduler", "script_stats"), ("daemon", "ping")]
+)
+_ENCODE_RETRIES = 3
+
+
+class SchedulerEndpoint:
+    """What API workers see as their Scheduler: submit() also runs cacheable specs through the shared ResultCache."""
+
+    def __init__(self, scheduler: RunScheduler, result_cache: Optional[ResultCache]) -> None:
+        self._scheduler = scheduler
+        self._cache = result_cache
+
+    def submit(
+        self,
+        *,
+        spec: ScriptSpec,
+        script_path: Path,
+        params: dict,
+        cwd: Optional[Path] = None,
+        priority: int = 0,
+    ) -> Tuple[str, Optional[str]]:
+        def submit() -> str:
+            return self._scheduler.submit(spec=spec, script_path=script_path, params=params, cwd=cwd, priority=priority)
+
+        if spec.cacheable and self._cache is not None:
+            # 所有 API worker 共用这一个 single-flight：两个 worker 同时收到同样的请求也只跑一次
+            return self._cache.submit(
+                script_id=spec.script_id,
+                script_path=script_path,
+                params=params,
+                ttl_s=spec.cache_ttl_s,
+                submit=submit,
+            )
+        return submit(), None
+
+    def queue_position(self, run_id: str) -> Optional[int]:
+        return self._scheduler.queue_position(run_id)
+
+    def stop(self, run_id: str) -> bool:
+        return self._scheduler.stop(run_id)
+
+    def stats(self) -> dict:
+        return self._scheduler.stats()
+
+    def script_stats(self, spec: ScriptSpec) -> Optional[dict]:
+        return self._scheduler.script_stats(spec)
+
+
+class _DaemonInfo:
+    def __init__(self) -> None:
+        self._started = time.monotonic()
+
+    def ping(self) -> dict:
+        return {"pid": os.getpid(), "uptime_s": round(time.monotonic() - self._started, 3)}
+
+    def metrics(self) -> str:
+        # run / 调度 / pool 的指标都在守护进程里记，API worker 的 /metrics/daemon 转出来
+        return metrics.REGISTRY.render()
+
+
+class RunDaemon:
+    """
+    Unix-socket server in front of the daemon's objects (only the methods listed in EXPOSED).
+
+    - One thread per connection reads pipelined frames. INLINE calls (in-memory reads)
+      are answered right there; everything else runs on a small thread pool, so a
+      10k-run batch create does not hold up the worker's other requests.
+    - Responses carry the request id and may go out in any order; writes are
+      serialized per connection.
+    - The socket file is created with mode 0600: pickle is only spoken to processes
+      of the same user.
+    """
+
+    def __init__(self, path: Path, targets: Dict[str, Any], *, pool_size: int = 16) -> None:
+        self._path = Path(path)
+        # None = 这个组件没开（比如 AP_SCHEDULES=off），调用时当作没开放
+        self._targets = {**{k: v for k, v in targets.items() if v is not None}, "daemon": _DaemonInfo()}
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="daemon-call")
+        self._sock: Optional[socket.socket] = None
+        self._closed = threading.Event()
+        self.stats = {"connections": 0, "calls": 0, "errors": 0}
+
+    def start(self) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        if self._path.exists():
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(str(self._path))
+            except OSError:
+                self._path.unlink()  # 上一个守护进程没清理掉的 socket 文件
+            else:
+                raise SystemExit(f"a run daemon is already listening on {self._path}")
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)  # bind 出来的 socket 文件直接就是 0600，没有先 0755 再 chmod 的窗口
+        try:
+            sock.bind(str(self._path))
+        finally:
+            os.umask(old_umask)
+        sock.listen(128)
+        self._sock = sock
+        threading.Thread(target=self._accept_loop, name="daemon-accept", daemon=True).start()
+        logger.info("run daemon listening on %s", self._path)
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._sock is not None:
+            self._sock.close()
+        try:
+            self._path.unlink()
+        except FileNotFoundError:
+            pass
+        self._executor.shutdown(wait=False)
+
+    def _accept_loop(self) -> None:
+        assert self._sock is not None
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                if self._closed.is_set():
+                    return
+                logger.exception("accept failed")
+                time.sleep(0.1)
+                continue
+            self.stats["connections"] += 1
+            threading.Thread(target=self._serve, args=(conn,), name="daemon-conn", daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        send_lock = threading.Lock()
+        f = conn.makefile("rb", buffering=1 << 16)
+        try:
+            while True:
+                frame = read_frame(f)
+                if frame is None:
+                    break
+                req_id, payload = frame
+                target, method, args, kwargs = pickle.loads(payload)
+                self.stats["calls"] += 1
+                if (target, method) in INLINE:
+                    self._answer(conn, send_lock, req_id, target, method, args, kwargs)
+                else:
+                    self._executor.submit(self._answer, conn, send_lock, req_id, target, method, args, kwargs)
+        except Exception as e:
+            logger.warning("daemon connection dropped: %r", e)
+        finally:
+            f.close()
+            conn.close()
+
+    def _answer(
+        self,
+        conn: socket.socket,
+        send_lock: threading.Lock,
+        req_id: int,
+        target: str,
+        method: str,
+        args: tuple,
+        kwargs: dict,
+    ) -> None:
+        try:
+            if method not in EXPOSED.get(target, ()) or target not in self._targets:
+                raise DaemonError(f"{target}.{method} is not exposed by the run daemon")
+            resp: Tuple[bool, Any] = (True, getattr(self._targets[target], method)(*args, **kwargs))
+        except Exception as e:
+            self.stats["errors"] += 1
+            resp = (False, e)
+
+        data = None
+        for attempt in range(_ENCODE_RETRIES):
+            try:
+                data = encode(req_id, resp)
+                break
+            except RuntimeError:
+                # Batch / WorkflowRun 是活的对象：pump 线程正好在改（dict 在迭代中变了大小），重新序列化一次
+                if attempt == _ENCODE_RETRIES - 1:
+                    data = encode(req_id, (False, DaemonError(f"{target}.{method}: result kept changing")))
+            except Exception as e:
+                data = encode(req_id, (False, DaemonError(f"{target}.{method}: unpicklable result: {e!r}")))
+                break
+        try:
+            with send_lock:
+                conn.sendall(data)
+        except OSError:
+            pass  # 客户端已经断开了，读线程那边会收尾
+
+
+def main() -> None:
+    from app.bootstrap import (
+        build_artifacts,
+        build_registry,
+        build_runner,
+        build_sampler,
+        build_store,
+        build_worker_pool,
+        start_spec_watcher,
+    )
+    from app.core.config import get_settings
+    from app.core.logging import setup_logging
+    from app.services.batches import BatchManager
+    from app.services.schedules import ScheduleManager
+    from app.services.supervisor import ProcessSupervisor
+    from app.services.workflow_engine import WorkflowEngine
+
+    setup_logging()
+    settings = get_settings()
+    logger.info("daemon_socket=%s state_backend=%s", settings.daemon_socket, settings.state_backend)
+
+    metrics.configure(enabled=settings.metrics_enabled)
+    store = build_store(settings)
+    registry = build_registry(settings)
+    watcher = start_spec_watcher(settings, registry)
+    sampler = build_sampler(settings, store)
+    supervisor = ProcessSupervisor()  # runner 和 pool 共用：所有超时 / stop 宽限期在一个堆里，一个线程
+    runner = build_runner(settings.runner_backend, store, sampler, supervisor)
+    pool = build_worker_pool(settings, registry, store, sampler, supervisor)
+    scheduler = RunScheduler(
+        runner=runner,
+        store=store,
+        max_concurrent_runs=settings.max_concurrent_runs,
+        pool=pool,
+        artifacts=build_artifacts(settings),
+    )
+    result_cache = ResultCache(
+        store,
+        default_ttl_s=settings.cache_ttl_s,
+        max_entries=settings.cache_max_entries,
+        max_log_bytes=int(settings.cache_max_log_mb * 1024 * 1024) if settings.cache_max_log_mb is not None else None,
+    )
+    registry.add_listener(result_cache.on_registry_change)
+    scheduler.add_listener(result_cache.on_run_finished)
+    batches = BatchManager(scheduler=scheduler, store=store, result_cache=result_cache)
+    engine = WorkflowEngine(registry=registry, scheduler=scheduler, store=store)
+    schedules = None
+    if settings.schedules_enabled:
+        # 定时任务也只在这里跑一份：N 个 API worker 不会各触发一次
+        schedules = ScheduleManager(
+            registry=registry,
+            scheduler=scheduler,
+            store=store,
+            state_path=settings.schedule_state_path,
+        )
+
+    daemon = RunDaemon(
+        settings.daemon_socket,
+        {
+            "store": store,
+            "scheduler": SchedulerEndpoint(scheduler, result_cache),
+            "cache": result_cache,
+            "batches": batches,
+            "workflows": engine,
+            "schedules": schedules,
+        },
+    )
+    done = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: done.set())
+    signal.signal(signal.SIGINT, lambda *_: done.set())
+    daemon.start()
+    done.wait()
+    logger.info("run daemon shutting down")
+    daemon.close()
+    if schedules is not None:
+        schedules.stop()
+    batches.stop()
+    engine.stop()
+    if watcher is not None:
+        watcher.stop()
+    if sampler is not None:
+        sampler.stop()
+    close = getattr(store, "close", None)  # sqlite：把还没写下去的批次刷进库
+    if close is not None:
+        close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# 脚本的结构化事件通道：进度 / 计数 / 结果，不用再从日志里按正则扫。
+#
+# 脚本这边用 scripts/ap_sdk.py：
+#   from ap_sdk import progress, counter, result
+#   progress(37, 100, "attack")      # -> {"type": "progress", "current": 37, "total": 100, "message": "attack"}
+#   counter("gold", 1200)            # -> {"type": "counter", "name": "gold", "inc": 1200}
+#   result({"trophies": 12})         # -> {"type": "result", "data": {...}}
+# 每个事件是一行 JSON，写到 AP_EVENTS_FD（runner 给每个 run 额外开的一个 pipe，和 stdout 分开）。
+# pool 里跑的脚本没有单独的 pipe：事件作为 MARKER 控制行走 worker 的 stdout（AP_EVENTS_VIA=pool）。
+#
+# runner 这边每个 run 一个 ProgressTracker：解析事件，维护最新状态 + 一小段历史，写进 RunRecord.progress；
+# GET /runs/{id}/progress 和 RunInfo.progress 直接读这个字段。
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.storage.state_store import RunProgress, StateStore
+
+logger = logging.getLogger("app.run_events")
+
+EVENTS_FD_ENV = "AP_EVENTS_FD"
+EVENTS_VIA_ENV = "AP_EVENTS_VIA"  # "fd"：写 AP_EVENTS_FD；"pool"：带 MARKER 写 stdout
+POOL_EVENT_PREFIX = "EVENT "  # pool_worker.MARKER 后面跟这个，再跟 JSON
+SDK_DIR = Path(__file__).resolve().parents[3] / "scripts"  # ap_sdk.py 所在目录，加到脚本的 PYTHONPATH 里
+
+MAX_EVENT_BYTES = 64 * 1024  # 一行事件的上限（result 也算在内）；更长的整行丢掉
+HISTORY_MAX = 50
+MAX_COUNTERS = 100
+PERSIST_EVERY_S = 1.0  # 内存里每个事件都更新；写 SQLite / Redis 最多这么频繁一次，结束时一定写
+
+
+def events_env(env: Optional[Dict[str, str]], *, via: str, fd: Optional[int] = None) -> Dict[str, str]:
+    """Child environment with the events channel (same rule as ParamsDelivery.merge_env: no spec env -> inherit)."""
+    out = dict(env) if env else dict(os.environ)
+    out[EVENTS_VIA_ENV] = via
+    if fd is not None:
+        out[EVENTS_FD_ENV] = str(fd)
+    out["PYTHONPATH"] = os.pathsep.join(p for p in (str(SDK_DIR), out.get("PYTHONPATH")) if p)
+    return out
+
+
+def _num(v: Any) -> Optional[float]:
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        return None
+    return v
+
+
+class ProgressTracker:
+    """
+    Parses one run's event stream (JSON lines) into a RunProgress kept on the run record.
+
+    - feed() takes raw pipe bytes, handle_line() one already-split line.
+    - Malformed / oversized / unknown-shape events are counted and skipped (one log line each).
+    - close() flushes the last partial line and persists the final state.
+    """
+
+    def __init__(self, store: StateStore, run_id: str) -> None:
+        self._store = store
+        self.run_id = run_id
+        self._buf = b""
+        self._current: Optional[float] = None
+        self._total: Optional[float] = None
+        self._message: Optional[str] = None
+        self._counters: Dict[str, float] = {}
+        self._result: Any = None
+        self._history: List[Dict[str, Any]] = []
+        self._events = 0
+        self._last_persist = 0.0
+        self._dirty = False
+        self.bad = 0
+
+    def feed(self, data: bytes) -> None:
+        buf = self._buf + data
+        *lines, self._buf = buf.split(b"\n")
+        if len(self._buf) > MAX_EVENT_BYTES:
+            self._reject(f"event longer than {MAX_EVENT_BYTES} bytes")
+            self._buf = b""
+        for line in lines:
+            self.handle_line(line)
+
+    def handle_line(self, line: bytes | str) -> None:
+        if not line.strip():
+            return
+        if len(line) > MAX_EVENT_BYTES:
+            self._reject(f"event longer than {MAX_EVENT_BYTES} bytes")
+            return
+        try:
+            ev = json.loads(line)
+        except ValueError:
+            self._reject("not JSON")
+            return
+        if not isinstance(ev, dict) or not isinstance(ev.get("type"), str):
+            self._reject('expected an object with a "type"')
+            return
+        if self._apply(ev):
+            self._publish()
+
+    def close(self) -> None:
+        if self._buf:
+            line, self._buf = self._buf, b""
+            self.handle_line(line)
+        if self._dirty:
+            self._publish(final=True)
+
+    def _apply(self, ev: Dict[str, Any]) -> bool:
+        kind = ev["type"]
+        ev.setdefault("ts", round(time.time(), 3))
+        if kind == "progress":
+            current, total = _num(ev.get("current")), _num(ev.get("total"))
+            if current is None:
+                self._reject('progress needs a numeric "current"')
+                return False
+            self._current = current
+            if total is not None:
+                self._total = total
+            if ev.get("message") is not None:
+                self._message = str(ev["message"])
+            # 连续的同一条 progress（同一个 message）只留最后一个：几千次 tick 不会把历史挤掉
+            last = self._history[-1] if self._history else None
+            if last is not None and last["type"] == "progress" and last.get("message") == ev.get("message"):
+                self._history[-1] = ev
+                self._events += 1
+                return True
+        elif kind == "counter":
+            name = ev.get("name")
+            inc, value = _num(ev.get("inc", 1)), _num(ev.get("value"))
+            if not isinstance(name, str) or not name or (inc is None and value is None):
+                self._reject('counter needs a "name" and a numeric "inc" or "value"')
+                return False
+            if name not in self._counters and len(self._counters) >= MAX_COUNTERS:
+                self._reject(f"more than {MAX_COUNTERS} counters")
+                return False
+            self._counters[name] = value if value is not None else self._counters.get(name, 0) + inc
+            self._events += 1
+            return True  # 计数太频繁，不进历史
+        elif kind == "result":
+            self._result = ev.get("data")
+            ev = {"type": "result", "ts": ev["ts"]}  # 历史里不再存一份 payload
+        self._history.append(ev)
+        if len(self._history) > HISTORY_MAX:
+            del self._history[0]
+        self._events += 1
+        return True
+
+    def _publish(self, final: bool = False) -> None:
+        now = time.monotonic()
+        persist = final or now - self._last_persist >= PERSIST_EVERY_S
+        if persist:
+            self._last_persist = now
+        self._dirty = not persist
+        self._store.set_progress(self.run_id, self.snapshot(), persist=persist)
+
+    def snapshot(self) -> RunProgress:
+        return RunProgress(
+            current=self._current,
+            total=self._total,
+            message=self._message,
+            counters=dict(self._counters),
+            result=self._result,
+            history=tuple(self._history),
+            events=self._events,
+            updated_at=datetime.utcnow(),
+        )
+
+    def _reject(self, why: str) -> None:
+        self.bad += 1
+        if self.bad <= 10:  # 一个脚本刷错事件时别把日志刷满
+            self._store.append_log(self.run_id, f"[events] bad event ignored: {why}\n")
+
+
+def open_channel() -> Tuple[int, int]:
+    """(read_fd, write_fd) of a fresh events pipe; the read end is non-blocking, both are non-inheritable."""
+    r, w = os.pipe()
+    os.set_blocking(r, False)
+    return r, w
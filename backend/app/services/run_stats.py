@@ -0,0 +1,202 @@
+# 每个脚本的运行统计：跑了几次、成功率、耗时分位数（GET /scripts/{id}/stats），以及按分位数算出来的自适应超时。
+#
+#   timeout_s: 3600              # 静态上限照旧（也是自适应超时的上限）
+#   adaptive_timeout:            # 或者直接写 true，全用默认值
+#     quantile: 0.99             # 看成功 run 的哪个分位数
+#     factor: 3                  # 超时 = 分位数 × factor
+#     min_runs: 20               # 成功 run 不够这么多次之前只用 timeout_s
+#     min_s: 5                   # 再短也不低于这个
+#
+# 统计在 run 结束时增量更新，不回头扫 store 里的历史：耗时进对数分桶的直方图（HDR histogram 的思路），
+# 每个桶比上一个宽 2%，1ms ~ 7 天约 1000 个桶，每个脚本固定 8KB，分位数的相对误差在 1% 左右。
+# 只在内存里，进程重启后从零开始（守护进程 / runner 节点各算各的）。
+from __future__ import annotations
+
+import math
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+_MIN_S = 0.001
+_MAX_S = 7 * 24 * 3600.0
+_GROWTH = 1.02
+_LOG_GROWTH = math.log(_GROWTH)
+_BUCKETS = int(math.ceil(math.log(_MAX_S / _MIN_S) / _LOG_GROWTH)) + 1
+
+
+@dataclass(frozen=True)
+class AdaptiveTimeout:
+    quantile: float = 0.99
+    factor: float = 3.0
+    min_runs: int = 20
+    min_s: float = 1.0
+
+
+def parse_adaptive_timeout(raw: Any) -> Optional[AdaptiveTimeout]:
+    """The `adaptive_timeout` value of a script spec (true / false / mapping) -> AdaptiveTimeout or None; raises ValueError."""
+    if raw is None or raw is False:
+        return None
+    if raw is True:
+        return AdaptiveTimeout()
+    if not isinstance(raw, dict):
+        raise ValueError("adaptive_timeout must be true/false or a mapping")
+    unknown = set(raw) - {"quantile", "factor", "min_runs", "min_s"}
+    if unknown:
+        raise ValueError(f"unknown adaptive_timeout keys: {sorted(unknown)}")
+    d = AdaptiveTimeout()
+    try:
+        cfg = AdaptiveTimeout(
+            quantile=float(raw.get("quantile", d.quantile)),
+            factor=float(raw.get("factor", d.factor)),
+            min_runs=int(raw.get("min_runs", d.min_runs)),
+            min_s=float(raw.get("min_s", d.min_s)),
+        )
+    except (TypeError, ValueError):
+        raise ValueError("adaptive_timeout values must be numbers")
+    if not 0 < cfg.quantile < 1:
+        raise ValueError("adaptive_timeout.quantile must be between 0 and 1")
+    if cfg.factor < 1:
+        raise ValueError("adaptive_timeout.factor must be >= 1")
+    if cfg.min_runs < 1 or cfg.min_s <= 0:
+        raise ValueError("adaptive_timeout.min_runs / min_s must be > 0")
+    return cfg
+
+
+class DurationHistogram:
+    """
+    Log-bucketed histogram of durations in seconds: fixed size, O(1) record,
+    quantiles within ~1% relative error (each bucket is 2% wider than the last).
+    Values outside 1ms..7d land in the first / last bucket; min/max stay exact.
+    """
+
+    __slots__ = ("_counts", "count", "total", "min", "max")
+
+    def __init__(self) -> None:
+        self._counts = array("Q", bytes(8 * _BUCKETS))
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value_s: float) -> None:
+        v = max(0.0, float(value_s))
+        i = 0 if v <= _MIN_S else min(_BUCKETS - 1, int(math.log(v / _MIN_S) / _LOG_GROWTH))
+        self._counts[i] += 1
+        self.count += 1
+        self.total += v
+        self.min = min(self.min, v)
+        self.max = max(self.max, v)
+
+    def quantiles(self, qs: Tuple[float, ...] = QUANTILES) -> Dict[float, float]:
+        """One pass over the buckets for all of `qs`; empty dict when nothing was recorded."""
+        if not self.count:
+            return {}
+        out: Dict[float, float] = {}
+        wanted = sorted(qs)
+        k = 0
+        seen = 0
+        for i, c in enumerate(self._counts):
+            if not c:
+                continue
+            seen += c
+            while k < len(wanted) and seen >= wanted[k] * self.count:
+                # 桶的几何中点，再夹到真实的 min / max 之间（只有一个样本时就是它本身）
+                mid = _MIN_S * _GROWTH ** (i + 0.5)
+                out[wanted[k]] = min(self.max, max(self.min, mid))
+                k += 1
+            if k == len(wanted):
+                break
+        return out
+
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+
+class ScriptRunStats:
+    """Counters + duration histogram for one script. Durations only come from successful runs."""
+
+    def __init__(self) -> None:
+        self.since = time.time()
+        self.by_status: Dict[str, int] = {}
+        self.durations = DurationHistogram()
+        self._cached: Optional[Tuple[int, Dict[float, float]]] = None  # (count, quantiles)，有新样本才重算
+
+    @property
+    def runs(self) -> int:
+        return sum(self.by_status.values())
+
+    def record(self, status: str, duration_s: Optional[float]) -> None:
+        self.by_status[status] = self.by_status.get(status, 0) + 1
+        if status == "done" and duration_s is not None:
+            self.durations.record(duration_s)
+
+    def quantiles(self) -> Dict[float, float]:
+        if self._cached is None or self._cached[0] != self.durations.count:
+            self._cached = (self.durations.count, self.durations.quantiles())
+        return self._cached[1]
+
+
+class RunStats:
+    """
+    Per-script statistics, updated as runs finish (RunScheduler._on_finish).
+    Nothing here reads the run history: memory is constant per script.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._scripts: Dict[str, ScriptRunStats] = {}
+
+    def record(self, script_id: str, status: str, duration_s: Optional[float]) -> None:
+        with self._lock:
+            st = self._scripts.get(script_id)
+            if st is None:
+                st = self._scripts[script_id] = ScriptRunStats()
+            st.record(status, duration_s)
+
+    def adaptive_timeout(
+        self, script_id: str, cfg: Optional[AdaptiveTimeout], static_s: Optional[float]
+    ) -> Tuple[Optional[float], Optional[str]]:
+        """
+        (timeout to use, why) for the next run. Falls back to `static_s` (why=None)
+        until the script has cfg.min_runs successful runs; never exceeds `static_s`.
+        """
+        if cfg is None:
+            return static_s, None
+        with self._lock:
+            st = self._scripts.get(script_id)
+            if st is None or st.durations.count < cfg.min_runs:
+                return static_s, None
+            n = st.durations.count
+            q = st.durations.quantiles((cfg.quantile,))[cfg.quantile]
+        timeout = round(max(cfg.min_s, q * cfg.factor), 3)
+        if static_s is not None and timeout >= static_s:
+            return static_s, None
+        pct = f"p{cfg.quantile * 100:g}"
+        return timeout, f"{pct} {q:.3g}s x {cfg.factor:g} over {n} runs"
+
+    def snapshot(self, script_id: str) -> Dict[str, Any]:
+        with self._lock:
+            st = self._scripts.get(script_id)
+            if st is None:
+                return {"runs": 0, "by_status": {}, "success_rate": None, "duration_s": None, "since": None}
+            h = st.durations
+            runs = st.runs
+            quantiles = st.quantiles()
+            return {
+                "runs": runs,
+                "by_status": dict(st.by_status),
+                "success_rate": st.by_status.get("done", 0) / runs if runs else None,
+                "duration_s": {
+                    "samples": h.count,
+                    "mean": h.mean(),
+                    "min": h.min,
+                    "max": h.max,
+                    **{f"p{q * 100:g}": v for q, v in quantiles.items()},
+                }
+                if h.count
+                else None,
+                "since": st.since,
+            }
@@ -51,41 +51,100 @@
 from __future__ import annotations
 
 import logging
+import os
+import signal
 import subprocess
 import sys
 import threading
 import time
 import uuid
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Protocol, Tuple
 
+from app.core.metrics import SPAWN_SECONDS
 from app.schemas.script import RunStatus
-from app.storage.state_store import InMemoryStateStore
+from app.services.log_ingest import CHUNK_SIZE, COALESCE_S, SMALL_READ_BYTES, LineSplitter
+from app.services.params import ParamsDelivery, params_to_cli_args, prepare_params  # noqa: F401 (params_to_cli_args 以前定义在这里)
+from app.services.resources import ResourceLimits, ResourceSampler, wait_exited
+from app.services.run_events import ProgressTracker, events_env, open_channel
+from app.services.supervisor import ProcessSupervisor, kill_group
+from app.storage.state_store import StateStore
 
 logger = logging.getLogger("app.runner")
 
+_SPAWN = SPAWN_SECONDS.labels("thread")
 
-def params_to_cli_args(params: dict) -> list[str]:
+# run 结束时的回调：(run_id, status, returncode)。调度器靠它知道“空出了一个位置”。
+FinishListener = Callable[[str, RunStatus, Optional[int]], None]
+
+
+def _feed_stdin(proc: subprocess.Popen, data: bytes) -> None:
+    # params_via=stdin：写完 JSON 就关掉，脚本读到 EOF
+    assert proc.stdin is not None
+    view = memoryview(data)
+    try:
+        while view:  # bufsize=0：write 可能只写进去一部分
+            view = view[proc.stdin.write(view):]
+    except (BrokenPipeError, OSError):
+        pass  # 脚本没读完就退出了
+    finally:
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+
+
+class Runner(Protocol):
     """
-    Simple rule:
-      {"x": 1, "name": "abc"} -> ["--x", "1", "--name", "abc"]
-    Later you can support booleans / lists / json.
+    Runner 的公共接口：API 层只依赖这两个方法，具体用线程还是 asyncio 由 create_app 决定。
     """
-    args: list[str] = []
-    for k, v in (params or {}).items():
-        key = str(k).strip()
-        if not key:
-            continue
-        args.append(f"--{key}")
-        args.append(str(v))
-    return args
+
+    def start(
+        self,
+        *,
+        script_id: str,
+        script_path: Path,
+        params: dict,
+        cwd: Optional[Path] = None,
+        env: Optional[dict[str, str]] = None,
+        timeout_s: Optional[float] = None,
+        run_id: Optional[str] = None,
+        params_via: str = "argv",
+        limits: Optional[ResourceLimits] = None,
+    ) -> str: ...
+
+    def stop(self, run_id: str, *, kill_after_s: float = 2.0) -> bool: ...
+
+    def add_listener(self, fn: FinishListener) -> None: ...
+
+
+@dataclass(eq=False)
+class _Child:
+    proc: subprocess.Popen
+    exited: threading.Event = field(default_factory=threading.Event)  # supervisor 看到进程退出（还没回收）
+    events_done: threading.Event = field(default_factory=threading.Event)  # 事件 pipe 读到 EOF、最后的进度已写进 store
+    stopping: bool = False
+    timed_out: bool = False
 
 
 class RunnerService:
-    def __init__(self, store: InMemoryStateStore) -> None:
+    def __init__(
+        self,
+        store: StateStore,
+        *,
+        sampler: Optional[ResourceSampler] = None,
+        supervisor: Optional[ProcessSupervisor] = None,
+    ) -> None:
         self._store = store
-        self._procs: Dict[str, subprocess.Popen] = {}
+        self._sampler = sampler
+        self._sup = supervisor or ProcessSupervisor()
+        self._procs: Dict[str, _Child] = {}
         self._lock = threading.Lock()
+        self._listeners: List[FinishListener] = []
+
+    def add_listener(self, fn: FinishListener) -> None:
+        self._listeners.append(fn)
 
     def start(
         self,
@@ -96,40 +155,80 @@ class RunnerService:
         cwd: Optional[Path] = None,
         env: Optional[dict[str, str]] = None,
         timeout_s: Optional[float] = None,
+        run_id: Optional[str] = None,
+        params_via: str = "argv",
+        limits: Optional[ResourceLimits] = None,
     ) -> str:
-        run_id = str(uuid.uuid4())
+        """
+        run_id 为空时自己生成并创建记录；
+        调度器传进来的 run_id 已经以 queued 状态存在 store 里，这里只把它切到 running。
+        """
+        queued = run_id is not None
+        run_id = run_id or str(uuid.uuid4())
         # 这边是生成一个全局唯一的 ID。
         # UUID（Universally Unique Identifier，全局唯一标识符）
         # UUID 的例子：4a0c693d-0a83-413e-9bbd-9064eddfaef5。
         # UUID 的特征：128 位（16 字节），十六进制字符串，分5段，用-分隔。
         # UUID 的设计目标只有一个：在不同机器、不同时刻、不同进程生成，几乎不可能撞号。
 
-        cli_args = params_to_cli_args(params)
-        cmd = [sys.executable, "-u", str(script_path), *cli_args]
+        delivery = prepare_params(params, params_via)
+        cmd = [sys.executable, "-u", str(script_path), *delivery.argv]
         # 拼出启动命令 cmd。
+        env = delivery.merge_env(env)
+        # 事件通道：额外一个 pipe，写端以原来的 fd 号传给子进程，脚本用 scripts/ap_sdk.py 往里写 JSON 行
+        events_r, events_w = open_channel()
+        env = events_env(env, via="fd", fd=events_w)
 
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            cwd=str(cwd) if cwd else None,
-            env={**(env or {})} if env else None,  # minimal; later merge with os.environ
-        )
+        t_spawn = time.perf_counter()
+        try:
+            proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE if delivery.stdin is not None else None,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0,  # 原始 bytes、不经过 Python 的缓冲；切行/解码在 LineSplitter 里批量做
+                cwd=str(cwd) if cwd else None,
+                env={**(env or {})} if env else None,  # minimal; later merge with os.environ
+                preexec_fn=limits.preexec_fn() if limits is not None else None,  # 在子进程里 setrlimit
+                start_new_session=True,  # 自己当进程组组长：stop / 超时的时候脚本拉起的孙进程一起杀
+                pass_fds=(events_w,),
+            )
+        except BaseException:
+            delivery.cleanup()
+            os.close(events_r)
+            raise
+        finally:
+            os.close(events_w)  # 父进程不留写端：子进程（和它的孙进程）都退出后读端才能读到 EOF
+        _SPAWN.observe(time.perf_counter() - t_spawn)
+        if delivery.stdin is not None:
+            # 单独的线程写：参数很大、脚本又不急着读的时候，别卡住这里
+            threading.Thread(target=_feed_stdin, args=(proc, delivery.stdin), daemon=True).start()
 
+        child = _Child(proc=proc)
         with self._lock:
-            self._procs[run_id] = proc
+            self._procs[run_id] = child
             # 把进程保存到字典里。
 
-        self._store.create_run(run_id=run_id, script_id=script_id, pid=proc.pid)
+        if queued:
+            self._store.mark_running(run_id, pid=proc.pid)
+        else:
+            self._store.create_run(run_id=run_id, script_id=script_id, pid=proc.pid)
+        if self._sampler is not None:
+            self._sampler.track(run_id, proc.pid, limits=limits)
+
+        tracker = ProgressTracker(self._store, run_id)
+        self._sup.add_reader(events_r, lambda data: self._on_events(child, tracker, data))
+        # 超时是 supervisor 堆里的一个截止时间：脚本不输出也会按时杀掉
+        self._sup.watch(proc.pid, lambda pid: self._on_exit(run_id, child))
+        if timeout_s is not None:
+            self._sup.call_later((run_id, "timeout"), float(timeout_s), lambda: self._on_timeout(run_id, child, timeout_s))
 
         t = threading.Thread(
             target=self._stream_and_watch,
-            args=(run_id, proc, timeout_s),
+            args=(run_id, child, delivery),
             daemon=True,
         )
-        # 开一个后台线程去读输出，看超时。
+        # 开一个后台线程去读输出，等进程结束。
         # target=self._stream_and_watch：这个线程要执行哪个函数。
         # args=(...)：给 target 函数传参数。
         # daemon=True：守护线程，主进程退出时，不会因为它还在跑而卡住退出（它会被直接干掉）。
@@ -141,74 +240,118 @@ class RunnerService:
         )
         return run_id
 
-    def _stream_and_watch(self, run_id: str, proc: subprocess.Popen, timeout_s: Optional[float]) -> None:
-        start_ts = time.time()
+    def _stream_and_watch(self, run_id: str, child: _Child, delivery: ParamsDelivery) -> None:
+        proc = child.proc
         try:
             if proc.stdout is None:
                 self._store.append_log(run_id, "[runner] no stdout pipe\n")
             else:
-                for line in proc.stdout:
-                    self._store.append_log(run_id, line)
-
-                    # timeout check while streaming
-                    if timeout_s is not None and (time.time() - start_ts) > float(timeout_s):
-                        self._store.append_log(run_id, "[runner] timeout reached, killing process\n")
-                        self._kill_process(run_id, proc)
-                        self._store.finish_run(run_id, status=RunStatus.failed, returncode=-9)
-                        return
+                splitter = LineSplitter()
+                while True:
+                    chunk = proc.stdout.read(CHUNK_SIZE)
+                    # bufsize=0 时 read(n) 就是一次 os.read：有多少拿多少，b"" 表示 EOF。
+                    if not chunk:
+                        break
+                    self._store.append_logs(run_id, splitter.feed(chunk))
+                    if len(chunk) < SMALL_READ_BYTES:
+                        time.sleep(COALESCE_S)
+                self._store.append_logs(run_id, splitter.flush())
 
         except Exception as e:
             self._store.append_log(run_id, f"[runner] stream error: {e}\n")
 
         finally:
-            # if already finished by timeout path, return
-            if self._store.get_run(run_id) and self._store.get_run(run_id).finished_at is not None:
-                self._cleanup(run_id)
-                return
-
-            proc.wait()
-            rc = proc.returncode
-            status = RunStatus.done if rc == 0 else RunStatus.failed
-            self._store.finish_run(run_id, status=status, returncode=rc)
+            delivery.cleanup()
+            # 等 supervisor 处理完退出（杀掉残留的孙进程、取消截止时间）再回收，回收之前 pid 不会被复用
+            child.exited.wait()
+            child.events_done.wait(timeout=2.0)  # 整组都杀掉了，写端都关了，正常马上就到
+            self._account(run_id, proc)
+            rc = proc.wait()
+            if child.stopping:
+                status = RunStatus.stopped
+            elif child.timed_out:
+                status = RunStatus.failed
+            else:
+                status = RunStatus.done if rc == 0 else RunStatus.failed
+            rec = self._store.peek_run(run_id)
+            if rec is None or rec.finished_at is None:
+                self._finish(run_id, status=status, returncode=rc)
             self._cleanup(run_id)
             logger.info("Finished run %s (rc=%s status=%s)", run_id, rc, status)
 
+    def _on_events(self, child: _Child, tracker: ProgressTracker, data: bytes) -> None:
+        # supervisor 线程里：data 为空就是 EOF
+        if data:
+            tracker.feed(data)
+            return
+        tracker.close()
+        child.events_done.set()
+
+    def _on_exit(self, run_id: str, child: _Child) -> None:
+        # supervisor 线程里：主进程退出了（还是僵尸）。脚本丢在后台的孙进程会一直占着 stdout，
+        # 读日志的线程就等不到 EOF，所以整组清掉；run 的生命周期以主进程为准。
+        kill_group(child.proc.pid)
+        self._sup.cancel((run_id, "timeout"), (run_id, "kill"))
+        child.exited.set()
+
+    def _on_timeout(self, run_id: str, child: _Child, timeout_s: float) -> None:
+        if child.exited.is_set() or child.stopping:
+            return
+        child.timed_out = True
+        self._store.append_log(run_id, "[runner] timeout reached, killing process\n")
+        self._store.set_failure_reason(run_id, f"timeout after {float(timeout_s):g}s")
+        self._kill_process(run_id, child)
+
     def stop(self, run_id: str, *, kill_after_s: float = 2.0) -> bool:
-        proc = self._get_proc(run_id)
-        if not proc:
+        """
+        Send SIGTERM to the run's process group and return right away; if it is still
+        alive after `kill_after_s` the supervisor sends SIGKILL. The stream thread
+        records the final `stopped` status once the process has exited.
+        """
+        child = self._get_child(run_id)
+        if child is None or child.exited.is_set():
             return False
+        if child.stopping:
+            return True  # 已经在停了，重复的 stop 不再发信号
 
+        child.stopping = True
         self._store.append_log(run_id, "[runner] stop requested\n")
         try:
-            proc.terminate()
+            kill_group(child.proc.pid, signal.SIGTERM)
         except Exception as e:
+            child.stopping = False
             self._store.append_log(run_id, f"[runner] terminate failed: {e}\n")
             return False
+        self._sup.call_later((run_id, "kill"), kill_after_s, lambda: self._kill_after_grace(run_id, child))
+        return True
 
-        # wait a bit, then kill if still alive
-        t0 = time.time()
-        while time.time() - t0 < kill_after_s:
-            if proc.poll() is not None:
-                break
-            time.sleep(0.05)
-
-        if proc.poll() is None:
-            self._store.append_log(run_id, "[runner] terminate timeout -> kill\n")
-            self._kill_process(run_id, proc)
-            self._store.finish_run(run_id, status=RunStatus.stopped, returncode=-9)
-        else:
-            self._store.finish_run(run_id, status=RunStatus.stopped, returncode=proc.returncode)
+    def _kill_after_grace(self, run_id: str, child: _Child) -> None:
+        if child.exited.is_set():
+            return
+        self._store.append_log(run_id, "[runner] terminate timeout -> kill\n")
+        self._kill_process(run_id, child)
 
-        self._cleanup(run_id)
-        return True
+    def _account(self, run_id: str, proc: subprocess.Popen) -> None:
+        # 等进程退出但先不回收（僵尸的 /proc 还在），读最后一次 CPU / IO，再交给 proc.wait()
+        if self._sampler is not None:
+            rc = proc.returncode if proc.returncode is not None else wait_exited(proc.pid)
+            self._sampler.finalize(run_id, rc, sample=proc.returncode is None)
+
+    def _finish(self, run_id: str, *, status: RunStatus, returncode: Optional[int]) -> None:
+        self._store.finish_run(run_id, status=status, returncode=returncode)
+        for fn in self._listeners:
+            try:
+                fn(run_id, status, returncode)
+            except Exception:
+                logger.exception("finish listener failed for run %s", run_id)
 
-    def _kill_process(self, run_id: str, proc: subprocess.Popen) -> None:
+    def _kill_process(self, run_id: str, child: _Child) -> None:
         try:
-            proc.kill()
+            kill_group(child.proc.pid, signal.SIGKILL)
         except Exception as e:
             self._store.append_log(run_id, f"[runner] kill failed: {e}\n")
 
-    def _get_proc(self, run_id: str) -> Optional[subprocess.Popen]:
+    def _get_child(self, run_id: str) -> Optional[_Child]:
         with self._lock:
             return self._procs.get(run_id)
 
@@ -0,0 +1,243 @@
+# runner 节点：从 Redis 共享队列里领 run，在本机执行（复用单机的 RunScheduler + runner + worker pool）。
+# 每台执行机起一个：
+#   cd backend && AP_STATE_BACKEND=redis AP_REDIS_URL=redis://api-host:6379/0 python -m app.services.runner_node
+from __future__ import annotations
+
+import logging
+import os
+import signal
+import socket
+import threading
+from typing import List, Optional, Set
+
+from app.schemas.script import RunStatus
+from app.services.registry import ScriptRegistry
+from app.services.scheduler import RunScheduler
+from app.services.work_queue import RedisWorkQueue, default_node_id, reap_dead_nodes, recover_node_runs
+from app.storage.redis_store import RedisStateStore
+
+logger = logging.getLogger("app.runner_node")
+
+
+class RunnerNode:
+    """
+    Pulls jobs from the shared queue while the local scheduler has free slots.
+
+    - Each pulled run is adopted by this node's RedisStateStore (so logs and
+      status are written locally and mirrored to Redis) and handed to the
+      local RunScheduler with its existing run_id.
+    - A heartbeat thread keeps `ap:node:<id>:alive` fresh and reaps other
+      nodes whose heartbeat expired.
+    - A control thread handles stop requests sent by the API.
+    - shutdown() stops the runs still in flight, waits up to `drain_s` for them
+      to finish, and settles whatever is left before unregistering the node.
+    """
+
+    def __init__(
+        self,
+        *,
+        node_id: str,
+        queue: RedisWorkQueue,
+        store: RedisStateStore,
+        registry: ScriptRegistry,
+        scheduler: RunScheduler,
+        capacity: int,
+        heartbeat_s: float = 5.0,
+        ttl_s: float = 15.0,
+        drain_s: float = 10.0,
+    ) -> None:
+        self.node_id = node_id
+        self._queue = queue
+        self._store = store
+        self._registry = registry
+        self._scheduler = scheduler
+        self._capacity = max(1, int(capacity))
+        self._heartbeat_s = max(0.1, float(heartbeat_s))
+        self._ttl_s = max(self._heartbeat_s * 2, float(ttl_s))
+        self._drain_s = max(0.0, float(drain_s))
+
+        self._cond = threading.Condition()
+        self._inflight: Set[str] = set()  # 领到、还没结束的 run
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def on_finish(self, run_id: str, status: RunStatus, returncode: Optional[int]) -> None:
+        # 注册到本机 scheduler 上的结束回调：空出位置就去领下一个
+        with self._cond:
+            if run_id not in self._inflight:
+                return  # 不是从共享队列领来的
+            self._inflight.discard(run_id)
+            self._cond.notify_all()
+        self._queue.release(self.node_id, run_id)
+
+    def start(self) -> None:
+        self._heartbeat()
+        for target, name in ((self._pull_loop, "node-pull"), (self._heartbeat_loop, "node-heartbeat"), (self._control_loop, "node-control")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info("Runner node %s started (capacity=%s)", self.node_id, self._capacity)
+
+    def shutdown(self) -> None:
+        # 不再领新的；还没结束的 run 停掉（子进程是独立的进程组，节点退出后不会跟着退出，没人管也没人写日志）
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=5)
+        with self._cond:
+            inflight = sorted(self._inflight)
+        for run_id in inflight:
+            self._store.append_log(run_id, f"[node {self.node_id}] shutting down, stopping run\n")
+            try:
+                self._scheduler.stop(run_id)
+            except Exception:
+                logger.exception("stop failed for run %s", run_id)
+        with self._cond:
+            self._cond.wait_for(lambda: not self._inflight, timeout=self._drain_s)
+        # 宽限期里没结束的：节点注销时一起处理掉，不然它们在 Redis 里永远是 running（reaper 已经看不到这个节点了）
+        left = self._queue.leave(self.node_id)
+        if left:
+            logger.warning("runner node %s left %s runs unfinished", self.node_id, len(left))
+            recover_node_runs(self._queue, self._store, self.node_id, left, "shut down")
+        self._store.flush(timeout=5)
+
+    # ---- loops ----
+
+    def _pull_loop(self) -> None:
+        while not self._stopping.is_set():
+            with self._cond:
+                while len(self._inflight) >= self._capacity and not self._stopping.is_set():
+                    self._cond.wait(timeout=1.0)
+            if self._stopping.is_set():
+                return
+            try:
+                job = self._queue.pop(self.node_id, timeout_s=1.0)
+            except Exception:
+                logger.exception("queue pop failed")
+                self._stopping.wait(1.0)
+                continue
+            if job is not None:
+                self._take(job)
+
+    def _take(self, job: dict) -> None:
+        run_id = job["run_id"]  # pop() 已经把它记在这个节点名下了
+        if not self._store.adopt_run(run_id, node=self.node_id):
+            logger.warning("run %s vanished before it could start", run_id)
+            self._queue.release(self.node_id, run_id)
+            return
+        with self._cond:
+            self._inflight.add(run_id)
+        try:
+            spec = self._registry.get(job["script_id"])
+            script_path = self._registry.resolve_script_path(spec.entry)
+            if not script_path.exists():
+                raise FileNotFoundError(f"Script file not found on node {self.node_id}: {script_path}")
+            self._scheduler.submit(
+                spec=spec,
+                script_path=script_path,
+                params=job["params"],
+                cwd=self._registry.resolve_cwd(spec.cwd),
+                priority=job["priority"],
+                run_id=run_id,
+            )
+        except Exception as e:
+            logger.exception("cannot start run %s on node %s", run_id, self.node_id)
+            self._store.append_log(run_id, f"[node {self.node_id}] start failed: {e}\n")
+            self._store.finish_run(run_id, status=RunStatus.failed, returncode=None)
+            self.on_finish(run_id, RunStatus.failed, None)
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stopping.wait(self._heartbeat_s):
+            try:
+                self._heartbeat()
+                reap_dead_nodes(self._queue, self._store)
+            except Exception:
+                logger.exception("heartbeat failed")
+
+    def _heartbeat(self) -> None:
+        with self._cond:
+            inflight = len(self._inflight)
+        info = {"host": socket.gethostname(), "pid": os.getpid(), "capacity": self._capacity, "inflight": inflight}
+        self._queue.heartbeat(self.node_id, info, self._ttl_s)
+
+    def _control_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                msg = self._queue.read_control(self.node_id, timeout_s=1.0)
+            except Exception:
+                logger.exception("control read failed")
+                self._stopping.wait(1.0)
+                continue
+            if msg and msg.get("op") == "stop":
+                run_id = msg.get("run_id", "")
+                # stop 只发信号就返回（宽限期由 supervisor 计时），直接在控制线程里调
+                try:
+                    self._scheduler.stop(run_id)
+                except Exception:
+                    logger.exception("stop failed for run %s", run_id)
+
+
+def main() -> None:
+    from app.bootstrap import (
+        build_artifacts,
+        build_registry,
+        build_runner,
+        build_sampler,
+        build_store,
+        build_worker_pool,
+        start_spec_watcher,
+    )
+    from app.core.config import get_settings
+    from app.core.logging import setup_logging
+    from app.services.supervisor import ProcessSupervisor
+
+    setup_logging()
+    settings = get_settings()
+    if settings.state_backend != "redis":
+        raise SystemExit("runner_node needs AP_STATE_BACKEND=redis")
+
+    store = build_store(settings)
+    assert isinstance(store, RedisStateStore)
+    registry = build_registry(settings)
+    watcher = start_spec_watcher(settings, registry)
+    sampler = build_sampler(settings, store)
+    supervisor = ProcessSupervisor()  # runner 和 pool 共用：所有超时 / stop 宽限期在一个堆里，一个线程
+    runner = build_runner(settings.runner_backend, store, sampler, supervisor)
+    pool = build_worker_pool(settings, registry, store, sampler, supervisor)
+    scheduler = RunScheduler(
+        runner=runner,
+        store=store,
+        max_concurrent_runs=settings.max_concurrent_runs,
+        pool=pool,
+        artifacts=build_artifacts(settings),  # 产物落在节点本机；API 要能下载就把 AP_ARTIFACTS_DIR 挂成共享目录
+    )
+
+    node = RunnerNode(
+        node_id=settings.node_id or default_node_id(),
+        queue=RedisWorkQueue(store.client, prefix=settings.redis_prefix),
+        store=store,
+        registry=registry,
+        scheduler=scheduler,
+        capacity=settings.max_concurrent_runs,
+        heartbeat_s=settings.node_heartbeat_s,
+        ttl_s=settings.node_ttl_s,
+    )
+    scheduler.add_listener(node.on_finish)
+
+    done = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: done.set())
+    signal.signal(signal.SIGINT, lambda *_: done.set())
+    node.start()
+    done.wait()
+    logger.info("Runner node %s shutting down", node.node_id)
+    node.shutdown()
+    if watcher is not None:
+        watcher.stop()
+    if sampler is not None:
+        sampler.stop()
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+# Scheduler = API 和 Runner 之间的“排队层”。
+# POST /runs 不再直接 fork 进程：先以 queued 状态进优先队列，有空位（全局上限 + 每个脚本的上限）才交给 runner 启动。
+from __future__ import annotations
+
+import bisect
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Protocol, Set, Tuple
+
+from app.core.metrics import RUN_DURATION, RUNS_FINISHED
+from app.schemas.script import RunStatus
+from app.services.registry import ScriptSpec
+from app.services.run_stats import RunStats
+from app.services.runner import FinishListener, Runner
+from app.services.worker_pool import WorkerPool
+from app.storage.artifacts import ARTIFACTS_ENV, ArtifactStore
+from app.storage.state_store import StateStore
+
+logger = logging.getLogger("app.scheduler")
+
+
+@dataclass
+class QueuedRun:
+    run_id: str
+    spec: ScriptSpec
+    script_path: Path
+    params: dict
+    cwd: Optional[Path]
+    priority: int
+
+
+class Scheduler(Protocol):
+    """
+    API 层用到的调度接口：单机是 RunScheduler，多机（AP_RUN_MODE=queue）是 work_queue.QueueScheduler。
+    """
+
+    def submit(
+        self,
+        *,
+        spec: ScriptSpec,
+        script_path: Path,
+        params: dict,
+        cwd: Optional[Path] = None,
+        priority: int = 0,
+    ) -> str: ...
+
+    def queue_position(self, run_id: str) -> Optional[int]: ...
+
+    def stop(self, run_id: str) -> bool: ...
+
+    def stats(self) -> dict: ...
+
+    def script_stats(self, spec: ScriptSpec) -> Optional[dict]: ...
+
+
+class RunScheduler:
+    """
+    Priority queue in front of a Runner.
+
+    - submit() only records the run as `queued` and returns; it never forks.
+    - One dispatcher thread starts runs whenever the global cap and the spec's
+      `max_concurrency` allow it. Runner finish callbacks free the slots.
+    - Specs with `execution: pool` go to the WorkerPool (if one is configured).
+    - With an ArtifactStore, every started run gets AP_ARTIFACTS_DIR and its files
+      are handed to the store's ingest thread once the run finishes.
+    - Finished runs feed per-script RunStats (counts, duration quantiles); specs with
+      `adaptive_timeout` get their timeout from those quantiles at launch.
+    """
+
+    def __init__(
+        self,
+        *,
+        runner: Runner,
+        store: StateStore,
+        max_concurrent_runs: int,
+        pool: Optional[WorkerPool] = None,
+        artifacts: Optional[ArtifactStore] = None,
+    ) -> None:
+        self._runner = runner
+        self._pool = pool
+        self._artifacts = artifacts
+        self._store = store
+        self._max_concurrent = max(1, int(max_concurrent_runs))
+
+        self._cond = threading.Condition()
+        # heap 里放 (-priority, seq, run_id)：priority 大的先出，同优先级按提交顺序（seq）。
+        self._heap: List[Tuple[int, int, str]] = []
+        self._seq = itertools.count()
+        self._pending: Dict[str, QueuedRun] = {}
+        self._keys: Dict[str, Tuple[int, int]] = {}
+        # 排队中所有 run 的 key，保持有序：queue_position 用二分查名次，不用每次把整个队列数一遍
+        self._order: List[Tuple[int, int]] = []
+        # 已经出队、executor.start 还没返回的 run：这时来的 stop 记在 _stop_requested 里，start 前后再处理
+        self._launching: Set[str] = set()
+        self._stop_requested: Set[str] = set()
+
+        self._active: Dict[str, str] = {}  # run_id -> script_id
+        self._active_by_script: Dict[str, int] = {}
+        self._started: Dict[str, float] = {}  # run_id -> 出队时的 monotonic 时间，算 run 时长用
+        self._pooled: Set[str] = set()  # 交给 pool 的 run_id，stop 时要找对执行者
+        self._listeners: List[FinishListener] = []
+        self.run_stats = RunStats()
+
+        runner.add_listener(self._on_finish)
+        if pool is not None:
+            pool.add_listener(self._on_finish)
+
+        self._thread = threading.Thread(target=self._dispatch_loop, name="run-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        *,
+        spec: ScriptSpec,
+        script_path: Path,
+        params: dict,
+        cwd: Optional[Path] = None,
+        priority: int = 0,
+        run_id: Optional[str] = None,
+    ) -> str:
+        # 传了 run_id 表示记录已经存在（runner 节点从共享队列里领到的 run），不再重复创建
+        if run_id is None:
+            run_id = str(uuid.uuid4())
+            self._store.create_run(run_id=run_id, script_id=spec.script_id, pid=None, status=RunStatus.queued)
+
+        job = QueuedRun(
+            run_id=run_id,
+            spec=spec,
+            script_path=script_path,
+            params=params,
+            cwd=cwd,
+            priority=int(priority),
+        )
+        with self._cond:
+            key = (-job.priority, next(self._seq))
+            heapq.heappush(self._heap, (*key, run_id))
+            bisect.insort(self._order, key)
+            self._pending[run_id] = job
+            self._keys[run_id] = key
+            self._cond.notify()
+        return run_id
+
+    def add_listener(self, fn: FinishListener) -> None:
+        # 每个经过调度器的 run 结束时都会回调一次（包括排队时被取消、启动失败）
+        self._listeners.append(fn)
+
+    def queue_position(self, run_id: str) -> Optional[int]:
+        """
+        0-based position among queued runs, or None if the run is not queued.
+        Runs blocked by their script's own cap still count as "ahead".
+        """
+        with self._cond:
+            key = self._keys.get(run_id)
+            if key is None:
+                return None
+            return bisect.bisect_left(self._order, key)
+
+    def stop(self, run_id: str) -> bool:
+        # 还在排队的直接取消；正在启动的记下来，由 _launch 处理；已经在跑的交给 runner 去停。
+        with self._cond:
+            job = self._pending.pop(run_id, None)
+            key = self._keys.pop(run_id, None)
+            if key is not None:
+                self._unorder_locked(key)
+            elif run_id in self._launching:
+                self._stop_requested.add(run_id)
+                return True
+        if job is not None:
+            self._store.append_log(run_id, "[scheduler] cancelled while queued\n")
+            self._store.finish_run(run_id, status=RunStatus.stopped, returncode=None)
+            RUNS_FINISHED.labels(job.spec.script_id, RunStatus.stopped.value).inc()
+            self._notify(run_id, RunStatus.stopped, None)
+            return True
+        return self._stop_started(run_id)
+
+    def _stop_started(self, run_id: str) -> bool:
+        with self._cond:
+            pooled = run_id in self._pooled
+        if pooled and self._pool is not None:
+            return self._pool.stop(run_id)
+        return self._runner.stop(run_id)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": len(self._pending),
+                "running": len(self._active),
+                "max_concurrent_runs": self._max_concurrent,
+            }
+
+    def script_stats(self, spec: ScriptSpec) -> Optional[dict]:
+        snap = self.run_stats.snapshot(spec.script_id)
+        timeout_s, _ = self.run_stats.adaptive_timeout(spec.script_id, spec.adaptive_timeout, spec.timeout_s)
+        return {
+            **snap,
+            "timeout_s": spec.timeout_s,
+            # 下一个 run 实际会用的超时；没开 adaptive_timeout / 样本还不够时就是 timeout_s
+            "effective_timeout_s": timeout_s,
+        }
+
+    def _on_finish(self, run_id: str, status: RunStatus, returncode: Optional[int]) -> None:
+        # 可能在 runner 的线程 / event loop 里被调用，只改计数 + 唤醒 dispatcher，不在这里启动新进程。
+        with self._cond:
+            self._pooled.discard(run_id)
+            script_id = self._active.pop(run_id, None)
+            started = self._started.pop(run_id, None)
+            if script_id is not None:
+                left = self._active_by_script.get(script_id, 1) - 1
+                if left > 0:
+                    self._active_by_script[script_id] = left
+                else:
+                    self._active_by_script.pop(script_id, None)
+                self._cond.notify()
+        if script_id is not None:
+            if self._artifacts is not None:
+                self._artifacts.ingest_later(run_id)  # 算 sha256 / 搬文件在 ingest 线程里，不占 runner 线程和 event loop
+            RUNS_FINISHED.labels(script_id, status.value).inc()
+            duration = time.monotonic() - started if started is not None else None
+            if duration is not None:
+                RUN_DURATION.labels(script_id).observe(duration)
+            self.run_stats.record(script_id, status.value, duration)
+            self._notify(run_id, status, returncode)
+
+    def _notify(self, run_id: str, status: RunStatus, returncode: Optional[int]) -> None:
+        for fn in self._listeners:
+            try:
+                fn(run_id, status, returncode)
+            except Exception:
+                logger.exception("scheduler listener failed for run %s", run_id)
+
+    def _unorder_locked(self, key: Tuple[int, int]) -> None:
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+
+    def _pick_locked(self) -> Optional[QueuedRun]:
+        if len(self._active) >= self._max_concurrent:
+            return None
+
+        skipped: List[Tuple[int, int, str]] = []
+        picked: Optional[QueuedRun] = None
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            job = self._pending.get(item[2])
+            if job is None or self._keys.get(item[2]) != item[:2]:
+                continue  # 已取消（懒删除）
+            cap = job.spec.max_concurrency
+            if cap is not None and self._active_by_script.get(job.spec.script_id, 0) >= cap:
+                skipped.append(item)  # 这个脚本已满，让后面别的脚本先走
+                continue
+            picked = job
+            break
+
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+
+        if picked is not None:
+            del self._pending[picked.run_id]
+            self._unorder_locked(self._keys.pop(picked.run_id))
+            self._launching.add(picked.run_id)
+            sid = picked.spec.script_id
+            self._active[picked.run_id] = sid
+            self._started[picked.run_id] = time.monotonic()
+            self._active_by_script[sid] = self._active_by_script.get(sid, 0) + 1
+        return picked
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                job = self._pick_locked()
+                while job is None:
+                    self._cond.wait()
+                    job = self._pick_locked()
+            self._launch(job)
+
+    def _launch(self, job: QueuedRun) -> None:
+        spec = job.spec
+        executor: Runner = self._runner  # WorkerPool 也满足 Runner 接口
+        if spec.execution == "pool" and self._pool is not None:
+            executor = self._pool
+            with self._cond:
+                self._pooled.add(job.run_id)
+        try:
+            env = spec.env
+            if self._artifacts is not None:
+                # 传了 env 的 Popen 不会再继承 os.environ，所以没写 env 的 spec 这里要先拷一份；
+                # pool 的 worker 是在自己的环境上 update，只传要加的就够了
+                base = spec.env or ({} if executor is self._pool else os.environ)
+                env = {**base, ARTIFACTS_ENV: str(self._artifacts.work_dir(job.run_id))}
+            timeout_s, why = self.run_stats.adaptive_timeout(spec.script_id, spec.adaptive_timeout, spec.timeout_s)
+            if why is not None:
+                self._store.append_log(job.run_id, f"[scheduler] adaptive timeout {timeout_s:.3g}s ({why})\n")
+            # 出队之后、start 之前被 stop 的，就不用再起进程了
+            with self._cond:
+                cancelled = job.run_id in self._stop_requested
+                self._stop_requested.discard(job.run_id)
+            if cancelled:
+                self._store.append_log(job.run_id, "[scheduler] cancelled while starting\n")
+                self._store.finish_run(job.run_id, status=RunStatus.stopped, returncode=None)
+                self._on_finish(job.run_id, RunStatus.stopped, None)
+                return
+            executor.start(
+                script_id=spec.script_id,
+                script_path=job.script_path,
+                params=job.params,
+                cwd=job.cwd,
+                env=env,
+                timeout_s=timeout_s,
+                run_id=job.run_id,
+                params_via=spec.params_via,
+                limits=spec.limits,
+            )
+        except Exception as e:
+            logger.exception("Failed to start run %s (script_id=%s)", job.run_id, spec.script_id)
+            self._store.append_log(job.run_id, f"[scheduler] start failed: {e}\n")
+            self._store.set_failure_reason(job.run_id, f"start failed: {e}")
+            self._store.finish_run(job.run_id, status=RunStatus.failed, returncode=None)
+            self._on_finish(job.run_id, RunStatus.failed, None)
+        finally:
+            with self._cond:
+                self._launching.discard(job.run_id)
+                stop_now = job.run_id in self._stop_requested
+                self._stop_requested.discard(job.run_id)
+        if stop_now:
+            # start 跑到一半时来的 stop：现在 runner 已经认得这个 run 了，再转给它
+            self._stop_started(job.run_id)
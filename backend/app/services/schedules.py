@@ -0,0 +1,382 @@
+# 内置定时器：spec 里写了 schedule 的脚本，到点由这里提交 run，不用外部 cron + curl。
+#
+# 一个线程 + 一个最小堆（按下次触发时间排序）：每次只看堆顶，到点的弹出来提交、算好下一次再压回去，
+# 几千个定时任务每次触发也只是 O(log n)。暂停 / spec 改了不去堆里找旧条目，而是把 generation 加一，
+# 旧条目弹出来时发现 generation 对不上就直接丢掉（懒删除，和 scheduler.py 的取消一样）。
+#
+# 下次触发时间会写进一个小 JSON 文件（AP_SCHEDULE_STATE），进程重启后知道错过了哪些，按 catch_up 策略补跑。
+from __future__ import annotations
+
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core import metrics
+from app.services.cron import ScheduleSpec
+from app.services.params import ParamError
+from app.services.registry import RegistryDiff, ScriptRegistry
+from app.services.scheduler import Scheduler
+from app.storage.state_store import StateStore
+
+logger = logging.getLogger("app.schedules")
+
+SCHEDULE_FIRES = metrics.counter(
+    "ap_schedule_fires_total", "Scheduled triggers, by result (fired, skipped_overlap, missed, error).", ("result",)
+)
+_FIRED, _SKIPPED, _MISSED, _ERROR = (SCHEDULE_FIRES.labels(r) for r in ("fired", "skipped_overlap", "missed", "error"))
+
+MISFIRE_GRACE_S = 30.0  # 晚了不超过这么多秒算正常触发，超过了按 catch_up 处理
+_MAX_CATCH_UP = 100  # catch_up=all 时最多补这么多次
+_MAX_OWED_STEPS = 1000  # 数错过了几次时最多一步步往后推这么多次，剩下的按平均间隔估
+_SAVE_EVERY_S = 5.0
+
+
+@dataclass
+class _Schedule:
+    schedule_id: str
+    script_id: str
+    spec: ScheduleSpec
+    paused: bool
+    gen: int = 0
+    next_due: Optional[float] = None  # 计划时间（不含 jitter），epoch 秒
+    fire_at: Optional[float] = None  # 实际在堆里的时间（含 jitter）
+    last_fire_at: Optional[float] = None
+    last_run_id: Optional[str] = None
+    last_error: Optional[str] = None
+    active: List[str] = field(default_factory=list)  # 还没结束的 run，检查 max_overlap 用
+    fired: int = 0
+    skipped: int = 0
+    missed: int = 0
+    errors: int = 0
+
+
+def schedule_id_for(script_id: str, spec: ScheduleSpec) -> str:
+    return f"{script_id}:{spec.name}" if spec.name else script_id
+
+
+class ScheduleManager:
+    """
+    In-process timer for the `schedule` entries of script specs.
+
+    - sync_registry() builds the schedule table from the registry and is
+      registered as a registry listener, so edited specs take effect live.
+    - One thread sleeps until the heap's earliest fire time (or a change),
+      pops every due entry and submits its run through the scheduler.
+    - Overlap is checked against this schedule's own unfinished runs
+      (looked up in the store, so it also works in queue mode).
+    """
+
+    def __init__(
+        self,
+        *,
+        registry: ScriptRegistry,
+        scheduler: Scheduler,
+        store: StateStore,
+        state_path: Optional[Path] = None,
+    ) -> None:
+        self._registry = registry
+        self._scheduler = scheduler
+        self._store = store
+        self._state_path = state_path
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, str, int]] = []  # (fire_at, seq, schedule_id, gen)
+        self._seq = itertools.count()
+        self._gens = itertools.count(1)  # 全局递增：删掉又加回来的同名定时也不会认领旧的堆条目
+        self._schedules: Dict[str, _Schedule] = {}
+        self._saved = self._load_state()
+        self._dirty = False
+        self._last_save = 0.0
+        self._stopping = False
+        self.stats = {"ticks": 0, "heap_pops": 0, "stale_pops": 0}
+
+        self.sync_registry()
+        registry.add_listener(self._on_registry_change)
+        self._thread = threading.Thread(target=self._loop, name="schedule-timer", daemon=True)
+        self._thread.start()
+
+    # ---- public ----
+
+    def list(self) -> List[_Schedule]:
+        with self._cond:
+            return sorted(self._schedules.values(), key=lambda s: s.schedule_id)
+
+    def get(self, schedule_id: str) -> Optional[_Schedule]:
+        with self._cond:
+            return self._schedules.get(schedule_id)
+
+    def pause(self, schedule_id: str) -> bool:
+        return self._set_paused(schedule_id, True)
+
+    def resume(self, schedule_id: str) -> bool:
+        return self._set_paused(schedule_id, False)
+
+    def trigger(self, schedule_id: str, *, force: bool = False) -> Tuple[Optional[str], str]:
+        """
+        Fire now, outside the timetable (the next planned fire is unchanged).
+        Returns (run_id, result) with result "fired" | "skipped_overlap" | "error"; raises KeyError.
+        """
+        with self._cond:
+            s = self._schedules.get(schedule_id)
+            if s is None:
+                raise KeyError(schedule_id)
+        return self._fire(s, time.time(), check_overlap=not force)
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        self._save(force=True)
+
+    def sync_registry(self, script_ids: Optional[Iterable[str]] = None) -> None:
+        """(Re)build schedules of the given scripts (all when None) from the current registry."""
+        specs = {s.script_id: s for s in self._registry.list()}
+        with self._cond:
+            if script_ids is None:
+                script_ids = set(specs) | {s.script_id for s in self._schedules.values()}
+            for script_id in script_ids:
+                wanted = {schedule_id_for(script_id, sch): sch for sch in (specs[script_id].schedules if script_id in specs else ())}
+                for sid in [sid for sid, s in self._schedules.items() if s.script_id == script_id and sid not in wanted]:
+                    del self._schedules[sid]  # 堆里的旧条目弹出来时找不到它，自然丢掉
+                    logger.info("schedule %s removed", sid)
+                for sid, sch in wanted.items():
+                    cur = self._schedules.get(sid)
+                    if cur is not None and cur.spec == sch:
+                        continue
+                    self._add_locked(sid, script_id, sch, prev=cur)
+            self._cond.notify()
+
+    # ---- internals ----
+
+    def _on_registry_change(self, diff: RegistryDiff) -> None:
+        self.sync_registry((*diff.added, *diff.changed, *diff.removed))
+
+    def _add_locked(self, schedule_id: str, script_id: str, spec: ScheduleSpec, *, prev: Optional[_Schedule]) -> None:
+        saved = self._saved.pop(schedule_id, None) or {}
+        if saved.get("expr") != spec.expr:
+            saved = {}  # 表达式变了，上次存的下次触发时间不再有意义
+        now = time.time()
+        s = _Schedule(
+            schedule_id=schedule_id,
+            script_id=script_id,
+            spec=spec,
+            paused=prev.paused if prev is not None else bool(saved.get("paused", spec.paused)),
+            gen=next(self._gens),
+        )
+        if prev is not None:
+            s.last_fire_at, s.last_run_id, s.active = prev.last_fire_at, prev.last_run_id, prev.active
+            s.fired, s.skipped, s.missed, s.errors = prev.fired, prev.skipped, prev.missed, prev.errors
+        else:
+            s.last_fire_at = saved.get("last_fire_at")
+        # 重启前存过下次触发时间：用它（可能已经过去了 -> 弹出时按 catch_up 补）；否则从现在算
+        due = saved.get("next_due")
+        s.next_due = float(due) if isinstance(due, (int, float)) else spec.next_after(now)
+        self._schedules[schedule_id] = s
+        self._push_locked(s)
+        self._dirty = True
+        if prev is None:
+            logger.info("schedule %s (%s) next at %s", schedule_id, spec.expr, _fmt(s.next_due))
+
+    def _push_locked(self, s: _Schedule) -> None:
+        if s.paused or s.next_due is None:
+            s.fire_at = None
+            return
+        s.fire_at = s.next_due + (random.uniform(0, s.spec.jitter_s) if s.spec.jitter_s else 0.0)
+        heapq.heappush(self._heap, (s.fire_at, next(self._seq), s.schedule_id, s.gen))
+
+    def _set_paused(self, schedule_id: str, paused: bool) -> bool:
+        with self._cond:
+            s = self._schedules.get(schedule_id)
+            if s is None:
+                return False
+            if s.paused == paused:
+                return True
+            s.paused = paused
+            s.gen = next(self._gens)  # 堆里的旧条目作废
+            if not paused:
+                # 暂停期间错过的不补：恢复后从现在开始按计划走
+                s.next_due = s.spec.next_after(time.time())
+            self._push_locked(s)
+            self._dirty = True
+            self._cond.notify()
+        logger.info("schedule %s %s", schedule_id, "paused" if paused else "resumed")
+        return True
+
+    def _loop(self) -> None:
+        while True:
+            due: List[Tuple[_Schedule, int]] = []
+            with self._cond:
+                while not self._stopping:
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    if self._dirty:
+                        timeout = min(timeout, _SAVE_EVERY_S) if timeout is not None else _SAVE_EVERY_S
+                    self._cond.wait(timeout)
+                    if self._dirty and time.monotonic() - self._last_save >= _SAVE_EVERY_S:
+                        break
+                if self._stopping:
+                    return
+                self.stats["ticks"] += 1
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, sid, gen = heapq.heappop(self._heap)
+                    self.stats["heap_pops"] += 1
+                    s = self._schedules.get(sid)
+                    if s is None or s.gen != gen or s.paused:
+                        self.stats["stale_pops"] += 1
+                        continue
+                    due.append((s, gen))
+            # 提交 run 不持锁：API 那边 list / pause 不用等
+            for s, gen in due:
+                try:
+                    self._run_due(s, gen)
+                except Exception:
+                    logger.exception("schedule %s: tick failed", s.schedule_id)
+            self._save()
+
+    def _run_due(self, s: _Schedule, gen: int) -> None:
+        planned = s.next_due
+        assert planned is not None
+        now = time.time()
+        spec = s.spec
+        owed, nxt = _owed_since(spec, planned, now)
+
+        grace = min(MISFIRE_GRACE_S, spec.every_s) if spec.every_s is not None else MISFIRE_GRACE_S
+        late = now - planned > grace
+        if not late:
+            runs = owed
+        elif spec.catch_up == "none":
+            runs = 0
+        elif spec.catch_up == "one":
+            runs = 1
+        else:
+            runs = min(owed, _MAX_CATCH_UP)
+        if owed - runs > 0:
+            s.missed += owed - runs
+            _MISSED.inc(owed - runs)
+            logger.warning("schedule %s: %d trigger(s) missed (catch_up=%s)", s.schedule_id, owed - runs, spec.catch_up)
+        for _ in range(runs):
+            self._fire(s, planned, check_overlap=spec.on_overlap == "skip")
+
+        with self._cond:
+            if s.gen != gen or self._schedules.get(s.schedule_id) is not s:
+                return  # 触发期间被暂停 / spec 改了：新的条目已经压进堆了
+            s.next_due = nxt
+            self._push_locked(s)
+            self._dirty = True
+
+    def _fire(self, s: _Schedule, planned: float, *, check_overlap: bool) -> Tuple[Optional[str], str]:
+        # 先把已经结束的 run 从 active 里去掉，再看有没有超过 max_overlap
+        active = [rid for rid in list(s.active) if self._unfinished(rid)]
+        if check_overlap and len(active) >= s.spec.max_overlap:
+            with self._cond:
+                s.active, s.skipped = active, s.skipped + 1
+            _SKIPPED.inc()
+            logger.info("schedule %s: skipped, %d run(s) still active (max_overlap=%d)", s.schedule_id, len(active), s.spec.max_overlap)
+            return None, "skipped_overlap"
+        try:
+            spec = self._registry.get(s.script_id)
+            params = spec.validate_params(s.spec.params)
+            script_path = self._registry.resolve_script_path(spec.entry)
+            if not script_path.exists():
+                raise FileNotFoundError(f"Script file not found: {script_path}")
+            run_id = self._scheduler.submit(
+                spec=spec,
+                script_path=script_path,
+                params=params,
+                cwd=self._registry.resolve_cwd(spec.cwd),
+            )
+        except (KeyError, ParamError, FileNotFoundError, ValueError) as e:
+            with self._cond:
+                s.active, s.errors, s.last_error = active, s.errors + 1, str(e).strip("'\"")
+            _ERROR.inc()
+            logger.warning("schedule %s: trigger failed: %s", s.schedule_id, e)
+            return None, "error"
+        with self._cond:
+            s.active = active + [run_id]
+            s.fired += 1
+            s.last_fire_at = planned
+            s.last_run_id = run_id
+            s.last_error = None
+            self._dirty = True
+        _FIRED.inc()
+        logger.info("schedule %s fired run %s", s.schedule_id, run_id)
+        return run_id, "fired"
+
+    def _unfinished(self, run_id: str) -> bool:
+        rec = self._store.peek_run(run_id)
+        return rec is not None and rec.finished_at is None
+
+    # ---- 状态文件 ----
+
+    def _load_state(self) -> Dict[str, dict]:
+        if self._state_path is None or not self._state_path.exists():
+            return {}
+        try:
+            data = json.loads(self._state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable schedule state %s: %s", self._state_path, e)
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _save(self, *, force: bool = False) -> None:
+        if self._state_path is None:
+            with self._cond:
+                self._dirty = False
+            return
+        with self._cond:
+            if not self._dirty or (not force and time.monotonic() - self._last_save < _SAVE_EVERY_S):
+                return
+            data = {
+                sid: {"expr": s.spec.expr, "next_due": s.next_due, "last_fire_at": s.last_fire_at, "paused": s.paused}
+                for sid, s in self._schedules.items()
+            }
+            data.update({sid: v for sid, v in self._saved.items() if sid not in data})  # 还没加载的脚本（比如 spec 暂时坏了）别丢
+            self._dirty = False
+            self._last_save = time.monotonic()
+        tmp = self._state_path.with_suffix(".tmp")
+        try:
+            self._state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(data, indent=1, sort_keys=True), encoding="utf-8")
+            os.replace(tmp, self._state_path)  # 原子替换，写到一半崩了也不会留下半个文件
+        except OSError as e:
+            logger.warning("Failed to save schedule state %s: %s", self._state_path, e)
+
+
+def _owed_since(spec: ScheduleSpec, planned: float, now: float) -> Tuple[int, Optional[float]]:
+    """
+    (triggers owed, next fire time) for a trigger planned at `planned` handled at
+    `now`: the planned one plus every later one up to `now` (downtime, a stuck
+    thread, a sleeping machine). The next fire time is always after `now`.
+    """
+    if spec.every_s is not None:
+        owed = math.floor((now - planned) / spec.every_s) + 1 if now >= planned else 1
+        return owed, planned + owed * spec.every_s
+    nxt = spec.next_after(planned)
+    owed = 1
+    while nxt is not None and nxt <= now and owed < _MAX_OWED_STEPS:
+        owed += 1
+        nxt = spec.next_after(nxt)
+    if nxt is not None and nxt <= now:
+        # 停机太久（比如每分钟一次的 cron 停了两天）：不再一步步数，剩下的按前面的平均间隔估一个数，
+        # 下一次直接从现在往后算，否则 nxt 还在过去，每个 tick 都会被当成到期再补一次
+        avg = (nxt - planned) / owed
+        owed += int((now - nxt) / avg) + 1 if avg > 0 else 1
+        nxt = spec.next_after(now)
+    return owed, nxt
+
+
+def _fmt(ts: Optional[float]) -> str:
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts is not None else "never"
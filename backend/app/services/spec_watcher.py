@@ -0,0 +1,197 @@
+# 监视 script_specs/ 目录，有变化就让 registry 增量刷新（只重新解析改过的文件）。
+# Linux 上用 inotify（ctypes 直接调 libc，不需要额外依赖），其它平台 / inotify 不可用时退回定时 stat 轮询。
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Set
+
+from app.services.registry import ScriptRegistry
+
+logger = logging.getLogger("app.spec_watcher")
+
+# <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+# 编辑器保存一般是“写临时文件再 rename”，MOVED_TO 就够了；直接覆盖写的看 CLOSE_WRITE
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_ATTRIB | _IN_MODIFY | _IN_DELETE_SELF | _IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class _Inotify:
+    """Minimal inotify binding for one directory."""
+
+    def __init__(self, path: Path) -> None:
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._libc = libc
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(str(path)), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err))
+
+    def read(self, timeout_s: float) -> Optional[Set[str]]:
+        """
+        Names touched since the last call ({} on timeout).
+        None means "rescan everything": queue overflow, or the directory itself went away.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout_s)
+        if not ready:
+            return set()
+        names: Set[str] = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            off = 0
+            while off + _EVENT_HEADER.size <= len(buf):
+                _wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, off)
+                off += _EVENT_HEADER.size
+                name = buf[off:off + length].rstrip(b"\0").decode("utf-8", "replace")
+                off += length
+                if mask & (_IN_Q_OVERFLOW | _IN_IGNORED | _IN_DELETE_SELF | _IN_MOVE_SELF):
+                    return None
+                if name:
+                    names.add(name)
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class SpecWatcher:
+    """
+    Background thread that keeps a ScriptRegistry in sync with specs_dir.
+
+    - mode "inotify": wait for directory events, collect the touched file names
+      for `debounce_s` (editors write in several steps), then refresh only those.
+      A full stat() rescan still runs every `poll_interval_s * 10` as a safety net.
+    - mode "poll": refresh() every `poll_interval_s`; refresh only stat()s files
+      and re-parses the ones whose content hash changed.
+    - mode "auto": inotify when available, else poll.
+    """
+
+    def __init__(
+        self,
+        registry: ScriptRegistry,
+        *,
+        mode: str = "auto",
+        poll_interval_s: float = 2.0,
+        debounce_s: float = 0.2,
+    ) -> None:
+        if mode not in ("auto", "inotify", "poll"):
+            raise ValueError(f"Unknown spec watch mode: {mode!r} (expected 'auto', 'inotify', 'poll' or 'off')")
+        self._registry = registry
+        self._dir = registry.specs_dir
+        self._mode = mode
+        self._poll_interval_s = max(0.1, float(poll_interval_s))
+        self._debounce_s = max(0.0, float(debounce_s))
+        self._stop = threading.Event()
+        self._inotify: Optional[_Inotify] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._inotify is not None else "poll"
+
+    def start(self) -> None:
+        if self._mode != "poll":
+            try:
+                self._inotify = _Inotify(self._dir)
+            except OSError as e:
+                if self._mode == "inotify":
+                    raise
+                logger.info("inotify unavailable for %s (%s), polling every %ss", self._dir, e, self._poll_interval_s)
+        target = self._inotify_loop if self._inotify is not None else self._poll_loop
+        self._thread = threading.Thread(target=target, name="spec-watcher", daemon=True)
+        self._thread.start()
+        logger.info("Watching %s for spec changes (%s)", self._dir, self.mode)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _refresh(self, names: Optional[Set[str]]) -> None:
+        try:
+            if names is None:
+                self._registry.refresh()
+            else:
+                self._registry.refresh([self._dir / n for n in names])
+        except Exception:
+            logger.exception("spec refresh failed")
+
+    def _poll_loop(self) -> None:
+        while not self._stop.wait(self._poll_interval_s):
+            self._refresh(None)
+
+    def _inotify_loop(self) -> None:
+        assert self._inotify is not None
+        rescan_every = self._poll_interval_s * 10
+        last_rescan = time.monotonic()
+        while not self._stop.is_set():
+            names = self._inotify.read(timeout_s=1.0)
+            if names is not None and not names:
+                if time.monotonic() - last_rescan >= rescan_every:
+                    self._refresh(None)
+                    last_rescan = time.monotonic()
+                continue
+            if names is not None:
+                # 攒一小会儿：一次保存往往是 create + modify + close_write 好几个事件
+                deadline = time.monotonic() + self._debounce_s
+                while names is not None and time.monotonic() < deadline:
+                    more = self._inotify.read(timeout_s=max(0.0, deadline - time.monotonic()))
+                    names = None if more is None else names | more
+            if names is None:
+                # 目录被删 / 换掉了，或者事件队列溢出：全量 stat 一遍，再重新挂 watch
+                self._refresh(None)
+                last_rescan = time.monotonic()
+                self._rewatch()
+            else:
+                self._refresh(names)
+
+    def _rewatch(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        while not self._stop.is_set():
+            try:
+                self._inotify = _Inotify(self._dir)
+                self._refresh(None)  # 重新挂上之前的变化也要补上
+                return
+            except OSError:
+                # 目录暂时不在：等它回来
+                self._stop.wait(self._poll_interval_s)
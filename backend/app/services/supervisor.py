@@ -0,0 +1,223 @@
+# 进程监督：所有子进程的“超时 / 退出通知 / 杀进程”集中到一个线程里。
+# 以前超时只在脚本有新输出时才检查（一个卡住、不输出的脚本永远不会被杀），
+# stop 则在 HTTP 请求线程里 sleep(0.05) 轮询 proc.poll()。现在：
+#   - 超时、stop 之后的“宽限期到了就 SIGKILL”都是最小堆里的一个截止时间，到点就触发；
+#   - 进程退出靠 pidfd（Linux 5.3+）挂在 epoll 上通知，没有 pidfd 时每个进程一个阻塞在 waitid 上的线程；
+#   - 子进程用 start_new_session=True 启动，自己是进程组组长，杀的时候连孙进程一起杀。
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import os
+import selectors
+import signal
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from app.services.resources import wait_exited
+
+logger = logging.getLogger("app.supervisor")
+
+ExitCallback = Callable[[int], None]
+DataCallback = Callable[[bytes], None]  # b"" = EOF（fd 已经关掉）
+
+
+def kill_group(pid: int, sig: int = signal.SIGKILL) -> bool:
+    """
+    Signal the process group led by `pid` (or just `pid` if it is not a group leader).
+    Returns False if the process is already gone (reaped).
+    """
+    try:
+        if os.getpgid(pid) == pid:
+            os.killpg(pid, sig)
+        else:
+            os.kill(pid, sig)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+class ProcessSupervisor:
+    """
+    One thread that owns every child's timers and exit notifications.
+
+    - call_later/call_at(key, ...) put a deadline on a min-heap; setting the same key
+      again replaces it, cancel(key) drops it (lazy deletion, O(log n) either way).
+    - watch(pid, fn) calls fn(pid) once the child has exited but before it is reaped,
+      so the caller can still signal its process group and read /proc.
+    - add_reader(fd, fn) feeds whatever arrives on a non-blocking fd to fn (the runs'
+      event pipes), then fn(b"") once at EOF; the supervisor closes the fd.
+    - Callbacks run on the supervisor thread: keep them short (signal, log, set an Event).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # heap 里放 (at, seq, key)；_deadlines[key] = (seq, fn)，seq 对不上的就是被取消 / 覆盖的旧条目
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._deadlines: Dict[Hashable, Tuple[int, Callable[[], None]]] = {}
+        self._seq = itertools.count()
+        self._todo: List[Callable[[], None]] = []  # 要在 supervisor 线程里做的注册（selector 不是线程安全的）
+        self._closed = False
+        self.stats = {"watched": 0, "exits": 0, "deadlines_fired": 0, "pidfd": hasattr(os, "pidfd_open")}
+
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, None)
+
+        self._thread = threading.Thread(target=self._loop, name="process-supervisor", daemon=True)
+        self._thread.start()
+
+    # ---- deadlines ----
+
+    def call_at(self, key: Hashable, at: float, fn: Callable[[], None]) -> None:
+        """Run fn() at time.monotonic() >= at, replacing any deadline already set for `key`."""
+        with self._lock:
+            seq = next(self._seq)
+            self._deadlines[key] = (seq, fn)
+            first = not self._heap or at < self._heap[0][0]
+            heapq.heappush(self._heap, (at, seq, key))
+            if len(self._heap) > 2 * len(self._deadlines) + 64:
+                # 取消得多的时候堆里全是死条目，重建一次
+                self._heap = [e for e in self._heap if self._deadlines.get(e[2], (None,))[0] == e[1]]
+                heapq.heapify(self._heap)
+        if first:
+            self._wake()  # 新的最早截止时间：让 select 提前醒
+
+    def call_later(self, key: Hashable, delay_s: float, fn: Callable[[], None]) -> None:
+        self.call_at(key, time.monotonic() + max(0.0, float(delay_s)), fn)
+
+    def cancel(self, *keys: Hashable) -> None:
+        with self._lock:
+            for key in keys:
+                self._deadlines.pop(key, None)
+
+    # ---- exits ----
+
+    def watch(self, pid: int, fn: ExitCallback) -> None:
+        """Call fn(pid) once child `pid` exits (it stays a zombie until its owner reaps it)."""
+        with self._lock:
+            self.stats["watched"] += 1
+        if self.stats["pidfd"]:
+            with self._lock:
+                self._todo.append(lambda: self._register(pid, fn))
+            self._wake()
+            return
+        # 没有 pidfd：阻塞在 waitid(WNOWAIT) 上等，不回收、也不轮询
+        threading.Thread(target=self._wait_thread, args=(pid, fn), name=f"wait-{pid}", daemon=True).start()
+
+    def add_reader(self, fd: int, fn: DataCallback) -> None:
+        """Call fn(chunk) for data on `fd` (must be non-blocking), fn(b"") at EOF; the fd is closed afterwards."""
+        with self._lock:
+            self._todo.append(lambda: self._sel.register(fd, selectors.EVENT_READ, ("fd", fd, fn)))
+        self._wake()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._wake()
+
+    # ---- internals ----
+
+    def _wake(self) -> None:
+        try:
+            os.write(self._wake_w, b"\0")
+        except (BlockingIOError, OSError):
+            pass  # pipe 满了说明已经有人叫醒过了
+
+    def _wait_thread(self, pid: int, fn: ExitCallback) -> None:
+        wait_exited(pid)
+        self._exited(pid, fn)
+
+    def _exited(self, pid: int, fn: ExitCallback) -> None:
+        with self._lock:
+            self.stats["exits"] += 1
+        try:
+            fn(pid)
+        except Exception:
+            logger.exception("exit callback failed for pid %s", pid)
+
+    def _register(self, pid: int, fn: ExitCallback) -> None:
+        try:
+            fd = os.pidfd_open(pid)
+        except OSError:
+            # 已经被回收了（ESRCH）：直接当作退出
+            self._exited(pid, fn)
+            return
+        self._sel.register(fd, selectors.EVENT_READ, ("pid", pid, fn))
+
+    def _read(self, fd: int, fn: DataCallback) -> None:
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._sel.unregister(fd)
+            os.close(fd)
+        try:
+            fn(data)
+        except Exception:
+            logger.exception("reader callback failed for fd %s", fd)
+
+    def _due(self) -> Tuple[List[Callable[[], None]], Optional[float]]:
+        # 取出到点的回调 + 下一次该醒的时间（None = 没有截止时间，一直等到有事件）
+        now = time.monotonic()
+        fns: List[Callable[[], None]] = []
+        with self._lock:
+            while self._heap:
+                at, seq, key = self._heap[0]
+                cur = self._deadlines.get(key)
+                if cur is None or cur[0] != seq:
+                    heapq.heappop(self._heap)
+                    continue
+                if at > now:
+                    return fns, at - now
+                heapq.heappop(self._heap)
+                del self._deadlines[key]
+                fns.append(cur[1])
+            return fns, None
+
+    def _loop(self) -> None:
+        while True:
+            with self._lock:
+                if self._closed:
+                    break
+                todo, self._todo = self._todo, []
+            for op in todo:
+                op()
+
+            fns, timeout = self._due()
+            for fn in fns:
+                self.stats["deadlines_fired"] += 1
+                try:
+                    fn()
+                except Exception:
+                    logger.exception("supervisor deadline callback failed")
+            if fns:
+                continue  # 回调里可能又设了新的截止时间，重新算
+
+            for key, _ in self._sel.select(timeout):
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                kind, arg, fn = key.data
+                if kind == "fd":
+                    self._read(key.fd, fn)
+                    continue
+                self._sel.unregister(key.fd)
+                os.close(key.fd)
+                self._exited(arg, fn)
+
+        for key in list(self._sel.get_map().values()):
+            if key.data is not None:
+                os.close(key.fd)
+        self._sel.close()
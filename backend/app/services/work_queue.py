@@ -0,0 +1,315 @@
+# 多机执行：API 只负责把 run 放进 Redis 里的共享队列，真正执行的是若干个 runner 节点（runner_node.py）。
+#
+# key 布局（和 RedisStateStore 共用 prefix）：
+#   ap:queue                 zset  等待执行的 run_id，score 越小越先出（优先级 + 提交时间）
+#   ap:queue:wake            list  有新 job 时推一个 token，空闲节点 BLPOP 在这上面等
+#   ap:job:<run_id>          hash  执行需要的参数（script_id / params / score），run 结束才删，节点挂了靠它重新入队
+#   ap:nodes                 set   注册过的节点
+#   ap:node:<id>             hash  节点信息（host / pid / capacity / last_seen）
+#   ap:node:<id>:alive       str   心跳，带过期时间；key 没了 = 节点挂了
+#   ap:node:<id>:runs        set   这个节点领走、还没结束的 run（和出队在同一个事务里加进来）
+#   ap:node:<id>:control     list  发给节点的控制消息（目前只有 stop）
+from __future__ import annotations
+
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.schemas.script import RunStatus
+from app.services.registry import ScriptSpec
+from app.storage.redis_store import RedisStateStore
+
+logger = logging.getLogger("app.work_queue")
+
+# score = -priority * _PRIORITY_STEP + 提交时间（秒）。priority 截到 ±_MAX_PRIORITY，
+# 这样 score 不超过 1e13，double 的精度还能分辨毫秒级的先后。
+_PRIORITY_STEP = 1e10
+_MAX_PRIORITY = 1000
+_WAKE_MAX = 64  # wake list 最多留这么多 token：没人等的时候别一直涨
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+
+
+class RedisWorkQueue:
+    """
+    Shared run queue + node registry on Redis (no Lua, works with fakeredis).
+
+    A job leaves `ap:queue` and enters `ap:node:<id>:runs` in one MULTI (WATCH on
+    the queue), and its payload stays in `ap:job:<run_id>` until the node releases
+    it: a node dying at any point leaves the run where the reaper can find it.
+    """
+
+    def __init__(self, client: Any, *, prefix: str = "ap:") -> None:
+        self.client = client
+        self._p = prefix
+
+    # ---- jobs ----
+
+    def push(self, run_id: str, *, script_id: str, params: dict, priority: int = 0) -> None:
+        prio = max(-_MAX_PRIORITY, min(_MAX_PRIORITY, int(priority)))
+        score = -prio * _PRIORITY_STEP + time.time()
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(
+            self._job_key(run_id),
+            mapping={"script_id": script_id, "params": json.dumps(params), "priority": prio, "score": score},
+        )
+        pipe.zadd(f"{self._p}queue", {run_id: score})
+        self._wake(pipe)
+        pipe.execute()
+
+    def pop(self, node_id: str, timeout_s: float = 1.0) -> Optional[Dict[str, Any]]:
+        """Claim the best job for `node_id` (waiting up to timeout_s for one); None on timeout."""
+        job = self._take(node_id)
+        if job is None:
+            # 队列空：等 push 推的 token。token 可能是别的节点已经领走的 job 留下的，那就白醒一次
+            self.client.blpop(f"{self._p}queue:wake", timeout=timeout_s)
+            job = self._take(node_id)
+        return job
+
+    def _take(self, node_id: str) -> Optional[Dict[str, Any]]:
+        from redis.exceptions import WatchError
+
+        queue_key = f"{self._p}queue"
+        runs_key = f"{self._node_key(node_id)}:runs"
+        while True:
+            with self.client.pipeline(transaction=True) as pipe:
+                try:
+                    pipe.watch(queue_key)
+                    head = pipe.zrange(queue_key, 0, 0)
+                    if not head:
+                        return None
+                    run_id = head[0]
+                    # 出队和记到节点名下在同一个事务里：中间挂掉不会有“哪儿都找不到”的 run
+                    pipe.multi()
+                    pipe.zrem(queue_key, run_id)
+                    pipe.sadd(runs_key, run_id)
+                    pipe.hgetall(self._job_key(run_id))
+                    _, _, job = pipe.execute()
+                except WatchError:
+                    continue  # 别的节点 / push / cancel 动了队列，重来
+            if not job:
+                # 被 cancel 删了 payload（ZREM 和 DELETE 之间）：这个 run 已经不归我们管
+                self.client.srem(runs_key, run_id)
+                continue
+            return {
+                "run_id": run_id,
+                "script_id": job["script_id"],
+                "params": json.loads(job.get("params") or "{}"),
+                "priority": int(job.get("priority") or 0),
+            }
+
+    def requeue(self, run_id: str) -> bool:
+        """Put a claimed-but-never-started job back at its original place; False if its payload is gone."""
+        score = self.client.hget(self._job_key(run_id), "score")
+        if score is None:
+            return False
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zadd(f"{self._p}queue", {run_id: float(score)})
+        self._wake(pipe)
+        pipe.execute()
+        return True
+
+    def cancel(self, run_id: str) -> bool:
+        # ZREM 返回 1 才算取消成功：和节点的出队事务抢，谁先拿到算谁的
+        if not self.client.zrem(f"{self._p}queue", run_id):
+            return False
+        self.client.delete(self._job_key(run_id))
+        return True
+
+    def position(self, run_id: str) -> Optional[int]:
+        return self.client.zrank(f"{self._p}queue", run_id)
+
+    def size(self) -> int:
+        return int(self.client.zcard(f"{self._p}queue"))
+
+    # ---- nodes ----
+
+    def heartbeat(self, node_id: str, info: Dict[str, Any], ttl_s: float) -> None:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.sadd(f"{self._p}nodes", node_id)
+        pipe.hset(self._node_key(node_id), mapping={**info, "last_seen": time.time()})
+        pipe.set(f"{self._node_key(node_id)}:alive", 1, px=max(1, int(ttl_s * 1000)))
+        pipe.execute()
+
+    def release(self, node_id: str, run_id: str) -> None:
+        # run 结束了：payload 也不用再留着重新入队了
+        pipe = self.client.pipeline(transaction=True)
+        pipe.srem(f"{self._node_key(node_id)}:runs", run_id)
+        pipe.delete(self._job_key(run_id))
+        pipe.execute()
+
+    def leave(self, node_id: str) -> List[str]:
+        """
+        Unregister a node that is shutting down and return the runs still on its
+        list; the caller settles them (recover_node_runs) instead of leaving them
+        `running` with nobody to reap them.
+        """
+        self.client.srem(f"{self._p}nodes", node_id)
+        return self._drop(node_id)
+
+    def nodes(self) -> List[Dict[str, Any]]:
+        ids = sorted(self.client.smembers(f"{self._p}nodes"))
+        if not ids:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        for nid in ids:
+            pipe.hgetall(self._node_key(nid))
+            pipe.exists(f"{self._node_key(nid)}:alive")
+            pipe.scard(f"{self._node_key(nid)}:runs")
+        res = pipe.execute()
+        out = []
+        for i, nid in enumerate(ids):
+            info, alive, running = res[3 * i], res[3 * i + 1], res[3 * i + 2]
+            out.append({**info, "node_id": nid, "alive": bool(alive), "running": int(running)})
+        return out
+
+    def reap(self, node_id: str) -> Optional[List[str]]:
+        """
+        Remove a node whose heartbeat expired and return its runs.
+        Only one caller wins (SREM returns 1), so several reapers don't double-fail runs.
+        """
+        if self.client.exists(f"{self._node_key(node_id)}:alive"):
+            return None
+        if not self.client.srem(f"{self._p}nodes", node_id):
+            return None
+        return self._drop(node_id)
+
+    def send_control(self, node_id: str, msg: Dict[str, Any]) -> None:
+        self.client.rpush(f"{self._node_key(node_id)}:control", json.dumps(msg))
+
+    def read_control(self, node_id: str, timeout_s: float = 1.0) -> Optional[Dict[str, Any]]:
+        item = self.client.blpop(f"{self._node_key(node_id)}:control", timeout=timeout_s)
+        return json.loads(item[1]) if item else None
+
+    def _drop(self, node_id: str) -> List[str]:
+        node_key = self._node_key(node_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.smembers(f"{node_key}:runs")
+        pipe.delete(f"{node_key}:runs", node_key, f"{node_key}:alive", f"{node_key}:control")
+        runs, _ = pipe.execute()
+        return sorted(runs)
+
+    def _wake(self, pipe: Any) -> None:
+        pipe.lpush(f"{self._p}queue:wake", 1)
+        pipe.ltrim(f"{self._p}queue:wake", 0, _WAKE_MAX - 1)
+
+    def _job_key(self, run_id: str) -> str:
+        return f"{self._p}job:{run_id}"
+
+    def _node_key(self, node_id: str) -> str:
+        return f"{self._p}node:{node_id}"
+
+
+def recover_node_runs(queue: RedisWorkQueue, store: RedisStateStore, node_id: str, runs: List[str], why: str) -> int:
+    """
+    Settle the runs a node left behind: never started (still `queued`) -> back on
+    the queue; already running -> failed. Returns how many runs were failed.
+    """
+    failed = 0
+    for run_id in runs:
+        rec = store.peek_run(run_id)
+        if rec is None or rec.status not in (RunStatus.queued, RunStatus.running):
+            queue.release(node_id, run_id)
+            continue
+        if rec.status == RunStatus.queued and queue.requeue(run_id):
+            store.append_log(run_id, f"[reaper] runner node {node_id} {why} before starting the run, requeued\n")
+            store.release_run(run_id)  # 下一个领到它的节点来写（不是自己的 run 时什么都不做）
+            continue
+        store.append_log(run_id, f"[reaper] runner node {node_id} {why}\n")
+        store.set_failure_reason(run_id, f"runner node {node_id} lost")
+        store.finish_run(run_id, status=RunStatus.failed, returncode=None)
+        queue.release(node_id, run_id)
+        failed += 1
+    return failed
+
+
+def reap_dead_nodes(queue: RedisWorkQueue, store: RedisStateStore) -> int:
+    """Settle the runs of every node whose heartbeat expired. Returns how many runs were failed."""
+    failed = 0
+    for node in queue.nodes():
+        if node["alive"]:
+            continue
+        runs = queue.reap(node["node_id"])
+        if runs is None:
+            continue
+        logger.warning("runner node %s lost its heartbeat (%s runs)", node["node_id"], len(runs))
+        failed += recover_node_runs(queue, store, node["node_id"], runs, "stopped sending heartbeats")
+    return failed
+
+
+class QueueScheduler:
+    """
+    API-side scheduler for multi-node mode (AP_RUN_MODE=queue).
+
+    - submit() records the run as `queued` in Redis and pushes it on the shared
+      queue; runner nodes pull jobs whenever they have free capacity.
+    - stop() cancels a queued run directly, or asks the owning node to stop it.
+    - A reaper thread fails the runs of nodes whose heartbeat expired.
+    Global and per-script concurrency caps are enforced per node.
+    """
+
+    def __init__(self, *, queue: RedisWorkQueue, store: RedisStateStore, reap_interval_s: float = 5.0) -> None:
+        self._queue = queue
+        self._store = store
+        self._reap_interval_s = max(0.5, float(reap_interval_s))
+        self._reaper = threading.Thread(target=self._reap_loop, name="node-reaper", daemon=True)
+        self._reaper.start()
+
+    def submit(
+        self,
+        *,
+        spec: ScriptSpec,
+        script_path: Path,
+        params: dict,
+        cwd: Optional[Path] = None,
+        priority: int = 0,
+    ) -> str:
+        # script_path / cwd 由节点按自己的 registry 解析（各节点是同一份代码 checkout）
+        run_id = str(uuid.uuid4())
+        self._store.create_run(run_id=run_id, script_id=spec.script_id, pid=None, status=RunStatus.queued)
+        # API 只是创建者，不执行：先把记录交回 Redis，节点 adopt 之后由节点来写
+        self._store.release_run(run_id)
+        self._queue.push(run_id, script_id=spec.script_id, params=params, priority=priority)
+        return run_id
+
+    def queue_position(self, run_id: str) -> Optional[int]:
+        return self._queue.position(run_id)
+
+    def stop(self, run_id: str) -> bool:
+        if self._queue.cancel(run_id):
+            self._store.append_log(run_id, "[scheduler] cancelled while queued\n")
+            self._store.finish_run(run_id, status=RunStatus.stopped, returncode=None)
+            return True
+        rec = self._store.peek_run(run_id)
+        if rec is None or rec.status not in (RunStatus.queued, RunStatus.running) or not rec.node:
+            return False
+        self._queue.send_control(rec.node, {"op": "stop", "run_id": run_id})
+        return True
+
+    def stats(self) -> dict:
+        nodes = self._queue.nodes()
+        return {
+            "mode": "queue",
+            "queued": self._queue.size(),
+            "running": sum(n["running"] for n in nodes),
+            "nodes": nodes,
+        }
+
+    def script_stats(self, spec: ScriptSpec) -> Optional[dict]:
+        # 耗时统计在每个 runner 节点的 RunScheduler 里各记各的（自适应超时也按节点算），API 这边没有
+        return None
+
+    def _reap_loop(self) -> None:
+        while True:
+            time.sleep(self._reap_interval_s)
+            try:
+                reap_dead_nodes(self._queue, self._store)
+            except Exception:
+                logger.exception("node reaper failed")
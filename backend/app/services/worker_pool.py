@@ -0,0 +1,450 @@
+# 预热进程池：给“短、频繁”的脚本省掉每次 `python -u script.py` 的冷启动。
+# 池里的 worker 启动时先把常用模块 import 好（preload），之后每个 run 用 runpy 在 worker 里执行 entry。
+# 脚本在 spec 里写 `execution: pool` 才会走这里，默认仍然是 RunnerService 的 Popen。
+from __future__ import annotations
+
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Set
+
+from app.core.metrics import SPAWN_SECONDS
+from app.schemas.script import RunStatus
+from app.services.log_ingest import CHUNK_SIZE, COALESCE_S, SMALL_READ_BYTES, LineSplitter
+from app.services.pool_worker import MARKER
+from app.services.params import ParamsDelivery, prepare_params
+from app.services.resources import ResourceLimits, ResourceSampler
+from app.services.run_events import EVENTS_VIA_ENV, POOL_EVENT_PREFIX, SDK_DIR, ProgressTracker
+from app.services.runner import FinishListener
+from app.services.supervisor import ProcessSupervisor, kill_group
+from app.storage.state_store import StateStore
+
+logger = logging.getLogger("app.worker_pool")
+
+_WORKER_SCRIPT = Path(__file__).with_name("pool_worker.py")
+_SPAWN = SPAWN_SECONDS.labels("pool")  # 池里没有 fork，只算把 job 写给 worker 的时间
+
+
+def read_rss_mb(pid: int) -> Optional[float]:
+    # /proc/<pid>/status 里的 VmRSS 单位是 kB。非 Linux 或进程已退出时返回 None。
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="ascii", errors="replace") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError, IndexError):
+        return None
+    return None
+
+
+@dataclass
+class PoolJob:
+    run_id: str
+    script_id: str
+    script_path: Path
+    params: dict
+    cwd: Optional[Path]
+    env: Optional[dict[str, str]]
+    timeout_s: Optional[float]
+    params_via: str = "argv"
+    limits: Optional[ResourceLimits] = None  # worker 是共用的，不能 setrlimit，只靠采样器检查
+    delivery: Optional[ParamsDelivery] = None  # 分配给 worker 时才准备（可能要写临时文件）
+    tracker: Optional[ProgressTracker] = None  # 脚本的进度事件（MARKER + "EVENT {...}" 控制行）
+
+
+@dataclass(eq=False)
+class _Worker:
+    proc: subprocess.Popen
+    job: Optional[PoolJob] = None
+    runs: int = 0
+    preload_gen: int = 0  # 启动时用的是第几版 preload；对不上的空闲后就换掉
+    stopping: bool = False
+    timed_out: bool = False
+    exited: threading.Event = field(default_factory=threading.Event)
+
+
+class WorkerPool:
+    """
+    Pool of pre-warmed Python worker processes.
+
+    - Same start/stop/add_listener contract as RunnerService; a run's pid is the worker's pid.
+    - Jobs wait in a small backlog until a worker is idle.
+    - A worker is recycled after `max_runs_per_worker` jobs or once its RSS exceeds `max_rss_mb`.
+    - stop / timeout kill the whole worker; a fresh one is forked to keep the pool at `size`.
+    - Workers only exist while the pool is `active` (some spec uses `execution: pool`);
+      reconfigure() follows registry reloads: it warms up, winds down, or replaces
+      workers that were started with an outdated preload list.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        *,
+        size: int,
+        preload: List[str] | None = None,
+        max_runs_per_worker: int = 100,
+        max_rss_mb: float = 512.0,
+        sampler: Optional[ResourceSampler] = None,
+        supervisor: Optional[ProcessSupervisor] = None,
+        active: bool = True,
+    ) -> None:
+        self._store = store
+        self._sampler = sampler
+        self._sup = supervisor or ProcessSupervisor()  # job 超时、stop 的宽限期都挂在它的截止时间堆上
+        self._size = max(1, int(size))
+        self._preload = sorted(set(preload or []))
+        self._preload_gen = 0
+        self._active = bool(active)
+        self._max_runs = max(1, int(max_runs_per_worker))
+        self._max_rss_mb = float(max_rss_mb)
+
+        self._lock = threading.Lock()
+        self._workers: Set[_Worker] = set()
+        self._idle: Deque[_Worker] = deque()
+        self._backlog: Deque[PoolJob] = deque()
+        self._by_run: Dict[str, _Worker] = {}
+        self._listeners: List[FinishListener] = []
+        self._closed = False
+
+        with self._lock:
+            self._fill_locked()
+
+        logger.info("Worker pool started (size=%s preload=%s active=%s)", self._size, self._preload, self._active)
+
+    def reconfigure(self, *, preload: List[str], active: bool) -> None:
+        """Apply a new preload list / on-off state (registry reload); busy workers are replaced after their job."""
+        preload = sorted(set(preload))
+        with self._lock:
+            if preload == self._preload and active == self._active:
+                return
+            if preload != self._preload:
+                self._preload = preload
+                self._preload_gen += 1
+            self._active = active
+            # 空闲的马上换掉；在跑的等 job 结束（_on_job_done）再换
+            for w in list(self._idle):
+                if self._outdated_locked(w):
+                    self._idle.remove(w)
+                    self._retire(w)
+            self._fill_locked()
+        logger.info("Worker pool reconfigured (preload=%s active=%s)", preload, active)
+
+    def add_listener(self, fn: FinishListener) -> None:
+        self._listeners.append(fn)
+
+    def start(
+        self,
+        *,
+        script_id: str,
+        script_path: Path,
+        params: dict,
+        cwd: Optional[Path] = None,
+        env: Optional[dict[str, str]] = None,
+        timeout_s: Optional[float] = None,
+        run_id: Optional[str] = None,
+        params_via: str = "argv",
+        limits: Optional[ResourceLimits] = None,
+    ) -> str:
+        if run_id is None:
+            run_id = str(uuid.uuid4())
+            self._store.create_run(run_id=run_id, script_id=script_id, pid=None, status=RunStatus.queued)
+
+        job = PoolJob(
+            run_id=run_id,
+            script_id=script_id,
+            script_path=script_path,
+            params=params,
+            cwd=cwd,
+            env=env,
+            timeout_s=timeout_s,
+            params_via=params_via,
+            limits=limits,
+        )
+        with self._lock:
+            self._backlog.append(job)
+            if not self._active:
+                # 刚好赶上 registry 重载把池关掉：还是用池跑，按需拉起来
+                self._active = True
+                self._fill_locked()
+            self._assign_locked()
+        return run_id
+
+    def stop(self, run_id: str, *, kill_after_s: float = 2.0) -> bool:
+        with self._lock:
+            w = self._by_run.get(run_id)
+            if w is None:
+                job = next((j for j in self._backlog if j.run_id == run_id), None)
+                if job is None:
+                    return False
+                self._backlog.remove(job)
+            else:
+                # 没法只停 worker 里的某个脚本，所以整个 worker 一起结束，reader 会补一个新的。
+                # 信号要在锁里发：锁一放，DONE 可能先到，worker 接了下一个 job，杀的就是别人了。
+                # 不在这里等：宽限期到了还没退出由 supervisor 发 SIGKILL，最终状态由 reader 线程写。
+                job = w.job
+                w.stopping = True
+                self._store.append_log(run_id, "[runner] stop requested\n")
+                try:
+                    kill_group(w.proc.pid, signal.SIGTERM)
+                except Exception as e:
+                    w.stopping = False
+                    self._store.append_log(run_id, f"[runner] terminate failed: {e}\n")
+                    return False
+
+        if w is None:
+            self._store.append_log(run_id, "[pool] cancelled before a worker was free\n")
+            self._finish(run_id, status=RunStatus.stopped, returncode=None)
+            return True
+
+        self._sup.call_later((w, "kill"), kill_after_s, lambda: self._kill_after_grace(run_id, w, job))
+        return True
+
+    def _kill_after_grace(self, run_id: str, w: _Worker, job: Optional[PoolJob]) -> None:
+        with self._lock:
+            if w.exited.is_set() or w.proc.returncode is not None:  # 已经回收的 pid 可能被复用
+                return
+            # 被 stop 的 worker 不会再接新 job（见 _on_job_done），这里只是防御
+            if w.job is not job and w.job is not None:
+                return
+            self._store.append_log(run_id, "[runner] terminate timeout -> kill\n")
+            kill_group(w.proc.pid, signal.SIGKILL)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+        for w in workers:
+            try:
+                w.proc.kill()
+            except Exception:
+                pass
+
+    # ---- internals ----
+
+    def _target_locked(self) -> int:
+        return self._size if self._active and not self._closed else 0
+
+    def _fill_locked(self) -> None:
+        for _ in range(self._target_locked() - len(self._workers)):
+            self._spawn_worker_locked()
+
+    def _outdated_locked(self, w: _Worker) -> bool:
+        return w.preload_gen != self._preload_gen or len(self._workers) > self._target_locked()
+
+    def _retire(self, w: _Worker) -> None:
+        # 关掉 stdin，worker 读到 EOF 自己退出；reader 线程收尾时按需补新的
+        try:
+            assert w.proc.stdin is not None
+            w.proc.stdin.close()
+        except Exception:
+            pass
+
+    def _spawn_worker_locked(self) -> None:
+        cmd = [sys.executable, "-u", str(_WORKER_SCRIPT), "--preload", ",".join(self._preload)]
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+            env={**os.environ, "PYTHONIOENCODING": "utf-8"},
+            start_new_session=True,  # 脚本在 worker 里拉起的子进程和 worker 同组，stop / 超时一起杀
+        )
+        w = _Worker(proc=proc, preload_gen=self._preload_gen)
+        self._workers.add(w)
+        t = threading.Thread(target=self._read_loop, args=(w,), name=f"pool-worker-{proc.pid}", daemon=True)
+        t.start()
+
+    def _assign_locked(self) -> None:
+        while self._backlog and self._idle:
+            w = self._idle.popleft()
+            job = self._backlog.popleft()
+            if job.delivery is None:
+                job.delivery = prepare_params(job.params, job.params_via)
+            msg = {
+                "run_id": job.run_id,
+                "script_path": str(job.script_path),
+                "argv": job.delivery.argv,
+                "stdin": job.delivery.stdin.decode("utf-8") if job.delivery.stdin is not None else None,
+                "cwd": str(job.cwd) if job.cwd else None,
+                # worker 里是在自己的环境上 update，所以这里不用像 RunnerService 那样合并 os.environ
+                # 没有单独的事件 pipe：ap_sdk 看到 AP_EVENTS_VIA=pool 就把事件当控制行写到 stdout
+                "env": {**(job.env or {}), **job.delivery.env, EVENTS_VIA_ENV: "pool"},
+                "path": [str(SDK_DIR)],  # 改 PYTHONPATH 对已经在跑的 worker 没用，直接加进 sys.path
+            }
+            job.tracker = ProgressTracker(self._store, job.run_id)
+            # 先登记再发：worker 的第一行输出可能比这里的代码先到 reader 线程
+            w.job = job
+            w.stopping = w.timed_out = False
+            t_spawn = time.perf_counter()
+            try:
+                assert w.proc.stdin is not None
+                data = memoryview(json.dumps(msg).encode("utf-8") + b"\n")
+                while data:  # bufsize=0：大 job 可能只写进去一部分
+                    data = data[w.proc.stdin.write(data):]
+            except (OSError, ValueError):
+                # worker 刚好挂了：job 放回去，等 reader 线程发现 EOF 再补 worker
+                w.job = None
+                self._backlog.appendleft(job)
+                continue
+
+            _SPAWN.observe(time.perf_counter() - t_spawn)
+            if job.timeout_s is not None:
+                self._sup.call_later((w, "timeout"), job.timeout_s, lambda w=w, job=job: self._on_timeout(w, job))
+            self._by_run[job.run_id] = w
+            self._store.mark_running(job.run_id, pid=w.proc.pid)
+            if self._sampler is not None:
+                # 记下 worker 当前的 CPU / IO 作为基数，这个 run 的用量 = 之后的增量
+                self._sampler.track(job.run_id, w.proc.pid, limits=job.limits, shared=True)
+
+    def _read_loop(self, w: _Worker) -> None:
+        assert w.proc.stdout is not None
+        splitter = LineSplitter()
+        try:
+            while True:
+                chunk = w.proc.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._handle_lines(w, splitter.feed(chunk))
+                if len(chunk) < SMALL_READ_BYTES and w.job is not None:
+                    time.sleep(COALESCE_S)
+            self._handle_lines(w, splitter.flush())
+        except Exception:
+            logger.exception("pool worker reader crashed (pid=%s)", w.proc.pid)
+        finally:
+            self._on_worker_exit(w)
+
+    def _handle_lines(self, w: _Worker, lines: List[str]) -> None:
+        # 普通输出攒成一批写 store；遇到控制消息先把前面那批提交掉，保证归属到正确的 run。
+        batch: List[str] = []
+        for line in lines:
+            idx = line.find(MARKER)
+            if idx < 0:
+                batch.append(line)
+                continue
+            if idx > 0:
+                # 脚本最后一行没换行，控制消息被接在了后面
+                batch.append(line[:idx] + "\n")
+            self._log(w, batch)
+            batch = []
+
+            msg = line[idx + len(MARKER):].strip()
+            if msg == "READY":
+                with self._lock:
+                    if self._outdated_locked(w):
+                        self._retire(w)  # 还在启动时 preload 就变了
+                    else:
+                        self._idle.append(w)
+                        self._assign_locked()
+            elif msg.startswith("DONE"):
+                self._on_job_done(w, int(msg.split()[1]))
+            elif msg.startswith(POOL_EVENT_PREFIX):
+                job = w.job
+                if job is not None and job.tracker is not None:
+                    job.tracker.handle_line(msg[len(POOL_EVENT_PREFIX):])
+        self._log(w, batch)
+
+    def _log(self, w: _Worker, lines: List[str]) -> None:
+        if not lines:
+            return
+        job = w.job
+        if job is not None:
+            self._store.append_logs(job.run_id, lines)
+        else:
+            for line in lines:
+                logger.info("[pool-worker %s] %s", w.proc.pid, line.rstrip())
+
+    def _on_job_done(self, w: _Worker, rc: int) -> None:
+        job = w.job
+        if self._sampler is not None and job is not None:
+            # 在 worker 接下一个 job 之前读最后一次
+            self._sampler.finalize(job.run_id, rc)
+        with self._lock:
+            job = w.job
+            w.job = None
+            w.runs += 1
+            self._sup.cancel((w, "timeout"))
+            if job is not None:
+                self._by_run.pop(job.run_id, None)
+
+            rss = read_rss_mb(w.proc.pid)
+            if w.stopping or w.timed_out:
+                # 信号已经发出去了（脚本刚好在那之前跑完）：这个 worker 马上要死，不能再派活
+                self._retire(w)
+            elif w.runs >= self._max_runs or (rss is not None and rss > self._max_rss_mb):
+                # 回收：reader 线程收尾时会补一个新的
+                logger.info("Recycling pool worker pid=%s (runs=%s rss_mb=%s)", w.proc.pid, w.runs, rss)
+                self._retire(w)
+            elif self._outdated_locked(w):
+                self._retire(w)  # preload 变了 / 池关了
+            else:
+                self._idle.append(w)
+                self._assign_locked()
+
+        if job is not None:
+            status = RunStatus.done if rc == 0 else RunStatus.failed
+            self._finish_job(job, status=status, returncode=rc)
+
+    def _on_worker_exit(self, w: _Worker) -> None:
+        rc = w.proc.wait()
+        self._sup.cancel((w, "timeout"), (w, "kill"))
+        with self._lock:
+            self._workers.discard(w)
+            try:
+                self._idle.remove(w)
+            except ValueError:
+                pass
+            job = w.job
+            w.job = None
+            if job is not None:
+                self._by_run.pop(job.run_id, None)
+            if len(self._workers) < self._target_locked():
+                self._spawn_worker_locked()
+        w.exited.set()
+
+        if job is None:
+            return
+        if w.stopping:
+            self._finish_job(job, status=RunStatus.stopped, returncode=rc)
+        elif w.timed_out:
+            self._finish_job(job, status=RunStatus.failed, returncode=-9)
+        else:
+            self._store.append_log(job.run_id, f"[pool] worker exited unexpectedly (rc={rc})\n")
+            self._finish_job(job, status=RunStatus.failed, returncode=rc)
+
+    def _on_timeout(self, w: _Worker, job: PoolJob) -> None:
+        # supervisor 线程里：job 换了（已经跑完、worker 接了下一个）就不算；和 stop 一样在锁里发信号
+        with self._lock:
+            if w.job is not job or w.timed_out:
+                return
+            w.timed_out = True
+            self._store.append_log(job.run_id, "[runner] timeout reached, killing process\n")
+            self._store.set_failure_reason(job.run_id, f"timeout after {job.timeout_s:g}s")
+            kill_group(w.proc.pid, signal.SIGKILL)
+
+    def _finish_job(self, job: PoolJob, *, status: RunStatus, returncode: Optional[int]) -> None:
+        if job.delivery is not None:
+            job.delivery.cleanup()
+        if job.tracker is not None:
+            job.tracker.close()
+        if self._sampler is not None:
+            # worker 已经退出（或者上面 _on_job_done 已经收过尾）：只停止跟踪
+            self._sampler.finalize(job.run_id, returncode, sample=False)
+        self._finish(job.run_id, status=status, returncode=returncode)
+
+    def _finish(self, run_id: str, *, status: RunStatus, returncode: Optional[int]) -> None:
+        self._store.finish_run(run_id, status=status, returncode=returncode)
+        for fn in self._listeners:
+            try:
+                fn(run_id, status, returncode)
+            except Exception:
+                logger.exception("finish listener failed for run %s", run_id)
@@ -0,0 +1,331 @@
+# 工作流引擎：按 DAG 把步骤交给调度器。一个步骤的上游全部成功就立刻提交，
+# 所以互相不依赖的分支是并行跑的，整个工作流的耗时 ≈ 关键路径，而不是所有步骤时间之和。
+#
+# 失败的传播：某个步骤失败 / 被停掉，它的下游全部标成 skipped；不相关的分支照常跑完（fail_fast 时一起停掉）。
+# 续跑（resume）：已经成功的步骤保留结果和输出，只把 failed / skipped / cancelled 的步骤重新跑一遍。
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from app.schemas.script import RunStatus
+from app.services.params import ParamError
+from app.services.registry import ScriptRegistry
+from app.services.scheduler import Scheduler
+from app.services.workflows import TemplateError, WorkflowSpec, parse_output_line, render
+from app.storage.state_store import StateStore
+
+logger = logging.getLogger("app.workflow_engine")
+
+_FINAL = (RunStatus.done, RunStatus.failed, RunStatus.stopped)
+_OUTPUT_PAGE = 5000
+
+
+@dataclass
+class StepState:
+    step_id: str
+    status: str = "pending"  # pending | running | done | failed | skipped | cancelled
+    run_id: Optional[str] = None
+    run_ids: List[str] = field(default_factory=list)  # 每次尝试的 run（resume 之后会有多个）
+    params: Optional[Dict[str, Any]] = None  # 代入上游输出之后真正提交的参数
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    started_at: Optional[float] = None  # monotonic，算耗时用
+    finished_at: Optional[float] = None
+
+    @property
+    def duration_s(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+@dataclass
+class WorkflowRun:
+    wf_run_id: str
+    spec: WorkflowSpec  # 启动时的快照：spec 文件后来改了不影响这次（包括 resume）
+    params: Dict[str, Any]
+    steps: Dict[str, StepState]
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+    status: str = "running"  # running | done | failed | cancelled
+    cancelled: bool = False
+    attempt: int = 1
+    started_mono: float = field(default_factory=time.monotonic)
+    finished_mono: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+
+class WorkflowEngine:
+    """
+    Runs WorkflowSpecs: each step is submitted to the scheduler as soon as
+    all of its `needs` succeeded.
+
+    Same pumping scheme as BatchManager: one thread advances every active
+    workflow run; scheduler finish events wake it immediately in local mode,
+    otherwise it polls the store every `poll_s`. Workflow runs are kept in
+    memory (the last `max_runs` finished ones stay queryable).
+    """
+
+    def __init__(
+        self,
+        *,
+        registry: ScriptRegistry,
+        scheduler: Scheduler,
+        store: StateStore,
+        poll_s: float = 1.0,
+        max_runs: int = 200,
+    ) -> None:
+        self._registry = registry
+        self._scheduler = scheduler
+        self._store = store
+        self._poll_s = max(0.05, float(poll_s))
+        self._max_runs = max(1, int(max_runs))
+        self._lock = threading.Lock()
+        self._runs: "OrderedDict[str, WorkflowRun]" = OrderedDict()
+        self._owned: Dict[str, str] = {}  # 在跑的步骤 run_id -> wf_run_id
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+        add_listener: Optional[Callable] = getattr(scheduler, "add_listener", None)
+        if add_listener is not None:
+            add_listener(self._on_run_finished)
+
+        self._thread = threading.Thread(target=self._loop, name="workflow-engine", daemon=True)
+        self._thread.start()
+
+    # ---- public ----
+
+    def start(self, spec: WorkflowSpec, params: Optional[Dict[str, Any]] = None) -> WorkflowRun:
+        wr = WorkflowRun(
+            wf_run_id=str(uuid.uuid4()),
+            spec=spec,
+            params={**(spec.params or {}), **(params or {})},
+            steps={s.step_id: StepState(step_id=s.step_id) for s in spec.steps},
+        )
+        with self._lock:
+            self._runs[wr.wf_run_id] = wr
+            self._trim_locked()
+            to_stop = self._advance_locked(wr)  # 没有上游的步骤直接提交
+        self._stop_runs(to_stop)
+        logger.info("workflow %s started: %s (%d steps)", spec.workflow_id, wr.wf_run_id, len(spec.steps))
+        return wr
+
+    def get(self, wf_run_id: str) -> Optional[WorkflowRun]:
+        with self._lock:
+            return self._runs.get(wf_run_id)
+
+    def list(self) -> List[WorkflowRun]:
+        with self._lock:
+            return list(reversed(self._runs.values()))
+
+    def cancel(self, wf_run_id: str) -> Optional[int]:
+        """Stop running steps; pending steps become cancelled. Returns how many runs were stopped."""
+        with self._lock:
+            wr = self._runs.get(wf_run_id)
+            if wr is None:
+                return None
+            if wr.finished:
+                return 0
+            wr.cancelled = True
+            to_stop = [s.run_id for s in wr.steps.values() if s.status == "running" and s.run_id]
+        stopped = sum(1 for rid in to_stop if self._scheduler.stop(rid))
+        self._wake.set()
+        return stopped
+
+    def resume(self, wf_run_id: str) -> WorkflowRun:
+        """
+        Re-run the failed / skipped / cancelled steps of a finished workflow run;
+        successful steps keep their run and outputs. Raises KeyError / ValueError.
+        """
+        with self._lock:
+            wr = self._runs.get(wf_run_id)
+            if wr is None:
+                raise KeyError(wf_run_id)
+            if not wr.finished:
+                raise ValueError("workflow run is still running")
+            if wr.status == "done":
+                raise ValueError("workflow run already succeeded")
+            for st in wr.steps.values():
+                if st.status in ("failed", "skipped", "cancelled"):
+                    st.status, st.run_id, st.error = "pending", None, None
+                    st.params, st.outputs = None, {}
+                    st.started_at = st.finished_at = None
+            wr.cancelled = False
+            wr.status = "running"
+            wr.finished_at = wr.finished_mono = None
+            wr.started_mono = time.monotonic()
+            wr.attempt += 1
+            self._runs.move_to_end(wf_run_id)
+            to_stop = self._advance_locked(wr)
+        self._stop_runs(to_stop)
+        logger.info("workflow run %s resumed (attempt %d)", wf_run_id, wr.attempt)
+        return wr
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = sum(1 for r in self._runs.values() if not r.finished)
+            return {"workflow_runs": len(self._runs), "active": active, "running_steps": len(self._owned)}
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+
+    # ---- internals ----
+
+    def _on_run_finished(self, run_id: str, status: RunStatus, returncode: Optional[int]) -> None:
+        # 调度器线程里调用：只叫醒引擎，读输出 / 提交下游都在引擎线程里做
+        if run_id in self._owned:
+            self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self._poll_s)
+            self._wake.clear()
+            with self._lock:
+                active = [r for r in self._runs.values() if not r.finished]
+            for wr in active:
+                try:
+                    self._poll(wr)
+                except Exception:
+                    logger.exception("workflow run %s: engine step failed", wr.wf_run_id)
+
+    def _poll(self, wr: WorkflowRun) -> None:
+        with self._lock:
+            running = [(s.step_id, s.run_id) for s in wr.steps.values() if s.status == "running" and s.run_id]
+        settled = False
+        for step_id, run_id in running:
+            rec = self._store.peek_run(run_id)
+            if rec is not None and rec.status not in _FINAL:
+                continue
+            # 读输出不持锁：日志可能很长
+            outputs = self._read_outputs(run_id) if rec is not None and rec.status == RunStatus.done else {}
+            with self._lock:
+                st = wr.steps[step_id]
+                if st.run_id != run_id or st.status != "running":
+                    continue
+                self._owned.pop(run_id, None)
+                st.finished_at = time.monotonic()
+                if rec is None:
+                    st.status, st.error = "failed", "run record evicted before it finished"
+                elif rec.status == RunStatus.done:
+                    st.status, st.outputs = "done", outputs
+                elif wr.cancelled:
+                    # 被我们停掉的（被 SIGTERM 杀掉的进程有时会记成 failed）
+                    st.status = "cancelled"
+                else:
+                    st.status = "failed"
+                    st.error = rec.failure_reason or f"{rec.status.value} (returncode={rec.returncode})"
+                settled = True
+        if settled or wr.cancelled:
+            with self._lock:
+                to_stop = self._advance_locked(wr)
+            self._stop_runs(to_stop)
+
+    def _stop_runs(self, run_ids: List[str]) -> None:
+        for rid in run_ids:
+            self._scheduler.stop(rid)
+
+    def _read_outputs(self, run_id: str) -> Dict[str, Any]:
+        # ap_sdk.result({...}) 的 dict 先当输出；日志里的 ::output 行覆盖同名的
+        rec = self._store.peek_run(run_id)
+        result = rec.progress.result if rec is not None and rec.progress is not None else None
+        outputs: Dict[str, Any] = dict(result) if isinstance(result, dict) else {}
+        since = 0
+        while True:
+            sl = self._store.read_logs(run_id, since=since, limit=_OUTPUT_PAGE)
+            for line in sl.lines:
+                kv = parse_output_line(line)
+                if kv is not None:
+                    outputs[kv[0]] = kv[1]
+            if not sl.lines or sl.next_seq <= since:
+                return outputs
+            since = sl.next_seq
+
+    def _advance_locked(self, wr: WorkflowRun) -> List[str]:
+        """Skip / cancel / dispatch pending steps; returns run_ids the caller must stop (after releasing the lock)."""
+        if wr.finished:
+            return []
+        for spec in wr.spec.steps:  # 拓扑序：上游的状态在这一轮里已经定下来了
+            st = wr.steps[spec.step_id]
+            if st.status != "pending":
+                continue
+            deps = [wr.steps[n] for n in spec.needs]
+            bad = next((d for d in deps if d.status in ("failed", "skipped", "cancelled")), None)
+            if bad is not None:
+                st.status, st.error = "skipped", f"upstream step {bad.step_id} {bad.status}"
+                continue
+            if wr.cancelled:
+                st.status = "cancelled"
+                continue
+            if all(d.status == "done" for d in deps):
+                self._dispatch_locked(wr, spec.step_id)
+
+        to_stop: List[str] = []
+        if wr.spec.fail_fast and not wr.cancelled and any(s.status == "failed" for s in wr.steps.values()):
+            # fail_fast：第一个失败出现后，其它在跑的步骤也停掉，没开始的标成 cancelled
+            wr.cancelled = True
+            for st in wr.steps.values():
+                if st.status == "pending":
+                    st.status = "cancelled"
+            to_stop = [s.run_id for s in wr.steps.values() if s.status == "running" and s.run_id]
+
+        if any(s.status in ("pending", "running") for s in wr.steps.values()):
+            return to_stop
+        wr.finished_at = datetime.utcnow()
+        wr.finished_mono = time.monotonic()
+        if all(s.status == "done" for s in wr.steps.values()):
+            wr.status = "done"
+        elif wr.cancelled and not any(s.status == "failed" for s in wr.steps.values()):
+            wr.status = "cancelled"
+        else:
+            wr.status = "failed"
+        logger.info("workflow run %s finished: %s", wr.wf_run_id, wr.status)
+        return []
+
+    def _dispatch_locked(self, wr: WorkflowRun, step_id: str) -> None:
+        spec = wr.spec.step(step_id)
+        st = wr.steps[step_id]
+        st.started_at = time.monotonic()
+        ctx = {
+            "params": wr.params,
+            "steps": {sid: {"outputs": s.outputs, "run_id": s.run_id} for sid, s in wr.steps.items() if s.status == "done"},
+        }
+        try:
+            script = self._registry.get(spec.script_id)
+            params = script.validate_params(render(spec.params or {}, ctx))
+            script_path = self._registry.resolve_script_path(script.entry)
+            if not script_path.exists():
+                raise FileNotFoundError(f"Script file not found: {script_path}")
+            run_id = self._scheduler.submit(
+                spec=script,
+                script_path=script_path,
+                params=params,
+                cwd=self._registry.resolve_cwd(script.cwd),
+            )
+        except (KeyError, TemplateError, ParamError, FileNotFoundError) as e:
+            # 步骤根本没启动：直接算失败，下游在下一轮被标成 skipped
+            st.status, st.error = "failed", str(e).strip("'\"")
+            st.finished_at = st.started_at
+            logger.warning("workflow run %s: step %s not started: %s", wr.wf_run_id, step_id, st.error)
+            return
+        st.status, st.run_id, st.params = "running", run_id, params
+        st.run_ids.append(run_id)
+        self._owned[run_id] = wr.wf_run_id
+
+    def _trim_locked(self) -> None:
+        over = len(self._runs) - self._max_runs
+        if over <= 0:
+            return
+        for rid in [rid for rid, r in self._runs.items() if r.finished][:over]:
+            del self._runs[rid]
@@ -0,0 +1,278 @@
+# 工作流 spec：workflow_specs/*.yaml，描述一个由脚本步骤组成的 DAG。
+#
+#   id: deploy_bots
+#   params: {region: eu}                 # 工作流参数的默认值，启动时可以覆盖
+#   fail_fast: false                     # true：一个步骤失败就停掉其它正在跑的步骤
+#   steps:
+#     - id: vpn
+#       script: connect_vpn              # script_specs 里的 script_id
+#       params: {region: "${params.region}"}
+#     - id: prep
+#       script: ssh_prep
+#       needs: [vpn]                     # 上游都成功才启动；互相不依赖的步骤并行跑
+#       params: {host: "${steps.vpn.outputs.ip}"}
+#
+# 步骤的输出：脚本往 stdout 打一行 `::output key=value`（value 能按 JSON 解析就按 JSON，否则当字符串），
+# 或者用 scripts/ap_sdk.py 的 result({...})（dict 的每个键都是一个输出，::output 行优先），
+# 下游用 ${steps.<id>.outputs.<key>} 引用。整个值就是一个 ${...} 时保留原类型，嵌在字符串里时转成字符串。
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import yaml
+
+logger = logging.getLogger("app.workflows")
+
+OUTPUT_PREFIX = "::output "
+_REF = re.compile(r"\$\{\s*([^}]+?)\s*\}")
+_STEP_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class StepSpec:
+    step_id: str
+    script_id: str
+    needs: Tuple[str, ...] = ()
+    params: Dict[str, Any] | None = None
+
+
+@dataclass(frozen=True)
+class WorkflowSpec:
+    workflow_id: str
+    description: str
+    steps: Tuple[StepSpec, ...]  # 已经按拓扑序排好
+    params: Dict[str, Any] | None = None
+    fail_fast: bool = False
+
+    def step(self, step_id: str) -> StepSpec:
+        for s in self.steps:
+            if s.step_id == step_id:
+                return s
+        raise KeyError(step_id)
+
+
+def _refs(value: Any) -> Iterable[str]:
+    # 参数里所有 ${...} 的内容（递归进 list / dict）
+    if isinstance(value, str):
+        yield from (m.group(1) for m in _REF.finditer(value))
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _refs(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _refs(v)
+
+
+def _lookup(ref: str, ctx: Mapping[str, Any]) -> Any:
+    # "params.region" / "steps.vpn.outputs.ip" / "steps.vpn.run_id"
+    cur: Any = ctx
+    for part in ref.split("."):
+        if not isinstance(cur, Mapping) or part not in cur:
+            raise TemplateError(f"unresolved reference ${{{ref}}}")
+        cur = cur[part]
+    return cur
+
+
+def render(value: Any, ctx: Mapping[str, Any]) -> Any:
+    """Substitute ${...} references in a step's params (ctx = {"params": ..., "steps": {id: {"outputs": ..., "run_id": ...}}})."""
+    if isinstance(value, str):
+        m = _REF.fullmatch(value.strip())
+        if m is not None:
+            return _lookup(m.group(1), ctx)  # 整个值就是一个引用：保留类型
+        return _REF.sub(lambda mm: _as_text(_lookup(mm.group(1), ctx)), value)
+    if isinstance(value, dict):
+        return {k: render(v, ctx) for k, v in value.items()}
+    if isinstance(value, list):
+        return [render(v, ctx) for v in value]
+    return value
+
+
+def _as_text(v: Any) -> str:
+    return v if isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+
+
+def parse_output_line(line: str) -> Optional[Tuple[str, Any]]:
+    """`::output key=value` -> (key, value); None for any other line."""
+    if not line.startswith(OUTPUT_PREFIX):
+        return None
+    body = line[len(OUTPUT_PREFIX):].rstrip("\r\n")
+    key, sep, raw = body.partition("=")
+    key = key.strip()
+    if not sep or not key:
+        return None
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def parse_workflow(path: Path, raw: bytes) -> Optional[WorkflowSpec]:
+    """One YAML file -> WorkflowSpec; None (with a warning) if it is invalid (bad refs, unknown needs, cycles)."""
+    try:
+        data = yaml.safe_load(raw.decode("utf-8")) or {}
+    except (yaml.YAMLError, UnicodeDecodeError) as e:
+        logger.warning("Invalid workflow (%s): %s", e, path)
+        return None
+    if not isinstance(data, dict):
+        logger.warning("Invalid workflow (not a mapping): %s", path)
+        return None
+
+    workflow_id = str(data.get("id") or "").strip()
+    raw_steps = data.get("steps") or []
+    if not workflow_id or not isinstance(raw_steps, list) or not raw_steps:
+        logger.warning("Invalid workflow (missing id/steps): %s", path)
+        return None
+    params = data.get("params") or None
+    if params is not None and not isinstance(params, dict):
+        logger.warning("Invalid workflow (params must be a mapping): %s", path)
+        return None
+
+    steps: Dict[str, StepSpec] = {}
+    for item in raw_steps:
+        if not isinstance(item, dict):
+            logger.warning("Invalid workflow (step is not a mapping): %s", path)
+            return None
+        step_id = str(item.get("id") or "").strip()
+        script_id = str(item.get("script") or "").strip()
+        needs = item.get("needs") or []
+        if isinstance(needs, str):
+            needs = [needs]
+        step_params = item.get("params") or None
+        if not step_id or not _STEP_ID.match(step_id) or not script_id:
+            logger.warning("Invalid workflow (step needs an id [A-Za-z0-9_-] and a script): %s", path)
+            return None
+        if step_id in steps:
+            logger.warning("Invalid workflow (duplicate step %r): %s", step_id, path)
+            return None
+        if step_params is not None and not isinstance(step_params, dict):
+            logger.warning("Invalid workflow (step %r: params must be a mapping): %s", step_id, path)
+            return None
+        steps[step_id] = StepSpec(
+            step_id=step_id,
+            script_id=script_id,
+            needs=tuple(str(n) for n in needs),
+            params=dict(step_params) if step_params else None,
+        )
+
+    order = _toposort(steps, path)
+    if order is None:
+        return None
+
+    # ${steps.X...} 只能引用上游（needs 的传递闭包），不然跑的时候 X 可能还没结果
+    ancestors: Dict[str, set] = {}
+    for sid in order:
+        s = steps[sid]
+        ancestors[sid] = set(s.needs).union(*(ancestors[n] for n in s.needs)) if s.needs else set()
+        for ref in _refs(s.params or {}):
+            head, _, rest = ref.partition(".")
+            if head == "params":
+                continue
+            target = rest.partition(".")[0]
+            if head != "steps" or target not in ancestors[sid]:
+                logger.warning("Invalid workflow (step %r: ${%s} is not params.* or an upstream step): %s", sid, ref, path)
+                return None
+
+    return WorkflowSpec(
+        workflow_id=workflow_id,
+        description=str(data.get("description") or "").strip(),
+        steps=tuple(steps[sid] for sid in order),
+        params=dict(params) if params else None,
+        fail_fast=bool(data.get("fail_fast", False)),
+    )
+
+
+def _toposort(steps: Dict[str, StepSpec], path: Path) -> Optional[List[str]]:
+    # Kahn：顺便检查 needs 指向不存在的步骤、环
+    indeg = {sid: 0 for sid in steps}
+    children: Dict[str, List[str]] = {sid: [] for sid in steps}
+    for s in steps.values():
+        for n in s.needs:
+            if n not in steps:
+                logger.warning("Invalid workflow (step %r needs unknown step %r): %s", s.step_id, n, path)
+                return None
+            indeg[s.step_id] += 1
+            children[n].append(s.step_id)
+    ready = [sid for sid in steps if indeg[sid] == 0]  # dict 保持 YAML 里的顺序
+    order: List[str] = []
+    while ready:
+        sid = ready.pop(0)
+        order.append(sid)
+        for c in children[sid]:
+            indeg[c] -= 1
+            if indeg[c] == 0:
+                ready.append(c)
+    if len(order) != len(steps):
+        logger.warning("Invalid workflow (dependency cycle among %s): %s", sorted(set(steps) - set(order)), path)
+        return None
+    return order
+
+
+class WorkflowRegistry:
+    """
+    Reads workflow_specs/*.yaml. refresh() is cheap (one stat per file) and
+    only re-parses files whose mtime/size/sha256 changed, so the API calls it
+    on every list/get instead of running a second directory watcher.
+    """
+
+    def __init__(self, *, specs_dir: Path) -> None:
+        self._specs_dir = specs_dir
+        self._lock = threading.Lock()
+        self._files: Dict[Path, Tuple[int, int, str, Optional[WorkflowSpec]]] = {}  # path -> (mtime_ns, size, sha256, spec)
+        self._cache: Dict[str, WorkflowSpec] = {}
+
+    def refresh(self) -> None:
+        with self._lock:
+            paths = set(self._specs_dir.glob("*.yaml")) if self._specs_dir.exists() else set()
+            dirty = bool(set(self._files) - paths)
+            files = {p: f for p, f in self._files.items() if p in paths}
+            for path in paths:
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    files.pop(path, None)
+                    dirty = True
+                    continue
+                prev = files.get(path)
+                if prev is not None and prev[0] == st.st_mtime_ns and prev[1] == st.st_size:
+                    continue
+                raw = path.read_bytes()
+                digest = hashlib.sha256(raw).hexdigest()
+                spec = prev[3] if prev is not None and prev[2] == digest else parse_workflow(path, raw)
+                files[path] = (st.st_mtime_ns, st.st_size, digest, spec)
+                dirty = True
+            if not dirty:
+                return
+            table: Dict[str, WorkflowSpec] = {}
+            for path in sorted(files):
+                spec = files[path][3]
+                if spec is None:
+                    continue
+                if spec.workflow_id in table:
+                    logger.warning("Duplicate workflow id %r in %s (ignored)", spec.workflow_id, path)
+                    continue
+                table[spec.workflow_id] = spec
+            self._files = files
+            self._cache = table
+            logger.info("Loaded %d workflows from %s", len(table), self._specs_dir)
+
+    def list(self) -> List[WorkflowSpec]:
+        self.refresh()
+        return list(self._cache.values())
+
+    def get(self, workflow_id: str) -> WorkflowSpec:
+        self.refresh()
+        try:
+            return self._cache[workflow_id]
+        except KeyError:
+            raise KeyError(f"Unknown workflow_id: {workflow_id}") from None
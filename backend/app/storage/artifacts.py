@@ -0,0 +1,354 @@
+# 脚本产物（截图、导出的文件……）：每个 run 一个工作目录，通过 AP_ARTIFACTS_DIR 告诉脚本往哪写。
+# run 结束后把目录里的文件按内容 sha256 收进对象库（同样的截图只存一份），再给这个 run 写一个 manifest（文件名 -> sha256）。
+# GET /runs/{id}/artifacts/{name} 直接对对象文件 FileResponse（支持 Range）；总大小 / 保留时间超了就从最老的 run 开始删。
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import queue
+import shutil
+import stat
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger("app.artifacts")
+
+ARTIFACTS_ENV = "AP_ARTIFACTS_DIR"
+_CHUNK = 1 << 20
+
+
+@dataclass(frozen=True)
+class Artifact:
+    name: str  # 相对工作目录的路径，用 "/" 分隔，比如 "shots/001.png"
+    sha256: str
+    size: int
+    content_type: str
+
+
+@dataclass(frozen=True)
+class ArtifactManifest:
+    run_id: str
+    created_at: float  # time.time()，保留策略按这个排
+    files: Tuple[Artifact, ...] = ()
+    skipped: int = 0  # 超过单个 run 文件数上限 / 不是普通文件（符号链接等）而没收进来的
+    by_name: Dict[str, Artifact] = field(default_factory=dict, compare=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.by_name.update((a.name, a) for a in self.files)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(a.size for a in self.files)
+
+
+def _manifest_to_json(m: ArtifactManifest) -> str:
+    doc = {"run_id": m.run_id, "created_at": m.created_at, "skipped": m.skipped, "files": [asdict(a) for a in m.files]}
+    return json.dumps(doc, ensure_ascii=False)
+
+
+def _manifest_from_json(raw: str) -> ArtifactManifest:
+    doc = json.loads(raw)
+    return ArtifactManifest(
+        run_id=doc["run_id"],
+        created_at=float(doc["created_at"]),
+        files=tuple(Artifact(**a) for a in doc.get("files") or ()),
+        skipped=int(doc.get("skipped") or 0),
+    )
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    buf = bytearray(_CHUNK)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for files scripts leave in their per-run artifacts directory.
+
+    Files under `root`:
+      work/<run_id>/...          what the script writes (AP_ARTIFACTS_DIR), removed after ingest
+      blobs/<sha[:2]>/<sha256>   one read-only file per distinct content
+      manifests/<run_id>.json    name -> sha256 / size / content type for one run
+
+    - ingest_later() queues a finished run for the single ingest thread (hashing never
+      runs on a runner thread or the asyncio loop). Ingest renames new content into
+      blobs/ (same filesystem, no copy) and drops duplicates.
+    - Blobs are reference-counted across manifests; sweep() drops whole runs, oldest
+      first, past `ttl_s` or while the blobs exceed `max_bytes`, then unreferenced blobs.
+    - Leftover work dirs from a previous process are ingested at startup.
+    - read_only=True only serves manifests/blobs another process writes (the API in
+      AP_RUN_MODE=queue with a shared directory): no ingest thread, no cleanup.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        *,
+        max_bytes: Optional[int] = None,
+        ttl_s: Optional[float] = None,
+        max_files_per_run: int = 1000,
+        read_only: bool = False,
+    ) -> None:
+        self._root = Path(root)
+        self._work = self._root / "work"
+        self._blobs = self._root / "blobs"
+        self._manifests_dir = self._root / "manifests"
+        for d in (self._work, self._blobs, self._manifests_dir):
+            d.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._max_files = max(1, int(max_files_per_run))
+
+        self._lock = threading.Lock()
+        self._manifests: Dict[str, ArtifactManifest] = {}
+        self._refs: Dict[str, int] = {}  # sha256 -> 被几个 manifest 条目引用
+        self._sizes: Dict[str, int] = {}  # sha256 -> 大小（只算有引用的 blob）
+        self._bytes = 0
+        self._pending: Set[str] = set()
+        self._claimed: Set[str] = set()  # ingest 中、还没进 manifest 的 sha256：sweep 不能删这些 blob
+        self.stats_counters = {"ingested_files": 0, "dedup_hits": 0, "dedup_bytes": 0, "swept_runs": 0}
+        self.read_only = read_only
+        if read_only:
+            return
+        self._load()
+
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._thread = threading.Thread(target=self._ingest_loop, name="artifact-ingest", daemon=True)
+        self._thread.start()
+        for leftover in sorted(p.name for p in self._work.iterdir() if p.is_dir()):
+            self.ingest_later(leftover)
+
+    # ---- run side ----
+
+    def work_dir(self, run_id: str) -> Path:
+        d = self._work / run_id
+        d.mkdir(parents=True, exist_ok=True)
+        return d
+
+    def ingest_later(self, run_id: str) -> None:
+        with self._lock:
+            self._pending.add(run_id)
+        self._queue.put(run_id)
+
+    def ingest(self, run_id: str) -> Optional[ArtifactManifest]:
+        """Move run_id's work dir into the store; returns its manifest (None when it left no files)."""
+        try:
+            return self._ingest(run_id)
+        finally:
+            with self._lock:
+                self._pending.discard(run_id)
+
+    # ---- read side ----
+
+    def pending(self, run_id: str) -> bool:
+        with self._lock:
+            return run_id in self._pending
+
+    def manifest(self, run_id: str) -> Optional[ArtifactManifest]:
+        with self._lock:
+            m = self._manifests.get(run_id)
+        if m is not None:
+            return m
+        # 不在索引里：可能是别的进程（runner 节点）写到共享目录里的，直接读文件
+        path = self._manifests_dir / f"{run_id}.json"
+        try:
+            return _manifest_from_json(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def open(self, run_id: str, name: str) -> Optional[Tuple[Path, Artifact]]:
+        """(blob path, entry) for one file of a run, or None."""
+        m = self.manifest(run_id)
+        art = m.by_name.get(name) if m is not None else None
+        if art is None:
+            return None
+        return self._blob_path(art.sha256), art
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "runs": len(self._manifests),
+                "blobs": len(self._sizes),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "pending": len(self._pending),
+                **self.stats_counters,
+            }
+
+    # ---- retention ----
+
+    def delete_run(self, run_id: str) -> bool:
+        with self._lock:
+            m = self._manifests.pop(run_id, None)
+            if m is None:
+                return False
+            dead = self._unref_locked(m)
+        self._remove(m.run_id, dead)
+        return True
+
+    def sweep(self) -> int:
+        """Drop runs past ttl_s, then the oldest runs while over max_bytes; returns how many runs were dropped."""
+        now = time.time()
+        dropped: List[Tuple[ArtifactManifest, List[str]]] = []
+        with self._lock:
+            oldest = sorted(self._manifests.values(), key=lambda m: m.created_at)
+            for m in oldest:
+                expired = self.ttl_s is not None and now - m.created_at > self.ttl_s
+                over = self.max_bytes is not None and self._bytes > self.max_bytes
+                if not (expired or over):
+                    break  # 按时间排好序的：这个不过期、也不超预算，后面的更不用删
+                del self._manifests[m.run_id]
+                dropped.append((m, self._unref_locked(m)))
+            self.stats_counters["swept_runs"] += len(dropped)
+        for m, dead in dropped:
+            self._remove(m.run_id, dead)
+        return len(dropped)
+
+    # ---- internals ----
+
+    def _blob_path(self, sha: str) -> Path:
+        return self._blobs / sha[:2] / sha
+
+    def _ingest_loop(self) -> None:
+        while True:
+            run_id = self._queue.get()
+            try:
+                self.ingest(run_id)
+            except Exception:
+                logger.exception("artifact ingest failed for run %s", run_id)
+
+    def _ingest(self, run_id: str) -> Optional[ArtifactManifest]:
+        work = self._work / run_id
+        if not work.is_dir():
+            return None
+        files: List[Artifact] = []
+        skipped = 0
+        manifest = None
+        try:
+            for dirpath, dirnames, filenames in os.walk(work):
+                dirnames.sort()
+                for fn in sorted(filenames):
+                    src = Path(dirpath) / fn
+                    st = src.lstat()
+                    if not stat.S_ISREG(st.st_mode) or len(files) >= self._max_files:
+                        skipped += 1  # 符号链接不跟（可能指到目录外面去）
+                        continue
+                    files.append(self._add_file(work, src, st.st_size))
+            if files or skipped:
+                manifest = self._commit(run_id, files, skipped)
+        finally:
+            with self._lock:
+                self._claimed.difference_update(a.sha256 for a in files)
+        shutil.rmtree(work, ignore_errors=True)
+        return manifest
+
+    def _add_file(self, work: Path, src: Path, size: int) -> Artifact:
+        sha = _sha256_file(src)
+        dest = self._blob_path(sha)
+        with self._lock:
+            self._claimed.add(sha)
+            dup = dest.exists()
+            if dup:
+                self.stats_counters["dedup_hits"] += 1
+                self.stats_counters["dedup_bytes"] += size
+        if dup:
+            src.unlink()  # 同样内容已经有了（重复的截图），工作目录里这份直接删
+        else:
+            dest.parent.mkdir(exist_ok=True)
+            os.replace(src, dest)  # 同一个文件系统里只是改名，不拷贝
+            os.chmod(dest, 0o444)
+        name = src.relative_to(work).as_posix()
+        ctype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return Artifact(name=name, sha256=sha, size=size, content_type=ctype)
+
+    def _commit(self, run_id: str, files: List[Artifact], skipped: int) -> ArtifactManifest:
+        manifest = ArtifactManifest(run_id=run_id, created_at=time.time(), files=tuple(files), skipped=skipped)
+        tmp = self._manifests_dir / f"{run_id}.json.tmp"
+        tmp.write_text(_manifest_to_json(manifest), encoding="utf-8")
+        tmp.replace(self._manifests_dir / f"{run_id}.json")
+        with self._lock:
+            old = self._manifests.pop(run_id, None)
+            dead = self._unref_locked(old) if old is not None else []
+            self._manifests[run_id] = manifest
+            self._ref_locked(manifest)
+            self.stats_counters["ingested_files"] += len(files)
+            over = self.max_bytes is not None and self._bytes > self.max_bytes
+        self._remove(None, dead)
+        if over:
+            self.sweep()
+        return manifest
+
+    def _ref_locked(self, m: ArtifactManifest) -> None:
+        for a in m.files:
+            n = self._refs.get(a.sha256, 0)
+            self._refs[a.sha256] = n + 1
+            if n == 0:
+                self._sizes[a.sha256] = a.size
+                self._bytes += a.size
+
+    def _unref_locked(self, m: ArtifactManifest) -> List[str]:
+        # 返回引用数降到 0 的 blob（由调用方在锁外删文件）
+        dead: List[str] = []
+        for a in m.files:
+            n = self._refs.get(a.sha256, 0) - 1
+            if n > 0:
+                self._refs[a.sha256] = n
+                continue
+            self._refs.pop(a.sha256, None)
+            self._bytes -= self._sizes.pop(a.sha256, 0)
+            dead.append(a.sha256)
+        return dead
+
+    def _remove(self, run_id: Optional[str], dead_blobs: List[str]) -> None:
+        if run_id is not None:
+            try:
+                (self._manifests_dir / f"{run_id}.json").unlink()
+            except FileNotFoundError:
+                pass
+        for sha in dead_blobs:
+            with self._lock:
+                if sha in self._refs or sha in self._claimed:
+                    continue  # 删之前又被新 ingest 的 run 引用了
+                try:
+                    self._blob_path(sha).unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _load(self) -> None:
+        # 启动时从 manifests/ 重建引用计数；没有任何 manifest 引用的 blob（上次 ingest 到一半挂了）删掉
+        for path in self._manifests_dir.glob("*.json"):
+            try:
+                m = _manifest_from_json(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError, KeyError, TypeError):
+                logger.warning("unreadable artifact manifest %s skipped", path)
+                continue
+            self._manifests[m.run_id] = m
+            self._ref_locked(m)
+        orphans = 0
+        for sub in self._blobs.iterdir():
+            for blob in sub.iterdir():
+                if blob.name not in self._refs:
+                    blob.unlink()
+                    orphans += 1
+        if self._manifests or orphans:
+            logger.info(
+                "artifact store: %s runs, %s blobs, %.1f MB (%s orphan blobs removed)",
+                len(self._manifests),
+                len(self._sizes),
+                self._bytes / (1024 * 1024),
+                orphans,
+            )
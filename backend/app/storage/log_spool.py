@@ -0,0 +1,305 @@
+# 日志落盘：每个 run 一个只追加的 segment 文件 + 稀疏的“行号 -> 字节偏移”索引。
+# 内存里的 deque 只留最近一小段（hot tail），更早的行按需从磁盘 mmap 读出来，几个小时的长 run 也不占堆内存。
+from __future__ import annotations
+
+import gzip
+import logging
+import mmap
+import os
+import shutil
+import threading
+from array import array
+from bisect import bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger("app.log_spool")
+
+
+@dataclass(eq=False)
+class _Segment:
+    path: Path
+    fh: Optional[object] = None  # 追加写的文件句柄（raw, 不缓冲）；结束后为 None
+    lines: int = 0
+    size: int = 0
+    # 稀疏索引：idx_lines[i] 这一行从文件的 idx_offsets[i] 字节处开始。
+    # 每次 append 一批时，距离上一个索引点超过 index_every 行才记一个新点，维护成本是 O(1)/批。
+    idx_lines: array = field(default_factory=lambda: array("Q", [0]))
+    idx_offsets: array = field(default_factory=lambda: array("Q", [0]))
+    compressed: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class LogSpool:
+    """
+    Append-only per-run log segments with a sparse line-offset index.
+
+    Files under `root`:
+      <run_id>.log      raw UTF-8 lines (every line ends with "\\n")
+      <run_id>.log.gz   same, when finished segments are compressed
+      <run_id>.idx      the sparse index, written when the segment is closed
+
+    Reads of open / uncompressed segments go through mmap and only scan from the
+    nearest index point. Compressed segments are read by streaming gzip (slower,
+    meant for old runs). Compression runs on one background thread; until it is
+    done the segment stays readable as plain .log.
+    """
+
+    def __init__(self, root: Path, *, index_every: int = 256, compress_finished: bool = False) -> None:
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._index_every = max(1, int(index_every))
+        self._compress = bool(compress_finished)
+        self._segments: Dict[str, _Segment] = {}
+        self._lock = threading.Lock()
+        # gzip 一个大 segment 要几百毫秒，不能压在 finish_run 的调用方（runner 线程 / asyncio loop）身上
+        self._gzip_pool: Optional[ThreadPoolExecutor] = None
+        self._pending: Set[Future] = set()
+
+    # ---- write side ----
+
+    def append(self, run_id: str, lines: List[str]) -> None:
+        if not lines:
+            return
+        seg = self._segment(run_id, create=True)
+        assert seg is not None
+        if lines[-1].endswith("\n"):
+            data = "".join(lines).encode("utf-8")
+        else:
+            # 文件里每行都必须以换行结尾，否则下一批的第一行会粘到它后面
+            data = "".join(line if line.endswith("\n") else line + "\n" for line in lines).encode("utf-8")
+
+        with seg.lock:
+            if seg.fh is None:
+                if seg.compressed:
+                    logger.warning("append to closed segment %s ignored", run_id)
+                    return
+                seg.fh = open(seg.path, "ab", buffering=0)
+            if seg.lines - seg.idx_lines[-1] >= self._index_every:
+                seg.idx_lines.append(seg.lines)
+                seg.idx_offsets.append(seg.size)
+            seg.fh.write(data)
+            seg.lines += len(lines)
+            seg.size += len(data)
+
+    def close(self, run_id: str) -> None:
+        """Run finished: close the file, persist the index, queue the gzip if enabled."""
+        seg = self._segment(run_id)
+        if seg is None:
+            return
+        with seg.lock:
+            if seg.fh is not None:
+                seg.fh.close()
+                seg.fh = None
+            self._write_index(run_id, seg)
+            if not self._compress or seg.compressed:
+                return
+        with self._lock:
+            if self._gzip_pool is None:
+                self._gzip_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-spool-gzip")
+            fut = self._gzip_pool.submit(self._compress_segment, run_id, seg)
+            self._pending.add(fut)
+        fut.add_done_callback(self._gzip_done)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued compression has finished."""
+        with self._lock:
+            pending = list(self._pending)
+        return not wait(pending, timeout=timeout).not_done
+
+    def _gzip_done(self, fut: Future) -> None:
+        with self._lock:
+            self._pending.discard(fut)
+        if fut.exception() is not None:
+            logger.warning("log segment compression failed: %s", fut.exception())
+
+    def _compress_segment(self, run_id: str, seg: _Segment) -> None:
+        with seg.lock:
+            if seg.fh is not None or seg.compressed or not seg.path.exists():
+                return
+            src_path, size = seg.path, seg.size
+        # 文件已经关了、不会再变，压缩本身不用拿锁，读请求照常走 mmap
+        gz_path = src_path.with_suffix(".log.gz")
+        tmp = gz_path.with_name(gz_path.name + ".tmp")
+        with open(src_path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        with seg.lock:
+            with self._lock:
+                live = self._segments.get(run_id) is seg
+            # 压缩期间 run 被删了，或者又有人往里追加了：这份 .gz 作废
+            if not live or seg.fh is not None or seg.size != size:
+                tmp.unlink(missing_ok=True)
+                return
+            os.replace(tmp, gz_path)
+            seg.path = gz_path
+            seg.compressed = True
+        src_path.unlink(missing_ok=True)
+
+    def delete(self, run_id: str) -> None:
+        with self._lock:
+            seg = self._segments.pop(run_id, None)
+        if seg is not None:
+            with seg.lock:
+                if seg.fh is not None:
+                    seg.fh.close()
+                    seg.fh = None
+        for suffix in (".log", ".log.gz", ".idx"):
+            try:
+                (self._root / f"{run_id}{suffix}").unlink()
+            except FileNotFoundError:
+                pass
+
+    def segment_files(self, run_id: str) -> List[Path]:
+        """Files currently on disk for a run (log segment + index), e.g. for archiving."""
+        return [p for p in (self._root / f"{run_id}{suffix}" for suffix in (".log", ".log.gz", ".idx")) if p.exists()]
+
+    # ---- read side ----
+
+    def line_count(self, run_id: str) -> int:
+        seg = self._segment(run_id)
+        return seg.lines if seg else 0
+
+    def byte_size(self, run_id: str) -> int:
+        seg = self._segment(run_id)
+        return seg.size if seg else 0
+
+    def read_lines(self, run_id: str, start: int, stop: int) -> List[str]:
+        """Lines [start, stop) by 0-based line number (= log seq)."""
+        seg = self._segment(run_id)
+        if seg is None:
+            return []
+        with seg.lock:
+            start = max(0, int(start))
+            stop = min(int(stop), seg.lines)
+            if start >= stop:
+                return []
+            i = bisect_right(seg.idx_lines, start) - 1
+            base_line, base_off, size = seg.idx_lines[i], seg.idx_offsets[i], seg.size
+            path, compressed = seg.path, seg.compressed
+
+        try:
+            if compressed:
+                with gzip.open(path, "rb") as f:
+                    f.seek(base_off)
+                    blob = f.read(size - base_off)
+                return self._cut_lines(blob, 0, start - base_line, stop - start)
+
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                return self._cut_lines(mm, base_off, start - base_line, stop - start)
+        except FileNotFoundError:
+            # 刚好被后台压缩换成了 .gz：按新路径再读一次；否则是 run 被保留策略淘汰（文件已删）
+            if not compressed and self._swapped_to_gz(seg):
+                return self.read_lines(run_id, start, stop)
+            return []
+
+    def read_bytes(self, run_id: str, offset: int, length: int) -> bytes:
+        seg = self._segment(run_id)
+        if seg is None:
+            return b""
+        with seg.lock:
+            size, path, compressed = seg.size, seg.path, seg.compressed
+        offset = max(0, int(offset))
+        end = min(size, offset + max(0, int(length)))
+        if offset >= end:
+            return b""
+        try:
+            if compressed:
+                with gzip.open(path, "rb") as f:
+                    f.seek(offset)
+                    return f.read(end - offset)
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                return mm[offset:end]
+        except FileNotFoundError:
+            if not compressed and self._swapped_to_gz(seg):
+                return self.read_bytes(run_id, offset, length)
+            return b""
+
+    @staticmethod
+    def _swapped_to_gz(seg: _Segment) -> bool:
+        with seg.lock:
+            return seg.compressed
+
+    @staticmethod
+    def _cut_lines(buf, pos: int, skip: int, count: int) -> List[str]:
+        # 从索引点 pos 开始跳过 skip 行，再取 count 行；只解码取出来的那一段。
+        for _ in range(skip):
+            pos = buf.find(b"\n", pos) + 1
+        end = pos
+        for _ in range(count):
+            nxt = buf.find(b"\n", end)
+            if nxt < 0:
+                end = len(buf)
+                break
+            end = nxt + 1
+        text = bytes(buf[pos:end]).decode("utf-8", errors="replace")
+        return [ln + "\n" for ln in text.split("\n")[:-1]]
+
+    # ---- internals ----
+
+    def _segment(self, run_id: str, *, create: bool = False) -> Optional[_Segment]:
+        with self._lock:
+            seg = self._segments.get(run_id)
+            if seg is not None:
+                return seg
+            seg = self._load(run_id)
+            if seg is None and create:
+                seg = _Segment(path=self._root / f"{run_id}.log")
+            if seg is not None:
+                self._segments[run_id] = seg
+            return seg
+
+    def _load(self, run_id: str) -> Optional[_Segment]:
+        # 进程重启后，已结束的 run 靠 .idx 文件恢复索引（配合持久化的 StateStore 使用）。
+        idx_path = self._root / f"{run_id}.idx"
+        if not idx_path.exists():
+            log_path = self._root / f"{run_id}.log"
+            # 没有 .idx 但有 .log：上个进程没来得及 close（崩溃 / 被 kill），扫一遍文件重建索引
+            return self._rebuild(log_path) if log_path.exists() else None
+        raw = idx_path.read_bytes()
+        head = array("Q")
+        head.frombytes(raw[:24])
+        lines, size, n = head
+        body = array("Q")
+        body.frombytes(raw[24:24 + 16 * n])
+        gz_path = self._root / f"{run_id}.log.gz"
+        compressed = gz_path.exists()
+        return _Segment(
+            path=gz_path if compressed else self._root / f"{run_id}.log",
+            lines=lines,
+            size=size,
+            idx_lines=body[:n],
+            idx_offsets=body[n:],
+            compressed=compressed,
+        )
+
+    def _rebuild(self, log_path: Path) -> _Segment:
+        seg = _Segment(path=log_path)
+        with open(log_path, "rb") as f:
+            while True:
+                block = f.read(1 << 20)
+                if not block:
+                    break
+                pos = 0
+                while True:
+                    nl = block.find(b"\n", pos)
+                    if nl < 0:
+                        break
+                    seg.lines += 1
+                    pos = nl + 1
+                    if seg.lines - seg.idx_lines[-1] >= self._index_every:
+                        seg.idx_lines.append(seg.lines)
+                        seg.idx_offsets.append(seg.size + pos)
+                seg.size += len(block)
+        logger.info("rebuilt log index for %s (%s lines)", log_path.name, seg.lines)
+        return seg
+
+    def _write_index(self, run_id: str, seg: _Segment) -> None:
+        head = array("Q", [seg.lines, seg.size, len(seg.idx_lines)])
+        tmp = self._root / f"{run_id}.idx.tmp"
+        with open(tmp, "wb") as f:
+            f.write(head.tobytes())
+            f.write(seg.idx_lines.tobytes())
+            f.write(seg.idx_offsets.tobytes())
+        os.replace(tmp, self._root / f"{run_id}.idx")
@@ -0,0 +1,609 @@
+# Redis 版 StateStore：多台机器共用一份 run 状态 + 日志。
+# 和 SqliteStateStore 一个思路：本进程负责执行（或刚创建）的 run 在内存里读写，
+# 变化交给后台 writer 线程，用 pipeline 批量写进 Redis；别的节点上的 run 直接从 Redis 读。
+#
+# key 布局（prefix 默认 "ap:"）：
+#   ap:run:<run_id>    hash   run 的元数据（status / pid / next_seq / node ...）
+#   ap:logs:<run_id>   stream 日志，一条 entry = 连续的一段行；ID = "<first_seq + 1>-0"，按行数封顶
+#   ap:runs            zset   所有 run，score = created_at（list_runs 用）
+#   ap:runs:script:<id>  zset  按 script 分的 run，score 同上（query_runs 用）
+#   ap:runs:status:<s>   zset  按状态分的 run，状态变化时从旧集合挪到新集合
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.schemas.script import RunStatus
+from app.storage.log_spool import LogSpool
+from app.storage.retention import ArchiveHook, RetentionPolicy
+from app.storage.state_store import (
+    InMemoryStateStore,
+    LogSlice,
+    RunKey,
+    RunPage,
+    RunQuery,
+    RunRecord,
+    RunUsage,
+    make_page,
+    progress_from_json,
+    progress_to_json,
+    run_key,
+    split_log_lines,
+)
+
+logger = logging.getLogger("app.redis_store")
+
+# writer 会把同一个 run 相邻的小块拼起来，但一条 stream entry 最多这么多行
+_CHUNK_MAX_LINES = 1024
+
+_OP_RUN = 0  # payload: (run_id, mapping, created_score, finished)
+_OP_LOGS = 1  # payload: (run_id, first_seq, lines)
+_OP_DELETE = 2  # payload: (run_id, script_id)
+_OP_FLUSH = 3  # payload: threading.Event
+_OP_CLOSE = 4
+
+
+def connect(url: str) -> Any:
+    """redis.Redis from a URL; the `redis` package is only needed for this backend."""
+    try:
+        import redis
+    except ImportError as e:
+        raise RuntimeError("AP_STATE_BACKEND=redis needs the `redis` package: pip install redis") from e
+    return redis.Redis.from_url(url, decode_responses=True)
+
+
+def _ts(dt: Optional[datetime]) -> str:
+    return dt.isoformat() if dt is not None else ""
+
+
+def _epoch(dt: datetime) -> float:
+    # created_at 是 naive UTC（datetime.utcnow()）
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _opt_int(raw: Optional[str]) -> Optional[int]:
+    return int(raw) if raw not in (None, "") else None
+
+
+def _score_bound(x: float) -> str:
+    if x == float("inf"):
+        return "+inf"
+    if x == float("-inf"):
+        return "-inf"
+    return repr(x)
+
+
+def _stream_id(first_seq: int) -> str:
+    # stream ID 必须 > 0-0，所以整体 +1
+    return f"{first_seq + 1}-0"
+
+
+class RedisStateStore(InMemoryStateStore):
+    """
+    InMemoryStateStore + Redis mirror, shared by the API and runner nodes.
+
+    - Runs this process owns (created here, or adopted by a runner node with
+      `adopt_run`) are read and written in memory; every change is queued to a
+      writer thread that sends it to Redis in one pipeline per batch.
+    - Runs owned by other processes are read from Redis. Writes to them
+      (e.g. the API cancelling a queued run, the reaper failing a dead node's
+      runs) go straight to Redis.
+    - Log streams are capped at roughly `stream_max_lines` lines (XADD MINID).
+      With a retention TTL, finished runs also get a Redis EXPIRE.
+    - `client` must be created with decode_responses=True; fakeredis works too.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        *,
+        prefix: str = "ap:",
+        logs_max_lines: int = 2000,
+        stream_max_lines: int = 100_000,
+        spool: Optional[LogSpool] = None,
+        retention: Optional[RetentionPolicy] = None,
+        on_evict: Optional[ArchiveHook] = None,
+        flush_interval_s: float = 0.02,
+        max_pending_ops: int = 10000,
+    ) -> None:
+        super().__init__(logs_max_lines, spool=spool, retention=retention, on_evict=on_evict)
+        self.client = client
+        self.prefix = prefix
+        self._stream_max_lines = max(1, int(stream_max_lines))
+        self._flush_interval_s = max(0.0, float(flush_interval_s))
+        self._queue: "queue.Queue[Tuple[int, Any]]" = queue.Queue(maxsize=max(1, int(max_pending_ops)))
+        self._writer_stats = {"batches": 0, "commands": 0, "log_lines": 0, "errors": 0}
+        self._closed = False
+
+        self._writer = threading.Thread(target=self._writer_loop, name="redis-store-writer", daemon=True)
+        self._writer.start()
+
+    # ---- keys ----
+
+    def run_key(self, run_id: str) -> str:
+        return f"{self.prefix}run:{run_id}"
+
+    def logs_key(self, run_id: str) -> str:
+        return f"{self.prefix}logs:{run_id}"
+
+    @property
+    def runs_key(self) -> str:
+        return f"{self.prefix}runs"
+
+    def script_index_key(self, script_id: str) -> str:
+        return f"{self.prefix}runs:script:{script_id}"
+
+    def status_index_key(self, status: RunStatus) -> str:
+        return f"{self.prefix}runs:status:{status.value}"
+
+    # ---- lifecycle ----
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far has been sent to Redis."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put((_OP_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((_OP_CLOSE, None))
+        self._writer.join(timeout=10)
+
+    # ---- ownership ----
+
+    def adopt_run(self, run_id: str, *, node: Optional[str] = None) -> bool:
+        """Take over a run created elsewhere (runner node picking a job from the queue)."""
+        rec = self._load_run(run_id)
+        if rec is None:
+            return False
+        if node is not None:
+            rec.node = node
+        with self._lock:
+            self._runs[run_id] = rec
+            self._index.add(rec)
+        with rec.lock:
+            self._persist_run_locked(rec)
+        return True
+
+    def release_run(self, run_id: str) -> None:
+        """Stop owning a run (API after enqueueing it): later reads/writes go to Redis."""
+        self.flush()
+        with self._lock:
+            live = self._runs.pop(run_id, None)
+            if live is not None:
+                self._index.remove(live)
+            self._forget_finished_locked(run_id)
+
+    # ---- overrides: runs owned elsewhere go straight to Redis ----
+
+    def append_log(self, run_id: str, line: str) -> None:
+        if run_id in self._runs:
+            super().append_log(run_id, line)
+        else:
+            self._remote_append(run_id, [line])
+
+    def append_logs(self, run_id: str, lines: List[str]) -> None:
+        if run_id in self._runs:
+            super().append_logs(run_id, lines)
+        elif lines:
+            self._remote_append(run_id, lines)
+
+    def finish_run(self, run_id: str, *, status: RunStatus, returncode: Optional[int]) -> None:
+        if run_id in self._runs:
+            super().finish_run(run_id, status=status, returncode=returncode)
+            return
+        self._remote_update(
+            run_id,
+            {"status": status.value, "returncode": "" if returncode is None else returncode, "finished_at": _ts(datetime.utcnow())},
+            finished=True,
+        )
+
+    def mark_running(self, run_id: str, *, pid: Optional[int]) -> None:
+        if run_id in self._runs:
+            super().mark_running(run_id, pid=pid)
+        else:
+            self._remote_update(run_id, {"status": RunStatus.running.value, "pid": "" if pid is None else pid})
+
+    def set_status(self, run_id: str, status: RunStatus) -> None:
+        if run_id in self._runs:
+            super().set_status(run_id, status)
+        else:
+            self._remote_update(run_id, {"status": status.value})
+
+    def set_failure_reason(self, run_id: str, reason: str) -> None:
+        if run_id in self._runs:
+            super().set_failure_reason(run_id, reason)
+        elif self.client.exists(self.run_key(run_id)):
+            # 和本地一样先到先得；HSETNX 不认空串，这里先看一眼（远程写很少见，竞争可以接受）
+            if not self.client.hget(self.run_key(run_id), "failure_reason"):
+                self.client.hset(self.run_key(run_id), "failure_reason", reason)
+
+    def delete_run(self, run_id: str) -> None:
+        rec = self.peek_run(run_id)  # 要 script_id 才能清掉按 script 分的索引
+        super().delete_run(run_id)
+        self._queue.put((_OP_DELETE, (run_id, rec.script_id if rec is not None else None)))
+
+    def get_run(self, run_id: str) -> Optional[RunRecord]:
+        rec = super().get_run(run_id)
+        if rec is not None:
+            return rec
+        return self._load_run(run_id)
+
+    def peek_run(self, run_id: str) -> Optional[RunRecord]:
+        rec = super().peek_run(run_id)
+        if rec is not None:
+            return rec
+        return self._load_run(run_id)
+
+    def list_runs(self) -> List[RunRecord]:
+        live = super().list_runs()
+        seen = {rec.run_id for rec in live}
+        remote_ids = [rid for rid in self.client.zrange(self.runs_key, 0, -1) if rid not in seen]
+        out: List[RunRecord] = []
+        if remote_ids:
+            pipe = self.client.pipeline(transaction=False)
+            for rid in remote_ids:
+                pipe.hgetall(self.run_key(rid))
+            gone = []
+            for rid, h in zip(remote_ids, pipe.execute()):
+                if h:
+                    out.append(self._hash_to_record(h))
+                else:
+                    gone.append(rid)  # 过期了，顺手清理索引
+            if gone:
+                self.client.zrem(self.runs_key, *gone)
+        out.extend(live)
+        return out
+
+    def query_runs(self, q: RunQuery) -> RunPage:
+        # 本进程的 run 走内存索引，其它的按 zset 索引从 Redis 取，合并后截一页
+        n = q.limit + 1
+        local = self._query_local(q, n)
+        seen = {rec.run_id for rec in local}
+        stop = run_key(local[-1]) if len(local) >= n else None  # 同 SqliteStateStore.query_runs
+        return make_page(local + self._query_remote(q, n, seen, stop), q)
+
+    def read_logs(self, run_id: str, *, since: Optional[int] = None, limit: int = 200) -> LogSlice:
+        if run_id in self._runs:
+            return super().read_logs(run_id, since=since, limit=limit)
+        rec = self._load_run(run_id)
+        if rec is None:
+            return LogSlice(lines=[], first_seq=0, next_seq=0, truncated=False)
+        limit = max(1, int(limit))
+        next_seq = rec.next_seq
+        if since is None:
+            start, stop = max(0, next_seq - limit), next_seq
+        else:
+            start = min(max(int(since), 0), next_seq)
+            stop = min(start + limit, next_seq)
+        first, lines = self._read_cold(run_id, start, stop)
+        return LogSlice(
+            lines=lines,
+            first_seq=first,
+            next_seq=first + len(lines),
+            truncated=(since is None and first > 0) or first > start,
+        )
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out["backend"] = "redis"
+        out["writer"] = {**self._writer_stats, "pending_ops": self._queue.qsize()}
+        return out
+
+    # ---- persistence hooks ----
+
+    @property
+    def _has_cold_logs(self) -> bool:
+        return True
+
+    def _persist_run_locked(self, rec: RunRecord) -> None:
+        mapping = {
+            "run_id": rec.run_id,
+            "script_id": rec.script_id,
+            "status": rec.status.value,
+            "pid": "" if rec.pid is None else rec.pid,
+            "returncode": "" if rec.returncode is None else rec.returncode,
+            "created_at": _ts(rec.created_at),
+            "finished_at": _ts(rec.finished_at),
+            "next_seq": rec.next_seq,
+            "node": rec.node or "",
+            "failure_reason": rec.failure_reason or "",
+        }
+        if rec.progress is not None:
+            mapping["progress"] = progress_to_json(rec.progress)
+        if rec.usage is not None:
+            mapping.update(
+                peak_rss_mb=rec.usage.peak_rss_mb,
+                cpu_s=rec.usage.cpu_s,
+                io_read_bytes=rec.usage.io_read_bytes,
+                io_write_bytes=rec.usage.io_write_bytes,
+            )
+        self._queue.put((_OP_RUN, (rec.run_id, mapping, _epoch(rec.created_at), rec.finished_at is not None)))
+
+    def _persist_logs_locked(self, rec: RunRecord, first_seq: int, lines: List[str]) -> None:
+        # 本地 spool 照写（本机读得快），stream 给别的节点读
+        super()._persist_logs_locked(rec, first_seq, lines)
+        self._queue.put((_OP_LOGS, (rec.run_id, first_seq, lines)))
+
+    def _read_cold(self, run_id: str, start: int, stop: int) -> Tuple[int, List[str]]:
+        if self._spool is not None:
+            return start, self._spool.read_lines(run_id, start, stop)
+        first, lines = self._select_lines(run_id, start, stop)
+        if len(lines) < stop - first:
+            # 刚被挤出 hot tail 的行可能还在 writer 队列里
+            self.flush(timeout=2.0)
+            first, lines = self._select_lines(run_id, start, stop)
+        # stream 封顶裁掉的行补不回来，first 会晚于 start（调用方据此标 truncated）
+        return first, lines
+
+    def _drop_persisted(self, run_id: str) -> None:
+        # 淘汰只是从本进程内存拿掉，Redis 里的留着（过期交给 EXPIRE）
+        pass
+
+    def _evict(self, victims) -> None:
+        if victims:
+            self.flush(timeout=5.0)
+        super()._evict(victims)
+
+    # ---- redis ----
+
+    def _load_run(self, run_id: str) -> Optional[RunRecord]:
+        h = self.client.hgetall(self.run_key(run_id))
+        return self._hash_to_record(h) if h else None
+
+    def _hash_to_record(self, h: Dict[str, str]) -> RunRecord:
+        return RunRecord(
+            run_id=h["run_id"],
+            script_id=h["script_id"],
+            status=RunStatus(h["status"]),
+            pid=_opt_int(h.get("pid")),
+            returncode=_opt_int(h.get("returncode")),
+            created_at=datetime.fromisoformat(h["created_at"]),
+            finished_at=datetime.fromisoformat(h["finished_at"]) if h.get("finished_at") else None,
+            logs=deque(maxlen=self._logs_max_lines),
+            next_seq=int(h.get("next_seq") or 0),
+            node=h.get("node") or None,
+            usage=RunUsage(
+                peak_rss_mb=float(h.get("peak_rss_mb") or 0.0),
+                cpu_s=float(h["cpu_s"]),
+                io_read_bytes=int(h.get("io_read_bytes") or 0),
+                io_write_bytes=int(h.get("io_write_bytes") or 0),
+            ) if h.get("cpu_s") else None,
+            failure_reason=h.get("failure_reason") or None,
+            progress=progress_from_json(h["progress"]) if h.get("progress") else None,
+        )
+
+    def _query_remote(self, q: RunQuery, n: int, seen: set, stop: Optional[RunKey]) -> List[RunRecord]:
+        # 两个过滤条件都给了的话走 script 的集合（一般比状态集合小），状态在取回来之后再过滤；
+        # 没有 (script, status) 组合的集合，状态变化时要多维护一份，不值得
+        if q.script_id is not None:
+            key = self.script_index_key(q.script_id)
+        elif q.status is not None:
+            key = self.status_index_key(q.status)
+        else:
+            key = self.runs_key
+        after = q.after_key()
+        lo = _epoch(q.created_after) if q.created_after is not None else float("-inf")
+        hi = _epoch(q.created_before) if q.created_before is not None else float("inf")
+        # 游标 / stop 所在那个 score 也要取回来（同一 score 按 run_id 排），精确的比较交给 q.matches / q.sorts_after
+        if q.descending:
+            if after is not None:
+                hi = min(hi, _epoch(after[0]))
+            if stop is not None:
+                lo = max(lo, _epoch(stop[0]))
+        else:
+            if after is not None:
+                lo = max(lo, _epoch(after[0]))
+            if stop is not None:
+                hi = min(hi, _epoch(stop[0]))
+        lo, hi = _score_bound(lo), _score_bound(hi)
+
+        out: List[RunRecord] = []
+        offset = 0
+        while len(out) < n:
+            if q.descending:
+                ids = self.client.zrevrangebyscore(key, hi, lo, start=offset, num=n)
+            else:
+                ids = self.client.zrangebyscore(key, lo, hi, start=offset, num=n)
+            offset += len(ids)
+            todo = [rid for rid in ids if rid not in seen and rid not in self._runs]
+            if todo:
+                pipe = self.client.pipeline(transaction=False)
+                for rid in todo:
+                    pipe.hgetall(self.run_key(rid))
+                gone = []
+                for rid, h in zip(todo, pipe.execute()):
+                    if not h:
+                        gone.append(rid)
+                        continue
+                    rec = self._hash_to_record(h)
+                    if stop is not None and q.sorts_after(run_key(rec), stop):
+                        continue
+                    if q.matches(rec, after):
+                        out.append(rec)
+                        if len(out) >= n:
+                            break
+                if gone:
+                    self._forget(key, gone)
+            if len(ids) < n:
+                break
+        return out
+
+    def _forget(self, index_key: str, run_ids: List[str]) -> None:
+        # hash 已经过期（EXPIRE）的 run：从总索引、状态索引和这次查的索引里拿掉
+        pipe = self.client.pipeline(transaction=False)
+        for key in {index_key, self.runs_key, *(self.status_index_key(st) for st in RunStatus)}:
+            pipe.zrem(key, *run_ids)
+        pipe.execute()
+
+    def _index_status(self, pipe: Any, run_id: str, status: RunStatus, score: float) -> None:
+        pipe.zadd(self.status_index_key(status), {run_id: score})
+        for other in RunStatus:
+            if other != status:
+                pipe.zrem(self.status_index_key(other), run_id)
+
+    def _select_lines(self, run_id: str, start: int, stop: int) -> Tuple[int, List[str]]:
+        """Lines [start, stop) from the stream; returns (seq of lines[0], lines)."""
+        if start >= stop:
+            return start, []
+        key = self.logs_key(run_id)
+        # 包含 start 的那一条 entry = ID <= start+1 里最大的那个
+        head = self.client.xrevrange(key, max=_stream_id(start), min="-", count=1)
+        if head:
+            lo = head[0][0]
+        else:
+            # start 之前的已经被封顶裁掉了：从现存最老的一条开始，仍然给够 stop - start 行
+            oldest = self.client.xrange(key, min="-", max="+", count=1)
+            if not oldest:
+                return start, []
+            lo = oldest[0][0]
+            skipped = max(0, int(lo.split("-", 1)[0]) - 1 - start)
+            start, stop = start + skipped, stop + skipped
+        entries = self.client.xrange(key, min=lo, max=f"{stop}-0")
+        out: List[str] = []
+        first: Optional[int] = None
+        for entry_id, fields in entries:
+            chunk_first = int(entry_id.split("-", 1)[0]) - 1
+            lines = split_log_lines(fields["d"])
+            a = max(0, start - chunk_first)
+            part = lines[a:max(0, stop - chunk_first)]
+            if part and first is None:
+                first = chunk_first + a
+            out.extend(part)
+        return (first if first is not None else start), out
+
+    def _remote_append(self, run_id: str, lines: List[str]) -> None:
+        key = self.run_key(run_id)
+        if not self.client.exists(key):
+            return
+        n = len(lines)
+        first_seq = self.client.hincrby(key, "next_seq", n) - n
+        data = "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+        self.client.xadd(
+            self.logs_key(run_id),
+            {"n": n, "d": data},
+            id=_stream_id(first_seq),
+            minid=_stream_id(max(0, first_seq + n - self._stream_max_lines)),
+            approximate=True,
+        )
+
+    def _remote_update(self, run_id: str, mapping: Dict[str, Any], *, finished: bool = False) -> None:
+        key = self.run_key(run_id)
+        if not self.client.exists(key):
+            return
+        score = self.client.zscore(self.runs_key, run_id) if "status" in mapping else None
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(key, mapping=mapping)
+        if score is not None:
+            self._index_status(pipe, run_id, RunStatus(mapping["status"]), score)
+        if finished:
+            self._expire_finished(pipe, run_id)
+        pipe.execute()
+
+    def _expire_finished(self, pipe: Any, run_id: str) -> None:
+        ttl = self._retention.finished_ttl_s
+        if ttl is not None:
+            ttl_ms = max(1, int(ttl * 1000))
+            pipe.pexpire(self.run_key(run_id), ttl_ms)
+            pipe.pexpire(self.logs_key(run_id), ttl_ms)
+
+    def _writer_loop(self) -> None:
+        closing = False
+        while not closing:
+            ops = [self._queue.get()]
+            deadline = time.monotonic() + self._flush_interval_s
+            while ops[-1][0] not in (_OP_FLUSH, _OP_CLOSE) and len(ops) < 5000:
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        op = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                ops.append(op)
+
+            closing = ops[-1][0] == _OP_CLOSE
+            try:
+                self._write_batch(ops)
+            except Exception:
+                self._writer_stats["errors"] += 1
+                logger.exception("redis store: failed to write a batch of %s ops", len(ops))
+            for kind, payload in ops:
+                if kind == _OP_FLUSH:
+                    payload.set()
+
+    def _write_batch(self, ops: List[Tuple[int, Any]]) -> None:
+        runs: Dict[str, tuple] = {}  # 同一个 run 一批里改了几次，只写最后一次
+        chunks: Dict[str, List[list]] = {}  # run_id -> [[first_seq, lines], ...]
+        deletes: List[Tuple[str, Optional[str]]] = []
+        n_lines = 0
+        for kind, payload in ops:
+            if kind == _OP_RUN:
+                runs[payload[0]] = payload
+            elif kind == _OP_LOGS:
+                run_id, first_seq, lines = payload
+                n_lines += len(lines)
+                pending = chunks.setdefault(run_id, [])
+                last = pending[-1] if pending else None
+                if last is not None and last[0] + len(last[1]) == first_seq and len(last[1]) < _CHUNK_MAX_LINES:
+                    last[1].extend(lines)
+                else:
+                    pending.append([first_seq, list(lines)])
+            elif kind == _OP_DELETE:
+                runs.pop(payload[0], None)
+                chunks.pop(payload[0], None)
+                deletes.append(payload)
+        if not (runs or chunks or deletes):
+            return
+
+        pipe = self.client.pipeline(transaction=True)
+        for run_id, mapping, score, finished in runs.values():
+            pipe.hset(self.run_key(run_id), mapping=mapping)
+            pipe.zadd(self.runs_key, {run_id: score}, nx=True)
+            pipe.zadd(self.script_index_key(mapping["script_id"]), {run_id: score}, nx=True)
+            self._index_status(pipe, run_id, RunStatus(mapping["status"]), score)
+            if finished:
+                self._expire_finished(pipe, run_id)
+        for run_id, pending in chunks.items():
+            key = self.logs_key(run_id)
+            for first_seq, lines in pending:
+                end = first_seq + len(lines)
+                pipe.xadd(
+                    key,
+                    {"n": len(lines), "d": "".join(lines)},
+                    id=_stream_id(first_seq),
+                    minid=_stream_id(max(0, end - self._stream_max_lines)),
+                    approximate=True,
+                )
+            # 别的节点靠 next_seq 知道有多少行；run 快照里的 next_seq 可能比这批日志旧
+            snap = runs.get(run_id)
+            end = max(pending[-1][0] + len(pending[-1][1]), int(snap[1]["next_seq"]) if snap else 0)
+            pipe.hset(self.run_key(run_id), "next_seq", end)
+        for run_id, script_id in deletes:
+            pipe.delete(self.run_key(run_id), self.logs_key(run_id))
+            pipe.zrem(self.runs_key, run_id)
+            if script_id is not None:
+                pipe.zrem(self.script_index_key(script_id), run_id)
+            for st in RunStatus:
+                pipe.zrem(self.status_index_key(st), run_id)
+
+        results = pipe.execute(raise_on_error=False)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            self._writer_stats["errors"] += len(errors)
+            logger.warning("redis store: %s commands failed in a batch, first: %s", len(errors), errors[0])
+        self._writer_stats["batches"] += 1
+        self._writer_stats["commands"] += len(results)
+        self._writer_stats["log_lines"] += n_lines
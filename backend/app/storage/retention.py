@@ -0,0 +1,95 @@
+# 已结束 run 的保留策略：最多留多少个、留多久、日志最多占多少内存。
+# 超出就从最早结束的开始淘汰；淘汰前可以先交给 archive hook 存档（比如写到磁盘）。
+from __future__ import annotations
+
+import json
+import logging
+import shutil
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from app.storage.log_spool import LogSpool
+    from app.storage.state_store import RunRecord
+
+logger = logging.getLogger("app.retention")
+
+# 被淘汰的 run 在真正删除之前会交给这个回调，回调抛异常也照样删（只计数 + 打日志）。
+ArchiveHook = Callable[["RunRecord"], None]
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    max_finished_runs: Optional[int] = None
+    finished_ttl_s: Optional[float] = None
+    max_log_bytes: Optional[int] = None  # 已结束 run 的内存日志总量上限（按字符数估算）
+
+    @property
+    def enabled(self) -> bool:
+        return any(v is not None for v in (self.max_finished_runs, self.finished_ttl_s, self.max_log_bytes))
+
+
+class DirectoryArchiver:
+    """
+    Archive hook: one `<run_id>.json` per evicted run (metadata + in-memory log tail).
+    With a LogSpool, the full log segment and its index are copied next to it.
+    """
+
+    def __init__(self, root: Path, *, spool: Optional["LogSpool"] = None) -> None:
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._spool = spool
+
+    def __call__(self, rec: "RunRecord") -> None:
+        from app.storage.state_store import progress_to_json  # state_store 也 import 这个模块
+
+        doc = {
+            "run_id": rec.run_id,
+            "script_id": rec.script_id,
+            "status": rec.status.value,
+            "pid": rec.pid,
+            "returncode": rec.returncode,
+            "created_at": rec.created_at.isoformat(),
+            "finished_at": rec.finished_at.isoformat() if rec.finished_at else None,
+            "next_seq": rec.next_seq,
+            "usage": asdict(rec.usage) if rec.usage is not None else None,
+            "failure_reason": rec.failure_reason,
+            "progress": json.loads(progress_to_json(rec.progress)) if rec.progress is not None else None,
+            "log_tail": list(rec.logs),
+        }
+        tmp = self._root / f"{rec.run_id}.json.tmp"
+        tmp.write_text(json.dumps(doc, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self._root / f"{rec.run_id}.json")
+
+        if self._spool is not None:
+            try:
+                self._copy_segment(rec.run_id)
+            except FileNotFoundError:
+                # 后台压缩刚好把 .log 换成了 .gz，按新的文件列表再拷一次
+                self._copy_segment(rec.run_id)
+
+    def _copy_segment(self, run_id: str) -> None:
+        assert self._spool is not None
+        for src in self._spool.segment_files(run_id):
+            shutil.copy2(src, self._root / src.name)
+
+
+def start_sweeper(sweep: Callable[[], int], interval_s: float, *, what: str = "finished runs") -> threading.Thread:
+    """Daemon thread calling `sweep()` every `interval_s` (so TTL applies on an idle server too)."""
+
+    def loop() -> None:
+        while True:
+            time.sleep(interval_s)
+            try:
+                n = sweep()
+                if n:
+                    logger.info("retention sweep evicted %s %s", n, what)
+            except Exception:
+                logger.exception("retention sweep failed")
+
+    t = threading.Thread(target=loop, name="store-retention", daemon=True)
+    t.start()
+    return t
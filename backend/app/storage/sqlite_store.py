@@ -0,0 +1,503 @@
+# SQLite 持久化的 StateStore：API 重启之后 run 历史还在。
+# 读写路径和 InMemoryStateStore 一样走内存（活着的 run 全在内存里），
+# 所有变化再交给一个后台 writer 线程，攒成一批在一个事务里写进 SQLite（WAL 模式）。
+# 这样 runner 的日志摄取线程永远不等磁盘，一次 commit 摊到几千行上。
+from __future__ import annotations
+
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.schemas.script import RunStatus
+from app.storage.log_spool import LogSpool
+from app.storage.retention import ArchiveHook, RetentionPolicy
+from app.storage.state_store import (
+    InMemoryStateStore,
+    LogSlice,
+    RunKey,
+    RunPage,
+    RunQuery,
+    RunRecord,
+    RunUsage,
+    make_page,
+    progress_from_json,
+    progress_to_json,
+    run_key,
+    split_log_lines,
+)
+
+logger = logging.getLogger("app.sqlite_store")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    script_id   TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    pid         INTEGER,
+    returncode  INTEGER,
+    created_at  TEXT NOT NULL,
+    finished_at TEXT,
+    next_seq    INTEGER NOT NULL DEFAULT 0,
+    peak_rss_mb REAL,
+    cpu_s       REAL,
+    io_read_bytes  INTEGER,
+    io_write_bytes INTEGER,
+    failure_reason TEXT,
+    progress    TEXT
+);
+-- 列表查询按 (created_at, run_id) 做 keyset 翻页，过滤列放在前面，一页只扫一小段索引
+DROP INDEX IF EXISTS idx_runs_script_id;
+DROP INDEX IF EXISTS idx_runs_status;
+DROP INDEX IF EXISTS idx_runs_created_at;
+CREATE INDEX IF NOT EXISTS idx_runs_script_created ON runs(script_id, created_at, run_id);
+CREATE INDEX IF NOT EXISTS idx_runs_status_created ON runs(status, created_at, run_id);
+CREATE INDEX IF NOT EXISTS idx_runs_script_status_created ON runs(script_id, status, created_at, run_id);
+CREATE INDEX IF NOT EXISTS idx_runs_created ON runs(created_at, run_id);
+
+-- 日志按块存：一行记录 = 连续的一段行（拼成一个字符串），first_seq 是第一行的序号。
+-- 一行日志一条记录的话，插入 / 索引的开销比日志本身还大。
+CREATE TABLE IF NOT EXISTS run_log_chunks (
+    run_id    TEXT NOT NULL,
+    first_seq INTEGER NOT NULL,
+    n_lines   INTEGER NOT NULL,
+    data      TEXT NOT NULL,
+    PRIMARY KEY (run_id, first_seq)
+) WITHOUT ROWID;
+"""
+
+# writer 会把同一个 run 相邻的小块拼起来，但一块最多这么多行（读一小段时不用解整块太大的文本）
+_CHUNK_MAX_LINES = 1024
+
+_RUN_COLUMNS = (
+    "run_id, script_id, status, pid, returncode, created_at, finished_at, next_seq, "
+    "peak_rss_mb, cpu_s, io_read_bytes, io_write_bytes, failure_reason, progress"
+)
+_RUN_PLACEHOLDERS = ", ".join("?" * len(_RUN_COLUMNS.split(",")))
+# 旧版本建的库没有这些列，启动时补上
+_ADDED_COLUMNS = {
+    "peak_rss_mb": "REAL",
+    "cpu_s": "REAL",
+    "io_read_bytes": "INTEGER",
+    "io_write_bytes": "INTEGER",
+    "failure_reason": "TEXT",
+    "progress": "TEXT",  # RunProgress 的 JSON
+}
+
+# writer 队列里的操作
+_OP_RUN = 0  # payload: runs 表的一整行（tuple）
+_OP_LOGS = 1  # payload: (run_id, first_seq, lines)
+_OP_DELETE = 2  # payload: run_id
+_OP_FLUSH = 3  # payload: threading.Event，写完这一批之后 set
+_OP_CLOSE = 4
+
+
+def _ts(dt: Optional[datetime]) -> Optional[str]:
+    return dt.isoformat() if dt is not None else None
+
+
+def _run_row(rec: RunRecord) -> tuple:
+    u = rec.usage
+    return (
+        rec.run_id,
+        rec.script_id,
+        rec.status.value,
+        rec.pid,
+        rec.returncode,
+        _ts(rec.created_at),
+        _ts(rec.finished_at),
+        rec.next_seq,
+        u.peak_rss_mb if u else None,
+        u.cpu_s if u else None,
+        u.io_read_bytes if u else None,
+        u.io_write_bytes if u else None,
+        rec.failure_reason,
+        progress_to_json(rec.progress) if rec.progress is not None else None,
+    )
+
+
+class SqliteStateStore(InMemoryStateStore):
+    """
+    InMemoryStateStore + SQLite persistence.
+
+    - Live runs are served from memory exactly like InMemoryStateStore.
+    - Every state change and log batch is queued to one writer thread, which
+      groups up to `batch_max_rows` rows (or whatever arrived within
+      `flush_interval_s`) into a single transaction. The queue is bounded, so a
+      writer that falls behind slows ingestion down instead of growing memory.
+    - Runs that are not in memory (evicted by the retention policy, or from a
+      previous process) are read back from the database.
+    - Retention eviction only frees memory; rows and spool files stay on disk.
+    - With a LogSpool, log lines live in the spool files and SQLite only keeps
+      run metadata. Without one, lines go to `run_log_chunks`, one row per
+      contiguous chunk of lines.
+    - On startup, runs left queued/running by a previous process are marked failed.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        logs_max_lines: int = 2000,
+        *,
+        spool: Optional[LogSpool] = None,
+        retention: Optional[RetentionPolicy] = None,
+        on_evict: Optional[ArchiveHook] = None,
+        batch_max_rows: int = 20000,
+        flush_interval_s: float = 0.05,
+        max_pending_ops: int = 10000,
+    ) -> None:
+        super().__init__(logs_max_lines, spool=spool, retention=retention, on_evict=on_evict)
+        self._db_path = Path(db_path)
+        self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._batch_max_rows = max(1, int(batch_max_rows))
+        self._flush_interval_s = max(0.0, float(flush_interval_s))
+        self._queue: "queue.Queue[Tuple[int, object]]" = queue.Queue(maxsize=max(1, int(max_pending_ops)))
+        self._local = threading.local()  # 每个读线程一个连接（sqlite3 连接不能跨线程用）
+        self._writer_stats = {"batches": 0, "rows": 0, "log_lines": 0, "errors": 0}
+        self._closed = False
+
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        self._migrate(conn)
+        self._recover_orphans(conn)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._writer_loop, name="sqlite-store-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # ---- lifecycle ----
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far is committed."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put((_OP_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((_OP_CLOSE, None))
+        self._writer.join(timeout=10)
+
+    # ---- overrides ----
+
+    def delete_run(self, run_id: str) -> None:
+        super().delete_run(run_id)
+        self._queue.put((_OP_DELETE, run_id))
+
+    def get_run(self, run_id: str) -> Optional[RunRecord]:
+        rec = super().get_run(run_id)
+        if rec is not None:
+            return rec
+        return self._load_run(run_id)
+
+    def peek_run(self, run_id: str) -> Optional[RunRecord]:
+        rec = super().peek_run(run_id)
+        if rec is not None:
+            return rec
+        return self._load_run(run_id)
+
+    def list_runs(self) -> List[RunRecord]:
+        live = super().list_runs()
+        seen = {rec.run_id for rec in live}
+        rows = self._reader().execute(f"SELECT {_RUN_COLUMNS} FROM runs ORDER BY created_at").fetchall()
+        out = [self._row_to_record(row) for row in rows if row[0] not in seen]
+        out.extend(live)
+        return out
+
+    def query_runs(self, q: RunQuery) -> RunPage:
+        # 内存里的 run 以内存为准；库里再按同样的条件 / 顺序取，跳过还在内存里的，两边合并后截一页
+        n = q.limit + 1
+        local = self._query_local(q, n)
+        seen = {rec.run_id for rec in local}
+        # 内存已经凑够 n 条的话，库里排在内存第 n 条之后的行不可能进这一页，扫到那里就停
+        stop = run_key(local[-1]) if len(local) >= n else None
+        return make_page(local + self._query_db(q, n, seen, stop), q)
+
+    def read_logs(self, run_id: str, *, since: Optional[int] = None, limit: int = 200) -> LogSlice:
+        if run_id in self._runs:
+            return super().read_logs(run_id, since=since, limit=limit)
+        rec = self._load_run(run_id)
+        if rec is None:
+            return LogSlice(lines=[], first_seq=0, next_seq=0, truncated=False)
+        limit = max(1, int(limit))
+        next_seq = rec.next_seq
+        if since is None:
+            start, stop = max(0, next_seq - limit), next_seq
+        else:
+            start = min(max(int(since), 0), next_seq)
+            stop = min(start + limit, next_seq)
+        first, lines = self._read_cold(run_id, start, stop)
+        return LogSlice(
+            lines=lines,
+            first_seq=first,
+            next_seq=first + len(lines),
+            truncated=since is None and first > 0,
+        )
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out["backend"] = "sqlite"
+        out["writer"] = {**self._writer_stats, "pending_ops": self._queue.qsize()}
+        return out
+
+    # ---- persistence hooks ----
+
+    @property
+    def _has_cold_logs(self) -> bool:
+        return True
+
+    def _persist_run_locked(self, rec: RunRecord) -> None:
+        self._queue.put((_OP_RUN, _run_row(rec)))
+
+    def _persist_logs_locked(self, rec: RunRecord, first_seq: int, lines: List[str]) -> None:
+        if self._spool is not None:
+            self._spool.append(rec.run_id, lines)
+            return
+        self._queue.put((_OP_LOGS, (rec.run_id, first_seq, lines)))
+
+    def _read_cold(self, run_id: str, start: int, stop: int) -> Tuple[int, List[str]]:
+        if self._spool is not None:
+            return start, self._spool.read_lines(run_id, start, stop)
+        lines = self._select_lines(run_id, start, stop)
+        if len(lines) < stop - start:
+            # 刚被挤出 hot tail 的行可能还在 writer 队列里（或者正在攒批）
+            self.flush(timeout=2.0)
+            lines = self._select_lines(run_id, start, stop)
+        return start, lines
+
+    def _drop_persisted(self, run_id: str) -> None:
+        # 淘汰只是从内存里拿掉，库里和日志文件都留着
+        pass
+
+    def _evict(self, victims) -> None:
+        if victims:
+            # 从内存拿掉之前保证最终状态已经落库，不然 get_run 会短暂读到旧状态
+            self.flush(timeout=5.0)
+        super()._evict(victims)
+
+    # ---- sqlite ----
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self._db_path), timeout=30.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL：commit 不 fsync（checkpoint 时才 fsync），断电最多丢最后几批，不会损坏库
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=1")
+            self._local.conn = conn
+        return conn
+
+    def _select_lines(self, run_id: str, start: int, stop: int) -> List[str]:
+        conn = self._reader()
+        # 先找包含 start 的那一块，再顺着主键往后取到 stop
+        head = conn.execute(
+            "SELECT first_seq FROM run_log_chunks WHERE run_id = ? AND first_seq <= ? ORDER BY first_seq DESC LIMIT 1",
+            (run_id, start),
+        ).fetchone()
+        lo = head[0] if head is not None else start
+        rows = conn.execute(
+            "SELECT first_seq, data FROM run_log_chunks WHERE run_id = ? AND first_seq >= ? AND first_seq < ? ORDER BY first_seq",
+            (run_id, lo, stop),
+        ).fetchall()
+        out: List[str] = []
+        for first_seq, data in rows:
+            lines = split_log_lines(data)
+            out.extend(lines[max(0, start - first_seq):max(0, stop - first_seq)])
+        return out
+
+    def _query_db(self, q: RunQuery, n: int, seen: set, stop: Optional[RunKey]) -> List[RunRecord]:
+        conds, args = [], []
+        if q.script_id is not None:
+            conds.append("script_id = ?")
+            args.append(q.script_id)
+        if q.status is not None:
+            conds.append("status = ?")
+            args.append(q.status.value)
+        if q.created_after is not None:
+            conds.append("created_at >= ?")
+            args.append(_ts(q.created_after))
+        if q.created_before is not None:
+            conds.append("created_at < ?")
+            args.append(_ts(q.created_before))
+        op, order = ("<", "DESC") if q.descending else (">", "ASC")
+        sql = (
+            f"SELECT {_RUN_COLUMNS} FROM runs WHERE "
+            + " AND ".join(conds + [f"(created_at {op} ? OR (created_at = ? AND run_id {op} ?))"])
+            + f" ORDER BY created_at {order}, run_id {order} LIMIT ?"
+        )
+        after = q.after_key()
+        out: List[RunRecord] = []
+        conn = self._reader()
+        while len(out) < n:
+            if after is None:
+                # 第一页：用一个排在所有数据之外的游标，省得拼两套 SQL
+                key_args = ["9999", "9999", ""] if q.descending else ["", "", ""]
+            else:
+                key_args = [_ts(after[0]), _ts(after[0]), after[1]]
+            rows = conn.execute(sql, (*args, *key_args, n)).fetchall()
+            for row in rows:
+                if stop is not None and q.sorts_after((datetime.fromisoformat(row[5]), row[0]), stop):
+                    return out
+                # 还在内存里的 run，库里那行可能是旧状态
+                if row[0] in seen or row[0] in self._runs:
+                    continue
+                out.append(self._row_to_record(row))
+                if len(out) >= n:
+                    break
+            if len(rows) < n:
+                break
+            last = rows[-1]
+            after = (datetime.fromisoformat(last[5]), last[0])
+        return out
+
+    def _load_run(self, run_id: str) -> Optional[RunRecord]:
+        row = self._reader().execute(f"SELECT {_RUN_COLUMNS} FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return self._row_to_record(row) if row is not None else None
+
+    def _row_to_record(self, row: tuple) -> RunRecord:
+        run_id, script_id, status, pid, returncode, created_at, finished_at, next_seq = row[:8]
+        peak_rss_mb, cpu_s, io_read, io_write, failure_reason, progress = row[8:]
+        if self._spool is not None:
+            # 进程被 kill 的 run，库里的 next_seq 可能落后于日志文件
+            next_seq = max(next_seq, self._spool.line_count(run_id))
+        return RunRecord(
+            run_id=run_id,
+            script_id=script_id,
+            status=RunStatus(status),
+            pid=pid,
+            returncode=returncode,
+            created_at=datetime.fromisoformat(created_at),
+            finished_at=datetime.fromisoformat(finished_at) if finished_at else None,
+            logs=deque(maxlen=self._logs_max_lines),
+            next_seq=next_seq,
+            usage=RunUsage(peak_rss_mb or 0.0, cpu_s or 0.0, io_read or 0, io_write or 0) if cpu_s is not None else None,
+            failure_reason=failure_reason,
+            progress=progress_from_json(progress) if progress else None,
+        )
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        have = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+        for name, decl in _ADDED_COLUMNS.items():
+            if name not in have:
+                conn.execute(f"ALTER TABLE runs ADD COLUMN {name} {decl}")
+
+    def _recover_orphans(self, conn: sqlite3.Connection) -> None:
+        # 上一个进程留下的 queued/running：进程已经不在了，统一标成 failed。
+        # next_seq 只在状态变化时写，日志在表里的话按实际行数补上。
+        now = _ts(datetime.utcnow())
+        cur = conn.execute(
+            """
+            UPDATE runs
+               SET status = ?,
+                   finished_at = ?,
+                   failure_reason = COALESCE(failure_reason, ?),
+                   next_seq = MAX(next_seq, COALESCE(
+                       (SELECT MAX(first_seq + n_lines) FROM run_log_chunks c WHERE c.run_id = runs.run_id), 0))
+             WHERE status IN (?, ?)
+            """,
+            (RunStatus.failed.value, now, "server restarted while the run was active", RunStatus.queued.value, RunStatus.running.value),
+        )
+        if cur.rowcount:
+            logger.warning("marked %s runs from a previous process as failed", cur.rowcount)
+
+    def _writer_loop(self) -> None:
+        conn = self._connect()
+        closing = False
+        while not closing:
+            ops = [self._queue.get()]
+            rows = 0
+            deadline = time.monotonic() + self._flush_interval_s
+            # 攒一批：凑够 batch_max_rows 行，或者等满 flush_interval_s，或者遇到 flush/close 就写
+            while rows < self._batch_max_rows and ops[-1][0] not in (_OP_FLUSH, _OP_CLOSE):
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        op = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                ops.append(op)
+                rows += len(op[1][2]) if op[0] == _OP_LOGS else 1
+
+            closing = ops[-1][0] == _OP_CLOSE
+            try:
+                self._write_batch(conn, ops)
+            except Exception:
+                self._writer_stats["errors"] += 1
+                logger.exception("sqlite store: failed to write a batch of %s ops", len(ops))
+            for kind, payload in ops:
+                if kind == _OP_FLUSH:
+                    payload.set()
+        conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, ops: List[Tuple[int, object]]) -> None:
+        runs: Dict[str, tuple] = {}  # 同一个 run 一批里改了几次，只写最后一次
+        chunks: Dict[str, List[list]] = {}  # run_id -> [[first_seq, lines], ...]
+        deletes: List[str] = []
+        n_lines = 0
+        for kind, payload in ops:
+            if kind == _OP_RUN:
+                runs[payload[0]] = payload
+            elif kind == _OP_LOGS:
+                run_id, first_seq, lines = payload
+                n_lines += len(lines)
+                pending = chunks.setdefault(run_id, [])
+                last = pending[-1] if pending else None
+                # 和上一块首尾相接就拼在一起（同一个 run 的 seq 是连续分配的，一般都能拼上）
+                if last is not None and last[0] + len(last[1]) == first_seq and len(last[1]) < _CHUNK_MAX_LINES:
+                    last[1].extend(lines)
+                else:
+                    pending.append([first_seq, list(lines)])
+            elif kind == _OP_DELETE:
+                runs.pop(payload, None)
+                chunks.pop(payload, None)
+                deletes.append(payload)
+        if not (runs or chunks or deletes):
+            return
+        log_rows = [
+            (run_id, first_seq, len(lines), "".join(lines))
+            for run_id, pending in chunks.items()
+            for first_seq, lines in pending
+        ]
+
+        conn.execute("BEGIN")
+        try:
+            if runs:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO runs ({_RUN_COLUMNS}) VALUES ({_RUN_PLACEHOLDERS})",
+                    list(runs.values()),
+                )
+            if log_rows:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO run_log_chunks (run_id, first_seq, n_lines, data) VALUES (?, ?, ?, ?)",
+                    log_rows,
+                )
+            for run_id in deletes:
+                conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+                conn.execute("DELETE FROM run_log_chunks WHERE run_id = ?", (run_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._writer_stats["batches"] += 1
+        self._writer_stats["rows"] += len(runs) + len(log_rows) + len(deletes)
+        self._writer_stats["log_lines"] += n_lines
@@ -1,13 +1,73 @@
 # 这就是“后端平台的内存状态层”。先用内存，后面换 Redis 不改变上层 API 结构。
 from __future__ import annotations
 
-from dataclasses import dataclass
+import base64
+import json
+import logging
+import sys
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import asdict, dataclass, field, replace
 from datetime import datetime
-from collections import deque
+from collections import OrderedDict, deque
+from itertools import islice
 from threading import Lock
-from typing import Deque, Dict, Optional, List
+from typing import Any, Deque, Dict, Iterator, Optional, List, Protocol, Tuple
 
+from app.core.metrics import store_lock
 from app.schemas.script import RunStatus
+from app.storage.log_spool import LogSpool
+from app.storage.retention import ArchiveHook, RetentionPolicy
+
+logger = logging.getLogger("app.state_store")
+
+
+@dataclass(frozen=True)
+class RunUsage:
+    # 资源采样器（services/resources.py）从 /proc 读到的累计值；每次采样整体替换，不原地改
+    peak_rss_mb: float = 0.0
+    cpu_s: float = 0.0  # user + system
+    io_read_bytes: int = 0
+    io_write_bytes: int = 0
+
+
+@dataclass(frozen=True)
+class RunProgress:
+    # 脚本通过事件通道（services/run_events.py）上报的最新状态；每来一个事件整体替换，不原地改
+    current: Optional[float] = None
+    total: Optional[float] = None
+    message: Optional[str] = None
+    counters: Dict[str, float] = field(default_factory=dict)
+    result: Any = None  # 脚本最后一次 result(...) 的内容
+    history: Tuple[Dict[str, Any], ...] = ()  # 最近的事件（连续的同一条 progress 只留最后一个）
+    events: int = 0  # 一共收到多少个事件
+    updated_at: Optional[datetime] = None
+
+    @property
+    def percent(self) -> Optional[float]:
+        if self.current is None or not self.total:
+            return None
+        return round(min(100.0, max(0.0, 100.0 * self.current / self.total)), 1)
+
+
+def progress_to_json(p: RunProgress) -> str:
+    d = asdict(p)
+    d["updated_at"] = p.updated_at.isoformat() if p.updated_at is not None else None
+    return json.dumps(d, ensure_ascii=False)
+
+
+def progress_from_json(raw: str) -> RunProgress:
+    d = json.loads(raw)
+    ts = d.get("updated_at")
+    return RunProgress(
+        current=d.get("current"),
+        total=d.get("total"),
+        message=d.get("message"),
+        counters=d.get("counters") or {},
+        result=d.get("result"),
+        history=tuple(d.get("history") or ()),
+        events=int(d.get("events") or 0),
+        updated_at=datetime.fromisoformat(ts) if ts else None,
+    )
 
 
 @dataclass
@@ -25,82 +85,682 @@ class RunRecord:
     # deque 是一个“为频繁追加而生的容器”，可以把它理解成：“更适合当日志缓冲区的 list”。
     # 如果用普通的list的话，可能会无限长，删前面的很慢。
     # logs = deque(maxlen=2000)的意思是：最多只保留 2000 行，新日志进来的话自动丢掉最旧的。
+    next_seq: int = 0
+    # 每一行日志都有一个单调递增的序号 seq（从 0 开始）。next_seq = 下一行会拿到的序号 = 总共写过多少行。
+    # deque 里第一行的序号 = next_seq - len(logs)。客户端拿着 since=<seq> 就能只要“上次之后的新行”。
+    log_bytes: int = 0
+    # run 结束时算一次：内存里这段日志大概占多少字节（给保留策略的内存预算用）。
+    accessed: bool = False
+    # 被 API 读过（get_run）就置 True；淘汰时用来做“第二次机会”（近似 LRU），不用每次读都去挪链表、抢全局锁。
+    node: Optional[str] = None
+    # 多机部署时是哪个 runner 节点在跑（RedisStateStore + runner_node），单机为 None。
+    usage: Optional[RunUsage] = None
+    # 没开资源采样、或者进程还没被采到时为 None。
+    failure_reason: Optional[str] = None
+    # failed / stopped 的原因（超时、超过资源上限、节点失联……），正常退出为 None。
+    progress: Optional[RunProgress] = None
+    # 脚本没上报过事件时为 None。
+    lock: Lock = field(default_factory=Lock, repr=False, compare=False)
+    # 每个 run 自己一把锁：写日志 / 改状态只锁自己这条记录，不同 run 之间互不阻塞。
+
+
+@dataclass
+class LogSlice:
+    lines: List[str]
+    first_seq: int  # lines[0] 的序号
+    next_seq: int  # 下次 since= 用这个
+    truncated: bool  # 前面还有更早的行（tail 模式），或者 since 指向的行已经被挤出缓冲区
+
+
+# 列表排序 / 翻页用的键：(created_at, run_id)。run_id 保证同一时刻创建的 run 也有确定的先后。
+RunKey = Tuple[datetime, str]
+
+
+def run_key(rec: RunRecord) -> RunKey:
+    return (rec.created_at, rec.run_id)
+
+
+def encode_cursor(key: RunKey) -> str:
+    raw = f"{key[0].isoformat()}|{key[1]}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> RunKey:
+    """Inverse of encode_cursor; raises ValueError on garbage."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        ts, run_id = raw.split("|", 1)
+        return (datetime.fromisoformat(ts), run_id)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+@dataclass
+class RunQuery:
+    script_id: Optional[str] = None
+    status: Optional[RunStatus] = None
+    created_after: Optional[datetime] = None  # 含
+    created_before: Optional[datetime] = None  # 不含
+    cursor: Optional[str] = None  # 上一页返回的 next_cursor
+    limit: int = 50
+    descending: bool = True  # 默认新的在前
+
+    def after_key(self) -> Optional[RunKey]:
+        return decode_cursor(self.cursor) if self.cursor else None
+
+    def sorts_after(self, key: RunKey, other: RunKey) -> bool:
+        # 按这个查询的顺序，key 是否排在 other 后面
+        return key < other if self.descending else key > other
+
+    def matches(self, rec: RunRecord, after: Optional[RunKey] = None) -> bool:
+        # 给“从库里 / Redis 里捞出来的行”做最后一道过滤；内存索引本身已经按这些条件缩小了范围
+        if self.script_id is not None and rec.script_id != self.script_id:
+            return False
+        if self.status is not None and rec.status != self.status:
+            return False
+        if self.created_after is not None and rec.created_at < self.created_after:
+            return False
+        if self.created_before is not None and rec.created_at >= self.created_before:
+            return False
+        if after is not None and not self.sorts_after(run_key(rec), after):
+            return False
+        return True
+
+
+@dataclass
+class RunPage:
+    records: List[RunRecord]
+    next_cursor: Optional[str]  # None = 没有下一页了
+
+
+def make_page(recs: List[RunRecord], q: RunQuery) -> RunPage:
+    """Order candidates (from one or several sources), cut to q.limit and compute the next cursor."""
+    recs = sorted(recs, key=run_key, reverse=q.descending)
+    if len(recs) <= q.limit:
+        return RunPage(records=recs, next_cursor=None)
+    recs = recs[:q.limit]
+    return RunPage(records=recs, next_cursor=encode_cursor(run_key(recs[-1])))
+
+
+class _RunIndex:
+    """
+    Secondary indexes for InMemoryStateStore: sorted RunKey lists over all runs,
+    per script_id, per status and per (script_id, status). Queries walk one list
+    from the cursor position, so a page costs O(log n + page) instead of a full scan.
+    """
+
+    def __init__(self) -> None:
+        self.by_time: List[RunKey] = []
+        self.by_script: Dict[str, List[RunKey]] = {}
+        self.by_status: Dict[RunStatus, List[RunKey]] = {}
+        self.by_script_status: Dict[Tuple[str, RunStatus], List[RunKey]] = {}
+        self._status: Dict[str, RunStatus] = {}  # 索引里记的是哪个状态（可能落后于 rec.status，restatus 时追上）
+
+    def add(self, rec: RunRecord) -> None:
+        key = run_key(rec)
+        insort(self.by_time, key)  # created_at 基本单调递增，实际上几乎总是追加到末尾
+        insort(self.by_script.setdefault(rec.script_id, []), key)
+        insort(self.by_status.setdefault(rec.status, []), key)
+        insort(self.by_script_status.setdefault((rec.script_id, rec.status), []), key)
+        self._status[rec.run_id] = rec.status
+
+    def remove(self, rec: RunRecord) -> None:
+        status = self._status.pop(rec.run_id, None)
+        if status is None:
+            return
+        key = run_key(rec)
+        _remove_key(self.by_time, key)
+        _remove_key(self.by_script, key, rec.script_id)
+        _remove_key(self.by_status, key, status)
+        _remove_key(self.by_script_status, key, (rec.script_id, status))
+
+    def restatus(self, rec: RunRecord) -> None:
+        old = self._status.get(rec.run_id)
+        new = rec.status
+        if old is None or old == new:
+            return
+        key = run_key(rec)
+        _remove_key(self.by_status, key, old)
+        _remove_key(self.by_script_status, key, (rec.script_id, old))
+        insort(self.by_status.setdefault(new, []), key)
+        insort(self.by_script_status.setdefault((rec.script_id, new), []), key)
+        self._status[rec.run_id] = new
+
+    def scan(self, q: RunQuery, after: Optional[RunKey]) -> Iterator[str]:
+        """run_ids in query order, from the index that matches the filters."""
+        if q.script_id is not None and q.status is not None:
+            keys = self.by_script_status.get((q.script_id, q.status), [])
+        elif q.script_id is not None:
+            keys = self.by_script.get(q.script_id, [])
+        elif q.status is not None:
+            keys = self.by_status.get(q.status, [])
+        else:
+            keys = self.by_time
+
+        lo, hi = 0, len(keys)
+        if q.created_after is not None:
+            lo = bisect_left(keys, (q.created_after, ""))
+        if q.created_before is not None:
+            hi = bisect_left(keys, (q.created_before, ""))
+        if after is not None:
+            if q.descending:
+                hi = min(hi, bisect_left(keys, after))
+            else:
+                lo = max(lo, bisect_right(keys, after))
+
+        order = range(hi - 1, lo - 1, -1) if q.descending else range(lo, hi)
+        for i in order:
+            yield keys[i][1]
+
+
+def _remove_key(index, key: RunKey, bucket=None) -> None:
+    # index 是一个有序 list，或者 {bucket: 有序 list}
+    keys = index if bucket is None else index.get(bucket)
+    if not keys:
+        return
+    i = bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
+    if bucket is not None and not keys:
+        del index[bucket]
+
+
+def split_log_lines(data: str) -> List[str]:
+    """A stored chunk ("".join(lines)) back into lines, cutting after "\\n" only."""
+    # 不能用 str.splitlines：它还会在 \r、\x0c、\x1c-\x1e、\x85、\u2028 这些字符处切，后面每一行的 seq 都会错位
+    out: List[str] = []
+    i = 0
+    n = len(data)
+    while i < n:
+        j = data.find("\n", i)
+        if j < 0:
+            out.append(data[i:])
+            break
+        out.append(data[i:j + 1])
+        i = j + 1
+    return out
+
+
+def _deque_slice(buf: Deque[str], start: int, stop: int) -> List[str]:
+    # 只复制 [start, stop) 这一段，从离得近的那一端开始数，不做 list(buf) 整体拷贝。
+    n = len(buf)
+    if start >= n - stop:
+        out = list(islice(reversed(buf), n - stop, n - start))
+        out.reverse()
+        return out
+    return list(islice(buf, start, stop))
+
+
+def _deque_bytes(buf: Deque[str]) -> int:
+    # 每行一个 str 对象：getsizeof 包含对象头，比 len() 更接近真实占用
+    return sum(map(sys.getsizeof, buf))
+
+
+def _snapshot(rec: RunRecord) -> RunRecord:
+    # 元数据的拷贝；logs 还是同一个 deque（不复制日志）。
+    with rec.lock:
+        return replace(rec)
+
+
+class StateStore(Protocol):
+    """
+    Store 的公共接口：runner / scheduler / API 只依赖这些方法，具体用内存还是 SQLite 由 create_app 决定。
+    """
+
+    def create_run(self, *, run_id: str, script_id: str, pid: Optional[int], status: RunStatus = RunStatus.running) -> None: ...
+
+    def append_log(self, run_id: str, line: str) -> None: ...
+
+    def append_logs(self, run_id: str, lines: List[str]) -> None: ...
+
+    def finish_run(self, run_id: str, *, status: RunStatus, returncode: Optional[int]) -> None: ...
+
+    def mark_running(self, run_id: str, *, pid: Optional[int]) -> None: ...
+
+    def set_status(self, run_id: str, status: RunStatus) -> None: ...
+
+    def set_usage(self, run_id: str, usage: RunUsage) -> None: ...
+
+    def set_progress(self, run_id: str, progress: RunProgress, *, persist: bool = False) -> None: ...
+
+    def set_failure_reason(self, run_id: str, reason: str) -> None: ...
+
+    def delete_run(self, run_id: str) -> None: ...
+
+    def get_run(self, run_id: str) -> Optional[RunRecord]: ...
+
+    def peek_run(self, run_id: str) -> Optional[RunRecord]: ...
+
+    def list_runs(self) -> List[RunRecord]: ...
+
+    def query_runs(self, q: RunQuery) -> RunPage: ...
+
+    def get_logs(self, run_id: str, tail: int = 200) -> tuple[list[str], bool]: ...
+
+    def read_logs(self, run_id: str, *, since: Optional[int] = None, limit: int = 200) -> LogSlice: ...
+
+    def read_log_bytes(self, run_id: str, offset: int, length: int) -> Optional[bytes]: ...
+
+    def log_size(self, run_id: str) -> Optional[int]: ...
+
+    def stats(self) -> dict: ...
 
 
 class InMemoryStateStore:
     """
     Single-process in-memory store.
-    - Thread-safe enough for your current "subprocess + thread streaming logs" design.
+    - Per-run locks: log appends and status changes only lock their own RunRecord.
+      The global lock guards the run map itself (create / delete / snapshot).
     - Later: replace with RedisStateStore implementing same methods.
+    - With a LogSpool, every line is also written to disk and the deque is only a
+      small hot tail (`logs_max_lines`); older lines are read back from the spool.
+    - Finished runs are kept according to a RetentionPolicy (count / TTL / log-memory
+      budget). Evicted runs go to the optional `on_evict` hook first, then are dropped
+      together with their spool files. Queued / running runs are never evicted.
     """
 
-    def __init__(self, logs_max_lines: int = 2000) -> None:
+    def __init__(
+        self,
+        logs_max_lines: int = 2000,
+        *,
+        spool: Optional[LogSpool] = None,
+        retention: Optional[RetentionPolicy] = None,
+        on_evict: Optional[ArchiveHook] = None,
+    ) -> None:
         self._runs: Dict[str, RunRecord] = {}
-        self._lock = Lock()
+        self._lock = store_lock()  # 就是一把 Lock；开着 metrics 时顺便记等待 / 持有时间
         self._logs_max_lines = int(logs_max_lines)
+        self._spool = spool
+        self._retention = retention or RetentionPolicy()
+        self._on_evict = on_evict
+        # 已结束的 run，按结束先后排；淘汰总是从最前面（最老的）开始看。受 self._lock 保护。
+        self._finished: "OrderedDict[str, RunRecord]" = OrderedDict()
+        # 同一批 run 的淘汰环（近似 LRU）：按数量 / 日志预算淘汰时从这里转。和 _finished 分开放，
+        # 挪到环尾不会打乱 _finished 的结束时间顺序（TTL 只看 _finished 的队头）。受 self._lock 保护。
+        self._lru: "OrderedDict[str, RunRecord]" = OrderedDict()
+        self._finished_log_bytes = 0
+        self._evicted = {"count": 0, "ttl": 0, "log_bytes": 0}
+        self._archived = 0
+        self._archive_errors = 0
+        self._index = _RunIndex()  # 受 self._lock 保护
 
-    def create_run(self, *, run_id: str, script_id: str, pid: Optional[int]) -> None:
+    def create_run(
+        self,
+        *,
+        run_id: str,
+        script_id: str,
+        pid: Optional[int],
+        status: RunStatus = RunStatus.running,
+    ) -> None:
         now = datetime.utcnow()
         # 记录“现在时间”，用 UTC（统一标准时间）。以后服务器在哪个时区都不乱。
         with self._lock:
         # 这边表示：“从这里开始，到缩进结束，这一小段代码， 同一时间只能有一个线程执行”。
         # 保护共享数据 self._runs 不被多个线程同时乱改。
-            self._runs[run_id] = RunRecord(
+            rec = RunRecord(
                 run_id=run_id,
                 script_id=script_id,
-                status=RunStatus.running,
+                status=status,
                 pid=pid,
                 returncode=None,
                 created_at=now,
                 finished_at=None,
                 logs=deque(maxlen=self._logs_max_lines),
             )
+            self._persist_run_locked(rec)
+            self._runs[run_id] = rec
+            self._index.add(rec)
+            # 顺手检查一下 TTL（只看队头，平时是 O(1)）
+            victims = self._collect_victims_locked(now)
+        self._evict(victims)
 
     def append_log(self, run_id: str, line: str) -> None:
     # 给某个 run_id，追加一行日志（字符串）。
-        with self._lock:
-            rec = self._runs.get(run_id)
-            if not rec:
-                return
+        rec = self._runs.get(run_id)
+        if not rec:
+            return
+        with rec.lock:
             rec.logs.append(line)
+            rec.next_seq += 1
             # .append() 不是 list 专属的方法，
             # deque 故意设计成“长得像 list、用起来也像 list”。
+            self._persist_logs_locked(rec, rec.next_seq - 1, [line])
+
+    def append_logs(self, run_id: str, lines: List[str]) -> None:
+        # 一批行只抢一次锁；runner 每读到一大块输出调用一次。
+        if not lines:
+            return
+        rec = self._runs.get(run_id)
+        if not rec:
+            return
+        with rec.lock:
+            first_seq = rec.next_seq
+            rec.logs.extend(lines)
+            rec.next_seq += len(lines)
+            self._persist_logs_locked(rec, first_seq, lines)
 
     def finish_run(self, run_id: str, *, status: RunStatus, returncode: Optional[int]) -> None:
         now = datetime.utcnow()
-        with self._lock:
-            rec = self._runs.get(run_id)
-            if not rec:
-                return
+        rec = self._runs.get(run_id)
+        if not rec:
+            return
+        with rec.lock:
             rec.status = status
             rec.returncode = returncode
             rec.finished_at = now
+            rec.log_bytes = _deque_bytes(rec.logs)
+            self._persist_run_locked(rec)
+        if self._spool is not None:
+            self._spool.close(run_id)
 
-    def set_status(self, run_id: str, status: RunStatus) -> None:
         with self._lock:
-            rec = self._runs.get(run_id)
-            if not rec:
-                return
+            if self._runs.get(run_id) is not rec or run_id in self._finished:
+                return  # 已经被删了，或者重复 finish
+            self._index.restatus(rec)
+            self._finished[run_id] = rec
+            self._lru[run_id] = rec
+            self._finished_log_bytes += rec.log_bytes
+            victims = self._collect_victims_locked(now)
+        self._evict(victims)
+
+    def mark_running(self, run_id: str, *, pid: Optional[int]) -> None:
+        # queued -> running：调度器把排队的 run 真正启动之后调用。
+        rec = self._runs.get(run_id)
+        if not rec:
+            return
+        with rec.lock:
+            rec.status = RunStatus.running
+            rec.pid = pid
+            self._persist_run_locked(rec)
+        self._reindex(rec)
+
+    def set_status(self, run_id: str, status: RunStatus) -> None:
+        rec = self._runs.get(run_id)
+        if not rec:
+            return
+        with rec.lock:
             rec.status = status
+            self._persist_run_locked(rec)
+        self._reindex(rec)
 
-    def get_run(self, run_id: str) -> Optional[RunRecord]:
+    def set_usage(self, run_id: str, usage: RunUsage) -> None:
+        # 采样器每个周期都会调，只改内存；finish_run 持久化时带上最后一次的值
+        rec = self._runs.get(run_id)
+        if rec is not None:
+            with rec.lock:
+                rec.usage = usage
+
+    def set_progress(self, run_id: str, progress: RunProgress, *, persist: bool = False) -> None:
+        # 每个事件都会调：内存里换一个引用就行；persist=True（tracker 自己限频）时才交给持久化层
+        rec = self._runs.get(run_id)
+        if rec is not None:
+            with rec.lock:
+                rec.progress = progress
+                if persist:
+                    self._persist_run_locked(rec)
+
+    def set_failure_reason(self, run_id: str, reason: str) -> None:
+        # 先到先得：比如超过内存上限被杀，之后 runner 看到的“被信号杀掉”不会覆盖真正的原因
+        rec = self._runs.get(run_id)
+        if rec is None:
+            return
+        with rec.lock:
+            if rec.failure_reason is None:
+                rec.failure_reason = reason
+                self._persist_run_locked(rec)
+
+    def delete_run(self, run_id: str) -> None:
         with self._lock:
-            return self._runs.get(run_id)
+            live = self._runs.pop(run_id, None)
+            if live is not None:
+                self._index.remove(live)
+            self._forget_finished_locked(run_id)
+        if self._spool is not None:
+            self._spool.delete(run_id)
+
+    def get_run(self, run_id: str) -> Optional[RunRecord]:
+        # dict.get 本身是原子的，不需要锁；拿到的是活的记录，字段会随着 run 推进而变化。
+        # 这是给 API（有人在看这个 run）用的：顺手标记“读过”，淘汰时给它第二次机会。
+        rec = self._runs.get(run_id)
+        if rec is not None:
+            rec.accessed = True
+        return rec
+
+    def peek_run(self, run_id: str) -> Optional[RunRecord]:
+        # 内部组件（runner / 调度 / 缓存 / 工作流…）查状态用这个：不算“读过”，
+        # 否则每个 run 结束前 runner 自己查一次，所有 run 都带着标记，第二次机会就没意义了。
+        return self._runs.get(run_id)
 
     def list_runs(self) -> List[RunRecord]:
+        """
+        Consistent snapshot: the set of runs is copied under the global lock (a pointer copy),
+        then each record's fields are copied under its own lock. Log writers never wait on this.
+        """
         with self._lock:
-            return list(self._runs.values())
+            recs = list(self._runs.values())
+        return [_snapshot(rec) for rec in recs]
+
+    def query_runs(self, q: RunQuery) -> RunPage:
+        """
+        Filtered, keyset-paginated listing (see RunQuery). Walks the secondary
+        index matching the filters from the cursor position: O(log n + page).
+        """
+        return make_page(self._query_local(q, q.limit + 1), q)
+
+    def _query_local(self, q: RunQuery, n: int) -> List[RunRecord]:
+        # 最多 n 条满足条件的快照，按 q 的顺序。子类拿它和库里 / Redis 里的结果合并。
+        after = q.after_key()
+        out: List[RunRecord] = []
+        with self._lock:
+            for run_id in self._index.scan(q, after):
+                rec = self._runs.get(run_id)
+                # 时间范围已经由 scan 的边界处理；这里再核对一次（状态可能刚改、还没 reindex）
+                if rec is None or not q.matches(rec):
+                    continue
+                out.append(rec)
+                if len(out) >= n:
+                    break
+        return [_snapshot(rec) for rec in out]
+
+    def _reindex(self, rec: RunRecord) -> None:
+        # 状态变了之后调用（不能持有 rec.lock）：按 rec 现在的状态挪索引，并发改状态时最终也会收敛到最新值
+        with self._lock:
+            if self._runs.get(rec.run_id) is rec:
+                self._index.restatus(rec)
 
     def get_logs(self, run_id: str, tail: int = 200) -> tuple[list[str], bool]:
         """
         Return last N lines, with truncated indicator.
         """
-        tail = max(1, int(tail))
+        sl = self.read_logs(run_id, limit=tail)
+        return sl.lines, sl.truncated
+
+    def read_logs(self, run_id: str, *, since: Optional[int] = None, limit: int = 200) -> LogSlice:
+        """
+        Incremental read by sequence number.
+
+        - since=None: the last `limit` lines (tail).
+        - since=<seq>: up to `limit` lines starting at seq; if those lines already
+          fell out of the buffer, start at the oldest kept line and set truncated.
+        Only the returned lines are copied. With a spool, lines older than the hot
+        tail are served from disk instead of being reported as truncated.
+        """
+        limit = max(1, int(limit))
+        rec = self._runs.get(run_id)
+        if not rec:
+            return LogSlice(lines=[], first_seq=0, next_seq=0, truncated=False)
+        with rec.lock:
+            n = len(rec.logs)
+            first = rec.next_seq - n
+            next_seq = rec.next_seq
+
+            if since is None:
+                k = min(limit, next_seq)
+                if k <= n or not self._has_cold_logs:
+                    k = min(k, n)
+                    lines = _deque_slice(rec.logs, n - k, n)
+                    return LogSlice(lines=lines, first_seq=next_seq - k, next_seq=next_seq, truncated=k < next_seq)
+                start, stop = next_seq - k, next_seq
+            else:
+                start = min(max(int(since), 0), next_seq)
+                stop = min(start + limit, next_seq)
+                if start >= first or not self._has_cold_logs:
+                    start = max(start, first)
+                    offset = start - first
+                    count = min(limit, n - offset)
+                    return LogSlice(
+                        lines=_deque_slice(rec.logs, offset, offset + count),
+                        first_seq=start,
+                        next_seq=start + count,
+                        truncated=int(since) < first,
+                    )
+
+        # 要的行已经不在 hot tail 里了：去磁盘读（不占 store 的锁）
+        first, lines = self._read_cold(run_id, start, stop)
+        return LogSlice(
+            lines=lines,
+            first_seq=first,
+            next_seq=first + len(lines),
+            truncated=(since is None and first > 0) or first > start,
+        )
+
+    # ---- persistence hooks（子类比如 SqliteStateStore 覆盖这几个）----
+
+    @property
+    def _has_cold_logs(self) -> bool:
+        # hot tail 之外的旧行能不能读回来
+        return self._spool is not None
+
+    def _persist_run_locked(self, rec: RunRecord) -> None:
+        # 元数据（状态 / pid / 结束时间）变了，持有 rec.lock 时调用。内存版什么都不用做。
+        pass
+
+    def _persist_logs_locked(self, rec: RunRecord, first_seq: int, lines: List[str]) -> None:
+        # 持有 rec.lock 时调用：保证落盘的行序和 seq 一致（同一个 run 可能有多个线程在写）
+        if self._spool is not None:
+            self._spool.append(rec.run_id, lines)
+
+    def _read_cold(self, run_id: str, start: int, stop: int) -> Tuple[int, List[str]]:
+        # 返回 (lines[0] 的 seq, lines)。有的后端会把太老的行裁掉，这时第一行会晚于 start。
+        assert self._spool is not None
+        return start, self._spool.read_lines(run_id, start, stop)
+
+    def _drop_persisted(self, run_id: str) -> None:
+        # 被保留策略淘汰之后：内存版连日志文件一起删
+        if self._spool is not None:
+            self._spool.delete(run_id)
+
+    def read_log_bytes(self, run_id: str, offset: int, length: int) -> Optional[bytes]:
+        """Raw byte range of the full log (needs a LogSpool; None without one)."""
+        if self._spool is None:
+            return None
+        return self._spool.read_bytes(run_id, offset, length)
+
+    def log_size(self, run_id: str) -> Optional[int]:
+        return self._spool.byte_size(run_id) if self._spool is not None else None
+
+    # ---- retention ----
+
+    def sweep(self) -> int:
+        """Apply the retention policy now (TTL needs this when no runs start or finish). Returns evicted count."""
         with self._lock:
-            rec = self._runs.get(run_id)
-            if not rec:
-                return [], False
-            logs = list(rec.logs)
-            if len(logs) <= tail:
-                return logs, False
-            return logs[-tail:], True
+            victims = self._collect_victims_locked(datetime.utcnow())
+        self._evict(victims)
+        return len(victims)
+
+    def stats(self) -> dict:
+        with self._lock:
+            recs = list(self._runs.values())
+            finished = len(self._finished)
+            finished_bytes = self._finished_log_bytes
+            evicted = dict(self._evicted)
+            archived, archive_errors = self._archived, self._archive_errors
+        by_status: Dict[str, int] = {}
+        for rec in recs:
+            by_status[rec.status.value] = by_status.get(rec.status.value, 0) + 1
+        active_bytes = 0
+        for rec in recs:
+            if rec.finished_at is None:
+                with rec.lock:
+                    active_bytes += _deque_bytes(rec.logs)
+        return {
+            "backend": "memory",
+            "runs": len(recs),
+            "active_runs": len(recs) - finished,
+            "finished_runs": finished,
+            "by_status": by_status,
+            "log_bytes_active": active_bytes,
+            "log_bytes_finished": finished_bytes,
+            "evicted": evicted,
+            "archived": archived,
+            "archive_errors": archive_errors,
+            "retention": asdict(self._retention),
+        }
+
+    def _collect_victims_locked(self, now: datetime) -> List[Tuple[RunRecord, str]]:
+        # 调用方持有 self._lock。只从 map 里摘掉，归档 / 删文件放到锁外做。
+        policy = self._retention
+        victims: List[Tuple[RunRecord, str]] = []
+        if not self._finished or not policy.enabled:
+            return victims
+
+        if policy.finished_ttl_s is not None:
+            # 按结束时间排好序的，队头没过期后面的也不会过期
+            while self._finished:
+                rec = next(iter(self._finished.values()))
+                if rec.finished_at is not None and (now - rec.finished_at).total_seconds() < policy.finished_ttl_s:
+                    break
+                victims.append((self._drop_locked(rec.run_id), "ttl"))
+
+        if policy.max_finished_runs is not None:
+            while len(self._lru) > policy.max_finished_runs:
+                victims.append((self._drop_lru_locked(), "count"))
+
+        if policy.max_log_bytes is not None:
+            while self._lru and self._finished_log_bytes > policy.max_log_bytes:
+                victims.append((self._drop_lru_locked(), "log_bytes"))
+
+        for _, reason in victims:
+            self._evicted[reason] += 1
+        return victims
+
+    def _drop_lru_locked(self) -> RunRecord:
+        # 近似 LRU（second chance / CLOCK）：队头最近被读过的话，清掉标记挪到队尾，再看下一个。
+        # 每挪一次就清一个标记，所以最多转一圈一定能找到要淘汰的。
+        while True:
+            run_id, rec = next(iter(self._lru.items()))
+            if not rec.accessed:
+                return self._drop_locked(run_id)
+            rec.accessed = False
+            self._lru.move_to_end(run_id)
+
+    def _drop_locked(self, run_id: str) -> RunRecord:
+        rec = self._forget_finished_locked(run_id)
+        assert rec is not None
+        self._runs.pop(run_id, None)
+        self._index.remove(rec)
+        return rec
+
+    def _forget_finished_locked(self, run_id: str) -> Optional[RunRecord]:
+        rec = self._finished.pop(run_id, None)
+        if rec is not None:
+            self._lru.pop(run_id, None)
+            self._finished_log_bytes -= rec.log_bytes
+        return rec
+
+    def _evict(self, victims: List[Tuple[RunRecord, str]]) -> None:
+        for rec, reason in victims:
+            if self._on_evict is not None:
+                # 先归档再删日志文件：hook 可能要从 spool 里拷完整日志
+                try:
+                    self._on_evict(rec)
+                    ok = True
+                except Exception:
+                    logger.exception("archive hook failed for run %s (evicted by %s)", rec.run_id, reason)
+                    ok = False
+                with self._lock:
+                    if ok:
+                        self._archived += 1
+                    else:
+                        self._archive_errors += 1
+            self._drop_persisted(rec.run_id)
@@ -0,0 +1,75 @@
+# 对比日志摄取：旧做法（text 模式逐行 + 每行 append_log） vs RunnerService 现在的读法（64KiB 块 + 小块合并 + append_logs）。
+#
+#   cd backend && python benchmarks/bench_log_ingest.py --lines 500000
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from app.services.log_ingest import CHUNK_SIZE, COALESCE_S, SMALL_READ_BYTES, LineSplitter  # noqa: E402
+from app.storage.state_store import InMemoryStateStore  # noqa: E402
+
+FLOOD = HERE / "fixtures" / "log_flood.py"
+
+
+def per_line(lines: int) -> dict:
+    store = InMemoryStateStore()
+    store.create_run(run_id="r", script_id="flood", pid=None)
+    proc = subprocess.Popen(
+        [sys.executable, "-u", str(FLOOD), "--lines", str(lines)],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+    )
+    t0, c0 = time.perf_counter(), time.process_time()
+    for line in proc.stdout:
+        store.append_log("r", line)
+    proc.wait()
+    return _result(lines, t0, c0)
+
+
+def chunked(lines: int) -> dict:
+    store = InMemoryStateStore()
+    store.create_run(run_id="r", script_id="flood", pid=None)
+    proc = subprocess.Popen(
+        [sys.executable, "-u", str(FLOOD), "--lines", str(lines)],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0,
+    )
+    splitter = LineSplitter()
+    t0, c0 = time.perf_counter(), time.process_time()
+    while True:
+        chunk = proc.stdout.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        store.append_logs("r", splitter.feed(chunk))
+        if len(chunk) < SMALL_READ_BYTES:
+            time.sleep(COALESCE_S)
+    store.append_logs("r", splitter.flush())
+    proc.wait()
+    return _result(lines, t0, c0)
+
+
+def _result(lines: int, t0: float, c0: float) -> dict:
+    wall = time.perf_counter() - t0
+    cpu = time.process_time() - c0  # 只算本进程（= API 进程）花的 CPU
+    return {
+        "wall_s": round(wall, 3),
+        "ingest_cpu_s": round(cpu, 3),
+        "lines_per_cpu_s": round(lines / cpu) if cpu else None,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=500_000)
+    ns = ap.parse_args()
+    print(json.dumps({"lines": ns.lines, "per_line": per_line(ns.lines), "chunked": chunked(ns.lines)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
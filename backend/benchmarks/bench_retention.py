@@ -0,0 +1,64 @@
+# 保留策略对内存的影响：连续跑 N 个“已结束”的 run（每个带一段日志），看 store 占用的堆内存。
+#
+#   cd backend && python benchmarks/bench_retention.py --runs 20000 --lines 200
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from app.schemas.script import RunStatus  # noqa: E402
+from app.storage.retention import RetentionPolicy  # noqa: E402
+from app.storage.state_store import InMemoryStateStore  # noqa: E402
+
+
+def run(policy: RetentionPolicy, runs: int, lines: int) -> dict:
+    store = InMemoryStateStore(logs_max_lines=2000, retention=policy)
+    batch_tpl = [f"{i:06d} " + "x" * 70 for i in range(lines)]
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for i in range(runs):
+        rid = f"run-{i}"
+        store.create_run(run_id=rid, script_id="bench", pid=None)
+        # 每个 run 都是新的 str 对象（真实的 ingest 也是每行新解码出来的）
+        store.append_logs(rid, [f"{line} {i}\n" for line in batch_tpl])
+        store.finish_run(rid, status=RunStatus.done, returncode=0)
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = store.stats()
+    return {
+        "kept_runs": stats["runs"],
+        "heap_mb": round(current / 2**20, 1),
+        "peak_heap_mb": round(peak / 2**20, 1),
+        "runs_per_s": round(runs / elapsed),
+        "evicted": stats["evicted"],
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=20000)
+    ap.add_argument("--lines", type=int, default=200)
+    ap.add_argument("--max-runs", type=int, default=1000)
+    ap.add_argument("--max-log-mb", type=float, default=64.0)
+    ns = ap.parse_args()
+
+    out = {"runs": ns.runs, "lines_per_run": ns.lines}
+    out["unbounded"] = run(RetentionPolicy(), ns.runs, ns.lines)
+    out["retention"] = run(
+        RetentionPolicy(max_finished_runs=ns.max_runs, max_log_bytes=int(ns.max_log_mb * 2**20)),
+        ns.runs,
+        ns.lines,
+    )
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
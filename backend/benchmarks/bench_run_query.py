@@ -0,0 +1,94 @@
+# GET /runs 的查询代价：二级索引 + keyset 翻页（query_runs） vs. 全量 list_runs 再过滤 / 排序 / 切片。
+#
+#   cd backend && python benchmarks/bench_run_query.py --runs 100000
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from app.schemas.script import RunStatus  # noqa: E402
+from app.storage.retention import RetentionPolicy  # noqa: E402
+from app.storage.sqlite_store import SqliteStateStore  # noqa: E402
+from app.storage.state_store import InMemoryStateStore, RunQuery, run_key  # noqa: E402
+
+_STATUSES = [RunStatus.done, RunStatus.done, RunStatus.failed, RunStatus.stopped]
+
+
+def fill(store, runs: int, scripts: int) -> None:
+    for i in range(runs):
+        rid = f"run-{i:07d}"
+        store.create_run(run_id=rid, script_id=f"script-{i % scripts}", pid=None)
+        if i % 50:  # 每 50 个留一个还在 running
+            store.finish_run(rid, status=_STATUSES[i % len(_STATUSES)], returncode=0)
+
+
+def scan_page(store, q: RunQuery) -> list:
+    # 没有索引时的做法：全部拿出来过滤排序
+    recs = [r for r in store.list_runs() if q.matches(r)]
+    recs.sort(key=run_key, reverse=q.descending)
+    return recs[:q.limit]
+
+
+def timed(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return round((time.perf_counter() - t0) / repeat * 1000, 3)
+
+
+def bench(store, repeat: int) -> dict:
+    queries = {
+        "latest": RunQuery(limit=50),
+        "by_script": RunQuery(script_id="script-7", limit=50),
+        "by_status_running": RunQuery(status=RunStatus.running, limit=50),
+        "script_and_status": RunQuery(script_id="script-3", status=RunStatus.stopped, limit=50),
+    }
+    out = {}
+    for name, q in queries.items():
+        assert [r.run_id for r in store.query_runs(q).records] == [r.run_id for r in scan_page(store, q)]
+        # 深翻页：拿第 10 页的游标
+        deep = q
+        for _ in range(10):
+            cur = store.query_runs(deep).next_cursor
+            if cur is None:
+                break
+            deep = RunQuery(**{**deep.__dict__, "cursor": cur})
+        out[name] = {
+            "query_ms": timed(lambda: store.query_runs(q), repeat),
+            "page10_ms": timed(lambda: store.query_runs(deep), repeat),
+            "scan_ms": timed(lambda: scan_page(store, q), max(1, repeat // 10)),
+        }
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=100_000)
+    ap.add_argument("--scripts", type=int, default=20)
+    ap.add_argument("--repeat", type=int, default=50)
+    ns = ap.parse_args()
+
+    out = {"runs": ns.runs}
+    mem = InMemoryStateStore(logs_max_lines=10)
+    fill(mem, ns.runs, ns.scripts)
+    out["memory"] = bench(mem, ns.repeat)
+
+    with tempfile.TemporaryDirectory() as d:
+        # 大部分 run 只在库里（内存只留 1000 个已结束的），走 SQLite 的复合索引
+        db = SqliteStateStore(Path(d) / "state.db", logs_max_lines=10, retention=RetentionPolicy(max_finished_runs=1000))
+        fill(db, ns.runs, ns.scripts)
+        db.flush()
+        out["sqlite"] = bench(db, ns.repeat)
+        db.close()
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
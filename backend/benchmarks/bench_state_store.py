@@ -0,0 +1,99 @@
+# 写吞吐对比：InMemoryStateStore vs SqliteStateStore（批量事务）vs 每个操作一个事务的 SQLite。
+# N 个写线程（模拟 runner 的日志摄取），每次 append_logs 一批行，尽量快地写 --seconds 秒；
+# SQLite 版最后再 flush()，把“写完落库”的时间也算进去。
+#
+#   cd backend && python benchmarks/bench_state_store.py --writers 8 --seconds 3
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from app.schemas.script import RunStatus  # noqa: E402
+from app.storage.sqlite_store import SqliteStateStore  # noqa: E402
+from app.storage.state_store import InMemoryStateStore  # noqa: E402
+
+
+def make_store(kind: str, tmp: Path):
+    if kind == "memory":
+        return InMemoryStateStore()
+    if kind == "sqlite":
+        return SqliteStateStore(tmp / "batched.db")
+    if kind == "sqlite_unbatched":
+        # 一个操作一个事务：看看不攒批的话能写多快
+        return SqliteStateStore(tmp / "unbatched.db", batch_max_rows=1, flush_interval_s=0.0)
+    raise ValueError(kind)
+
+
+def run(kind: str, writers: int, seconds: float, batch: int, tmp: Path) -> dict:
+    store = make_store(kind, tmp)
+    lines = [f"{i:06d} " + "x" * 70 + "\n" for i in range(batch)]
+    run_ids = [f"run-{i}" for i in range(writers)]
+    for rid in run_ids:
+        store.create_run(run_id=rid, script_id="bench", pid=None)
+
+    stop = threading.Event()
+    written = [0] * writers
+
+    def writer(i: int) -> None:
+        rid = run_ids[i]
+        n = 0
+        while not stop.is_set():
+            store.append_logs(rid, lines)
+            n += 1
+        written[i] = n * batch
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    for rid in run_ids:
+        store.finish_run(rid, status=RunStatus.done, returncode=0)
+    t_ingest = time.perf_counter() - t0
+    if isinstance(store, SqliteStateStore):
+        store.flush()
+    t_total = time.perf_counter() - t0
+
+    total = sum(written)
+    out = {
+        "lines": total,
+        "ingest_lines_per_s": round(total / t_ingest),
+        "durable_lines_per_s": round(total / t_total),
+        "drain_s": round(t_total - t_ingest, 3),
+    }
+    if isinstance(store, SqliteStateStore):
+        w = store.stats()["writer"]
+        out["batches"] = w["batches"]
+        out["rows_per_batch"] = round(w["rows"] / max(1, w["batches"]))
+        store.close()
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--writers", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=3.0)
+    ap.add_argument("--batch", type=int, default=50, help="lines per append_logs call")
+    ap.add_argument("--kinds", default="memory,sqlite,sqlite_unbatched")
+    ns = ap.parse_args()
+
+    out = {"writers": ns.writers, "seconds": ns.seconds, "batch": ns.batch}
+    with tempfile.TemporaryDirectory() as d:
+        for kind in ns.kinds.split(","):
+            out[kind] = run(kind, ns.writers, ns.seconds, ns.batch, Path(d))
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# 锁竞争对比：旧的“全局一把锁”store vs 现在的 per-run 锁。
+# N 个写线程（模拟 runner 的日志摄取，每个写自己的 run），M 个读线程（模拟 API 轮询 get_run / read_logs / list_runs）。
+# 所有锁都换成 TimedLock，统计“等锁”花的总时间。
+#
+#   cd backend && python benchmarks/bench_store_contention.py --writers 64 --readers 16 --seconds 3
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from app.schemas.script import RunStatus  # noqa: E402
+from app.storage.state_store import InMemoryStateStore  # noqa: E402
+
+
+class TimedLock:
+    """threading.Lock + 统计等待时间（只在拿不到锁的时候才计时）。"""
+
+    def __init__(self, stats: dict) -> None:
+        self._lock = threading.Lock()
+        self._stats = stats
+        self._acquires = itertools.count()  # next() 在 GIL 下是原子的，不用再加锁
+        stats.setdefault("locks", []).append(self)
+
+    def __enter__(self):
+        if not self._lock.acquire(blocking=False):
+            t0 = time.perf_counter()
+            self._lock.acquire()
+            waited = time.perf_counter() - t0
+            with _STATS_LOCK:
+                self._stats["contended"] += 1
+                self._stats["wait_s"] += waited
+        next(self._acquires)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._lock.release()
+
+    def acquires(self) -> int:
+        # 只在压测结束后调用一次：count() 前面被 next 了 k 次，这里再 next 一次刚好返回 k。
+        return next(self._acquires)
+
+
+_STATS_LOCK = threading.Lock()
+
+
+class LegacyStore:
+    """Pre-change InMemoryStateStore locking: every method takes the one global lock."""
+
+    def __init__(self, lock) -> None:
+        self._runs: Dict[str, dict] = {}
+        self._lock = lock
+
+    def create_run(self, *, run_id: str, script_id: str, pid: Optional[int]) -> None:
+        with self._lock:
+            self._runs[run_id] = {"run_id": run_id, "status": RunStatus.running, "logs": deque(maxlen=2000), "next_seq": 0}
+
+    def append_logs(self, run_id: str, lines: List[str]) -> None:
+        with self._lock:
+            rec = self._runs.get(run_id)
+            rec["logs"].extend(lines)
+            rec["next_seq"] += len(lines)
+
+    def get_run(self, run_id: str):
+        with self._lock:
+            return self._runs.get(run_id)
+
+    def list_runs(self):
+        with self._lock:
+            return list(self._runs.values())
+
+    def read_logs(self, run_id: str, *, since: Optional[int] = None, limit: int = 200):
+        with self._lock:
+            logs = list(self._runs[run_id]["logs"])
+            return logs[-limit:]
+
+
+def run(kind: str, writers: int, readers: int, seconds: float, batch: int, writer_sleep_s: float) -> dict:
+    stats: dict = {"contended": 0, "wait_s": 0.0}
+    if kind == "global_lock":
+        store = LegacyStore(TimedLock(stats))
+    else:
+        store = InMemoryStateStore()
+        store._lock = TimedLock(stats)
+
+    run_ids = [f"run-{i}" for i in range(writers)]
+    for rid in run_ids:
+        store.create_run(run_id=rid, script_id="bench", pid=None)
+        if kind != "global_lock":
+            store.get_run(rid).lock = TimedLock(stats)
+
+    stop = threading.Event()
+    lines = [f"{i:06d} " + "x" * 70 + "\n" for i in range(batch)]
+    written = [0] * writers
+    read_lat: List[float] = []
+
+    def writer(i: int) -> None:
+        rid = run_ids[i]
+        n = 0
+        while not stop.is_set():
+            store.append_logs(rid, lines)
+            n += 1
+            # 真实的 ingest 线程大部分时间在等 pipe（read + 1ms 合并），这里用 sleep 模拟，同时让出 GIL
+            time.sleep(writer_sleep_s)
+        written[i] = n * batch
+
+    def reader(seed: int) -> None:
+        rnd = random.Random(seed)
+        local: List[float] = []
+        while not stop.is_set():
+            rid = rnd.choice(run_ids)
+            t0 = time.perf_counter()
+            store.get_run(rid)
+            store.read_logs(rid, limit=200)
+            if rnd.random() < 0.05:
+                store.list_runs()
+            local.append(time.perf_counter() - t0)
+        with _STATS_LOCK:
+            read_lat.extend(local)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(j,)) for j in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    read_lat.sort()
+    acquires = sum(lock.acquires() for lock in stats["locks"])
+    return {
+        "lines_per_s": round(sum(written) / seconds),
+        "reads_per_s": round(len(read_lat) / seconds),
+        "read_p50_us": round(read_lat[len(read_lat) // 2] * 1e6, 1) if read_lat else None,
+        "read_p99_us": round(read_lat[int(len(read_lat) * 0.99)] * 1e6, 1) if read_lat else None,
+        "lock_acquires": acquires,
+        "lock_contended_pct": round(100.0 * stats["contended"] / max(1, acquires), 2),
+        "lock_wait_total_s": round(stats["wait_s"], 3),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--writers", type=int, default=64)
+    ap.add_argument("--readers", type=int, default=16)
+    ap.add_argument("--seconds", type=float, default=3.0)
+    ap.add_argument("--batch", type=int, default=50, help="lines per append_logs call")
+    ap.add_argument("--writer-sleep-ms", type=float, default=1.0)
+    ns = ap.parse_args()
+
+    out = {"writers": ns.writers, "readers": ns.readers, "seconds": ns.seconds, "batch": ns.batch}
+    for kind in ("global_lock", "per_run_lock"):
+        out[kind] = run(kind, ns.writers, ns.readers, ns.seconds, ns.batch, ns.writer_sleep_ms / 1000.0)
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# 对比：RunnerService（每次 Popen 冷启动） vs WorkerPool（预热 worker + runpy）。
+#
+#   cd backend && python benchmarks/bench_worker_pool.py --runs 200 --pool-size 4
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+from app.services.runner import RunnerService  # noqa: E402
+from app.services.worker_pool import WorkerPool  # noqa: E402
+from app.storage.state_store import InMemoryStateStore  # noqa: E402
+
+PRELOAD = ["asyncio", "decimal", "email.mime.multipart", "http.client", "json", "sqlite3", "xml.etree.ElementTree"]
+
+
+def run_batch(executor, store: InMemoryStateStore, script: Path, runs: int, concurrency: int) -> dict:
+    done = threading.Semaphore(0)
+    slots = threading.Semaphore(concurrency)
+    executor.add_listener(lambda run_id, status, rc: (slots.release(), done.release()))
+
+    latencies: list[float] = []
+    started: dict[str, float] = {}
+
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        slots.acquire()
+        t = time.perf_counter()
+        run_id = executor.start(script_id=script.stem, script_path=script, params={})
+        started[run_id] = t
+    for _ in range(runs):
+        done.acquire()
+    wall = time.perf_counter() - t0
+
+    for run_id, t in started.items():
+        rec = store.get_run(run_id)
+        assert rec is not None and rec.finished_at is not None, run_id
+        latencies.append((rec.finished_at - rec.created_at).total_seconds())
+    latencies.sort()
+    return {
+        "runs": runs,
+        "wall_s": round(wall, 3),
+        "runs_per_s": round(runs / wall, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        "failed": sum(1 for r in started if store.get_run(r).returncode != 0),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=200)
+    ap.add_argument("--pool-size", type=int, default=4)
+    ap.add_argument("--script", default="import_heavy", choices=["noop", "import_heavy"])
+    ns = ap.parse_args()
+
+    script = HERE / "fixtures" / f"{ns.script}.py"
+    out = {"script": ns.script, "concurrency": ns.pool_size}
+
+    store = InMemoryStateStore()
+    out["popen"] = run_batch(RunnerService(store), store, script, ns.runs, ns.pool_size)
+
+    store = InMemoryStateStore()
+    pool = WorkerPool(store, size=ns.pool_size, preload=PRELOAD, max_runs_per_worker=10_000)
+    time.sleep(1.0)  # 等 worker 预热完
+    try:
+        out["pool"] = run_batch(pool, store, script, ns.runs, ns.pool_size)
+    finally:
+        pool.close()
+
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
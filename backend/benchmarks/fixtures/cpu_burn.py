@@ -0,0 +1,14 @@
+# 烧 CPU：纯 Python 循环跑满一个核，和 runner / API 抢 CPU。
+import argparse
+import time
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--seconds", type=float, default=5.0)
+ns = ap.parse_args()
+
+deadline = time.perf_counter() + ns.seconds
+x = 0
+while time.perf_counter() < deadline:
+    for _ in range(10_000):
+        x += 1
+print("burned", x)
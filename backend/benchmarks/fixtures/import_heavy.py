@@ -0,0 +1,10 @@
+# 模拟真实自动化脚本：一上来先 import 一堆库，然后很快结束。
+import asyncio  # noqa: F401
+import decimal  # noqa: F401
+import email.mime.multipart  # noqa: F401
+import http.client  # noqa: F401
+import json  # noqa: F401
+import sqlite3  # noqa: F401
+import xml.etree.ElementTree  # noqa: F401
+
+print("ok")
@@ -0,0 +1,13 @@
+# 刷屏脚本：尽可能快地打印日志行，用来压日志摄取。
+import argparse
+import sys
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--lines", type=int, default=200_000)
+ap.add_argument("--width", type=int, default=80)
+ns = ap.parse_args()
+
+payload = "x" * max(0, ns.width - 12)
+write = sys.stdout.write
+for i in range(ns.lines):
+    write(f"{i:010d} {payload}\n")
@@ -0,0 +1,2 @@
+# 什么都不做：用来量“启动一个 run”本身的开销。
+print("ok")
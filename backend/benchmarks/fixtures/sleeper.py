@@ -0,0 +1,11 @@
+# 长时间睡眠：占着并发名额、不怎么出日志，模拟等外部资源的脚本。
+import argparse
+import time
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--seconds", type=float, default=30.0)
+ns = ap.parse_args()
+
+print("sleeping", ns.seconds, flush=True)
+time.sleep(ns.seconds)
+print("woke up")
@@ -0,0 +1,384 @@
+# run 生命周期的整体基准：走真正的 FastAPI app（create_app + TestClient），不是单个组件。
+# 每个场景用一个新的 app（新 store / scheduler），互不影响。结果是 JSON，可以存下来当 baseline，之后对比。
+#
+#   cd backend && python benchmarks/run_bench.py --save var/bench.json
+#   cd backend && python benchmarks/run_bench.py --baseline var/bench.json      # 回退超过 10% 的指标 exit 1
+#   cd backend && python benchmarks/run_bench.py --quick --only submit,first_log
+#
+# 场景（fixtures/ 里的脚本）：
+#   submit     POST /runs 的吞吐 + 一批 noop run 全部跑完的 runs/s
+#   first_log  从 POST /runs 到 store 里出现第一行日志的延迟
+#   ingest     log_flood 刷屏，日志摄取 lines/s
+#   poll       一边有刷屏 / 睡眠 / 烧 CPU 的 run，一边多线程轮询 GET /runs/{id}/logs 的延迟
+#   memory     每个已结束 run 在 store 里占多少内存（tracemalloc）
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+
+HERE = Path(__file__).resolve().parent
+FIXTURES = HERE / "fixtures"
+sys.path.insert(0, str(HERE.parent))
+
+# import app.main 会顺带用环境变量建一个默认 app：别让它去读真正的 spec 目录、开日志落盘 / 产物目录、起进程池
+_QUIET_ENV = {
+    "AP_SPEC_WATCH": "off",
+    "AP_LOG_SPOOL_DIR": "off",
+    "AP_ARTIFACTS_DIR": "off",
+    "AP_WORKER_POOL_SIZE": "0",
+    "AP_SCHEDULES": "off",
+}
+for _k, _v in _QUIET_ENV.items():
+    os.environ.setdefault(_k, _v)
+
+import logging  # noqa: E402
+
+# stdout 只放 JSON 结果：先给 root 装一个 stderr handler，setup_logging() 看到已有 handler 就不再加 stdout 的
+logging.basicConfig(stream=sys.stderr, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s", datefmt="%H:%M:%S")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.core.config import Settings, get_settings  # noqa: E402
+from app.main import create_app  # noqa: E402
+
+SPECS = {
+    "noop": "entry: noop.py\n",
+    "log_flood": "entry: log_flood.py\nargs_schema:\n  lines: {type: integer, default: 200000}\n  width: {type: integer, default: 80}\n",
+    "sleeper": "entry: sleeper.py\nargs_schema:\n  seconds: {type: number, default: 30}\n",
+    "cpu_burn": "entry: cpu_burn.py\nargs_schema:\n  seconds: {type: number, default: 5}\n",
+}
+
+# 每个指标：value + 单位 + 哪个方向是“好”，baseline 对比靠 better 判断是不是回退
+Metric = Dict[str, object]
+
+
+def metric(value: float, unit: str, better: str) -> Metric:
+    return {"value": round(float(value), 3), "unit": unit, "better": better}
+
+
+def pct(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * q))]
+
+
+class Bench:
+    """One fresh app per scenario, driven over HTTP via TestClient."""
+
+    def __init__(self, base: Settings) -> None:
+        self._base = base
+
+    def app(self, **overrides) -> "BenchApp":
+        settings = dataclasses.replace(self._base, **overrides) if overrides else self._base
+        app = create_app(settings)
+        logging.getLogger().setLevel(logging.WARNING)  # create_app 会调回 INFO；每个 run 的 INFO 日志会干扰计时
+        return BenchApp(app)
+
+
+class BenchApp:
+    def __init__(self, app) -> None:
+        self.app = app
+        self.store = app.state.store
+        self.client = TestClient(app)
+        self.client.__enter__()  # 一个 event loop portal，多线程请求共用
+
+    def close(self) -> None:
+        self.client.__exit__(None, None, None)
+
+    def submit(self, script_id: str, **params) -> str:
+        r = self.client.post("/runs", json={"script_id": script_id, "params": params})
+        r.raise_for_status()
+        return r.json()["run_id"]
+
+    def stop(self, run_id: str) -> None:
+        self.client.post(f"/runs/{run_id}/stop")
+
+    def wait(self, run_ids: List[str], timeout_s: float = 300.0) -> None:
+        # 直接看 store，不走 HTTP：等待本身别占被测的 API
+        pending = set(run_ids)
+        deadline = time.monotonic() + timeout_s
+        while pending:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{len(pending)} runs still not finished")
+            pending = {r for r in pending if (rec := self.store.get_run(r)) is None or rec.finished_at is None}
+            if pending:
+                time.sleep(0.005)
+
+
+# ---- 场景 ----
+
+
+def bench_submit(b: Bench, ns: argparse.Namespace) -> Dict[str, Metric]:
+    a = b.app()
+    try:
+        n = ns.runs
+        lat: List[float] = []
+        ids: List[str] = []
+        t0 = time.perf_counter()
+        for _ in range(n):
+            t = time.perf_counter()
+            ids.append(a.submit("noop"))
+            lat.append(time.perf_counter() - t)
+        t_submit = time.perf_counter() - t0
+        a.wait(ids)
+        wall = time.perf_counter() - t0
+        failed = sum(1 for r in ids if a.store.get_run(r).returncode != 0)
+    finally:
+        a.close()
+    return {
+        "submit_req_per_s": metric(n / t_submit, "req/s", "higher"),
+        "submit_p50_ms": metric(pct(lat, 0.5) * 1000, "ms", "lower"),
+        "submit_p99_ms": metric(pct(lat, 0.99) * 1000, "ms", "lower"),
+        "runs_per_s": metric(n / wall, "runs/s", "higher"),
+        "runs_failed": metric(failed, "runs", "lower"),
+    }
+
+
+def bench_first_log(b: Bench, ns: argparse.Namespace) -> Dict[str, Metric]:
+    a = b.app()
+    try:
+        samples: List[float] = []
+        for _ in range(ns.first_log_runs):
+            t0 = time.perf_counter()
+            run_id = a.submit("noop")
+            while not a.store.read_logs(run_id, since=0, limit=1).lines:
+                if time.perf_counter() - t0 > 30:
+                    raise TimeoutError("no log line within 30s")
+                time.sleep(0.0005)
+            samples.append(time.perf_counter() - t0)
+            a.wait([run_id])
+    finally:
+        a.close()
+    return {
+        "first_log_p50_ms": metric(pct(samples, 0.5) * 1000, "ms", "lower"),
+        "first_log_p95_ms": metric(pct(samples, 0.95) * 1000, "ms", "lower"),
+    }
+
+
+def bench_ingest(b: Bench, ns: argparse.Namespace) -> Dict[str, Metric]:
+    a = b.app()
+    lines, width = ns.flood_lines, 80
+    try:
+        t0 = time.perf_counter()
+        run_id = a.submit("log_flood", lines=lines, width=width)
+        a.wait([run_id])
+        wall = time.perf_counter() - t0
+        got = a.store.read_logs(run_id, limit=1).next_seq
+    finally:
+        a.close()
+    return {
+        "ingest_lines_per_s": metric(got / wall, "lines/s", "higher"),
+        "ingest_mb_per_s": metric(got * width / wall / 1e6, "MB/s", "higher"),
+        "ingest_lines_lost": metric(lines - got, "lines", "lower"),
+    }
+
+
+def bench_poll(b: Bench, ns: argparse.Namespace) -> Dict[str, Metric]:
+    a = b.app()
+    try:
+        # 背景负载：刷屏 + 睡眠 + 烧 CPU
+        ids = [a.submit("log_flood", lines=ns.flood_lines * 10) for _ in range(ns.poll_floods)]
+        ids += [a.submit("sleeper", seconds=600) for _ in range(ns.poll_sleepers)]
+        ids += [a.submit("cpu_burn", seconds=600) for _ in range(ns.poll_burners)]
+        time.sleep(0.5)
+
+        lat: List[float] = []
+        lock = threading.Lock()
+        stop_at = time.perf_counter() + ns.poll_seconds
+
+        def poller(seed: int) -> None:
+            rnd = random.Random(seed)
+            cursors: Dict[str, int] = {}
+            mine: List[float] = []
+            while time.perf_counter() < stop_at:
+                run_id = rnd.choice(ids)
+                t = time.perf_counter()
+                r = a.client.get(f"/runs/{run_id}/logs", params={"since": cursors.get(run_id, 0), "tail": 200})
+                mine.append(time.perf_counter() - t)
+                if r.status_code == 200:
+                    cursors[run_id] = r.json()["next_seq"]
+            with lock:
+                lat.extend(mine)
+
+        threads = [threading.Thread(target=poller, args=(i,)) for i in range(ns.pollers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for run_id in ids:
+            a.stop(run_id)
+        a.wait(ids, timeout_s=60)
+    finally:
+        a.close()
+    return {
+        "poll_req_per_s": metric(len(lat) / ns.poll_seconds, "req/s", "higher"),
+        "poll_p50_ms": metric(pct(lat, 0.5) * 1000, "ms", "lower"),
+        "poll_p99_ms": metric(pct(lat, 0.99) * 1000, "ms", "lower"),
+    }
+
+
+def bench_memory(b: Bench, ns: argparse.Namespace) -> Dict[str, Metric]:
+    # retention 关掉：不然超过上限的 run 会被淘汰，量出来的就不是“每个 run”的占用
+    a = b.app(retention_max_runs=None, retention_ttl_s=None, retention_max_log_mb=None)
+    try:
+        n = ns.memory_runs
+        a.wait([a.submit("noop")])  # 先跑一个，把各处的懒初始化排除掉
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        ids = []
+        for _ in range(n):
+            ids.append(a.submit("log_flood", lines=ns.memory_lines))
+        a.wait(ids)
+        time.sleep(0.2)  # 让 runner 线程收完尾
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    finally:
+        a.close()
+    return {"memory_kb_per_finished_run": metric((after - before) / n / 1024, "KiB", "lower")}
+
+
+SCENARIOS: Dict[str, Callable[[Bench, argparse.Namespace], Dict[str, Metric]]] = {
+    "submit": bench_submit,
+    "first_log": bench_first_log,
+    "ingest": bench_ingest,
+    "poll": bench_poll,
+    "memory": bench_memory,
+}
+
+
+# ---- baseline 对比 ----
+
+
+def compare(current: Dict[str, Metric], baseline: Dict[str, Metric], tolerance: float) -> Dict[str, dict]:
+    """Per metric: change vs baseline, and whether it is a regression beyond `tolerance`."""
+    out: Dict[str, dict] = {}
+    for name, cur in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        b, c = float(base["value"]), float(cur["value"])
+        change = (c - b) / b if b else (0.0 if c == b else float("inf"))
+        worse = change < -tolerance if cur["better"] == "higher" else change > tolerance
+        # 本来就是 0 的计数（丢行 / 失败数）变成非 0 也算回退
+        if b == 0 and c > 0 and cur["better"] == "lower":
+            worse = True
+        out[name] = {"baseline": b, "current": c, "change_pct": round(change * 100, 1), "regression": worse}
+    return out
+
+
+def meta(ns: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "runner_backend": ns.runner,
+        "state_backend": ns.store,
+        "max_concurrent_runs": ns.concurrency,
+        "quick": ns.quick,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--only", default=",".join(SCENARIOS), help="comma separated: " + ",".join(SCENARIOS))
+    ap.add_argument("--quick", action="store_true", help="smaller sizes, for a smoke run")
+    ap.add_argument("--runner", default="thread", choices=["thread", "asyncio"])
+    ap.add_argument("--store", default="memory", choices=["memory", "sqlite"])
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--save", type=Path, help="write the JSON result here (use it later as --baseline)")
+    ap.add_argument("--baseline", type=Path, help="compare against a saved result; exit 1 on regressions")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="allowed relative change before it is a regression")
+    ns = ap.parse_args()
+
+    scale = 0.2 if ns.quick else 1.0
+    ns.runs = max(10, int(200 * scale))
+    ns.first_log_runs = max(5, int(50 * scale))
+    ns.flood_lines = max(10_000, int(500_000 * scale))
+    ns.poll_floods, ns.poll_sleepers, ns.poll_burners = 2, 8, 1
+    ns.pollers = 8
+    ns.poll_seconds = 2.0 if ns.quick else 5.0
+    ns.memory_runs = max(20, int(300 * scale))
+    ns.memory_lines = 50
+
+    names = [s.strip() for s in ns.only.split(",") if s.strip()]
+    unknown = [s for s in names if s not in SCENARIOS]
+    if unknown:
+        ap.error(f"unknown scenario(s): {unknown}")
+
+    with tempfile.TemporaryDirectory(prefix="ap-bench-") as tmp:
+        specs_dir = Path(tmp) / "specs"
+        specs_dir.mkdir()
+        for sid, body in SPECS.items():
+            (specs_dir / f"{sid}.yaml").write_text(f"id: {sid}\n{body}", encoding="utf-8")
+        base = dataclasses.replace(
+            get_settings(),
+            scripts_dir=FIXTURES,
+            script_specs_dir=specs_dir,
+            spec_watch="off",
+            runner_backend=ns.runner,
+            max_concurrent_runs=ns.concurrency,
+            worker_pool_size=0,
+            state_backend=ns.store,
+            state_db_path=Path(tmp) / "state.db",
+            log_spool_dir=None,
+            artifacts_dir=None,  # 测的是 run 生命周期；不往仓库的 var/ 里写产物
+            schedule_state_path=None,
+        )
+        bench = Bench(base)
+
+        results: Dict[str, Metric] = {}
+        for name in names:
+            t0 = time.perf_counter()
+            if ns.store == "sqlite":
+                # 每个场景一个新库
+                bench = Bench(dataclasses.replace(base, state_db_path=Path(tmp) / f"{name}.db"))
+            results.update(SCENARIOS[name](bench, ns))
+            print(f"[bench] {name} done in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    out: dict = {"meta": meta(ns), "results": results}
+    regressions: List[str] = []
+    if ns.baseline is not None:
+        base_doc = json.loads(ns.baseline.read_text(encoding="utf-8"))
+        out["baseline_meta"] = base_doc.get("meta")
+        out["comparison"] = compare(results, base_doc.get("results", {}), ns.tolerance)
+        regressions = [k for k, v in out["comparison"].items() if v["regression"]]
+        for k, v in out["comparison"].items():
+            flag = "  REGRESSION" if v["regression"] else ""
+            print(f"[bench] {k:28s} {v['baseline']:>12} -> {v['current']:>12} ({v['change_pct']:+.1f}%){flag}", file=sys.stderr)
+
+    text = json.dumps(out, indent=2)
+    print(text)
+    if ns.save is not None:
+        ns.save.parent.mkdir(parents=True, exist_ok=True)
+        ns.save.write_text(text + "\n", encoding="utf-8")
+    if regressions:
+        print(f"[bench] {len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
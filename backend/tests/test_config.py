@@ -0,0 +1,36 @@
+from pathlib import Path
+
+from app.bootstrap import build_store
+from app.core.config import get_settings
+
+
+def test_log_spool_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("AP_LOG_SPOOL_DIR", raising=False)
+    monkeypatch.delenv("AP_STATE_BACKEND", raising=False)
+    settings = get_settings()
+    assert settings.log_spool_dir is None
+    # 不落盘时内存里保留完整的 logs_max_lines 行，而不是落盘时的热尾巴
+    store = build_store(settings)
+    store.create_run(run_id="r1", script_id="s", pid=None)
+    store.append_logs("r1", [f"{i}\n" for i in range(2500)])
+    lines, truncated = store.get_logs("r1", tail=5000)
+    assert len(lines) == settings.logs_max_lines == 2000 and truncated
+
+
+def test_log_spool_env_enables_it(monkeypatch, tmp_path):
+    monkeypatch.setenv("AP_LOG_SPOOL_DIR", str(tmp_path / "logs"))
+    assert get_settings().log_spool_dir == Path(tmp_path / "logs")
+    monkeypatch.setenv("AP_LOG_SPOOL_DIR", "off")
+    assert get_settings().log_spool_dir is None
+
+
+def test_artifacts_are_off_by_default(monkeypatch, tmp_path):
+    from app.bootstrap import build_artifacts
+
+    monkeypatch.delenv("AP_ARTIFACTS_DIR", raising=False)
+    settings = get_settings()
+    assert settings.artifacts_dir is None
+    assert build_artifacts(settings) is None
+
+    monkeypatch.setenv("AP_ARTIFACTS_DIR", str(tmp_path / "art"))
+    assert get_settings().artifacts_dir == Path(tmp_path / "art")
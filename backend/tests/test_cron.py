@@ -0,0 +1,113 @@
+from datetime import datetime
+
+import pytest
+
+from app.services.cron import CronExpr, parse_schedules
+from app.services.schedules import _owed_since
+
+# 2024-01-01 是周一
+
+
+def _next(text, after):
+    return CronExpr.parse(text).next_after(after)
+
+
+def test_fields_lists_ranges_steps_and_names():
+    e = CronExpr.parse("*/15 9-17/4 1,15 jan-mar mon-fri")
+    assert e.minutes == {0, 15, 30, 45}
+    assert e.hours == {9, 13, 17}
+    assert e.days == {1, 15}
+    assert e.months == {1, 2, 3}
+    assert e.weekdays == {1, 2, 3, 4, 5}
+    assert CronExpr.parse("5/20 * * * *").minutes == {5, 25, 45}
+    assert CronExpr.parse("0 0 * * 7").weekdays == {0}  # 7 也是周日
+
+
+def test_macros():
+    assert _next("@hourly", datetime(2024, 1, 1, 10, 30)) == datetime(2024, 1, 1, 11, 0)
+    assert _next("@daily", datetime(2024, 1, 1, 10, 30)) == datetime(2024, 1, 2)
+    assert _next("@weekly", datetime(2024, 1, 1)) == datetime(2024, 1, 7)
+
+
+def test_next_is_strictly_after():
+    assert _next("30 10 * * *", datetime(2024, 1, 1, 10, 30)) == datetime(2024, 1, 2, 10, 30)
+    assert _next("30 10 * * *", datetime(2024, 1, 1, 10, 29, 59)) == datetime(2024, 1, 1, 10, 30)
+
+
+def test_rolls_over_month_and_year():
+    assert _next("0 0 31 * *", datetime(2024, 4, 1)) == datetime(2024, 5, 31)
+    assert _next("0 12 29 2 *", datetime(2024, 3, 1)) == datetime(2028, 2, 29, 12)
+    assert _next("0 0 1 1 *", datetime(2024, 12, 31, 23, 59)) == datetime(2025, 1, 1)
+
+
+def test_dom_and_dow_match_either_when_both_set():
+    # 15 号或者周五，和 Vixie cron 一样是"或"
+    assert _next("0 0 15 * fri", datetime(2024, 1, 1)) == datetime(2024, 1, 5)
+    assert _next("0 0 15 * fri", datetime(2024, 1, 13)) == datetime(2024, 1, 15)
+    # 只限定了周：日字段的 * 不算数
+    assert _next("0 0 * * sun", datetime(2024, 1, 1)) == datetime(2024, 1, 7)
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "*/0 * * * *", "5-1 * * * *", "0 0 30 2 *", "x * * * *"],
+)
+def test_bad_expressions(text):
+    with pytest.raises(ValueError):
+        CronExpr.parse(text)
+
+
+def test_parse_schedules():
+    assert parse_schedules(None) == ()
+    (s,) = parse_schedules({"every_s": 60, "params": {"a": 1}})
+    assert (s.name, s.every_s, s.params, s.on_overlap, s.catch_up, s.max_overlap) == ("", 60.0, {"a": 1}, "skip", "one", 1)
+    assert s.next_after(1000.0) == 1060.0
+    assert s.expr == "every 60s"
+
+    a, b = parse_schedules([{"name": "a", "cron": "@daily"}, {"name": "b", "every_s": 5, "catch_up": "all"}])
+    assert a.cron is not None and a.expr == "@daily"
+    assert b.catch_up == "all"
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        {},
+        {"cron": "@daily", "every_s": 5},
+        {"every_s": 0},
+        {"every_s": 5, "on_overlap": "queue"},
+        {"every_s": 5, "catch_up": "some"},
+        {"every_s": 5, "max_overlap": 0},
+        {"every_s": 5, "params": [1]},
+        [{"every_s": 5}, {"every_s": 6}],
+        [{"name": "a", "every_s": 5}, {"name": "a", "every_s": 6}],
+        "daily",
+    ],
+)
+def test_bad_schedules(raw):
+    with pytest.raises(ValueError):
+        parse_schedules(raw)
+
+
+def _ts(*a):
+    return datetime(*a).timestamp()
+
+
+def test_owed_triggers_after_short_downtime():
+    (s,) = parse_schedules({"cron": "*/10 * * * *"})
+    owed, nxt = _owed_since(s, _ts(2024, 1, 1, 10, 0), _ts(2024, 1, 1, 10, 35))
+    assert (owed, nxt) == (4, _ts(2024, 1, 1, 10, 40))
+
+    (s,) = parse_schedules({"every_s": 60})
+    owed, nxt = _owed_since(s, 1000.0, 1000.0 + 150)
+    assert (owed, nxt) == (3, 1000.0 + 180)
+
+
+def test_long_downtime_jumps_to_the_future():
+    # 每分钟一次，停了两天：一步步数会在 1000 次时停下，nxt 还在 31 小时前
+    (s,) = parse_schedules({"cron": "* * * * *"})
+    planned = _ts(2024, 1, 1)
+    now = _ts(2024, 1, 3, 0, 0, 30)
+    owed, nxt = _owed_since(s, planned, now)
+    assert nxt == _ts(2024, 1, 3, 0, 1)
+    assert owed == 2 * 24 * 60 + 1
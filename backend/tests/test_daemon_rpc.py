@@ -0,0 +1,101 @@
+import io
+import pickle
+import tempfile
+import threading
+from pathlib import Path
+
+import pytest
+
+from app.schemas.script import RunStatus
+from app.services.daemon_rpc import HEADER, DaemonClient, DaemonError, RemoteStateStore, encode, read_frame
+from app.services.run_daemon import RunDaemon
+from app.storage.state_store import InMemoryStateStore
+
+
+def test_frames_round_trip_back_to_back():
+    buf = io.BytesIO(encode(1, ("store", "get_run", ("r1",), {})) + encode(7, (True, [1, 2])))
+    req_id, payload = read_frame(buf)
+    assert (req_id, pickle.loads(payload)) == (1, ("store", "get_run", ("r1",), {}))
+    req_id, payload = read_frame(buf)
+    assert (req_id, pickle.loads(payload)) == (7, (True, [1, 2]))
+    assert read_frame(buf) is None
+
+
+@pytest.mark.parametrize("cut", [3, HEADER.size + 2])
+def test_truncated_frame_is_an_error(cut):
+    with pytest.raises(DaemonError):
+        read_frame(io.BytesIO(encode(1, "x" * 10)[:cut]))
+
+
+def test_oversized_frame_is_rejected(monkeypatch):
+    from app.services import daemon_rpc
+
+    monkeypatch.setattr(daemon_rpc, "MAX_FRAME", 8)
+    with pytest.raises(DaemonError, match="too large"):
+        read_frame(io.BytesIO(encode(1, "x" * 100)))
+
+
+def test_run_record_travels_without_logs_or_lock():
+    store = InMemoryStateStore()
+    store.create_run(run_id="r1", script_id="s", pid=None)
+    store.append_log("r1", "hello\n")
+    _, payload = read_frame(io.BytesIO(encode(1, store.get_run("r1"))))
+    rec = pickle.loads(payload)
+    assert (rec.run_id, rec.script_id, rec.status) == ("r1", "s", RunStatus.running)
+    assert list(rec.logs) == []
+    assert rec.lock is not store.get_run("r1").lock
+
+
+@pytest.fixture
+def daemon():
+    # AF_UNIX 路径有 108 字节的上限，pytest 的 tmp_path 可能太长
+    with tempfile.TemporaryDirectory(prefix="ap-") as d:
+        store = InMemoryStateStore()
+        server = RunDaemon(Path(d) / "d.sock", {"store": store}, pool_size=4)
+        server.start()
+        client = DaemonClient(Path(d) / "d.sock", timeout_s=5)
+        try:
+            yield store, client
+        finally:
+            client.close()
+            server.close()
+
+
+def test_client_calls_daemon(daemon):
+    store, client = daemon
+    store.create_run(run_id="r1", script_id="s", pid=None)
+    remote = RemoteStateStore(client)
+    assert remote.get_run("r1").script_id == "s"
+    assert remote.get_run("nope") is None
+    assert client.call("daemon", "ping")
+
+
+def test_unexposed_methods_are_refused(daemon):
+    _, client = daemon
+    with pytest.raises(DaemonError, match="not exposed"):
+        client.call("store", "delete_run", "r1")
+    with pytest.raises(DaemonError, match="not exposed"):
+        client.call("scheduler", "stats")  # 这个 daemon 没配调度器
+
+
+def test_pipelined_calls_from_many_threads(daemon):
+    store, client = daemon
+    for i in range(20):
+        store.create_run(run_id=f"r{i}", script_id=f"s{i}", pid=None)
+    results = {}
+
+    def worker(i):
+        results[i] = client.call("store", "get_run", f"r{i}").script_id
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert results == {i: f"s{i}" for i in range(20)}
+
+
+def test_unreachable_daemon():
+    client = DaemonClient(Path(tempfile.gettempdir()) / "ap-no-such-daemon.sock", timeout_s=1)
+    with pytest.raises(DaemonError, match="not reachable"):
+        client.call("daemon", "ping")
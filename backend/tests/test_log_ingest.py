@@ -0,0 +1,44 @@
+from app.services import log_ingest
+from app.services.log_ingest import LineSplitter
+
+
+def _split(chunks):
+    sp = LineSplitter()
+    out = []
+    for c in chunks:
+        out.extend(sp.feed(c))
+    return out + sp.flush()
+
+
+def test_partial_lines_wait_for_the_next_chunk():
+    sp = LineSplitter()
+    assert sp.feed(b"hel") == []
+    assert sp.feed(b"lo\nwor") == ["hello\n"]
+    assert sp.feed(b"ld\n\n") == ["world\n", "\n"]
+    assert sp.flush() == []
+
+
+def test_flush_returns_trailing_partial_line_without_newline():
+    assert _split([b"a\nb"]) == ["a\n", "b"]
+
+
+def test_newlines_are_normalized_across_chunks():
+    assert _split([b"a\r\nb\rc\r", b"\nd\r"]) == ["a\n", "b\n", "c\n", "d\n"]
+
+
+def test_utf8_split_between_reads():
+    data = "日志 ✓\n".encode()
+    # 每个字节单独喂：多字节字符被切开也能正确解码
+    assert _split([data[i:i + 1] for i in range(len(data))]) == ["日志 ✓\n"]
+
+
+def test_invalid_bytes_are_replaced():
+    assert _split([b"\xff\xfe ok\n"]) == ["�� ok\n"]
+
+
+def test_overlong_line_is_cut(monkeypatch):
+    monkeypatch.setattr(log_ingest, "MAX_LINE_BYTES", 8)
+    sp = LineSplitter()
+    assert sp.feed(b"abcd") == []
+    assert sp.feed(b"efghij") == ["abcdefghij\n"]
+    assert sp.feed(b"k\n") == ["k\n"]
@@ -0,0 +1,55 @@
+import threading
+
+from app.storage.log_spool import LogSpool
+
+LINES = [f"line {i}\n" for i in range(1000)]
+
+
+def _spool(tmp_path, **kw):
+    spool = LogSpool(tmp_path / "spool", index_every=16, compress_finished=True, **kw)
+    spool.append("r1", LINES[:400])
+    spool.append("r1", LINES[400:])
+    return spool
+
+
+def test_close_does_not_gzip_on_the_caller(tmp_path):
+    spool = _spool(tmp_path)
+    gate = threading.Event()
+    real = spool._compress_segment
+
+    def slow(run_id, seg):
+        gate.wait(10)
+        real(run_id, seg)
+
+    spool._compress_segment = slow
+    spool.close("r1")  # 压缩被卡住也要马上返回
+    root = tmp_path / "spool"
+    assert (root / "r1.log").exists() and not (root / "r1.log.gz").exists()
+    assert spool.read_lines("r1", 500, 503) == LINES[500:503]
+
+    gate.set()
+    assert spool.flush(timeout=10)
+    assert (root / "r1.log.gz").exists() and not (root / "r1.log").exists()
+    assert spool.read_lines("r1", 500, 503) == LINES[500:503]
+    assert spool.read_bytes("r1", 0, 7) == b"line 0\n"
+
+    # 重开之后从 .idx + .gz 恢复
+    again = LogSpool(root, index_every=16)
+    assert again.read_lines("r1", 998, 1000) == LINES[998:]
+
+
+def test_delete_while_compressing_leaves_nothing_behind(tmp_path):
+    spool = _spool(tmp_path)
+    gate = threading.Event()
+    real = spool._compress_segment
+
+    def slow(run_id, seg):
+        gate.wait(10)
+        real(run_id, seg)
+
+    spool._compress_segment = slow
+    spool.close("r1")
+    spool.delete("r1")
+    gate.set()
+    assert spool.flush(timeout=10)
+    assert list((tmp_path / "spool").iterdir()) == []
@@ -0,0 +1,53 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.scripts import build_router
+from app.schemas.script import RunStatus
+from app.storage.state_store import InMemoryStateStore
+
+
+class _LoopCheckingStore(InMemoryStateStore):
+    """Records store calls made on the event loop thread (they would block every request)."""
+
+    def __init__(self):
+        super().__init__(100)
+        self.on_loop = []
+
+    def _check(self, name):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.on_loop.append(name)
+
+    def get_run(self, run_id):
+        self._check("get_run")
+        return super().get_run(run_id)
+
+    def read_logs(self, run_id, **kw):
+        self._check("read_logs")
+        return super().read_logs(run_id, **kw)
+
+
+def _client(store):
+    app = FastAPI()
+    app.include_router(build_router(registry=None, scheduler=None, store=store))
+    return TestClient(app)
+
+
+def test_stream_sends_lines_then_end_off_the_event_loop():
+    store = _LoopCheckingStore()
+    store.create_run(run_id="r1", script_id="s", pid=None)
+    store.append_logs("r1", ["a\n", "b\n", "c\n"])
+    store.finish_run("r1", status=RunStatus.done, returncode=0)
+
+    body = _client(store).get("/runs/r1/logs/stream", headers={"Last-Event-ID": "0"}).text
+    assert "id: 1\ndata: b\n\n" in body and "id: 0\n" not in body
+    assert 'event: end\ndata: {"status": "done", "next_seq": 3}' in body
+    assert store.on_loop == []
+
+
+def test_stream_unknown_run_is_404():
+    assert _client(_LoopCheckingStore()).get("/runs/nope/logs/stream").status_code == 404
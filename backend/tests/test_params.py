@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+from app.services.params import ParamError, compile_args_schema, params_to_cli_args, prepare_params
+
+
+@pytest.fixture
+def validator():
+    return compile_args_schema(
+        {
+            "seconds": {"type": "number", "default": 5, "min": 0},
+            "mode": {"type": "string", "enum": ["fast", "slow"], "required": True},
+            "tags": {"type": "array", "items": "string", "max": 2},
+            "verbose": "boolean",
+            "count": "integer",
+        }
+    )
+
+
+def test_no_schema_means_no_validator():
+    assert compile_args_schema(None) is None
+    assert compile_args_schema({}) is None
+
+
+def test_defaults_and_coercion(validator):
+    out = validator.validate({"mode": "fast", "verbose": "yes", "count": "3", "tags": '["a", "b"]'})
+    assert out == {"seconds": 5, "mode": "fast", "verbose": True, "count": 3, "tags": ["a", "b"]}
+    assert validator.validate({"mode": "slow", "seconds": "1.5"})["seconds"] == 1.5
+
+
+def test_every_problem_is_reported(validator):
+    with pytest.raises(ParamError) as exc:
+        validator.validate({"seconds": -1, "count": 1.5, "tags": ["a", "b", "c"], "extra": 1})
+    errors = {e["loc"]: e["msg"] for e in exc.value.errors}
+    assert errors == {
+        "mode": "required",
+        "seconds": "must be >= 0",
+        "count": "expected an integer",
+        "tags": "length must be <= 2",
+        "extra": "unknown parameter",
+    }
+
+
+@pytest.mark.parametrize(
+    "params, loc",
+    [
+        ({"mode": "medium"}, "mode"),
+        ({"mode": "fast", "verbose": "maybe"}, "verbose"),
+        ({"mode": "fast", "verbose": 2}, "verbose"),
+        ({"mode": "fast", "count": True}, "count"),
+        ({"mode": "fast", "tags": [{"a": 1}]}, "tags"),
+        ({"mode": "fast", "tags": "not json"}, "tags"),
+    ],
+)
+def test_bad_values(validator, params, loc):
+    with pytest.raises(ParamError) as exc:
+        validator.validate(params)
+    assert [e["loc"] for e in exc.value.errors] == [loc]
+
+
+@pytest.mark.parametrize(
+    "schema",
+    [
+        {"x": {"type": "uuid"}},
+        {"x": {"type": "integer", "enum": ["a"]}},
+        {"x": {"type": "integer", "default": "soon"}},
+        {"x": 3},
+        ["x"],
+    ],
+)
+def test_bad_schema_is_rejected(schema):
+    with pytest.raises(ValueError):
+        compile_args_schema(schema)
+
+
+def test_cli_args_are_json_for_non_strings():
+    assert params_to_cli_args({"x": 1, "name": "abc", "on": True, "ids": [1, 2], " ": "skip"}) == [
+        "--x", "1", "--name", "abc", "--on", "true", "--ids", "[1, 2]",
+    ]
+
+
+def test_delivery_modes():
+    assert prepare_params({"a": 1}).argv == ["--a", "1"]
+
+    d = prepare_params({"a": 1}, "stdin")
+    assert (d.argv, json.loads(d.stdin), d.env) == ([], {"a": 1}, {"AP_PARAMS_VIA": "stdin"})
+
+    d = prepare_params({"a": [1]}, "file")
+    try:
+        assert d.env["AP_PARAMS_FILE"] == str(d.file)
+        assert json.loads(d.file.read_text()) == {"a": [1]}
+        assert d.merge_env({"K": "v"}) == {"K": "v", **d.env}
+    finally:
+        path = d.file
+        d.cleanup()
+    assert not path.exists()
+
+    with pytest.raises(ValueError):
+        prepare_params({}, "pigeon")
+
+
+def test_auto_falls_back_to_file_for_nested_or_long_params():
+    assert prepare_params({"a": 1}, "auto").via == "argv"
+    for params in ({"a": {"b": 1}}, {"a": "x" * 5000}):
+        d = prepare_params(params, "auto")
+        try:
+            assert d.via == "file"
+        finally:
+            d.cleanup()
@@ -0,0 +1,33 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.schemas.script import RunStatus
+from app.storage.redis_store import RedisStateStore
+
+# 这些字符 str.splitlines 都会当成换行，但对日志来说只是行里的普通字符
+ODD = ["page\x0cbreak\n", "cr\rinside\n", "vt\x0bfs\x1c\n", "nel\x85ls ps\n"]
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def test_other_nodes_read_logs_with_the_right_seq(client):
+    writer = RedisStateStore(client, logs_max_lines=2, flush_interval_s=0)
+    writer.create_run(run_id="r1", script_id="s", pid=None)
+    lines = ODD + [f"line{i}\n" for i in range(6)]
+    writer.append_logs("r1", lines[:5])
+    writer.append_logs("r1", lines[5:])
+    writer.finish_run("r1", status=RunStatus.done, returncode=0)
+    assert writer.flush(timeout=5)
+
+    # 另一个进程（API / 别的节点）：内存里没有这个 run，日志全从 stream 里读
+    reader = RedisStateStore(client, logs_max_lines=2, flush_interval_s=0)
+    assert reader.get_run("r1").status == RunStatus.done
+    for since in range(len(lines)):
+        sl = reader.read_logs("r1", since=since, limit=3)
+        assert (sl.first_seq, sl.lines) == (since, lines[since:since + 3])
+    sl = reader.read_logs("r1", limit=3)
+    assert sl.lines == lines[-3:] and sl.truncated
@@ -0,0 +1,146 @@
+import itertools
+
+import pytest
+
+from app.schemas.script import RunStatus
+from app.services import result_cache as rc
+from app.services.registry import RegistryDiff
+from app.services.result_cache import ResultCache
+from app.storage.state_store import InMemoryStateStore
+
+
+class _Env:
+    def __init__(self, tmp_path, listener=True, **kw):
+        self.store = InMemoryStateStore()
+        self.cache = ResultCache(self.store, **kw)
+        self.listener = listener
+        self.script = tmp_path / "job.py"
+        self.script.write_text("print('v1')\n", encoding="utf-8")
+        self._ids = itertools.count()
+        self.submitted = []
+
+    def submit(self, params, ttl_s=None, script_id="s"):
+        def start():
+            run_id = f"r{next(self._ids)}"
+            self.store.create_run(run_id=run_id, script_id=script_id, pid=None, status=RunStatus.queued)
+            self.submitted.append(run_id)
+            return run_id
+
+        return self.cache.submit(script_id=script_id, script_path=self.script, params=params, ttl_s=ttl_s, submit=start)
+
+    def finish(self, run_id, status=RunStatus.done):
+        self.store.append_log(run_id, "out\n")
+        self.store.finish_run(run_id, status=status, returncode=0 if status == RunStatus.done else 1)
+        if self.listener:
+            self.cache.on_run_finished(run_id, status, 0)
+
+
+@pytest.fixture
+def env(tmp_path):
+    return _Env(tmp_path)
+
+
+def test_miss_joined_hit(env):
+    run_id, outcome = env.submit({"a": 1})
+    assert outcome == "miss"
+    assert env.submit({"a": 1}) == (run_id, "joined")
+    assert env.submit({"a": 2})[1] == "miss"  # 参数不同是另一个 key
+    env.finish(run_id)
+    assert env.submit({"a": 1}) == (run_id, "hit")
+    assert len(env.submitted) == 2
+
+
+def test_failed_runs_are_not_cached(env):
+    run_id, _ = env.submit({"a": 1})
+    env.finish(run_id, RunStatus.failed)
+    assert env.cache.stats()["entries"] == 0
+    assert env.submit({"a": 1})[1] == "miss"
+
+
+def test_ttl(env, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rc.time, "monotonic", lambda: now[0])
+    run_id, _ = env.submit({"a": 1}, ttl_s=10)
+    env.finish(run_id)
+    now[0] += 9
+    assert env.submit({"a": 1}, ttl_s=10) == (run_id, "hit")
+    now[0] += 2
+    new_id, outcome = env.submit({"a": 1}, ttl_s=10)
+    assert outcome == "miss" and new_id != run_id
+
+
+def test_finished_unique_runs_stay_within_max_entries(tmp_path):
+    env = _Env(tmp_path, max_entries=5)
+    for i in range(50):
+        run_id, _ = env.submit({"i": i})
+        env.finish(run_id)
+    assert env.cache.stats()["entries"] == 5
+    assert env.cache.stats()["inflight"] == 0
+    # 最久没用到的先走：最后 5 个还在
+    assert env.submit({"i": 49})[1] == "hit"
+    assert env.submit({"i": 0})[1] == "miss"
+
+
+def test_lru_keeps_recently_hit_entries(tmp_path):
+    env = _Env(tmp_path, max_entries=2)
+    a, _ = env.submit({"k": "a"})
+    env.finish(a)
+    b, _ = env.submit({"k": "b"})
+    env.finish(b)
+    assert env.submit({"k": "a"})[1] == "hit"
+    c, _ = env.submit({"k": "c"})
+    env.finish(c)
+    assert env.submit({"k": "a"})[1] == "hit"
+    assert env.submit({"k": "b"})[1] == "miss"
+
+
+def test_log_budget(tmp_path):
+    env = _Env(tmp_path, max_log_bytes=10)
+    for i in range(5):
+        run_id, _ = env.submit({"i": i})
+        env.finish(run_id)
+    # 每个 run 的日志是 "out\n"（4 字节），10 字节的预算只放得下两个
+    assert env.cache.stats()["entries"] == 2
+    assert env.cache.stats()["log_bytes"] == 8
+
+
+def test_without_finish_listener_finished_runs_are_reconciled(tmp_path):
+    env = _Env(tmp_path, listener=False, max_entries=5)
+    for i in range(50):
+        run_id, _ = env.submit({"i": i})
+        env.finish(run_id)
+    st = env.cache.stats()
+    assert st["inflight"] <= 5 and st["entries"] <= 10
+    # 没有回调时，再次查到同一个 key 会按 store 里的状态结算
+    run_id, _ = env.submit({"x": 1})
+    env.finish(run_id)
+    assert env.submit({"x": 1}) == (run_id, "hit")
+
+
+def test_evicted_run_is_not_a_hit(env):
+    run_id, _ = env.submit({"a": 1})
+    env.finish(run_id)
+    env.store.delete_run(run_id)
+    assert env.submit({"a": 1})[1] == "miss"
+
+
+def test_script_change_invalidates(env):
+    run_id, _ = env.submit({"a": 1})
+    env.finish(run_id)
+    env.script.write_text("print('version 2')\n", encoding="utf-8")
+    new_id, outcome = env.submit({"a": 1})
+    assert outcome == "miss" and new_id != run_id
+    assert env.cache.stats()["entries"] == 1  # 旧内容的结果顺手清掉了
+
+
+def test_spec_change_invalidates(env):
+    done, _ = env.submit({"a": 1})
+    env.finish(done)
+    running, _ = env.submit({"a": 2})
+    env.submit({"a": 3}, script_id="other")
+    env.cache.on_registry_change(RegistryDiff(changed=("s",)))
+    assert env.cache.stats()["entries"] == 1
+    assert env.submit({"a": 1})[1] == "miss"
+    # 被清掉的 in-flight run 结束时不会再变成缓存结果
+    env.finish(running)
+    assert env.submit({"a": 2})[1] == "miss"
@@ -0,0 +1,137 @@
+import json
+import threading
+from datetime import timedelta
+
+from app.schemas.script import RunStatus
+from app.storage.retention import DirectoryArchiver, RetentionPolicy
+from app.storage.state_store import InMemoryStateStore
+
+
+def _ids(store):
+    # list_runs 不算"读过"，不会影响 LRU 标记
+    return {r.run_id for r in store.list_runs()}
+
+
+def _finish(store, run_id, lines=()):
+    store.create_run(run_id=run_id, script_id="s", pid=None)
+    store.append_logs(run_id, list(lines))
+    store.finish_run(run_id, status=RunStatus.done, returncode=0)
+
+
+def test_no_policy_keeps_everything():
+    store = InMemoryStateStore()
+    for i in range(5):
+        _finish(store, f"r{i}")
+    assert len(_ids(store)) == 5
+    assert store.sweep() == 0
+
+
+def test_count_limit_evicts_oldest_finished_first():
+    store = InMemoryStateStore(retention=RetentionPolicy(max_finished_runs=2))
+    store.create_run(run_id="running", script_id="s", pid=None)
+    for i in range(4):
+        _finish(store, f"r{i}")
+    assert _ids(store) == {"running", "r2", "r3"}
+    assert store.stats()["evicted"]["count"] == 2
+
+
+def test_recently_read_runs_get_a_second_chance():
+    store = InMemoryStateStore(retention=RetentionPolicy(max_finished_runs=2))
+    _finish(store, "r0")
+    _finish(store, "r1")
+    store.get_run("r0")  # r0 最老，但刚被读过
+    _finish(store, "r2")
+    assert _ids(store) == {"r0", "r2"}
+    # r0 被挪到了队尾，标记也清掉了：先淘汰 r2，再下一次才轮到 r0
+    _finish(store, "r3")
+    assert _ids(store) == {"r0", "r3"}
+    _finish(store, "r4")
+    assert _ids(store) == {"r3", "r4"}
+
+
+def test_ttl_is_applied_by_sweep():
+    store = InMemoryStateStore(retention=RetentionPolicy(finished_ttl_s=60))
+    _finish(store, "old")
+    _finish(store, "new")
+    store.create_run(run_id="running", script_id="s", pid=None)
+    old = store.peek_run("old")
+    old.finished_at -= timedelta(seconds=120)
+    assert store.sweep() == 1
+    assert _ids(store) == {"new", "running"}
+    assert store.stats()["evicted"]["ttl"] == 1
+
+
+def test_log_budget_evicts_until_under():
+    store = InMemoryStateStore(retention=RetentionPolicy(max_log_bytes=1))
+    store.create_run(run_id="running", script_id="s", pid=None)
+    store.append_logs("running", ["x" * 100 + "\n"] * 10)  # 还在跑的不算预算，也不淘汰
+    _finish(store, "r0", ["line\n"])
+    assert _ids(store) == {"running"}
+    assert store.stats()["log_bytes_finished"] == 0
+    assert store.stats()["evicted"]["log_bytes"] == 1
+
+
+def test_evicted_runs_are_archived(tmp_path):
+    seen = []
+
+    def hook(rec):
+        seen.append(rec.run_id)
+        if rec.run_id == "r1":
+            raise OSError("disk full")
+
+    store = InMemoryStateStore(retention=RetentionPolicy(max_finished_runs=1), on_evict=hook)
+    for i in range(3):
+        _finish(store, f"r{i}")
+    assert seen == ["r0", "r1"]
+    stats = store.stats()
+    assert (stats["archived"], stats["archive_errors"]) == (1, 1)
+    assert _ids(store) == {"r2"}  # hook 失败也照样删
+
+
+def test_directory_archiver_writes_metadata_and_log_tail(tmp_path):
+    store = InMemoryStateStore(
+        retention=RetentionPolicy(max_finished_runs=0), on_evict=DirectoryArchiver(tmp_path / "archive")
+    )
+    _finish(store, "r0", ["a\n", "b\n"])
+    doc = json.loads((tmp_path / "archive" / "r0.json").read_text(encoding="utf-8"))
+    assert (doc["run_id"], doc["status"], doc["returncode"], doc["log_tail"]) == ("r0", "done", 0, ["a\n", "b\n"])
+    assert doc["next_seq"] == 2
+
+
+def test_runner_lookups_do_not_count_as_reads(tmp_path):
+    # runner 在 run 结束前自己会查一次记录；那不算"有人读过"，淘汰顺序还是按结束先后
+    from app.bootstrap import build_runner
+
+    store = InMemoryStateStore(retention=RetentionPolicy(max_finished_runs=2))
+    runner = build_runner("thread", store)
+    finished = []
+    done = threading.Event()
+    runner.add_listener(lambda run_id, status, rc: (finished.append(run_id), done.set()))
+    script = tmp_path / "job.py"
+    script.write_text("print('hi')\n", encoding="utf-8")
+
+    def run():
+        done.clear()
+        run_id = runner.start(script_id="s", script_path=script, params={})
+        assert done.wait(10)
+        return run_id
+
+    r0, r1 = run(), run()
+    store.get_run(r1)  # API 读了 r1
+    r2 = run()
+    assert _ids(store) == {r1, r2}
+    r3 = run()  # r1 用掉了第二次机会，这次轮到 r2（比 r1 晚结束，但没人读过）
+    assert _ids(store) == {r1, r3}
+    assert r0 not in _ids(store)
+
+
+def test_second_chance_does_not_hide_expired_runs_from_ttl():
+    store = InMemoryStateStore(retention=RetentionPolicy(max_finished_runs=2, finished_ttl_s=60))
+    _finish(store, "r0")
+    _finish(store, "r1")
+    store.get_run("r0")
+    _finish(store, "r2")  # r1 被淘汰，r0 在淘汰环里挪到了 r2 后面
+    assert _ids(store) == {"r0", "r2"}
+    store.peek_run("r0").finished_at -= timedelta(seconds=120)
+    assert store.sweep() == 1
+    assert _ids(store) == {"r2"}
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.schemas.script import RunStatus
+from app.storage import state_store
+from app.storage.state_store import InMemoryStateStore, RunQuery, decode_cursor
+
+T0 = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    # r0..r9，每个隔一分钟；偶数是脚本 a，奇数是脚本 b；r0..r4 已经结束
+    clock = iter(T0 + timedelta(minutes=i) for i in range(10))
+
+    class _Clock(datetime):
+        @classmethod
+        def utcnow(cls):
+            return next(clock, T0 + timedelta(hours=1))
+
+    monkeypatch.setattr(state_store, "datetime", _Clock)
+    s = InMemoryStateStore()
+    for i in range(10):
+        s.create_run(run_id=f"r{i}", script_id="a" if i % 2 == 0 else "b", pid=None)
+    for i in range(5):
+        s.finish_run(f"r{i}", status=RunStatus.done, returncode=0)
+    return s
+
+
+def _ids(page):
+    return [r.run_id for r in page.records]
+
+
+def _all_pages(store, **kw):
+    out, cursor = [], None
+    while True:
+        page = store.query_runs(RunQuery(cursor=cursor, limit=3, **kw))
+        out.append(_ids(page))
+        cursor = page.next_cursor
+        if cursor is None:
+            return out
+
+
+def test_newest_first_with_keyset_pages(store):
+    assert _all_pages(store) == [["r9", "r8", "r7"], ["r6", "r5", "r4"], ["r3", "r2", "r1"], ["r0"]]
+    assert _all_pages(store, descending=False)[0] == ["r0", "r1", "r2"]
+
+
+def test_filters_use_their_index(store):
+    assert _ids(store.query_runs(RunQuery(script_id="a"))) == ["r8", "r6", "r4", "r2", "r0"]
+    assert _ids(store.query_runs(RunQuery(status=RunStatus.done))) == ["r4", "r3", "r2", "r1", "r0"]
+    assert _ids(store.query_runs(RunQuery(script_id="b", status=RunStatus.running))) == ["r9", "r7", "r5"]
+    assert _ids(store.query_runs(RunQuery(script_id="nope"))) == []
+
+
+def test_time_range_is_half_open(store):
+    q = RunQuery(created_after=T0 + timedelta(minutes=2), created_before=T0 + timedelta(minutes=5), descending=False)
+    assert _ids(store.query_runs(q)) == ["r2", "r3", "r4"]
+
+
+def test_status_change_moves_the_run_between_indexes(store):
+    store.finish_run("r9", status=RunStatus.failed, returncode=1)
+    assert _ids(store.query_runs(RunQuery(status=RunStatus.failed))) == ["r9"]
+    assert "r9" not in _ids(store.query_runs(RunQuery(status=RunStatus.running)))
+    store.mark_running("r8", pid=1)  # 状态没变，索引不动
+    assert _ids(store.query_runs(RunQuery(status=RunStatus.running, script_id="a"))) == ["r8", "r6"]
+
+
+def test_deleted_runs_leave_every_index(store):
+    store.delete_run("r4")
+    idx = store._index
+    assert all("r4" not in {k[1] for k in keys} for keys in [idx.by_time, *idx.by_script.values(), *idx.by_status.values()])
+    assert _ids(store.query_runs(RunQuery(script_id="a", status=RunStatus.done))) == ["r2", "r0"]
+
+
+def test_cursor_round_trip_and_garbage(store):
+    page = store.query_runs(RunQuery(limit=2))
+    assert decode_cursor(page.next_cursor) == (T0 + timedelta(minutes=8), "r8")
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
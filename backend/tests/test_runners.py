@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from app.bootstrap import build_runner
+from app.schemas.script import RunStatus
+from app.storage.state_store import InMemoryStateStore
+
+
+@pytest.fixture(params=["thread", "asyncio"])
+def runner(request):
+    store = InMemoryStateStore()
+    r = build_runner(request.param, store)
+    finished = {}
+    done = threading.Event()
+
+    def on_finish(run_id, status, returncode):
+        finished[run_id] = (status, returncode)
+        done.set()
+
+    r.add_listener(on_finish)
+    return r, store, finished, done
+
+
+def _script(tmp_path, body):
+    p = tmp_path / "job.py"
+    p.write_text(body, encoding="utf-8")
+    return p
+
+
+def test_run_to_completion(runner, tmp_path):
+    r, store, finished, done = runner
+    path = _script(tmp_path, "import sys\nprint('args', sys.argv[1:])\nprint('bye')\n")
+    run_id = r.start(script_id="s", script_path=path, params={"n": 2})
+    assert done.wait(10)
+    assert finished[run_id] == (RunStatus.done, 0)
+    rec = store.get_run(run_id)
+    assert rec.status == RunStatus.done
+    lines, _ = store.get_logs(run_id)
+    assert "args ['--n', '2']\n" in lines and "bye\n" in lines
+
+
+def test_failure_and_timeout(runner, tmp_path):
+    r, store, finished, done = runner
+    run_id = r.start(script_id="s", script_path=_script(tmp_path, "raise SystemExit(4)\n"), params={})
+    assert done.wait(10)
+    assert finished[run_id] == (RunStatus.failed, 4)
+
+    done.clear()
+    slow = _script(tmp_path, "import time\ntime.sleep(60)\n")
+    run_id = r.start(script_id="s", script_path=slow, params={}, timeout_s=0.3)
+    assert done.wait(10)
+    assert finished[run_id][0] == RunStatus.failed
+    assert "timeout" in (store.get_run(run_id).failure_reason or "")
+
+
+def test_stop(runner, tmp_path):
+    r, store, finished, done = runner
+    slow = _script(tmp_path, "import time\nprint('up', flush=True)\ntime.sleep(60)\n")
+    run_id = r.start(script_id="s", script_path=slow, params={})
+    assert r.stop(run_id) is True
+    assert done.wait(10)
+    assert finished[run_id][0] == RunStatus.stopped
+    assert r.stop(run_id) is False
+
+
+def test_timeout_keeps_the_last_partial_line(runner, tmp_path):
+    r, store, finished, done = runner
+    path = _script(tmp_path, "import sys, time\nsys.stdout.write('no newline yet')\nsys.stdout.flush()\ntime.sleep(60)\n")
+    run_id = r.start(script_id="s", script_path=path, params={}, timeout_s=0.5)
+    assert done.wait(10)
+    lines, _ = store.get_logs(run_id)
+    assert any(line.startswith("no newline yet") for line in lines)
+
+
+def test_stop_racing_exit_finishes_once(runner, tmp_path):
+    r, store, finished, done = runner
+    calls = []
+    r.add_listener(lambda run_id, status, rc: calls.append((run_id, status)))
+    path = _script(tmp_path, "print('quick')\n")
+    for _ in range(10):
+        done.clear()
+        run_id = r.start(script_id="s", script_path=path, params={})
+        while not done.is_set():
+            r.stop(run_id, kill_after_s=0.5)
+        done.wait(10)
+        # 同一个 run 只收尾一次，store 里的状态和回调给出的一致
+        mine = [status for rid, status in calls if rid == run_id]
+        assert len(mine) == 1
+        assert store.get_run(run_id).status == mine[0]
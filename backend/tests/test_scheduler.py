@@ -0,0 +1,145 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from app.schemas.script import RunStatus
+from app.services.registry import ScriptSpec
+from app.services.scheduler import RunScheduler
+from app.storage.state_store import InMemoryStateStore
+
+
+class _FakeRunner:
+    """Runner whose runs only finish when the test says so; start() can be held on an Event."""
+
+    def __init__(self):
+        self.started = []
+        self.stopped = []
+        self.hold = None  # threading.Event：设了就让 start() 卡在这里
+        self.entered = threading.Event()
+        self._listeners = []
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def start(self, *, script_id, script_path, params, run_id=None, **kw):
+        self.entered.set()
+        if self.hold is not None:
+            self.hold.wait(5)
+        self.started.append(run_id)
+        return run_id
+
+    def stop(self, run_id, *, kill_after_s=2.0):
+        if run_id not in self.started:
+            return False
+        self.stopped.append(run_id)
+        self.finish(run_id, RunStatus.stopped)
+        return True
+
+    def finish(self, run_id, status=RunStatus.done):
+        for fn in self._listeners:
+            fn(run_id, status, 0)
+
+
+def _spec(script_id="s", **kw):
+    return ScriptSpec(script_id=script_id, entry="x.py", description="", **kw)
+
+
+def _wait(cond, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def env():
+    runner = _FakeRunner()
+    store = InMemoryStateStore()
+    return runner, store
+
+
+def _submit(sched, spec, priority=0):
+    return sched.submit(spec=spec, script_path=Path("x.py"), params={}, priority=priority)
+
+
+def test_global_cap_and_priority_order(env):
+    runner, store = env
+    sched = RunScheduler(runner=runner, store=store, max_concurrent_runs=1)
+    first = _submit(sched, _spec())
+    assert _wait(lambda: runner.started == [first])
+    low = _submit(sched, _spec(), priority=0)
+    high = _submit(sched, _spec(), priority=5)
+    assert sched.queue_position(high) == 0
+    assert sched.queue_position(low) == 1
+    assert sched.queue_position(first) is None
+
+    runner.finish(first)
+    assert _wait(lambda: runner.started == [first, high])
+    assert sched.queue_position(low) == 0
+    runner.finish(high)
+    assert _wait(lambda: runner.started == [first, high, low])
+    assert sched.queue_position(low) is None
+
+
+def test_per_script_cap(env):
+    runner, store = env
+    sched = RunScheduler(runner=runner, store=store, max_concurrent_runs=4)
+    capped = _spec("a", max_concurrency=1)
+    a1 = _submit(sched, capped)
+    a2 = _submit(sched, capped)
+    b = _submit(sched, _spec("b"))
+    assert _wait(lambda: set(runner.started) == {a1, b})
+    # a2 被自己脚本的上限挡着，但名次照算
+    assert sched.queue_position(a2) == 0
+    assert sched.stats()["running"] == 2
+    runner.finish(a1)
+    assert _wait(lambda: a2 in runner.started)
+
+
+def test_stop_queued_run(env):
+    runner, store = env
+    sched = RunScheduler(runner=runner, store=store, max_concurrent_runs=1)
+    first = _submit(sched, _spec())
+    queued = [_submit(sched, _spec()) for _ in range(3)]
+    assert _wait(lambda: runner.started == [first])
+    assert sched.stop(queued[1]) is True
+    assert store.get_run(queued[1]).status == RunStatus.stopped
+    assert sched.queue_position(queued[2]) == 1
+    runner.finish(first)
+    assert _wait(lambda: runner.started == [first, queued[0]])
+
+
+def test_stop_before_start_never_launches(env, monkeypatch):
+    runner, store = env
+    sched = RunScheduler(runner=runner, store=store, max_concurrent_runs=1)
+    gate = threading.Event()
+    real = sched.run_stats.adaptive_timeout
+
+    def slow_timeout(*a, **kw):
+        gate.wait(5)  # 已经出队、还没调 executor.start
+        return real(*a, **kw)
+
+    monkeypatch.setattr(sched.run_stats, "adaptive_timeout", slow_timeout)
+    run_id = _submit(sched, _spec())
+    assert _wait(lambda: sched.stats()["running"] == 1)
+    assert sched.stop(run_id) is True
+    gate.set()
+    assert _wait(lambda: store.get_run(run_id).status == RunStatus.stopped)
+    assert runner.started == []
+    assert sched.stats()["running"] == 0
+
+
+def test_stop_during_start_is_forwarded(env):
+    runner, store = env
+    runner.hold = threading.Event()
+    sched = RunScheduler(runner=runner, store=store, max_concurrent_runs=1)
+    run_id = _submit(sched, _spec())
+    assert runner.entered.wait(2)
+    assert sched.stop(run_id) is True
+    runner.hold.set()
+    assert _wait(lambda: runner.stopped == [run_id])
+    assert _wait(lambda: sched.stats()["running"] == 0)
@@ -0,0 +1,69 @@
+import pytest
+
+from app.schemas.script import RunStatus
+from app.storage.sqlite_store import SqliteStateStore
+from app.storage.state_store import RunQuery, split_log_lines
+
+# 这些字符 str.splitlines 都会当成换行，但对日志来说只是行里的普通字符
+ODD = ["page\x0cbreak\n", "cr\rinside\n", "vt\x0bfs\x1c\n", "nel\x85ls ps \n"]
+
+
+@pytest.fixture
+def db(tmp_path):
+    return tmp_path / "runs.db"
+
+
+def _reopen(db, **kw):
+    return SqliteStateStore(db, logs_max_lines=2, flush_interval_s=0, **kw)
+
+
+def test_split_log_lines_only_cuts_at_newline():
+    assert split_log_lines("".join(ODD) + "tail") == [*ODD, "tail"]
+    assert split_log_lines("") == []
+
+
+def test_cold_reads_keep_seq_with_odd_characters(db):
+    store = _reopen(db)
+    store.create_run(run_id="r1", script_id="s", pid=None)
+    lines = ODD + [f"line{i}\n" for i in range(6)]
+    store.append_logs("r1", lines[:5])
+    store.append_logs("r1", lines[5:])
+    # hot tail 只留 2 行，前面的都要从库里读
+    for since in range(len(lines)):
+        sl = store.read_logs("r1", since=since, limit=3)
+        assert (sl.first_seq, sl.lines) == (since, lines[since:since + 3])
+    store.finish_run("r1", status=RunStatus.done, returncode=0)
+    store.close()
+
+    # 重开之后整个 run 都只在库里
+    store = _reopen(db)
+    try:
+        assert store.get_run("r1").status == RunStatus.done
+        sl = store.read_logs("r1", since=1, limit=2)
+        assert (sl.first_seq, sl.lines) == (1, lines[1:3])
+        sl = store.read_logs("r1", limit=3)
+        assert sl.lines == lines[-3:] and sl.truncated
+    finally:
+        store.close()
+
+
+def test_runs_survive_a_restart_and_active_ones_fail(db):
+    store = _reopen(db)
+    store.create_run(run_id="done", script_id="a", pid=None)
+    store.finish_run("done", status=RunStatus.done, returncode=0)
+    store.create_run(run_id="active", script_id="b", pid=1)
+    store.append_logs("active", ["x\n", "y\n", "z\n"])
+    store.flush()
+    store.close()
+
+    store = _reopen(db)
+    try:
+        active = store.get_run("active")
+        assert active.status == RunStatus.failed
+        assert active.next_seq == 3
+        assert "restarted" in active.failure_reason
+        ids = [r.run_id for r in store.query_runs(RunQuery(descending=False)).records]
+        assert ids == ["done", "active"]
+        assert [r.run_id for r in store.query_runs(RunQuery(status=RunStatus.done)).records] == ["done"]
+    finally:
+        store.close()
@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from app.services.supervisor import ProcessSupervisor, kill_group
+
+
+@pytest.fixture
+def sup():
+    s = ProcessSupervisor()
+    yield s
+    s.close()
+
+
+def test_deadlines_fire_in_order(sup):
+    fired = []
+    done = threading.Event()
+    sup.call_later("b", 0.10, lambda: fired.append("b"))
+    sup.call_later("a", 0.05, lambda: fired.append("a"))
+    sup.call_later("c", 0.15, lambda: (fired.append("c"), done.set()))
+    assert done.wait(2)
+    assert fired == ["a", "b", "c"]
+    assert sup.stats["deadlines_fired"] == 3
+
+
+def test_same_key_replaces_and_cancel_drops(sup):
+    fired = []
+    done = threading.Event()
+    sup.call_later("x", 0.05, lambda: fired.append("old"))
+    sup.call_later("x", 0.10, lambda: fired.append("new"))
+    sup.call_later("y", 0.05, lambda: fired.append("cancelled"))
+    sup.cancel("y")
+    sup.call_later("end", 0.20, done.set)
+    assert done.wait(2)
+    assert fired == ["new"]
+
+
+@pytest.mark.parametrize("pidfd", [True, False])
+def test_watch_reports_exit_before_reap(sup, pidfd):
+    sup.stats["pidfd"] = pidfd and hasattr(os, "pidfd_open")
+    proc = subprocess.Popen([sys.executable, "-c", "import sys; sys.exit(3)"])
+    exited = threading.Event()
+    seen = []
+
+    def on_exit(pid):
+        # 回调时进程还没被回收：/proc 里还在（zombie）
+        seen.append((pid, os.path.exists(f"/proc/{pid}")))
+        exited.set()
+
+    sup.watch(proc.pid, on_exit)
+    assert exited.wait(5)
+    assert seen == [(proc.pid, True)]
+    assert proc.wait(1) == 3
+
+
+def test_kill_group_takes_grandchildren(sup):
+    code = "import subprocess, sys, time; subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)']); print('up', flush=True); time.sleep(60)"
+    proc = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, start_new_session=True)
+    assert proc.stdout.readline() == b"up\n"
+    assert kill_group(proc.pid)
+    assert proc.wait(5) < 0
+    proc.stdout.close()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            os.killpg(proc.pid, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail("grandchild survived kill_group")
+    assert kill_group(proc.pid) is False
+
+
+def test_reader_gets_data_then_eof(sup):
+    r, w = os.pipe()
+    os.set_blocking(r, False)
+    chunks = []
+    eof = threading.Event()
+
+    def on_data(chunk):
+        chunks.append(chunk)
+        if chunk == b"":
+            eof.set()
+
+    sup.add_reader(r, on_data)
+    os.write(w, b"hello ")
+    os.write(w, b"world")
+    os.close(w)
+    assert eof.wait(2)
+    assert b"".join(chunks) == b"hello world" and chunks[-1] == b""
@@ -0,0 +1,125 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.schemas.script import RunStatus
+from app.services.runner_node import RunnerNode
+from app.services.work_queue import QueueScheduler, RedisWorkQueue, reap_dead_nodes
+from app.storage.redis_store import RedisStateStore
+
+
+class _Spec:
+    script_id = "s"
+
+
+class _StuckScheduler:
+    """Local scheduler whose runs never finish (stop() is ignored)."""
+
+    def __init__(self):
+        self.stopped = []
+
+    def stop(self, run_id):
+        self.stopped.append(run_id)
+        return True
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def _enqueue(client, n=1, priority=0):
+    api_store = RedisStateStore(client)
+    queue = RedisWorkQueue(client)
+    sched = QueueScheduler(queue=queue, store=api_store, reap_interval_s=3600)
+    run_ids = [sched.submit(spec=_Spec(), script_path=None, params={"i": i}, priority=priority) for i in range(n)]
+    api_store.flush()
+    return queue, run_ids
+
+
+def test_pop_claims_job_for_node(client):
+    queue, (rid,) = _enqueue(client)
+    job = queue.pop("n1", timeout_s=0.1)
+    assert job["run_id"] == rid and job["params"] == {"i": 0}
+    assert client.smembers("ap:node:n1:runs") == {rid}
+    assert client.exists(f"ap:job:{rid}")  # 留着，节点挂了还能重新入队
+    assert queue.pop("n1", timeout_s=0.1) is None
+
+
+def test_pop_respects_priority(client):
+    queue, low = _enqueue(client, 2)
+    _, (high,) = _enqueue(client, 1, priority=5)
+    assert [queue.pop("n1", timeout_s=0.1)["run_id"] for _ in range(3)] == [high, *low]
+
+
+def test_cancelled_job_is_not_popped(client):
+    queue, (rid,) = _enqueue(client)
+    assert queue.cancel(rid)
+    assert queue.pop("n1", timeout_s=0.1) is None
+    assert not client.smembers("ap:node:n1:runs")
+
+
+def test_dead_node_unstarted_run_is_requeued(client):
+    queue, (rid,) = _enqueue(client)
+    queue.heartbeat("n1", {"capacity": 1}, ttl_s=10)
+    assert queue.pop("n1", timeout_s=0.1)["run_id"] == rid
+    client.delete("ap:node:n1:alive")  # 领到之后、启动之前挂了
+
+    store = RedisStateStore(client)
+    assert reap_dead_nodes(queue, store) == 0
+    store.flush()
+    assert store.get_run(rid).status == RunStatus.queued
+    job = queue.pop("n2", timeout_s=0.1)
+    assert job is not None and job["run_id"] == rid
+
+
+def test_dead_node_running_run_is_failed(client):
+    queue, (rid,) = _enqueue(client)
+    queue.heartbeat("n1", {"capacity": 1}, ttl_s=10)
+    queue.pop("n1", timeout_s=0.1)
+    node_store = RedisStateStore(client)
+    node_store.adopt_run(rid, node="n1")
+    node_store.mark_running(rid, pid=123)
+    node_store.flush()
+    client.delete("ap:node:n1:alive")
+
+    store = RedisStateStore(client)
+    assert reap_dead_nodes(queue, store) == 1
+    store.flush()
+    rec = store.get_run(rid)
+    assert rec.status == RunStatus.failed and rec.failure_reason == "runner node n1 lost"
+    assert not client.exists(f"ap:job:{rid}")
+
+
+def test_leave_returns_runs_still_claimed(client):
+    queue, (rid,) = _enqueue(client)
+    queue.heartbeat("n1", {"capacity": 1}, ttl_s=10)
+    queue.pop("n1", timeout_s=0.1)
+    assert queue.leave("n1") == [rid]
+    assert not client.exists("ap:node:n1:runs")
+    assert queue.nodes() == []
+
+
+def test_shutdown_settles_runs_that_did_not_stop(client):
+    queue, (rid,) = _enqueue(client)
+    store = RedisStateStore(client)
+    scheduler = _StuckScheduler()
+    node = RunnerNode(
+        node_id="n1", queue=queue, store=store, registry=None, scheduler=scheduler, capacity=1, drain_s=0.1
+    )
+    node._heartbeat()
+    job = queue.pop("n1", timeout_s=0.1)
+    store.adopt_run(rid, node="n1")
+    store.mark_running(rid, pid=123)
+    node._inflight.add(job["run_id"])
+
+    node.shutdown()
+    assert scheduler.stopped == [rid]
+    assert store.get_run(rid).status == RunStatus.failed
+    assert not client.exists("ap:node:n1:runs")
+    # 别的节点的 reaper 之后也不会再碰到它
+    assert reap_dead_nodes(queue, RedisStateStore(client)) == 0
+    store.flush()
+    assert RedisStateStore(client).get_run(rid).status == RunStatus.failed
@@ -0,0 +1,97 @@
+import dataclasses
+import time
+
+import pytest
+
+from app.bootstrap import build_worker_pool
+from app.core.config import get_settings
+from app.schemas.script import RunStatus
+from app.services.registry import ScriptRegistry
+from app.storage.state_store import InMemoryStateStore
+
+
+def _wait(cond, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def env(tmp_path):
+    (tmp_path / "specs").mkdir()
+    (tmp_path / "scripts").mkdir()
+    (tmp_path / "scripts" / "mods.py").write_text("import sys\nprint('csv' in sys.modules, 'wave' in sys.modules)\n")
+    (tmp_path / "specs" / "plain.yaml").write_text("id: plain\nentry: mods.py\n")
+    registry = ScriptRegistry(project_root=tmp_path, scripts_dir=tmp_path / "scripts", specs_dir=tmp_path / "specs")
+    registry.refresh()
+    settings = dataclasses.replace(get_settings(), worker_pool_size=1, worker_pool_preload=("csv",))
+    store = InMemoryStateStore(100)
+    pool = build_worker_pool(settings, registry, store)
+    yield tmp_path, registry, store, pool
+    if pool is not None:
+        pool.close()
+
+
+def _run(pool, store, tmp_path, run_id):
+    pool.start(script_id="x", script_path=tmp_path / "scripts" / "mods.py", params={}, run_id=run_id)
+    _wait(lambda: store.get_run(run_id).status == RunStatus.done)
+    return store.get_logs(run_id)[0]
+
+
+def test_disabled_by_default(tmp_path):
+    registry = ScriptRegistry(project_root=tmp_path, scripts_dir=tmp_path, specs_dir=tmp_path)
+    assert get_settings().worker_pool_size == 0
+    assert build_worker_pool(get_settings(), registry, InMemoryStateStore(100)) is None
+
+
+def test_no_workers_until_a_spec_opts_in(env):
+    tmp_path, registry, store, pool = env
+    assert pool._workers == set()
+
+    (tmp_path / "specs" / "pooled.yaml").write_text("id: pooled\nentry: mods.py\nexecution: pool\npreload: [wave]\n")
+    registry.refresh()  # spec watcher 的热加载走的也是这里
+    _wait(lambda: len(pool._idle) == 1)
+    store.create_run(run_id="r1", script_id="x", pid=None, status=RunStatus.queued)
+    assert _run(pool, store, tmp_path, "r1") == ["True True\n"]
+
+
+def test_preload_change_replaces_workers(env):
+    tmp_path, registry, store, pool = env
+    (tmp_path / "specs" / "pooled.yaml").write_text("id: pooled\nentry: mods.py\nexecution: pool\n")
+    registry.refresh()
+    _wait(lambda: len(pool._idle) == 1)
+    store.create_run(run_id="r1", script_id="x", pid=None, status=RunStatus.queued)
+    assert _run(pool, store, tmp_path, "r1") == ["True False\n"]
+
+    (tmp_path / "specs" / "pooled.yaml").write_text("id: pooled\nentry: mods.py\nexecution: pool\npreload: [wave]\n")
+    registry.refresh()
+    _wait(lambda: len(pool._idle) == 1 and pool._idle[0].preload_gen == pool._preload_gen)
+    store.create_run(run_id="r2", script_id="x", pid=None, status=RunStatus.queued)
+    assert _run(pool, store, tmp_path, "r2") == ["True True\n"]
+
+    (tmp_path / "specs" / "pooled.yaml").unlink()
+    registry.refresh()
+    _wait(lambda: not pool._workers)
+
+
+def test_stop_that_loses_the_race_does_not_kill_the_next_job(env):
+    tmp_path, registry, store, pool = env
+    scripts = tmp_path / "scripts"
+    # 脚本在 worker 进程里装了 SIGTERM handler：stop 发出的信号被吞掉，脚本照常跑完
+    (scripts / "stubborn.py").write_text(
+        "import signal, time\nsignal.signal(signal.SIGTERM, lambda *a: None)\ntime.sleep(0.5)\nprint('a')\n"
+    )
+    (scripts / "slow.py").write_text("import time\ntime.sleep(1.5)\nprint('b')\n")
+    for run_id in ("a", "b"):
+        store.create_run(run_id=run_id, script_id="x", pid=None, status=RunStatus.queued)
+    pool.start(script_id="x", script_path=scripts / "stubborn.py", params={}, run_id="a")
+    pool.start(script_id="x", script_path=scripts / "slow.py", params={}, run_id="b")
+    _wait(lambda: store.get_run("a").status == RunStatus.running)
+    time.sleep(0.2)
+    assert pool.stop("a", kill_after_s=0.8)
+
+    # 宽限期到的时候 b 正在跑：SIGKILL 不能落到 b 头上
+    _wait(lambda: store.get_run("b").finished_at is not None)
+    assert store.get_run("b").status == RunStatus.done
+    assert store.get_logs("b")[0] == ["b\n"]
@@ -0,0 +1,84 @@
+# 脚本上报进度 / 计数 / 结果用的小工具（只依赖标准库）。平台启动脚本时会把这个目录加进 PYTHONPATH，直接 import：
+#
+#   from ap_sdk import progress, counter, result
+#
+#   for i in range(1, 101):
+#       attack()
+#       progress(i, 100, "attack")     # GET /runs/{id}/progress 里看到 current=37 total=100 percent=37.0
+#   counter("gold", 1200)              # 累加；counter("gold", value=5000) 直接设值
+#   result({"trophies": 12})           # 最终结果，覆盖上一次
+#   img.save(artifact_path("shots/001.png"))   # 产物（截图等）：结束后在 GET /runs/{id}/artifacts 里能下载
+#
+# 事件是一行 JSON，写到平台给的 AP_EVENTS_FD（和 stdout 分开，不会混进日志）。
+# 不在平台里跑（直接 python xxx.py）时什么都不做，脚本照常运行。
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+MAX_EVENT_BYTES = 64 * 1024  # 和平台那边的上限一致，超过的事件会被丢掉
+_POOL_MARKER = "\x00AP-POOL EVENT "  # execution: pool 的脚本：事件作为控制行走 stdout（见 app/services/pool_worker.py）
+
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    """True when running under the platform (events go somewhere)."""
+    return os.environ.get("AP_EVENTS_VIA") in ("fd", "pool")
+
+
+def _target() -> Optional[tuple]:
+    via = os.environ.get("AP_EVENTS_VIA")
+    if via == "pool":
+        return 1, _POOL_MARKER
+    if via == "fd" and os.environ.get("AP_EVENTS_FD"):
+        return int(os.environ["AP_EVENTS_FD"]), ""
+    return None
+
+
+def emit(type: str, **fields: Any) -> bool:
+    """Send one event {"type": type, **fields}; returns False when not running under the platform."""
+    target = _target()
+    if target is None:
+        return False
+    fd, prefix = target
+    line = json.dumps({"type": type, **fields}, ensure_ascii=False, default=str)
+    data = (prefix + line + "\n").encode("utf-8")
+    if len(data) > MAX_EVENT_BYTES:
+        raise ValueError(f"event too large ({len(data)} bytes > {MAX_EVENT_BYTES})")
+    view = memoryview(data)
+    with _lock:  # 多线程的脚本：一行事件不能被别的线程插进来
+        try:
+            if prefix:
+                sys.stdout.flush()  # pool：先把脚本自己缓冲着的输出写出去，控制行单独成行
+                sys.stderr.flush()
+            while view:
+                view = view[os.write(fd, view):]
+        except OSError:
+            return False  # 平台那边已经不读了（比如 run 被停掉），别让脚本因为上报失败而崩
+    return True
+
+
+def progress(current: float, total: Optional[float] = None, message: Optional[str] = None) -> bool:
+    return emit("progress", current=current, total=total, message=message)
+
+
+def counter(name: str, inc: float = 1, *, value: Optional[float] = None) -> bool:
+    if value is not None:
+        return emit("counter", name=name, value=value)
+    return emit("counter", name=name, inc=inc)
+
+
+def result(data: Any) -> bool:
+    return emit("result", data=data)
+
+
+def artifact_path(name: str) -> Path:
+    """Where to write artifact `name` (AP_ARTIFACTS_DIR, or the cwd outside the platform); parent dirs are created."""
+    path = Path(os.environ.get("AP_ARTIFACTS_DIR") or ".") / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path